@@ -8,18 +8,21 @@ Interface profissional e moderna com PyQt6
 """
 
 import sys
+import multiprocessing
 import threading
 import time
 import json
 import os
+import queue
 from pathlib import Path
 
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QPushButton, QRadioButton, QButtonGroup, QSpinBox,
-    QGroupBox, QMessageBox, QDialog, QComboBox
+    QGroupBox, QMessageBox, QDialog, QComboBox, QFileDialog, QPlainTextEdit,
+    QTableView, QHeaderView, QAbstractItemView, QDoubleSpinBox, QCheckBox
 )
-from PyQt6.QtCore import Qt, pyqtSignal, QObject, QTimer
+from PyQt6.QtCore import Qt, pyqtSignal, QObject, QTimer, QAbstractTableModel, QModelIndex
 from PyQt6.QtGui import QFont, QIcon, QColor
 
 try:
@@ -29,11 +32,26 @@ except ImportError:
     print("Erro: pynput não está instalado. Execute: pip install pynput")
     exit(1)
 
+# macro_engine.py é compartilhado pelas duas versões (pasta Shared na raiz do
+# repositório); no executável do PyInstaller ele já vem empacotado
+if not getattr(sys, "frozen", False):
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "Shared"))
+from macro_engine import (
+    ControlServer, CoordinateMapper, EngineProcess, FAILSAFE_REASON, FocusGuard, HookEventQueue,
+    HotkeyMatcher, InputHub, InputRecorder, LIMIT_REASONS, MacroEngine, MacroMetrics, Monitor,
+    MonitorLayout, OnDemandHook, REC_KIND_NAMES, REC_MOVE, REC_RELEASE, Recording, RecordingEdits,
+    RunLimits, ScheduledTrigger, ScriptCompiler, TrackSet, TriggerScheduler, WINDOW_REASON,
+    WindowTracker, build_simple_program, create_controllers, default_control_address,
+    parse_remote_settings, resolve_combo, simplify_recording, window_under_pointer
+)
+
 
 class SignalEmitter(QObject):
     """Emite sinais para atualização segura da GUI da thread."""
     status_changed = pyqtSignal(str, str)
     coordinates_updated = pyqtSignal(int, int)
+    settings_changed = pyqtSignal()
+    gui_call = pyqtSignal(object)  # Executa uma função na thread da GUI
 
 
 class ConfigManager:
@@ -86,7 +104,36 @@ class ConfigManager:
             "click_delay_ms": 100,
             "action_type": "click",
             "hold_duration_ms": 500,
-            "custom_key_name": "Nenhuma"
+            "custom_key_name": "Nenhuma",
+            "custom_key_combo": None,
+            "type_text": "",
+            "type_char_delay_ms": 0,
+            "control_api_enabled": False,
+            "control_socket": None,
+            "control_port": 47800,
+            "metrics_textfile": None,
+            "input_backend": "pynput",  # "pynput", "uinput" (Linux, também Wayland) ou "xtest"
+            "uinput_device": None,
+            "xtest_flush_policy": "tick",  # immediate, action, tick ou manual
+            "worker_cpus": None,  # Afinidade do worker, ex.: "2-3" (Linux)
+            "worker_sched_policy": None,  # "fifo", "rr" ou "other" (requer permissão)
+            "worker_rt_priority": 10,
+            "worker_nice": None,
+            "engine_process": False,  # Motor em processo separado (isola do GIL da GUI)
+            "failsafe_corner_px": 0,  # Cursor a N px do canto de um monitor para o macro (0 = desligado)
+            "watchdog_timeout_s": 5.0,  # Motor sem batimento por esse tempo é parado (0 = desligado)
+            "max_injections_per_sec": None,  # Teto global de injeções por segundo
+            "window_relative": False,  # Coordenadas relativas à janela alvo (X11, requer python-xlib)
+            "target_window": None,  # {"title": trecho do título, "class": WM_CLASS}
+            "pause_on_focus_loss": False,  # Pausa quando a janela alvo perde o foco (X11 EWMH, requer python-xlib)
+            "saved_target": None,  # Coordenada salva normalizada: {"monitor", "index", "u", "v"}
+            "capture_layout": None,  # Monitores no momento da captura (remapeia se mudarem)
+            "profiles": {},  # nome -> {"tracks": [{"name", "script" ou "source"}], "schedule": [...], "limits": {...}}
+            "active_profile": None,
+            "recording_file": "gravacao.mrec",  # Gravação de mouse/teclado ao lado da config
+            "recording_simplify_px": None,  # Simplifica a gravação ao parar (tolerância em px, requer NumPy)
+            "recording_simplify_ms": 0,  # Intervalo máximo entre pontos mantidos (0 = sem limite)
+            "script_file": None
         }
         self.config = self.load_config()
     
@@ -243,6 +290,111 @@ class ThemeManager:
         return cls.THEMES.get(theme_name, cls.THEMES["dark"])
 
 
+class RecordingTableModel(QAbstractTableModel):
+    """Modelo preguiçoso de uma gravação .mrec para o editor de linha do tempo.
+
+    rowCount vem do tamanho da RecordingEdits e data() decodifica só as
+    linhas que a view pede (as visíveis); um cache pequeno evita
+    redecodificar a mesma linha para cada coluna.
+    """
+    COLUMNS = ("Tempo (s)", "Tipo", "X", "Y", "Botão/Tecla")
+    ROW_CACHE = 512
+    
+    def __init__(self, edits, parent=None):
+        super().__init__(parent)
+        self.edits = edits
+        self._rows = {}
+    
+    def set_edits(self, edits):
+        self.beginResetModel()
+        self.edits = edits
+        self._rows.clear()
+        self.endResetModel()
+    
+    def event_at(self, row):
+        event = self._rows.get(row)
+        if event is None:
+            if len(self._rows) >= self.ROW_CACHE:
+                self._rows.clear()
+            event = self._rows[row] = self.edits[row]
+        return event
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.edits)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.COLUMNS[section]
+        return section + 1
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return None
+        t_us, kind, x, y, name = self.event_at(index.row())
+        column = index.column()
+        if column == 0:
+            return f"{t_us / 1e6:.6f}"
+        if column == 1:
+            return REC_KIND_NAMES[kind]
+        if column in (2, 3):
+            return (x if column == 2 else y) if kind <= REC_RELEASE else ""
+        return name or ""
+    
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() >= 2:
+            kind = self.event_at(index.row())[1]
+            if (index.column() < 4 and kind <= REC_RELEASE) or (index.column() == 4 and kind != REC_MOVE):
+                flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+    
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or not index.isValid():
+            return False
+        t_us, kind, x, y, name = self.event_at(index.row())
+        try:
+            if index.column() == 2:
+                x = int(value)
+            elif index.column() == 3:
+                y = int(value)
+            elif index.column() == 4 and str(value).strip():
+                name = str(value).strip()
+            else:
+                return False
+            self.edits.replace(index.row(), (t_us, kind, x, y, name))
+        except ValueError:
+            return False
+        self._rows.clear()
+        self.dataChanged.emit(index, index)
+        return True
+    
+    def insert_event(self, row, event):
+        """Insere um evento antes de row (ValueError se fora de ordem)."""
+        # Valida antes de beginInsertRows: a view não pode ver uma inserção falha
+        self.edits.check_order(row, row, event[0], event[0])
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.edits.insert(row, event)
+        self._rows.clear()
+        self.endInsertRows()
+    
+    def delete_rows(self, row, count):
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        self.edits.delete(row, count)
+        self._rows.clear()
+        self.endRemoveRows()
+    
+    def shift_rows(self, row, count, delta_us):
+        """Desloca [row, row + count) no tempo (ValueError se quebrar a ordem)."""
+        self.edits.shift(row, count, delta_us)
+        self._rows.clear()
+        self.dataChanged.emit(self.index(row, 0), self.index(row + count - 1, 0))
+
+
 class MacroAutomationPyQt(QMainWindow):
     """Aplicação principal com PyQt6."""
     
@@ -272,16 +424,38 @@ class MacroAutomationPyQt(QMainWindow):
         self.theme = ThemeManager.get_theme(self.current_theme)
         
         # Variáveis de controle
-        self.mouse_controller = MouseController()
-        self.keyboard_controller = KeyboardController()
+        self.mouse_controller, self.keyboard_controller = self._create_controllers()
+        # Botões e teclas que o macro mantém pressionados (ver InputState)
+        self.input_state = self.mouse_controller.input_state
+        # Cantos do failsafe: tamanho da tela lido uma vez, na thread da GUI
+        self.screen_size = self._backend_options()[0]
+        # Monitores atuais e o mapeamento da coordenada salva, recalculados
+        # só quando o Qt avisa que a disposição mudou
+        self.monitor_layout = self._monitor_layout()
+        self.coordinate_mapper = None
         self.is_running = False
         self.is_paused = False
         self.capture_mode = False
         
+        # Thread do macro e geração da execução atual (evita dois loops
+        # simultâneos quando start/pause chegam em sequência rápida)
+        self.macro_thread = None
+        self._run_id = 0
+        self._state_lock = threading.Lock()
+        self.engine = None
+        
+        # Métricas do motor (painel de estatísticas e exportação)
+        self.metrics = MacroMetrics()
+        
+        # Motor fora do processo da GUI (opcional): a GUI só envia comandos
+        self.engine_process = self._create_engine_process()
+        
         # Sinais para atualização segura da GUI
         self.signal_emitter = SignalEmitter()
         self.signal_emitter.status_changed.connect(self.update_status)
         self.signal_emitter.coordinates_updated.connect(self.update_coordinates_display)
+        self.signal_emitter.settings_changed.connect(self._sync_widgets_from_state)
+        self.signal_emitter.gui_call.connect(self._run_in_gui)
         
         # Coordenadas
         self.saved_x = self.config_mgr.get("saved_x")
@@ -292,11 +466,16 @@ class MacroAutomationPyQt(QMainWindow):
         self.button_type = self.config_mgr.get("button_type", "esquerdo")
         self.click_delay_ms = self.config_mgr.get("click_delay_ms", 100)
         self.hold_duration_ms = self.config_mgr.get("hold_duration_ms", 500)
+        self.type_text = self.config_mgr.get("type_text", "")
+        self.type_char_delay_ms = self.config_mgr.get("type_char_delay_ms", 0)
         
-        # Tecla customizada
-        self.custom_key = self.config_mgr.get("custom_key", None)
+        # Tecla customizada (tupla de teclas; mais de uma = acorde)
+        self.custom_key = self._load_custom_key()
         self.custom_key_name = self.config_mgr.get("custom_key_name", "Nenhuma")
         
+        # Script de macro (arquivo .macro ao lado do macro_config.json)
+        self.script_file = self.config_mgr.get("script_file")
+        
         # Hotkeys
         key_start_str = self.config_mgr.get("key_start", "f1")
         key_pause_str = self.config_mgr.get("key_pause", "f2")
@@ -308,18 +487,54 @@ class MacroAutomationPyQt(QMainWindow):
         self.key_exit = self._string_to_key(key_exit_str)
         
         print(f"Hotkeys convertidos: START={self.key_start}, PAUSE={self.key_pause}, EXIT={self.key_exit}")
-        
-        # Listeners
-        self.listener = None
-        self.mouse_listener = None
+        self._compile_hotkeys()
+        
+        # Hooks globais: um único hook de teclado compartilhado (hotkeys e
+        # diálogos de captura assinam) e o de mouse só durante a captura.
+        # Os callbacks só enfileiram; disco e GUI ficam com hook_events
+        self.hook_events = HookEventQueue(self.metrics)
+        self.input_hub = InputHub(lambda on_press, on_release: Listener(
+            on_press=self.hook_events.timed(on_press, "teclado"),
+            on_release=self.hook_events.timed(on_release, "teclado")
+        ))
+        self.mouse_hook = OnDemandHook(lambda: MouseListener(
+            on_move=self.hook_events.timed(self._on_mouse_move, "mouse"),
+            on_click=self.hook_events.timed(self._on_mouse_click, "mouse")
+        ), "mouse", self.metrics)
+        
+        # Gravação em andamento (InputRecorder) e sua assinatura no teclado
+        self.recorder = None
+        self._record_subscription = None
+        
+        # Servidor de controle local (opcional)
+        self.control_server = None
+        
+        # Inícios agendados dos perfis (uma thread, só se houver gatilhos)
+        self.trigger_scheduler = TriggerScheduler(self._on_scheduled_trigger)
+        
+        # Geometria da janela alvo (coordenadas relativas), criada sob demanda
+        self.window_tracker = None
+        # Pausa automática quando a janela alvo perde o foco: o programa da
+        # execução atual é guardado para retomar quando o foco voltar
+        self.focus_guard = None
+        self._focus_paused = False
+        self._run_program = None
+        
+        self._layout_refresh_pending = False
+        self._watch_screens()
         
         self._initialize_listeners()
         self._init_ui()
         self.apply_theme(self.current_theme)
+        self._start_control_server()
+        self._load_schedule()
     
     def _string_to_key(self, key_str):
         try:
             key_str_clean = key_str.lower().strip()
+            # Acordes ("ctrl+shift+x") e sequências ("g g") ficam como texto
+            if len(key_str_clean) > 1 and ("+" in key_str_clean or " " in key_str_clean):
+                return key_str_clean
             # Tentar com underscore
             try:
                 result = getattr(Key, key_str_clean)
@@ -352,34 +567,77 @@ class MacroAutomationPyQt(QMainWindow):
             print(f"Erro em _key_to_string: {e}, retornando f1")
             return "f1"
     
-    def _normalize_key(self, key):
-        """Normaliza uma tecla para comparação."""
-        try:
-            # Se é uma string, retornar como está
-            if isinstance(key, str):
-                return key.lower()
-            # Se é um Key enum, retornar o nome
+    def _compile_hotkeys(self):
+        """Compila os hotkeys da configuração no autômato de reconhecimento."""
+        defaults = {"start": "f1", "pause": "f2", "exit": "f3"}
+        specs = {}
+        for action, default in defaults.items():
+            spec = self.config_mgr.get(f"key_{action}", default)
             try:
-                return key.name.lower().lstrip("_")
-            except:
-                return str(key).lower()
-        except:
-            return str(key).lower()
+                HotkeyMatcher.parse(spec)
+                specs[action] = spec
+            except ValueError as e:
+                print(f"Hotkey inválido para {action} ({e}), usando {default}")
+                specs[action] = default
+        self.hotkeys = HotkeyMatcher(specs)
     
-    def _initialize_listeners(self):
+    def _load_custom_key(self):
+        """Lê a tecla (ou acorde) customizada salva na configuração."""
+        combo = self.config_mgr.get("custom_key_combo") or self.config_mgr.get("custom_key_stored")
+        if not combo:
+            return None
         try:
-            self.mouse_listener = MouseListener(on_click=self._on_mouse_click)
-            self.mouse_listener.start()
-            
-            self.listener = Listener(on_press=self._on_key_press)
-            self.listener.start()
-        except Exception as e:
-            print(f"Erro ao inicializar listeners: {e}")
+            return resolve_combo(combo)
+        except ValueError as e:
+            print(f"Tecla customizada inválida '{combo}': {e}")
+            return None
+    
+    def _create_controllers(self):
+        """Cria os controladores do backend de injeção configurado."""
+        backend = self.config_mgr.get("input_backend", "pynput")
+        try:
+            return create_controllers(backend, *self._backend_options(), max_rate=self._max_rate())
+        except (OSError, ValueError) as e:
+            print(f"Backend de injeção '{backend}' indisponível ({e}); usando pynput")
+            return create_controllers("pynput", max_rate=self._max_rate())
+    
+    def _backend_options(self):
+        """Tamanho da tela, dispositivo uinput e política de flush do XTest."""
+        screen = QApplication.primaryScreen().virtualGeometry()
+        return (
+            (screen.width(), screen.height()), self.config_mgr.get("uinput_device"),
+            self.config_mgr.get("xtest_flush_policy", "tick")
+        )
+    
+    def _max_rate(self):
+        """Teto de injeções por segundo (None ou 0 = sem teto)."""
+        return self.config_mgr.get("max_injections_per_sec") or None
+    
+    def _create_engine_process(self):
+        """Inicia o processo do motor se "engine_process" estiver ativo."""
+        if not self.config_mgr.get("engine_process", False):
+            return None
+        engine_process = EngineProcess(
+            self.metrics, self.config_mgr.get("input_backend", "pynput"), *self._backend_options(),
+            max_rate=self._max_rate()
+        )
+        try:
+            engine_process.start()
+        except OSError as e:
+            print(f"Não foi possível iniciar o processo do motor ({e}); usando thread local")
+            return None
+        print("Motor executando em processo separado")
+        return engine_process
+    
+    def _initialize_listeners(self):
+        self.hook_events.start()
+        self.input_hub.subscribe(self._on_key_press, self._on_key_release, InputHub.PRIORITY_HOTKEYS)
+        self.input_hub.start()
     
     def _init_ui(self):
         """Inicializa a interface do usuário."""
         self.setWindowTitle("Macro Automation V2.0 - PyQt6")
-        self.setGeometry(100, 100, 800, 700)
+        self.setGeometry(100, 100, 800, 960)
         
         # Widget central
         central_widget = QWidget()
@@ -396,18 +654,23 @@ class MacroAutomationPyQt(QMainWindow):
         self.action_button_group = QButtonGroup()
         action_click_radio = QRadioButton("Clique Único")
         action_hold_radio = QRadioButton("Pressionar e Manter (Hold)")
+        action_type_radio = QRadioButton("Digitar Texto")
         
         if self.action_type == "click":
             action_click_radio.setChecked(True)
+        elif self.action_type == "type":
+            action_type_radio.setChecked(True)
         else:
             action_hold_radio.setChecked(True)
         
         self.action_button_group.addButton(action_click_radio, 0)
         self.action_button_group.addButton(action_hold_radio, 1)
+        self.action_button_group.addButton(action_type_radio, 2)
         self.action_button_group.buttonClicked.connect(self._on_action_changed)
         
         action_layout.addWidget(action_click_radio)
         action_layout.addWidget(action_hold_radio)
+        action_layout.addWidget(action_type_radio)
         action_group.setLayout(action_layout)
         main_layout.addWidget(action_group)
         
@@ -432,6 +695,7 @@ class MacroAutomationPyQt(QMainWindow):
         
         if self.button_type in button_map:
             self.button_button_group.button(button_map[self.button_type]).setChecked(True)
+        self.button_button_group.buttonClicked.connect(self._on_button_changed)
         
         button_layout.addWidget(left_button_radio)
         button_layout.addWidget(right_button_radio)
@@ -505,6 +769,40 @@ class MacroAutomationPyQt(QMainWindow):
         timing_group.setLayout(timing_layout)
         main_layout.addWidget(timing_group)
         
+        # Seção de texto (ação "Digitar Texto")
+        text_group = QGroupBox("Texto para Digitar")
+        text_layout = QVBoxLayout()
+        
+        self.type_text_edit = QPlainTextEdit()
+        self.type_text_edit.setPlainText(self.type_text)
+        self.type_text_edit.setFixedHeight(70)
+        self.type_text_edit.textChanged.connect(self._on_type_text_changed)
+        text_layout.addWidget(self.type_text_edit)
+        
+        type_delay_layout = QHBoxLayout()
+        type_delay_label = QLabel("Intervalo por caractere (ms):")
+        type_delay_label.setFixedWidth(200)
+        self.type_delay_spinbox = QSpinBox()
+        self.type_delay_spinbox.setMinimum(0)
+        self.type_delay_spinbox.setMaximum(5000)
+        self.type_delay_spinbox.setValue(self.type_char_delay_ms)
+        self.type_delay_spinbox.setToolTip("0 = digitação em lote, o mais rápido possível")
+        self.type_delay_spinbox.valueChanged.connect(self._on_type_delay_changed)
+        type_delay_layout.addWidget(type_delay_label)
+        type_delay_layout.addWidget(self.type_delay_spinbox)
+        type_delay_layout.addStretch()
+        text_layout.addLayout(type_delay_layout)
+        
+        text_group.setLayout(text_layout)
+        main_layout.addWidget(text_group)
+        
+        # Salvar o texto só depois de uma pausa na edição
+        self.type_text_save_timer = QTimer(self)
+        self.type_text_save_timer.setSingleShot(True)
+        self.type_text_save_timer.timeout.connect(
+            lambda: self.config_mgr.set("type_text", self.type_text)
+        )
+        
         # Seção de informações
         info_group = QGroupBox("Hotkeys de Controle")
         info_layout = QVBoxLayout()
@@ -529,9 +827,25 @@ class MacroAutomationPyQt(QMainWindow):
         self.status_label = QLabel("Status: Pronto")
         self.status_label.setFont(QFont("Arial", 10))
         status_layout.addWidget(self.status_label)
+        self.script_label = QLabel(self._script_label_text())
+        self.script_label.setStyleSheet("color: gray; font-size: 9pt;")
+        status_layout.addWidget(self.script_label)
         status_group.setLayout(status_layout)
         main_layout.addWidget(status_group)
         
+        # Estatísticas ao vivo
+        stats_group = QGroupBox("Estatísticas")
+        stats_layout = QVBoxLayout()
+        self.stats_label = QLabel(self.metrics.summary())
+        self.stats_label.setFont(QFont("Consolas", 9))
+        stats_layout.addWidget(self.stats_label)
+        stats_group.setLayout(stats_layout)
+        main_layout.addWidget(stats_group)
+        
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self._refresh_stats)
+        self.stats_timer.start(500)
+        
         central_widget.setLayout(main_layout)
         
         # Criar menu bar
@@ -545,6 +859,23 @@ class MacroAutomationPyQt(QMainWindow):
         create_config_action = arquivo_menu.addAction("Criar Config Padrão")
         create_config_action.triggered.connect(self._create_default_config)
         
+        arquivo_menu.addSeparator()
+        load_script_action = arquivo_menu.addAction("Carregar Script de Macro...")
+        load_script_action.triggered.connect(self._load_script_dialog)
+        
+        clear_script_action = arquivo_menu.addAction("Desativar Script")
+        clear_script_action.triggered.connect(self._clear_script)
+        
+        arquivo_menu.addSeparator()
+        self.record_action = arquivo_menu.addAction("Iniciar Gravação")
+        self.record_action.triggered.connect(self._toggle_recording)
+        
+        play_recording_action = arquivo_menu.addAction("Reproduzir Gravação")
+        play_recording_action.triggered.connect(self._play_recording)
+        
+        edit_recording_action = arquivo_menu.addAction("Editar Gravação...")
+        edit_recording_action.triggered.connect(self._open_recording_editor)
+        
         arquivo_menu.addSeparator()
         sair_action = arquivo_menu.addAction("Sair")
         sair_action.triggered.connect(self.close)
@@ -557,6 +888,16 @@ class MacroAutomationPyQt(QMainWindow):
         theme_action = config_menu.addAction("Alterar Tema...")
         theme_action.triggered.connect(self._open_theme_dialog)
         
+        window_action = config_menu.addAction("Coordenadas Relativas à Janela")
+        window_action.setCheckable(True)
+        window_action.setChecked(self.config_mgr.get("window_relative", False))
+        window_action.toggled.connect(self._set_window_relative)
+        
+        focus_action = config_menu.addAction("Pausar sem Foco na Janela Alvo")
+        focus_action.setCheckable(True)
+        focus_action.setChecked(self.config_mgr.get("pause_on_focus_loss", False))
+        focus_action.toggled.connect(self._set_pause_on_focus_loss)
+        
         config_menu.addSeparator()
         reset_action = config_menu.addAction("Restaurar Padrão")
         reset_action.triggered.connect(self._reset_all)
@@ -576,17 +917,37 @@ class MacroAutomationPyQt(QMainWindow):
         )
         
         self.capture_mode = True
+        if not self.mouse_hook.acquire("capture"):
+            self.capture_mode = False
+            self.signal_emitter.status_changed.emit("Erro ao instalar hook de mouse", "error")
+            return
         self.capture_button.setEnabled(False)
         self.capture_button.setText("Aguardando clique...")
         self.signal_emitter.status_changed.emit("Aguardando clique na tela...", "warning")
     
     def _on_action_changed(self):
         """Callback quando tipo de ação muda."""
-        if self.action_button_group.checkedId() == 0:
-            self.action_type = "click"
-        else:
-            self.action_type = "hold"
+        action_map = {0: "click", 1: "hold", 2: "type"}
+        self.action_type = action_map.get(self.action_button_group.checkedId(), "click")
         self.config_mgr.set("action_type", self.action_type)
+        self._reload_program()
+    
+    def _on_type_text_changed(self):
+        """Callback quando o texto a digitar muda."""
+        self.type_text = self.type_text_edit.toPlainText()
+        self.type_text_save_timer.start(500)
+    
+    def _on_type_delay_changed(self):
+        """Callback quando o intervalo por caractere muda."""
+        self.type_char_delay_ms = self.type_delay_spinbox.value()
+        self.config_mgr.set("type_char_delay_ms", self.type_char_delay_ms)
+    
+    def _on_button_changed(self):
+        """Callback quando o botão/tecla selecionado muda."""
+        button_map = {0: "esquerdo", 1: "direito", 2: "custom"}
+        self.button_type = button_map.get(self.button_button_group.checkedId(), "esquerdo")
+        self.config_mgr.set("button_type", self.button_type)
+        self._reload_program()
     
     def _on_timing_changed(self):
         """Callback quando timing muda."""
@@ -594,138 +955,959 @@ class MacroAutomationPyQt(QMainWindow):
         self.hold_duration_ms = self.hold_spinbox.value()
         self.config_mgr.set("click_delay_ms", self.click_delay_ms)
         self.config_mgr.set("hold_duration_ms", self.hold_duration_ms)
+        self._reload_program()
     
     def _on_key_press(self, key):
-        """Manipulador de eventos de teclado para hotkeys."""
+        """Manipulador de eventos de teclado para hotkeys (thread do hook)."""
+        received_at = time.perf_counter()
         try:
-            # Normalizar tecla para comparação
-            key_pressed = self._normalize_key(key)
-            key_start = self._normalize_key(self.key_start)
-            key_pause = self._normalize_key(self.key_pause)
-            key_exit = self._normalize_key(self.key_exit)
-            
-            if key_pressed == key_start:
-                if self.saved_x is None or self.saved_y is None:
-                    QMessageBox.warning(
-                        self,
-                        "Aviso",
-                        "Por favor, capture uma coordenada primeiro!"
-                    )
-                    return
-                
-                self.is_running = True
-                self.is_paused = False
-                self.signal_emitter.status_changed.emit("Executando...", "success")
-                
-                thread = threading.Thread(target=self._execute_macro, daemon=True)
-                thread.start()
-            
-            elif key_pressed == key_pause:
-                self.is_running = False
-                self.is_paused = True
-                self._release_all()
-                self.signal_emitter.status_changed.emit("Pausado", "warning")
-            
-            elif key_pressed == key_exit:
-                self.is_running = False
-                self.is_paused = False
-                self._release_all()
-                self.config_mgr.save_config()
-                QTimer.singleShot(500, self.close)
-        
+            action = self.hotkeys.feed_press(key)
         except AttributeError:
-            pass
+            return
+        if action:
+            self.hook_events.post(self._handle_hotkey, action, received_at)
+    
+    def _handle_hotkey(self, action, received_at):
+        """Executa a ação de um hotkey (thread consumidora de eventos)."""
+        if action == "start":
+            if not self._start_macro(received_at):
+                self.signal_emitter.gui_call.emit(lambda: QMessageBox.warning(
+                    self,
+                    "Aviso",
+                    "Por favor, capture uma coordenada primeiro!"
+                ))
+        
+        elif action == "pause":
+            self._pause_macro()
+        
+        elif action == "exit":
+            self._stop_macro()
+            self.config_mgr.save_config()
+            self.signal_emitter.gui_call.emit(lambda: QTimer.singleShot(500, self.close))
+    
+    def _on_key_release(self, key):
+        """Acompanha a soltura de modificadores para os acordes."""
+        self.hotkeys.feed_release(key)
     
-    def _execute_macro(self):
-        """Executa a automação do macro."""
+    def _start_macro(self, requested_at=None, program=None):
+        """Inicia o macro (ou o program dado). Retorna False se não há coordenada capturada."""
+        needs_point = (program is None and not self.script_file and not self._uses_tracks()
+                       and self.action_type != "type")
+        if needs_point and (self.saved_x is None or self.saved_y is None):
+            return False
+        
         try:
-            # Atualizar button_type a partir do selecionado
-            button_map = {0: "esquerdo", 1: "direito", 2: "custom"}
-            self.button_type = button_map.get(self.button_button_group.checkedId(), "esquerdo")
-            self.config_mgr.set("button_type", self.button_type)
+            # Spec da janela alvo; na thread local o motor recebe o WindowTracker
+            window = self._window_spec()
+            if window and not self.engine_process:
+                window = self._window_tracker(window)
+            guard = self._focus_guard()
+        except (OSError, ValueError) as e:
+            self.signal_emitter.status_changed.emit(f"Janela alvo: {e}", "error")
+            return True
+        if guard is not None and not guard.focused:
+            # Começa quando a janela alvo ganhar o foco
+            self._focus_paused, self._run_program = True, program
+            self.signal_emitter.status_changed.emit("Aguardando foco na janela alvo...", "warning")
+            return True
+        
+        with self._state_lock:
+            if self.is_running:
+                return True
+            self._run_id += 1
+            self._run_program = program
+            self.is_running = True
+            self.is_paused = False
+            status_callback = lambda message: self.signal_emitter.status_changed.emit(message, "success")
+            if self.engine_process:
+                self.engine = self.engine_process.session(
+                    status_callback, self._worker_scheduling(), self._failsafe(), window
+                )
+            else:
+                self.engine = MacroEngine(
+                    self.mouse_controller, self.keyboard_controller, self.metrics,
+                    status_callback=status_callback, scheduling=self._worker_scheduling(),
+                    failsafe=self._failsafe(), window=window
+                )
+            self.macro_thread = threading.Thread(
+                target=self._execute_macro,
+                args=(self._run_id, self.engine, requested_at or time.perf_counter(), program),
+                daemon=True
+            )
+            self.macro_thread.start()
+        
+        self.signal_emitter.status_changed.emit("Executando...", "success")
+        return True
+    
+    def _pause_macro(self):
+        """Pausa o macro e solta tudo que estiver pressionado."""
+        self._focus_paused = False
+        with self._state_lock:
+            self.is_running = False
+            self.is_paused = True
+            if self.engine:
+                self.engine.stop()
+        self._release_all()
+        self.signal_emitter.status_changed.emit("Pausado", "warning")
+    
+    def _stop_macro(self):
+        """Para o macro sem deixá-lo em estado de pausa."""
+        self._focus_paused = False
+        with self._state_lock:
+            self.is_running = False
+            self.is_paused = False
+            if self.engine:
+                self.engine.stop()
+        self._release_all()
+    
+    def _execute_macro(self, run_id, engine, requested_at, program=None):
+        """Executa a automação do macro (programa compilado no MacroEngine)."""
+        try:
+            limits = None
+            if program is None:
+                program = self._build_program()
+                limits = RunLimits.from_profile(self._active_profile())
+            reason = engine.run(program, requested_at, limits)
             
-            while self.is_running:
-                if self.button_type in ["esquerdo", "direito"]:
-                    self.mouse_controller.position = (self.saved_x, self.saved_y)
-                    time.sleep(0.05)
-                
-                if self.button_type == "esquerdo":
-                    self._perform_action(Button.left, self.action_type)
-                elif self.button_type == "direito":
-                    self._perform_action(Button.right, self.action_type)
-                elif self.button_type == "custom":
-                    if self.custom_key:
-                        self._perform_keyboard_action(self.custom_key, self.action_type)
-                    else:
-                        self.signal_emitter.status_changed.emit("Erro: Nenhuma tecla customizada selecionada", "error")
-                        break
-                
-                if self.action_type == "click":
-                    time.sleep(self.click_delay_ms / 1000)
-                else:
-                    time.sleep((self.hold_duration_ms + self.click_delay_ms) / 1000)
+            if run_id != self._run_id:
+                # Uma nova execução já assumiu o controle
+                return
             
             self._release_all()
-            self.signal_emitter.status_changed.emit("Parado", "error")
+            if reason == "finished" or reason in LIMIT_REASONS:
+                with self._state_lock:
+                    if run_id == self._run_id:
+                        self.is_running = False
+                # A digitação e os jobs com limites já informaram o resumo
+                # pelo status_callback
+                if reason == "finished" and program.name != "texto":
+                    self.signal_emitter.status_changed.emit("Script concluído", "success")
+            elif reason == FAILSAFE_REASON:
+                with self._state_lock:
+                    if run_id == self._run_id:
+                        self.is_running = False
+                self.signal_emitter.status_changed.emit("Failsafe acionado: macro parado", "error")
+            elif reason == WINDOW_REASON:
+                with self._state_lock:
+                    if run_id == self._run_id:
+                        self.is_running = False
+                self.signal_emitter.status_changed.emit("Janela alvo indisponível: macro parado", "error")
+            else:
+                self.signal_emitter.status_changed.emit("Parado", "error")
         
         except Exception as e:
+            with self._state_lock:
+                if run_id == self._run_id:
+                    self.is_running = False
+            self._release_all()
             self.signal_emitter.status_changed.emit(f"Erro: {str(e)}", "error")
             print(f"Erro durante execução: {str(e)}")
     
-    def _perform_action(self, button, action_type):
+    def _worker_scheduling(self):
+        """Afinidade/prioridade opcionais do worker lidas da configuração."""
+        scheduling = {
+            "cpus": self.config_mgr.get("worker_cpus"),
+            "policy": self.config_mgr.get("worker_sched_policy"),
+            "rt_priority": self.config_mgr.get("worker_rt_priority", 10),
+            "nice": self.config_mgr.get("worker_nice"),
+        }
+        if scheduling["cpus"] is None and not scheduling["policy"] and scheduling["nice"] is None:
+            return None
+        return scheduling
+    
+    def _failsafe(self):
+        """Argumentos do Watchdog (cantos dos monitores e batimento do motor) lidos da configuração."""
+        corner_px = self.config_mgr.get("failsafe_corner_px", 0)
+        timeout = self.config_mgr.get("watchdog_timeout_s", 5.0)
+        if not corner_px and not timeout:
+            return None
+        # Retângulos simples: os argumentos vão para o processo do motor
+        monitors = [(m.x, m.y, m.width, m.height) for m in self.monitor_layout.monitors]
+        return {"corner_px": corner_px, "heartbeat_timeout": timeout, "monitors": monitors}
+    
+    def _window_spec(self):
+        """Janela alvo ({"title", "class"}) se as coordenadas são relativas, senão None."""
+        if not self.config_mgr.get("window_relative", False):
+            return None
+        spec = self.config_mgr.get("target_window")
+        if not spec:
+            raise ValueError("capture a coordenada sobre a janela alvo")
+        return spec
+    
+    def _window_tracker(self, spec):
+        """WindowTracker da janela alvo, reaproveitado enquanto o spec não muda."""
+        tracker = self.window_tracker
+        if tracker is None or tracker.spec() != {key: value for key, value in spec.items() if value}:
+            if tracker is not None:
+                tracker.stop()
+            self.window_tracker = None
+            self.window_tracker = WindowTracker.from_spec(spec).start()
+        return self.window_tracker
+    
+    def _focus_guard(self):
+        """FocusGuard da janela alvo se a pausa por foco está ligada, reaproveitado enquanto o spec não muda."""
+        if not self.config_mgr.get("pause_on_focus_loss", False):
+            self._stop_focus_guard()
+            return None
+        spec = self.config_mgr.get("target_window")
+        if not spec:
+            raise ValueError("capture a coordenada sobre a janela alvo")
+        guard = self.focus_guard
+        if guard is None or guard.spec() != {key: value for key, value in spec.items() if value}:
+            self._stop_focus_guard()
+            self.focus_guard = FocusGuard.from_spec(spec, self._on_focus_changed).start()
+        return self.focus_guard
+    
+    def _stop_focus_guard(self):
+        guard, self.focus_guard = self.focus_guard, None
+        self._focus_paused = False
+        if guard is not None:
+            guard.stop()
+    
+    def _on_focus_changed(self, focused):
+        """Transição de foco da janela alvo (thread do FocusGuard): aplicada na thread da GUI."""
+        self.signal_emitter.gui_call.emit(lambda: self._apply_focus(focused))
+    
+    def _apply_focus(self, focused):
+        if not focused and self.is_running:
+            program = self._run_program
+            self._pause_macro()
+            self._focus_paused, self._run_program = True, program
+            self.signal_emitter.status_changed.emit("Janela alvo sem foco: pausado", "warning")
+        elif focused and self._focus_paused and not self.is_running:
+            self._focus_paused = False
+            self._start_macro(program=self._run_program)
+    
+    def _build_program(self):
+        """Compila as trilhas do perfil, o script ativo ou a configuração simples."""
+        if self._uses_tracks():
+            name = self.config_mgr.get("active_profile")
+            return TrackSet.from_profile(self._active_profile(), self.config_mgr.config_file.parent, name)
+        if self.script_file:
+            return ScriptCompiler.load(self._script_path())
+        x, y = self._target_point()
+        return build_simple_program(
+            self.button_type, self.action_type, x, y,
+            self.click_delay_ms, self.hold_duration_ms, self.custom_key,
+            type_text=self.type_text, type_char_delay_ms=self.type_char_delay_ms
+        )
+    
+    def _reload_program(self):
+        """Aplica mudanças de configuração ao programa em execução."""
+        engine = self.engine
+        if not self.is_running or engine is None or self.script_file or self._uses_tracks():
+            return
         try:
-            if action_type == "click":
-                self.mouse_controller.click(button, 1)
-            else:
-                self.mouse_controller.press(button)
-                time.sleep(self.hold_duration_ms / 1000)
-                self.mouse_controller.release(button)
-        except Exception as e:
-            print(f"Erro ao performar ação do mouse: {e}")
+            engine.replace_program(self._build_program())
+        except ValueError as e:
+            print(f"Configuração inválida, mantendo programa atual: {e}")
+    
+    def _script_path(self, script_file=None):
+        path = Path(script_file or self.script_file)
+        if not path.is_absolute():
+            path = self.config_mgr.config_file.parent / path
+        return path
+    
+    def _script_label_text(self):
+        if self._uses_tracks():
+            tracks = self._active_profile()["tracks"]
+            return f"Perfil: {self.config_mgr.get('active_profile')} ({len(tracks)} trilhas)"
+        return f"Script: {self.script_file}" if self.script_file else "Script: nenhum (modo simples)"
     
-    def _perform_keyboard_action(self, key, action_type):
+    def _active_profile(self):
+        """Perfil ativo do macro_config.json, ou None."""
+        name = self.config_mgr.get("active_profile")
+        if not name:
+            return None
+        return self.config_mgr.get("profiles", {}).get(name)
+    
+    def _uses_tracks(self):
+        """True se o perfil ativo define trilhas (agendador multi-trilha)."""
+        profile = self._active_profile()
+        return bool(profile and profile.get("tracks"))
+    
+    def _set_active_profile(self, name):
+        """Ativa um perfil (compilando suas trilhas) ou nenhum, com None."""
+        if name:
+            self._check_profile(name)
+        self.config_mgr.set("active_profile", name or None)
+        self.signal_emitter.settings_changed.emit()
+    
+    def _check_profile(self, name):
+        """Valida um perfil (trilhas e limites) sem ativá-lo."""
+        profile = self.config_mgr.get("profiles", {}).get(name)
+        if profile is None:
+            raise ValueError(f"Perfil desconhecido: {name}")
+        if profile.get("tracks"):
+            TrackSet.from_profile(profile, self.config_mgr.config_file.parent, name)
+        RunLimits.from_profile(profile)
+    
+    def _set_script_file(self, script_file):
+        """Valida (compilando) e ativa um script, ou desativa com None."""
+        if script_file:
+            ScriptCompiler.load(self._script_path(script_file))
+        self.script_file = script_file or None
+        self.config_mgr.set("script_file", self.script_file)
+        self.signal_emitter.settings_changed.emit()
+    
+    def _load_script_dialog(self):
+        """Abre um script de macro e o compila para validar."""
+        base_dir = self.config_mgr.config_file.parent
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Carregar Script de Macro", str(base_dir),
+            "Scripts de macro (*.macro *.txt);;Todos os arquivos (*)"
+        )
+        if not path:
+            return
+        
+        path = Path(path)
+        # Guardar caminho relativo quando o script está ao lado da config
+        script_file = path.name if path.parent.resolve() == base_dir.resolve() else str(path)
         try:
-            if action_type == "click":
-                self.keyboard_controller.press(key)
-                time.sleep(0.05)
-                self.keyboard_controller.release(key)
-            else:
-                self.keyboard_controller.press(key)
-                time.sleep(self.hold_duration_ms / 1000)
-                self.keyboard_controller.release(key)
+            self._set_script_file(script_file)
         except Exception as e:
-            print(f"Erro ao performar ação do teclado: {e}")
+            QMessageBox.critical(self, "Erro no Script", f"Falha ao compilar o script:\n{e}")
+            return
+        
+        program = ScriptCompiler.load(self._script_path())
+        QMessageBox.information(
+            self, "Script Carregado",
+            f"Script '{script_file}' compilado: {len(program)} instruções."
+        )
     
-    def _release_all(self):
+    def _clear_script(self):
+        self._set_script_file(None)
+        self.signal_emitter.status_changed.emit("Script desativado", "warning")
+    
+    def _recording_path(self):
+        path = Path(self.config_mgr.get("recording_file") or "gravacao.mrec")
+        if not path.is_absolute():
+            path = self.config_mgr.config_file.parent / path
+        return path
+    
+    def _toggle_recording(self):
+        """Inicia ou finaliza a gravação de mouse e teclado."""
+        if self.recorder is None:
+            try:
+                self.recorder = InputRecorder(self._recording_path())
+            except OSError as e:
+                QMessageBox.critical(self, "Erro", f"Não foi possível criar a gravação:\n{e}")
+                return
+            if not self.mouse_hook.acquire("record"):
+                self.recorder.stop()
+                self.recorder = None
+                self.signal_emitter.status_changed.emit("Erro ao instalar hook de mouse", "error")
+                return
+            self._record_subscription = self.input_hub.subscribe(
+                self.recorder.on_press, self.recorder.on_release, InputHub.PRIORITY_RECORD
+            )
+            self.record_action.setText("Parar Gravação")
+            self.signal_emitter.status_changed.emit("Gravando...", "warning")
+            return
+        
+        recorder, self.recorder = self.recorder, None
+        self._record_subscription.cancel()
+        self._record_subscription = None
+        self.mouse_hook.release("record")
+        count = recorder.stop()
+        self.record_action.setText("Iniciar Gravação")
+        self.signal_emitter.status_changed.emit(f"Gravação salva: {count} eventos", "success")
+        if self.config_mgr.get("recording_simplify_px"):
+            threading.Thread(target=self._simplify_recording, daemon=True).start()
+    
+    def _simplify_recording(self):
+        """Simplifica a gravação recém-salva, fora da thread da GUI."""
+        path = self._recording_path()
+        simplified = path.with_name(path.name + ".simples")
         try:
-            self.mouse_controller.release(Button.left)
-        except:
-            pass
-        
+            report = simplify_recording(
+                path, simplified,
+                float(self.config_mgr.get("recording_simplify_px")),
+                float(self.config_mgr.get("recording_simplify_ms") or 0)
+            )
+            os.replace(simplified, path)
+        except (OSError, ValueError, RuntimeError) as e:
+            self.signal_emitter.status_changed.emit(f"Erro ao simplificar gravação: {e}", "error")
+            return
+        self.signal_emitter.status_changed.emit(
+            f"Gravação simplificada: {report['events_in']} -> {report['events_out']} eventos "
+            f"({report['reduction']}x, desvio máx. {report['max_deviation_px']} px)", "success"
+        )
+    
+    def _play_recording(self):
+        """Reproduz a gravação salva pelo caminho de execução normal."""
+        if self.recorder is not None:
+            self._toggle_recording()
         try:
-            self.mouse_controller.release(Button.right)
-        except:
-            pass
+            recording = Recording(self._recording_path())
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Aviso", f"Nenhuma gravação disponível:\n{e}")
+            return
+        self._start_macro(program=recording)
+    
+    def _open_recording_editor(self):
+        """Editor de linha do tempo da gravação (edições em memória até salvar)."""
+        if self.recorder is not None:
+            self._toggle_recording()
+        path = self._recording_path()
+        try:
+            recording = Recording(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Aviso", f"Nenhuma gravação disponível:\n{e}")
+            return
         
-        if self.custom_key:
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"Editor de Gravação - {recording.name}")
+        dialog.setGeometry(200, 200, 720, 560)
+        layout = QVBoxLayout()
+        
+        model = RecordingTableModel(RecordingEdits(recording), dialog)
+        table = QTableView()
+        table.setModel(model)
+        table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        # Altura fixa: a view não mede linhas, então milhões de linhas rolam sem custo
+        table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        table.verticalHeader().setDefaultSectionSize(22)
+        table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(table)
+        
+        info_label = QLabel()
+        layout.addWidget(info_label)
+        
+        def refresh_info():
+            edits = model.edits
+            pending = f" - {edits.edit_count} edições não salvas" if edits.modified else ""
+            info_label.setText(f"{len(edits):,} eventos, {edits.recording.duration:.1f} s{pending}")
+        
+        def selected_ranges():
+            # Faixas contíguas (não materializa índices de seleções enormes)
+            return sorted(((r.top(), r.bottom()) for r in table.selectionModel().selection()), reverse=True)
+        
+        def current_row():
+            return table.currentIndex().row() if table.currentIndex().isValid() else -1
+        
+        # Navegação por tempo
+        seek_layout = QHBoxLayout()
+        seek_layout.addWidget(QLabel("Ir para (s):"))
+        seek_spin = QDoubleSpinBox()
+        seek_spin.setDecimals(3)
+        seek_spin.setRange(0, 10 ** 7)
+        seek_layout.addWidget(seek_spin)
+        seek_button = QPushButton("Ir")
+        
+        def seek():
+            row = min(model.edits.row_at(int(seek_spin.value() * 1e6)), model.rowCount() - 1)
+            if row >= 0:
+                table.scrollTo(model.index(row, 0), QAbstractItemView.ScrollHint.PositionAtTop)
+                table.selectRow(row)
+        
+        seek_button.clicked.connect(seek)
+        seek_layout.addWidget(seek_button)
+        seek_layout.addStretch()
+        layout.addLayout(seek_layout)
+        
+        # Edição
+        edit_layout = QHBoxLayout()
+        insert_button = QPushButton("Duplicar")
+        
+        def insert():
+            row = current_row()
+            if row < 0:
+                return
+            model.insert_event(row + 1, model.event_at(row))
+            table.selectRow(row + 1)
+            refresh_info()
+        
+        insert_button.clicked.connect(insert)
+        edit_layout.addWidget(insert_button)
+        
+        delete_button = QPushButton("Excluir")
+        
+        def delete():
+            for top, bottom in selected_ranges():
+                model.delete_rows(top, bottom - top + 1)
+            refresh_info()
+        
+        delete_button.clicked.connect(delete)
+        edit_layout.addWidget(delete_button)
+        
+        edit_layout.addWidget(QLabel("Deslocar (ms):"))
+        shift_spin = QSpinBox()
+        shift_spin.setRange(-10 ** 7, 10 ** 7)
+        edit_layout.addWidget(shift_spin)
+        ripple_check = QCheckBox("até o fim")
+        ripple_check.setChecked(True)
+        edit_layout.addWidget(ripple_check)
+        shift_button = QPushButton("Aplicar")
+        
+        def shift():
+            ranges = selected_ranges()
+            if not ranges:
+                return
+            top = ranges[-1][0]
+            count = model.rowCount() - top if ripple_check.isChecked() else ranges[0][1] - top + 1
+            try:
+                model.shift_rows(top, count, shift_spin.value() * 1000)
+            except ValueError as e:
+                QMessageBox.warning(dialog, "Aviso", f"Deslocamento inválido: {e}")
+            refresh_info()
+        
+        shift_button.clicked.connect(shift)
+        edit_layout.addWidget(shift_button)
+        layout.addLayout(edit_layout)
+        
+        # Salvar / fechar
+        button_layout = QHBoxLayout()
+        save_button = QPushButton("Salvar")
+        
+        def finish_save(error):
+            dialog.setEnabled(True)
+            if error is not None:
+                refresh_info()
+                QMessageBox.critical(dialog, "Erro", f"Não foi possível salvar a gravação:\n{error}")
+                return
+            model.edits.recording.close()
             try:
-                self.keyboard_controller.release(self.custom_key)
-            except:
-                pass
+                os.replace(edited, path)
+                model.set_edits(RecordingEdits(Recording(path)))
+            except (OSError, ValueError) as e:
+                QMessageBox.critical(dialog, "Erro", f"Não foi possível reabrir a gravação:\n{e}")
+                dialog.reject()
+                return
+            refresh_info()
+            self.signal_emitter.status_changed.emit(f"Gravação editada: {len(model.edits)} eventos", "success")
+        
+        edited = path.with_name(path.name + ".editado")
+        
+        def save():
+            # Escrita em streaming numa thread; a GUI só reabre o arquivo no fim
+            dialog.setEnabled(False)
+            info_label.setText("Salvando...")
+            
+            def worker():
+                # Qualquer erro precisa chegar a finish_save, senão o diálogo fica desabilitado
+                error = None
+                try:
+                    model.edits.save(edited)
+                except Exception as e:
+                    error = e
+                finally:
+                    self.signal_emitter.gui_call.emit(lambda: finish_save(error))
+            
+            threading.Thread(target=worker, daemon=True).start()
+        
+        save_button.clicked.connect(save)
+        button_layout.addWidget(save_button)
+        
+        close_button = QPushButton("Fechar")
+        
+        def close():
+            if model.edits.modified and QMessageBox.question(
+                dialog, "Descartar", "Descartar as edições não salvas?"
+            ) != QMessageBox.StandardButton.Yes:
+                return
+            dialog.accept()
+        
+        close_button.clicked.connect(close)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        
+        refresh_info()
+        dialog.setLayout(layout)
+        dialog.exec()
+        model.edits.recording.close()
+    
+    def _release_all(self):
+        """Solta só os botões e teclas que estão de fato pressionados."""
+        self.input_state.release_all()
+        # Local, o motor compartilha o mesmo estado; no processo do motor,
+        # o estado de lá é solto por comando
+        if self.engine is not None:
+            self.engine.release_all()
+    
+    def _on_mouse_move(self, x, y):
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.on_move(x, y)
     
     def _on_mouse_click(self, x, y, button, pressed):
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.on_click(x, y, button, pressed)
         if self.capture_mode and pressed:
-            self.saved_x = x
-            self.saved_y = y
             self.capture_mode = False
-            
-            self.config_mgr.set("saved_x", self.saved_x)
-            self.config_mgr.set("saved_y", self.saved_y)
-            
-            self.signal_emitter.coordinates_updated.emit(self.saved_x, self.saved_y)
-            self.capture_button.setEnabled(True)
-            self.capture_button.setText("Capturar Coordenada")
-            self.signal_emitter.status_changed.emit("Coordenada capturada!", "success")
+            self.hook_events.post(self._apply_captured_coordinate, x, y)
+    
+    def _apply_captured_coordinate(self, x, y):
+        """Grava a coordenada capturada e atualiza a GUI (fora do hook)."""
+        self.mouse_hook.release("capture")
+        message = "Coordenada capturada!"
+        if self.config_mgr.get("window_relative", False):
+            relative = self._capture_window(x, y)
+            if relative is None:
+                self.signal_emitter.gui_call.emit(self._reset_capture_button)
+                self.signal_emitter.status_changed.emit("Nenhuma janela sob o cursor", "error")
+                return
+            x, y, message = relative
+        elif self.config_mgr.get("pause_on_focus_loss", False):
+            # Coordenada absoluta; a janela sob o cursor vira a janela alvo do foco
+            if self._capture_window(x, y) is not None:
+                spec = self.config_mgr.get("target_window")
+                message = f"Coordenada capturada; janela alvo '{spec.get('class') or spec.get('title')}'"
+        self.saved_x = x
+        self.saved_y = y
+        self._remember_target(x, y)
+        
+        # Uma única gravação em disco para as duas coordenadas
+        self.config_mgr.config["saved_x"] = self.saved_x
+        self.config_mgr.set("saved_y", self.saved_y)
+        
+        self.signal_emitter.coordinates_updated.emit(self.saved_x, self.saved_y)
+        self.signal_emitter.gui_call.emit(self._reset_capture_button)
+        self.signal_emitter.status_changed.emit(message, "success")
+    
+    def _set_window_relative(self, enabled):
+        """Liga/desliga coordenadas relativas à janela alvo."""
+        self.config_mgr.set("window_relative", enabled)
+        if enabled:
+            self.signal_emitter.status_changed.emit(
+                "Coordenadas relativas à janela: capture a coordenada sobre a janela alvo", "warning"
+            )
+        else:
+            self.signal_emitter.status_changed.emit(
+                "Coordenadas absolutas: capture a coordenada de novo", "warning"
+            )
+    
+    def _set_pause_on_focus_loss(self, enabled):
+        """Liga/desliga a pausa automática quando a janela alvo perde o foco."""
+        self.config_mgr.set("pause_on_focus_loss", enabled)
+        if not enabled:
+            self._stop_focus_guard()
+            self.signal_emitter.status_changed.emit("Pausa por foco desligada", "warning")
+        elif not self.config_mgr.get("target_window"):
+            self.signal_emitter.status_changed.emit(
+                "Pausa por foco: capture a coordenada sobre a janela alvo", "warning"
+            )
+        else:
+            self.signal_emitter.status_changed.emit("Pausa por foco ligada", "success")
+    
+    def _capture_window(self, x, y):
+        """Identifica a janela sob o cursor como alvo; retorna (x, y relativos, mensagem) ou None."""
+        try:
+            spec, origin = window_under_pointer()
+        except OSError as e:
+            print(f"Não foi possível identificar a janela: {e}")
+            return None
+        if spec is None:
+            return None
+        self.config_mgr.config["target_window"] = spec
+        name = spec.get("class") or spec.get("title")
+        return x - origin[0], y - origin[1], f"Coordenada capturada relativa a '{name}'"
+    
+    def _monitor_layout(self):
+        """Monitores atuais em pixels físicos (geometria do Qt x devicePixelRatio), o principal primeiro."""
+        primary = QApplication.primaryScreen()
+        monitors = []
+        for screen in QApplication.screens():
+            geometry, ratio = screen.geometry(), screen.devicePixelRatio()
+            monitor = Monitor(
+                screen.name() or f"tela {len(monitors) + 1}",
+                round(geometry.x() * ratio), round(geometry.y() * ratio),
+                round(geometry.width() * ratio), round(geometry.height() * ratio), ratio
+            )
+            if screen == primary:
+                monitors.insert(0, monitor)
+            else:
+                monitors.append(monitor)
+        return MonitorLayout(monitors)
+    
+    def _watch_screens(self):
+        """Recalcula o mapeamento quando monitores entram, saem ou mudam de resolução/DPI."""
+        app = QApplication.instance()
+        app.screenAdded.connect(self._watch_screen)
+        app.screenAdded.connect(self._schedule_layout_refresh)
+        app.screenRemoved.connect(self._schedule_layout_refresh)
+        app.primaryScreenChanged.connect(self._schedule_layout_refresh)
+        for screen in app.screens():
+            self._watch_screen(screen)
+        self._update_coordinate_mapper()
+    
+    def _watch_screen(self, screen):
+        screen.geometryChanged.connect(self._schedule_layout_refresh)
+        screen.physicalDotsPerInchChanged.connect(self._schedule_layout_refresh)
+    
+    def _schedule_layout_refresh(self, *args):
+        # Adiado: uma troca de monitor emite vários sinais seguidos e o
+        # screenRemoved chega antes da tela sair de screens()
+        if not self._layout_refresh_pending:
+            self._layout_refresh_pending = True
+            QTimer.singleShot(0, self._refresh_monitor_layout)
+    
+    def _refresh_monitor_layout(self):
+        """Relê os monitores, recalcula as transformações e remonta o programa."""
+        self._layout_refresh_pending = False
+        layout = self._monitor_layout()
+        if layout == self.monitor_layout:
+            return
+        self.monitor_layout = layout
+        self.screen_size = self._backend_options()[0]
+        self._update_coordinate_mapper()
+        print(f"Monitores mudaram: {layout}")
+        if self.coordinate_mapper is not None and self.config_mgr.get("saved_target"):
+            x, y = self._target_point()
+            self.signal_emitter.status_changed.emit(
+                f"Monitores mudaram: coordenada remapeada para X={x}, Y={y}", "warning"
+            )
+            self._reload_program()
+    
+    def _update_coordinate_mapper(self):
+        """Mapeador do layout da captura para o atual (None se são iguais ou não há captura)."""
+        self.coordinate_mapper = None
+        captured = self.config_mgr.get("capture_layout")
+        if not captured:
+            return
+        try:
+            source = MonitorLayout.from_json(captured)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Layout de captura inválido, usando a coordenada absoluta: {e}")
+            return
+        if source != self.monitor_layout:
+            self.coordinate_mapper = CoordinateMapper(source, self.monitor_layout)
+    
+    def _remember_target(self, x, y):
+        """Grava a coordenada normalizada e o layout da captura (relativa à janela, não há)."""
+        if self.config_mgr.get("window_relative", False):
+            target, layout = None, None
+        else:
+            target, layout = self.monitor_layout.normalize(x, y), self.monitor_layout.to_json()
+        self.config_mgr.config["saved_target"] = target
+        self.config_mgr.config["capture_layout"] = layout
+        self.coordinate_mapper = None
+    
+    def _target_point(self):
+        """Coordenada salva, remapeada se os monitores mudaram desde a captura."""
+        mapper = self.coordinate_mapper
+        target = self.config_mgr.get("saved_target")
+        if mapper is None or not target or self.config_mgr.get("window_relative", False):
+            return self.saved_x, self.saved_y
+        return mapper.map_target(target)
+    
+    def _reset_capture_button(self):
+        self.capture_button.setEnabled(True)
+        self.capture_button.setText("Capturar Coordenada")
+    
+    def _start_control_server(self):
+        """Inicia o servidor de controle local se habilitado na configuração."""
+        if not self.config_mgr.get("control_api_enabled", False):
+            return
+        
+        address = self.config_mgr.get("control_socket") or default_control_address(
+            self.config_mgr.get("control_port", 47800)
+        )
+        self.control_server = ControlServer(self._handle_control_command, address)
+        if not self.control_server.start():
+            self.control_server = None
+    
+    def _load_schedule(self):
+        """Carrega no agendador os gatilhos "schedule" de todos os perfis."""
+        triggers = []
+        for name, profile in self.config_mgr.get("profiles", {}).items():
+            try:
+                triggers.extend(ScheduledTrigger.from_profile(name, profile))
+            except ValueError as e:
+                print(f"Agendamento inválido no perfil {name}: {e}")
+        self.trigger_scheduler.set_triggers(triggers)
+        upcoming = self._next_scheduled()
+        if upcoming:
+            when = time.strftime("%d/%m %H:%M", time.localtime(upcoming["at"]))
+            message = f"Próximo início agendado: {upcoming['profile']} em {when}"
+            self.signal_emitter.status_changed.emit(message, "success")
+    
+    def _next_scheduled(self):
+        """Próximo início agendado ({"profile", "at" em epoch}) ou None."""
+        upcoming = self.trigger_scheduler.upcoming(1)
+        if not upcoming:
+            return None
+        when, trigger = upcoming[0]
+        return {"profile": trigger.profile, "at": when}
+    
+    def _on_scheduled_trigger(self, trigger):
+        """Gatilho agendado (thread do agendador): ativa o perfil e inicia pelo caminho normal."""
+        if self.is_running:
+            message = f"Início agendado ignorado ({trigger.describe()}): macro já em execução"
+            self.signal_emitter.status_changed.emit(message, "warning")
+            return
+        try:
+            if self.config_mgr.get("active_profile") != trigger.profile:
+                self._set_active_profile(trigger.profile)
+            started = self._start_macro()
+        except ValueError as e:
+            message = f"Erro no início agendado ({trigger.describe()}): {e}"
+            self.signal_emitter.status_changed.emit(message, "error")
+            return
+        if not started:
+            message = f"Início agendado sem coordenada capturada: {trigger.profile}"
+            self.signal_emitter.status_changed.emit(message, "error")
+            return
+        self.metrics.inc("scheduled_starts_total")
+    
+    def _handle_control_command(self, cmd, args):
+        """Executa um comando recebido pelo servidor de controle.
+        
+        Chamado na thread do servidor: as métricas respondem ali mesmo; os
+        demais comandos mexem no estado da janela e na config, então rodam
+        na thread da GUI (sinal gui_call) e o resultado volta por uma fila.
+        """
+        if cmd == "metrics":
+            if args.get("format") == "prometheus":
+                return self.metrics.to_prometheus()
+            return self.metrics.snapshot()
+        return self._call_in_gui(self._run_control_command, cmd, args)
+    
+    def _call_in_gui(self, function, *args, timeout=2.0):
+        """Executa function na thread da GUI e devolve o resultado (ou relança o erro)."""
+        results = queue.Queue(maxsize=1)
+        
+        def call():
+            try:
+                results.put((True, function(*args)))
+            except Exception as e:
+                results.put((False, e))
+        
+        self.signal_emitter.gui_call.emit(call)
+        try:
+            ok, value = results.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("a interface não respondeu a tempo") from None
+        if not ok:
+            raise value
+        return value
+    
+    def _run_control_command(self, cmd, args):
+        """Comando do servidor de controle, já na thread da GUI."""
+        if cmd == "start":
+            if not self._start_macro():
+                raise ValueError("Nenhuma coordenada capturada")
+        elif cmd == "pause":
+            self._pause_macro()
+        elif cmd == "stop":
+            self._stop_macro()
+            self.update_status("Parado", "error")
+        elif cmd == "reconfigure":
+            self._apply_remote_settings(args)
+        elif cmd != "status":
+            raise ValueError(f"Comando desconhecido: {cmd}")
+        return self._control_status()
+    
+    def _apply_remote_settings(self, args):
+        """Aplica configurações recebidas pelo servidor de controle (na thread da GUI).
+        
+        Tudo é validado antes da primeira atribuição: um argumento inválido
+        recusa o comando inteiro sem deixar configurações pela metade.
+        """
+        settings = parse_remote_settings(args)
+        if settings.get("script_file"):
+            ScriptCompiler.load(self._script_path(settings["script_file"]))
+        if settings.get("active_profile"):
+            self._check_profile(settings["active_profile"])
+        
+        for key in ("action_type", "button_type", "click_delay_ms", "hold_duration_ms",
+                    "type_text", "type_char_delay_ms"):
+            if key in settings:
+                setattr(self, key, settings[key])
+        if "saved_x" in settings:
+            self.saved_x, self.saved_y = settings["saved_x"], settings["saved_y"]
+            self._remember_target(self.saved_x, self.saved_y)
+            self.update_coordinates_display(self.saved_x, self.saved_y)
+        if "script_file" in settings:
+            self._set_script_file(settings["script_file"])
+        if "active_profile" in settings:
+            self._set_active_profile(settings["active_profile"])
+        if "custom_key_combo" in settings:
+            combo = settings["custom_key_combo"]
+            self.custom_key = settings["custom_key"]
+            self.custom_key_name = combo.upper() if combo else "Nenhuma"
+            self.config_mgr.config["custom_key_combo"] = combo
+            self.config_mgr.config["custom_key_name"] = self.custom_key_name
+        hotkeys = {name: settings[name] for name in ("key_start", "key_pause", "key_exit")
+                   if name in settings}
+        if hotkeys:
+            self.config_mgr.config.update(hotkeys)
+            self._compile_hotkeys()
+            self.key_start = self._string_to_key(self.config_mgr.get("key_start"))
+            self.key_pause = self._string_to_key(self.config_mgr.get("key_pause"))
+            self.key_exit = self._string_to_key(self.config_mgr.get("key_exit"))
+        
+        for key in ("action_type", "button_type", "click_delay_ms", "hold_duration_ms",
+                    "saved_x", "saved_y", "type_text", "type_char_delay_ms"):
+            self.config_mgr.config[key] = getattr(self, key)
+        # Gravar em disco apenas quando pedido, para manter o comando barato
+        if settings["persist"]:
+            self.config_mgr.save_config()
+        
+        self._reload_program()
+        self._sync_widgets_from_state()
+    
+    def _control_status(self):
+        return {
+            "running": self.is_running,
+            "paused": self.is_paused,
+            "action_type": self.action_type,
+            "button_type": self.button_type,
+            "click_delay_ms": self.click_delay_ms,
+            "hold_duration_ms": self.hold_duration_ms,
+            "type_char_delay_ms": self.type_char_delay_ms,
+            "type_text_length": len(self.type_text),
+            "saved_x": self.saved_x,
+            "saved_y": self.saved_y,
+            "script_file": self.script_file,
+            "active_profile": self.config_mgr.get("active_profile"),
+            "next_scheduled": self._next_scheduled()
+        }
+    
+    def _sync_widgets_from_state(self):
+        """Reflete nos widgets o estado alterado fora da GUI."""
+        button_map = {"esquerdo": 0, "direito": 1, "custom": 2}
+        action_map = {"click": 0, "hold": 1, "type": 2}
+        self.action_button_group.button(action_map.get(self.action_type, 0)).setChecked(True)
+        self.button_button_group.button(button_map.get(self.button_type, 0)).setChecked(True)
+        self.script_label.setText(self._script_label_text())
+        if self.type_text_edit.toPlainText() != self.type_text:
+            self.type_text_edit.blockSignals(True)
+            self.type_text_edit.setPlainText(self.type_text)
+            self.type_text_edit.blockSignals(False)
+        self.custom_key_label.setText(f"Tecla selecionada: {self.custom_key_name}")
+        self.info_label.setText(
+            f"{self._key_name(self.key_start)} - Iniciar (Start)\n"
+            f"{self._key_name(self.key_pause)} - Pausar/Parar (Pause/Stop)\n"
+            f"{self._key_name(self.key_exit)} - Sair (Exit)\n\n"
+            "Configure a coordenada antes de iniciar!\n"
+            "Acesse Configurações para rebindar as teclas."
+        )
+        
+        # Evitar que valueChanged regrave o arquivo de config
+        for spinbox, value in ((self.delay_spinbox, self.click_delay_ms),
+                               (self.hold_spinbox, self.hold_duration_ms),
+                               (self.type_delay_spinbox, self.type_char_delay_ms)):
+            spinbox.blockSignals(True)
+            spinbox.setValue(value)
+            spinbox.blockSignals(False)
+    
+    def _refresh_stats(self):
+        """Atualiza o painel de estatísticas e o arquivo de métricas."""
+        snapshot = self.metrics.snapshot()
+        self.stats_label.setText(self.metrics.summary(snapshot))
+        
+        textfile = self.config_mgr.get("metrics_textfile")
+        if textfile:
+            try:
+                self.metrics.write_prometheus(textfile, snapshot)
+            except OSError as e:
+                print(f"Erro ao exportar métricas: {e}")
+    
+    def _run_in_gui(self, fn):
+        """Slot do sinal gui_call (conexão enfileirada na thread da GUI)."""
+        fn()
     
     def update_coordinates_display(self, x, y):
         self.coord_label.setText(f"Coordenadas: X={x}, Y={y}")
@@ -741,13 +1923,6 @@ class MacroAutomationPyQt(QMainWindow):
     
     def _open_keybind_dialog(self):
         """Abre diálogo para rebindar as teclas de hotkey (F1, F2, F3)."""
-        # Parar listener global para evitar conflitos
-        try:
-            if self.listener:
-                self.listener.stop()
-        except:
-            pass
-        
         dialog = QDialog(self)
         dialog.setWindowTitle("Rebindar Hotkeys")
         dialog.setGeometry(200, 200, 450, 300)
@@ -805,13 +1980,6 @@ class MacroAutomationPyQt(QMainWindow):
         
         dialog.setLayout(layout)
         dialog.exec()
-        
-        # Reiniciar listener quando dialog fecha
-        try:
-            if not self.listener or not self.listener.is_alive():
-                self._initialize_listeners()
-        except:
-            self._initialize_listeners()
     
     def _capture_hotkey_rebind(self, hotkey_type, parent_dialog):
         """Captura uma tecla para rebindar um hotkey."""
@@ -839,67 +2007,59 @@ class MacroAutomationPyQt(QMainWindow):
         
         dialog.setLayout(layout)
         
-        listener_obj = None
-        
-        def capture_key_in_thread():
-            nonlocal listener_obj
-            
-            def on_press(key):
-                try:
-                    # Obter nome da tecla
-                    try:
-                        key_name = key.name
-                        if key_name.startswith("_"):
-                            key_name = key_name[1:]
-                    except AttributeError:
-                        key_name = str(key).replace("'", "")
-                    
-                    key_name_clean = key_name.lower()
-                    
-                    # Salvar a tecla apropriada
-                    if hotkey_type == "start":
-                        self.key_start = key
-                        self.config_mgr.set("key_start", key_name_clean)
-                        self.start_key_display.setText(self._key_name(self.key_start))
-                        print(f"Rebinded START para: {key_name_clean}")
-                    elif hotkey_type == "pause":
-                        self.key_pause = key
-                        self.config_mgr.set("key_pause", key_name_clean)
-                        self.pause_key_display.setText(self._key_name(self.key_pause))
-                        print(f"Rebinded PAUSE para: {key_name_clean}")
-                    elif hotkey_type == "exit":
-                        self.key_exit = key
-                        self.config_mgr.set("key_exit", key_name_clean)
-                        self.exit_key_display.setText(self._key_name(self.key_exit))
-                        print(f"Rebinded EXIT para: {key_name_clean}")
-                    
-                    # Atualizar display
-                    key_display.setText(f"Tecla selecionada: {key_name.upper()}")
-                    
-                    # Fechar após 1 segundo
-                    QTimer.singleShot(1000, dialog.accept)
-                    return False
-                except Exception as e:
-                    print(f"Erro ao capturar hotkey: {e}")
-                    return False
-            
+        def apply_rebind(key):
             try:
-                listener_obj = Listener(on_press=on_press)
-                listener_obj.start()
-                listener_obj.join(timeout=15)
+                # Obter nome da tecla
+                try:
+                    key_name = key.name
+                    if key_name.startswith("_"):
+                        key_name = key_name[1:]
+                except AttributeError:
+                    key_name = str(key).replace("'", "")
+                
+                key_name_clean = key_name.lower()
+                
+                # Salvar a tecla apropriada
+                if hotkey_type == "start":
+                    self.key_start = key
+                    self.config_mgr.set("key_start", key_name_clean)
+                    print(f"Rebinded START para: {key_name_clean}")
+                elif hotkey_type == "pause":
+                    self.key_pause = key
+                    self.config_mgr.set("key_pause", key_name_clean)
+                    print(f"Rebinded PAUSE para: {key_name_clean}")
+                elif hotkey_type == "exit":
+                    self.key_exit = key
+                    self.config_mgr.set("key_exit", key_name_clean)
+                    print(f"Rebinded EXIT para: {key_name_clean}")
+                
+                self.signal_emitter.gui_call.emit(lambda: update_dialog(key_name))
             except Exception as e:
-                print(f"Erro na listener: {e}")
+                print(f"Erro ao capturar hotkey: {e}")
+        
+        def update_dialog(key_name):
+            self.start_key_display.setText(self._key_name(self.key_start))
+            self.pause_key_display.setText(self._key_name(self.key_pause))
+            self.exit_key_display.setText(self._key_name(self.key_exit))
+            key_display.setText(f"Tecla selecionada: {key_name.upper()}")
+            
+            # Fechar após 1 segundo
+            QTimer.singleShot(1000, dialog.accept)
         
-        thread = threading.Thread(target=capture_key_in_thread, daemon=True)
-        thread.start()
+        def on_press(key):
+            # Thread do hook: só enfileira e consome a tecla, para que os
+            # hotkeys atuais não disparem durante a captura
+            self.hook_events.post(apply_rebind, key)
+            return True
         
+        # Assinatura one-shot no hook compartilhado (sem Listener próprio)
+        subscription = self.input_hub.subscribe(
+            on_press, priority=InputHub.PRIORITY_CAPTURE, once=True
+        )
         dialog.exec()
+        subscription.cancel()
         
-        if listener_obj:
-            try:
-                listener_obj.stop()
-            except:
-                pass
+        self._compile_hotkeys()
         
         # Atualizar info_label na janela principal
         info_text = (
@@ -958,10 +2118,12 @@ class MacroAutomationPyQt(QMainWindow):
             self.config_mgr.set("key_start", "f1")
             self.config_mgr.set("key_pause", "f2")
             self.config_mgr.set("key_exit", "f3")
+            self._compile_hotkeys()
             
             self.custom_key = None
             self.custom_key_name = "Nenhuma"
             self.config_mgr.set("custom_key_name", "Nenhuma")
+            self.config_mgr.set("custom_key_combo", None)
             self.custom_key_label.setText("Tecla selecionada: Nenhuma")
             
             self.delay_spinbox.setValue(100)
@@ -1013,19 +2175,7 @@ F3 - Sair
     
     def _create_default_config(self):
         """Cria um arquivo de configuração padrão que pode ser editado manualmente."""
-        default_template = {
-            "theme": "dark",
-            "button_type": "esquerdo",
-            "saved_x": None,
-            "saved_y": None,
-            "key_start": "f1",
-            "key_pause": "f2",
-            "key_exit": "f3",
-            "click_delay_ms": 100,
-            "action_type": "click",
-            "hold_duration_ms": 500,
-            "custom_key_name": "Nenhuma"
-        }
+        default_template = dict(self.config_mgr.default_config)
         
         try:
             with open(self.config_mgr.config_file, 'w', encoding='utf-8') as f:
@@ -1071,78 +2221,75 @@ F3 - Sair
         
         dialog.setLayout(layout)
         
-        listener_obj = None
-        
-        def capture_key_in_thread():
-            """Captura a tecla em uma thread separada."""
-            nonlocal listener_obj
-            
-            def on_press(key):
-                try:
-                    # Obter nome da tecla de forma robusta
-                    try:
-                        key_name = key.name
-                        if key_name.startswith("_"):
-                            key_name = key_name[1:]
-                    except AttributeError:
-                        # Para caracteres normais/KeyCode
-                        key_name = str(key).replace("'", "")
-                    
-                    self.custom_key = key
-                    self.custom_key_name = key_name.upper()
-                    self.config_mgr.set("custom_key_name", self.custom_key_name)
-                    
-                    # Atualizar UI
-                    selected_key_label.setText(f"Tecla selecionada: {self.custom_key_name}")
-                    self.custom_key_label.setText(f"Tecla selecionada: {self.custom_key_name}")
-                    
-                    # Fechar após 1 segundo
-                    QTimer.singleShot(1000, dialog.accept)
-                    return False
-                except Exception as e:
-                    print(f"Erro ao capturar tecla: {e}")
-                    return False
-            
+        def apply_key(key):
             try:
-                listener_obj = Listener(on_press=on_press)
-                listener_obj.start()
-                listener_obj.join(timeout=15)  # Timeout de 15 segundos
+                # Obter nome da tecla de forma robusta
+                try:
+                    key_name = key.name
+                    if key_name.startswith("_"):
+                        key_name = key_name[1:]
+                except AttributeError:
+                    # Para caracteres normais/KeyCode
+                    key_name = str(key).replace("'", "")
+                
+                self.custom_key = (key,)
+                self.custom_key_name = key_name.upper()
+                self.config_mgr.config["custom_key_name"] = self.custom_key_name
+                self.config_mgr.set("custom_key_combo", key_name.lower())
+                self.signal_emitter.gui_call.emit(update_dialog)
             except Exception as e:
-                print(f"Erro na listener: {e}")
+                print(f"Erro ao capturar tecla: {e}")
         
-        thread = threading.Thread(target=capture_key_in_thread, daemon=True)
-        thread.start()
+        def update_dialog():
+            selected_key_label.setText(f"Tecla selecionada: {self.custom_key_name}")
+            self.custom_key_label.setText(f"Tecla selecionada: {self.custom_key_name}")
+            
+            # Fechar após 1 segundo
+            QTimer.singleShot(1000, dialog.accept)
         
-        dialog.exec()
+        def on_press(key):
+            self.hook_events.post(apply_key, key)
+            return True
         
-        if listener_obj:
-            try:
-                listener_obj.stop()
-            except:
-                pass
+        subscription = self.input_hub.subscribe(
+            on_press, priority=InputHub.PRIORITY_CAPTURE, once=True
+        )
+        dialog.exec()
+        subscription.cancel()
     
     def closeEvent(self, event):
-        self.is_running = False
-        self._release_all()
+        self._stop_macro()
         
-        self.config_mgr.set("button_type", "esquerdo")  # Salvar estado
+        if self.recorder is not None:
+            self._toggle_recording()
         
-        try:
-            if self.listener:
-                self.listener.stop()
-        except:
-            pass
+        backend = getattr(self.mouse_controller, "backend", None)
+        if backend:
+            backend.close()
         
-        try:
-            if self.mouse_listener:
-                self.mouse_listener.stop()
-        except:
-            pass
+        if self.control_server:
+            self.control_server.stop()
+        
+        self.trigger_scheduler.stop()
+        
+        if self.window_tracker is not None:
+            self.window_tracker.stop()
+        self._stop_focus_guard()
+        
+        if self.engine_process:
+            self.engine_process.close()
+        
+        self.config_mgr.set("button_type", "esquerdo")  # Salvar estado
+        
+        self.input_hub.stop()
+        self.mouse_hook.close()
+        self.hook_events.stop()
         
         event.accept()
 
 
 def main():
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = MacroAutomationPyQt()
     window.show()
@@ -1,9 +1,10 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
 
 
 a = Analysis(
     ['MacroV2.0_PyQt6.py'],
-    pathex=[],
+    pathex=[os.path.join(SPECPATH, '..', '..', 'Shared')],  # macro_engine.py compartilhado
     binaries=[],
     datas=[],
     hiddenimports=[],
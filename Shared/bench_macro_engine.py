@@ -0,0 +1,1107 @@
+"""
+Benchmarks do motor de macro (macro_engine.py)
+Fora do módulo do motor para não irem parar nos executáveis do PyInstaller.
+Autor: Senior Python Developer
+
+Uso: python bench_macro_engine.py [nome ...]
+"""
+
+import asyncio
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from macro_engine import (
+    AsyncMacroEngine, CoordinateMapper, EngineProcess, FocusGuard, HookEventQueue, HotkeyMatcher,
+    INPUT_EVENT, InputHub, MacroEngine, MacroMetrics, Monitor, MonitorLayout, MouseController,
+    MouseListener, OnDemandHook, REC_MOVE, REC_PRESS, REC_RELEASE, Recording, RecordingEdits,
+    RecordingWriter, RunLimits, ScriptCompiler, TrackSet, UINPUT_PATH, UInputBackend, VirtualClock,
+    WindowTracker, XTEST_FLUSH_POLICIES, XTestBackend, apply_worker_scheduling,
+    build_simple_program, decode_input_events, np, rate_limit_controllers, resolve_button,
+    resolve_combo, resolve_key, simplify_recording, simulate, track_controllers, x11_monitor_layout,
+    xdisplay, _NullController, _window_origin
+)
+
+
+class _NullListener(threading.Thread):
+    """Listener que só ocupa uma thread até ser parado (sem hook real)."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._stopped = threading.Event()
+
+    def run(self):
+        self._stopped.wait()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _bench_script(iterations=200000):
+    """Instruções/s do interpretador vs. um laço Python equivalente."""
+    program = ScriptCompiler.compile(
+        f"repeat {iterations}\n  move 10 10\n  click left\n  key a\nend\n"
+    )
+    # move + click + key + LOOP_NEXT por iteração
+    instructions = iterations * 4
+    engine = MacroEngine(_NullController(), _NullController(), MacroMetrics())
+
+    start = time.perf_counter()
+    engine.run(program)
+    interpreted = time.perf_counter() - start
+
+    mouse, keyboard, metrics = _NullController(), _NullController(), MacroMetrics()
+    button, key = resolve_button("left"), resolve_key("a")
+    start = time.perf_counter()
+    for _ in range(iterations):
+        mouse.position = (10, 10)
+        mouse.click(button, 1)
+        metrics.inc("actions_total")
+        keyboard.press(key)
+        keyboard.release(key)
+        metrics.inc("actions_total")
+    handwritten = time.perf_counter() - start
+
+    print(f"Interpretador: {instructions / interpreted:,.0f} instruções/s ({interpreted:.3f} s)")
+    print(f"Laço Python:   {instructions / handwritten:,.0f} instruções/s ({handwritten:.3f} s)")
+    print(f"Razão: {interpreted / handwritten:.2f}x")
+
+
+def _bench_hotkeys(events=500000):
+    """Custo por evento do HotkeyMatcher."""
+    matcher = HotkeyMatcher({"start": "f1", "pause": "ctrl+shift+x", "exit": "g g"})
+    stream = [resolve_key(name) for name in ("a", "b", "ctrl", "shift", "x", "g", "g", "f1")]
+    ctrl, shift = resolve_key("ctrl"), resolve_key("shift")
+
+    start = time.perf_counter()
+    for i in range(events):
+        key = stream[i & 7]
+        if key is ctrl or key is shift:
+            matcher.feed_press(key)
+            continue
+        matcher.feed_press(key)
+        if i & 7 == 4:
+            matcher.feed_release(ctrl)
+            matcher.feed_release(shift)
+    elapsed = time.perf_counter() - start
+    print(f"HotkeyMatcher: {elapsed / events * 1e9:.0f} ns/evento ({events / elapsed:,.0f} eventos/s)")
+
+
+def _bench_hooks(cycles=200, events=200000):
+    """Ciclo de vida do hook sob demanda vs. listener sempre ativo."""
+    def real_listener():
+        return MouseListener(on_click=lambda x, y, button, pressed: None)
+
+    factory = _NullListener
+    if MouseListener is not None:
+        try:
+            probe = real_listener()
+            probe.start()
+            probe.stop()
+            factory = real_listener
+        except Exception as e:
+            print(f"MouseListener real indisponível ({e}); usando listener nulo")
+    print(f"Listener: {'pynput' if factory is real_listener else 'nulo'}")
+
+    threads_before = threading.active_count()
+    hook = OnDemandHook(factory, metrics=MacroMetrics())
+    install, remove = [], []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        hook.acquire("capture")
+        install.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        hook.release("capture")
+        remove.append(time.perf_counter() - start)
+    time.sleep(0.2)
+    install.sort()
+    remove.sort()
+    print(f"Instalar: mediana {install[cycles // 2] * 1e6:.0f} µs, p99 {install[cycles * 99 // 100] * 1e6:.0f} µs")
+    print(f"Remover:  mediana {remove[cycles // 2] * 1e6:.0f} µs, p99 {remove[cycles * 99 // 100] * 1e6:.0f} µs")
+    print(f"Threads após {cycles} ciclos: {threading.active_count()} (antes: {threads_before})")
+
+    # Custo que o listener sempre ativo cobrava por evento do desktop em idle;
+    # com o hook sob demanda nenhum desses callbacks acontece
+    capture_mode = False
+
+    def on_click(x, y, button, pressed):
+        if capture_mode and pressed:
+            pass
+
+    start = time.perf_counter()
+    for i in range(events):
+        on_click(i, i, None, True)
+    elapsed = time.perf_counter() - start
+    print(f"Sempre ativo: {elapsed / events * 1e9:.0f} ns de callback Python por evento em idle "
+          f"(sem contar a ida e volta do hook do SO)")
+    print("Sob demanda: 0 callbacks por evento em idle")
+
+
+def _bench_hub(events=500000, captures=500):
+    """Despacho do InputHub vs. um Listener dedicado por captura."""
+    hub = InputHub(lambda on_press, on_release: _NullListener())
+    matcher = HotkeyMatcher({"start": "f1", "pause": "f2", "exit": "f3"})
+    hub.subscribe(matcher.feed_press, matcher.feed_release, InputHub.PRIORITY_HOTKEYS)
+    key = resolve_key("a")
+
+    for subscribers in (1, 4):
+        while len(hub._subscribers) < subscribers:
+            hub.subscribe(lambda k: None, priority=10)
+        start = time.perf_counter()
+        for _ in range(events):
+            hub._on_press(key)
+        elapsed = time.perf_counter() - start
+        print(f"Despacho com {subscribers} assinante(s): {elapsed / events * 1e9:.0f} ns/evento")
+
+    # Captura de uma tecla: assinatura one-shot vs. thread de Listener nova
+    start = time.perf_counter()
+    for _ in range(captures):
+        hub.subscribe(lambda k: True, priority=InputHub.PRIORITY_CAPTURE, once=True)
+        hub._on_press(key)
+    shared = (time.perf_counter() - start) / captures
+
+    start = time.perf_counter()
+    for _ in range(captures):
+        listener = _NullListener()
+        listener.start()
+        listener.stop()
+        listener.join()
+    dedicated = (time.perf_counter() - start) / captures
+    print(f"Captura one-shot no hub: {shared * 1e6:.1f} µs")
+    print(f"Listener dedicado (só a thread, sem hook do SO): {dedicated * 1e6:.1f} µs")
+
+
+def _bench_handoff(events=2000):
+    """Tempo na thread do hook: gravar a config inline vs. enfileirar."""
+    config = {f"chave_{i}": i for i in range(40)}
+    path = os.path.join(tempfile.gettempdir(), f"macro_bench_{os.getpid()}.json")
+
+    def save(x, y):
+        config["saved_x"], config["saved_y"] = x, y
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=4)
+
+    start = time.perf_counter()
+    for i in range(events):
+        save(i, i)
+        save(i, i)  # Antes: duas chamadas a config_mgr.set por clique
+    inline = (time.perf_counter() - start) / events
+
+    hook_events = HookEventQueue()
+    hook_events.start()
+    start = time.perf_counter()
+    for i in range(events):
+        hook_events.post(save, i, i)
+    posted = (time.perf_counter() - start) / events
+    hook_events.stop(timeout=30)
+    os.remove(path)
+    print(f"Inline (2 gravações JSON): {inline * 1e6:.1f} µs por callback")
+    print(f"Enfileirado:               {posted * 1e6:.2f} µs por callback")
+
+
+def _bench_uinput(clicks=20000):
+    """Cliques/s: uinput (pipe de teste e /dev/uinput real) vs. pynput."""
+    def measure(label, mouse, count):
+        button = resolve_button("left")
+        start = time.perf_counter()
+        for _ in range(count):
+            mouse.click(button, 1)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {count / elapsed:,.0f} cliques/s ({elapsed / count * 1e6:.1f} µs/clique)")
+
+    # Dispositivo simulado: pipe drenado e decodificado por outra thread
+    read_fd, write_fd = os.pipe()
+    received = []
+
+    def drain():
+        pending = b""
+        while True:
+            chunk = os.read(read_fd, 1 << 16)
+            if not chunk:
+                break
+            pending += chunk
+            usable = len(pending) - len(pending) % INPUT_EVENT.size
+            received.extend(decode_input_events(pending[:usable]))
+            pending = pending[usable:]
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    backend = UInputBackend(write_fd)
+    measure("uinput (pipe)", backend.mouse, clicks)
+    os.close(write_fd)
+    reader.join()
+    os.close(read_fd)
+    print(f"  {backend.writes} write()s, {len(received)} eventos decodificados "
+          f"({len(received) // clicks} por clique)")
+
+    try:
+        real = UInputBackend(UINPUT_PATH)
+    except OSError as e:
+        print(f"uinput (/dev/uinput): indisponível ({e})")
+    else:
+        try:
+            measure("uinput (/dev/uinput)", real.mouse, min(clicks, 2000))
+        finally:
+            real.close()
+
+    if MouseController is None:
+        print("pynput: não instalado")
+        return
+    try:
+        controller = MouseController()
+        measure("pynput", controller, min(clicks, 2000))
+    except Exception as e:
+        print(f"pynput: indisponível ({e})")
+
+
+def _start_xvfb():
+    """Sobe um Xvfb descartável e aponta DISPLAY para ele (None se indisponível)."""
+    import shutil
+    import subprocess
+
+    if not shutil.which("Xvfb"):
+        return None
+    for number in range(99, 120):
+        if not os.path.exists(f"/tmp/.X11-unix/X{number}"):
+            break
+    proc = subprocess.Popen(
+        ["Xvfb", f":{number}", "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 5
+    while not os.path.exists(f"/tmp/.X11-unix/X{number}"):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            return None
+        time.sleep(0.05)
+    os.environ["DISPLAY"] = f":{number}"
+    return proc
+
+
+def _bench_xtest(clicks=5000):
+    """Eventos/s do XTest em lote por política vs. mouse_controller.click do pynput."""
+    if xdisplay is None:
+        print("python-xlib não instalado")
+        return
+    xvfb = _start_xvfb()
+    print(f"Servidor X: {os.environ.get('DISPLAY')} ({'Xvfb' if xvfb else 'existente'})")
+    try:
+        for policy in XTEST_FLUSH_POLICIES:
+            try:
+                backend = XTestBackend(flush_policy=policy)
+            except Exception as e:
+                print(f"XTest indisponível: {e}")
+                return
+            mouse, button = backend.mouse, resolve_button("left")
+            start = time.perf_counter()
+            for i in range(clicks):
+                mouse.position = (i % 1000, i % 700)
+                mouse.click(button, 1)
+                mouse.tick()
+            backend.display.sync()
+            elapsed = time.perf_counter() - start
+            print(f"XTest [{policy:9}]: {backend.events_sent / elapsed:,.0f} eventos/s, "
+                  f"{backend.flushes} flushes")
+            backend.close()
+
+        if MouseController is None:
+            print("pynput: não instalado")
+            return
+        try:
+            controller = MouseController()
+            button = resolve_button("left")
+            start = time.perf_counter()
+            for i in range(clicks):
+                controller.position = (i % 1000, i % 700)
+                controller.click(button, 1)
+            elapsed = time.perf_counter() - start
+            print(f"pynput:               {clicks * 3 / elapsed:,.0f} eventos/s")
+        except Exception as e:
+            print(f"pynput: indisponível ({e})")
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+def _bench_jitter(samples=2000, interval=0.001):
+    """Atraso das esperas do worker com e sem afinidade/prioridade, sob carga.
+
+    A configuração "depois" usa MACRO_BENCH_CPUS (padrão: a última CPU
+    permitida), MACRO_BENCH_POLICY (padrão: fifo) e MACRO_BENCH_NICE
+    (padrão: -5, usado se o tempo real for recusado).
+    """
+    import subprocess
+
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    scheduling = {
+        "cpus": os.environ.get("MACRO_BENCH_CPUS") or (allowed[-1:] or None),
+        "policy": os.environ.get("MACRO_BENCH_POLICY", "fifo"),
+        "nice": int(os.environ.get("MACRO_BENCH_NICE", "-5")),
+    }
+
+    def measure(config):
+        overshoot = []
+
+        def worker():
+            if config:
+                for message in apply_worker_scheduling(**config):
+                    print(f"  {message}")
+            deadline = time.perf_counter()
+            for _ in range(samples):
+                deadline += interval
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                overshoot.append((time.perf_counter() - deadline) * 1000)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        overshoot.sort()
+        return overshoot
+
+    # Carga: um processo ocupado por CPU, como um build ou jogo rodando ao lado
+    load = [
+        subprocess.Popen([sys.executable, "-c", "while True: pass"])
+        for _ in range(os.cpu_count() or 1)
+    ]
+    try:
+        for label, config in (("Antes (padrão)", None), ("Depois", scheduling)):
+            print(f"{label}:")
+            overshoot = measure(config)
+            print(f"  atraso p50 {overshoot[samples // 2]:.3f} ms, "
+                  f"p99 {overshoot[samples * 99 // 100]:.3f} ms, máx {overshoot[-1]:.3f} ms")
+    finally:
+        for proc in load:
+            proc.kill()
+            proc.wait()
+
+
+def _bench_process(iterations=500):
+    """Overshoot das esperas com a GUI ocupando o GIL: thread local vs processo."""
+    program = ScriptCompiler.compile(f"repeat {iterations}\n  click left\n  wait 2\nend\n")
+
+    def busy_gui(done):
+        # Simula o Qt/Tk aplicando folhas de estilo: Python puro segurando o GIL
+        while not done.is_set():
+            ";".join(f"QPushButton {{ color: #{i:06x}; }}" for i in range(2000)).split(";")
+
+    def measure(run):
+        done = threading.Event()
+        worker = threading.Thread(target=lambda: (run(), done.set()))
+        worker.start()
+        busy_gui(done)
+        worker.join()
+
+    def report(label, metrics):
+        snapshot = metrics.snapshot()
+        hist = snapshot["histograms"]["sleep_overshoot_ms"]
+        print(f"{label}: overshoot médio {hist['sum'] / hist['count']:.3f} ms, "
+              f"p99 ≤ {metrics.percentile(snapshot, 'sleep_overshoot_ms', 0.99)} ms "
+              f"({hist['count']} esperas)")
+
+    metrics = MacroMetrics()
+    controller = _NullController()
+    measure(lambda: MacroEngine(controller, controller, metrics).run(program))
+    report("Thread no processo da GUI", metrics)
+
+    # O processo do motor injeta num arquivo comum (uinput emulado)
+    fd, device = tempfile.mkstemp(prefix="macro-bench-", suffix=".uinput")
+    os.close(fd)
+    metrics = MacroMetrics()
+    engine_process = EngineProcess(metrics, backend="uinput", device=device)
+    try:
+        measure(lambda: engine_process.session().run(program))
+        report("Processo separado        ", metrics)
+    finally:
+        engine_process.close()
+        os.unlink(device)
+
+
+def _bench_tracks(seconds=2.0, hz=20):
+    """CPU do agendador de trilhas (uma thread) vs uma thread por trilha."""
+    source = f"repeat\n  click left\n  wait {1000 / hz:g}\nend\n"
+    program = ScriptCompiler.compile(source)
+    controller = _NullController()
+
+    def measure(label, count, threaded):
+        metrics = MacroMetrics()
+        engines = []
+        if threaded:
+            engines = [MacroEngine(controller, controller, metrics) for _ in range(count)]
+            threads = [threading.Thread(target=engine.run, args=(program,)) for engine in engines]
+        else:
+            engines = [MacroEngine(controller, controller, metrics)]
+            tracks = TrackSet([(f"t{i}", program) for i in range(count)])
+            threads = [threading.Thread(target=engines[0].run, args=(tracks,))]
+        cpu = time.process_time()
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        for engine in engines:
+            engine.stop()
+        for thread in threads:
+            thread.join()
+        cpu = time.process_time() - cpu
+        snapshot = metrics.snapshot()
+        actions = snapshot["counters"].get("actions_total", 0)
+        expected = count * hz * seconds
+        print(f"{label:<28} {count:>4} trilhas: {actions / seconds:8.0f} ações/s "
+              f"({actions / expected:.0%} do alvo), CPU {cpu / seconds:6.1%}, "
+              f"p99 atraso ≤ {metrics.percentile(snapshot, 'sleep_overshoot_ms', 0.99)} ms")
+
+    for count in (1, 10, 100):
+        measure("Agendador (1 thread)", count, False)
+    for count in (1, 10, 100):
+        measure("Uma thread por trilha", count, True)
+
+
+def _bench_async(macros=1000, clicks=20, interval_ms=50):
+    """Milhares de macros concorrentes no AsyncMacroEngine, sem thread por macro."""
+    program = ScriptCompiler.compile(f"repeat {clicks}\n  click left\n  wait {interval_ms}\nend\n")
+    controller = _NullController()
+    metrics = MacroMetrics()
+
+    async def scenario():
+        engines = [AsyncMacroEngine(controller, controller, metrics) for _ in range(macros)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(engine.run(program) for engine in engines))
+        return time.perf_counter() - start, results, threading.active_count()
+
+    cpu = time.process_time()
+    elapsed, results, threads = asyncio.run(scenario())
+    cpu = time.process_time() - cpu
+    snapshot = metrics.snapshot()
+    actions = snapshot["counters"].get("actions_total", 0)
+    ideal = (clicks - 1) * interval_ms / 1000
+    print(f"{macros} macros x {clicks} cliques: {actions} ações em {elapsed:.2f} s "
+          f"(ideal {ideal:.2f} s), {actions / elapsed:.0f} ações/s, CPU {cpu:.2f} s")
+    print(f"Threads no processo: {threads}; todas concluídas: {results.count('finished') == macros}; "
+          f"p99 atraso ≤ {metrics.percentile(snapshot, 'sleep_overshoot_ms', 0.99)} ms")
+
+
+def _bench_virtual(hours=1.0):
+    """Simula horas de agenda com VirtualClock e confere o instante de cada ação.
+
+    Retorna False se alguma conferência falhou.
+    """
+
+    class Recorder(_NullController):
+        def __init__(self, clock):
+            self.clock = clock
+            self.times = []
+
+        def click(self, button, count=1):
+            self.times.append(self.clock.now())
+
+        def press(self, key):
+            self.times.append(self.clock.now())
+
+    def check(label, times, interval, expected):
+        worst = max((abs(b - a - interval) for a, b in zip(times, times[1:])), default=0.0)
+        ok = len(times) == expected and worst < 1e-6
+        print(f"  {label}: {len(times)} ações (esperado {expected}), "
+              f"maior desvio do intervalo {worst * 1e6:.3f} µs [{'OK' if ok else 'FALHOU'}]")
+        return ok
+
+    ok = True
+
+    duration = hours * 3600
+    scenarios = (
+        # O programa simples espera 50 ms após o move e mais 50 ms de delay
+        ("Programa simples", lambda: build_simple_program("esquerdo", "click", 10, 10, 50, 0), 0.1),
+        ("Script", lambda: ScriptCompiler.compile("repeat\n  click left\n  wait 50\nend\n"), 0.05),
+    )
+    for label, make_program, interval in scenarios:
+        clock = VirtualClock()
+        recorder = Recorder(clock)
+        engine = MacroEngine(recorder, recorder, clock=clock)
+        clock.call_at(duration, engine.stop)
+        start = time.perf_counter()
+        engine.run(make_program())
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {hours:g} h simulada(s) em {elapsed:.2f} s ({duration / elapsed:,.0f}x o tempo real)")
+        # Intervalo semiaberto: a ação no instante exato do stop não ocorre
+        ok &= check("cliques", recorder.times, interval, round(duration / interval))
+
+    # Trilhas: cliques a 20 Hz e uma tecla a cada 3 s no mesmo agendador
+    clock = VirtualClock()
+    clicks, keys = Recorder(clock), Recorder(clock)
+    engine = MacroEngine(clicks, keys, clock=clock)
+    clock.call_at(duration, engine.stop)
+    tracks = TrackSet([
+        ("cliques", ScriptCompiler.compile("repeat\n  click left\n  wait 50\nend\n")),
+        ("tecla", ScriptCompiler.compile("repeat\n  key f5\n  wait 3000\nend\n")),
+    ])
+    start = time.perf_counter()
+    engine.run(tracks)
+    print(f"Trilhas: {hours:g} h simulada(s) em {time.perf_counter() - start:.2f} s")
+    ok &= check("cliques", clicks.times, 0.05, round(duration / 0.05))
+    ok &= check("tecla", keys.times, 3.0, round(duration / 3.0))
+    return ok
+
+
+def _bench_jobs():
+    """Jobs com limites (iterações, duração) simulados: ponto de parada e vazão.
+
+    Retorna False se algum job parou fora do instante esperado.
+    """
+    program = build_simple_program("esquerdo", "click", 100, 100, 50, 0, None)
+    tracks = TrackSet([
+        ("cliques", ScriptCompiler.compile("repeat\n click\n wait 50\nend")),
+        ("tecla", ScriptCompiler.compile("repeat\n key a\n wait 3000\nend")),
+    ], "jobs")
+    cases = [
+        ("Simples, 10000 iterações", program, RunLimits(iterations=10000), 1000.0),
+        ("Simples, 30 min", program, RunLimits(duration=1800), 1800.0),
+        ("Trilhas, 5000 iterações", tracks, RunLimits(iterations=5000), 250.0),
+        ("Trilhas, 10 min", tracks, RunLimits(duration=600), 600.0),
+    ]
+    ok = True
+    for label, plan, limits, expected in cases:
+        messages = []
+        start = time.perf_counter()
+        reason, engine = simulate(plan, 86400, limits=limits, status_callback=messages.append)
+        elapsed = time.perf_counter() - start
+        gauges = engine.metrics.snapshot()["gauges"]
+        within = abs(engine.clock.now() - expected) < 1e-3
+        ok &= within
+        status = "OK" if within else "FORA DO ESPERADO"
+        print(f"{label:<26}: {reason:<10} em {engine.clock.now():8.1f} s simulados "
+              f"(esperado {expected:.1f}) [{status}], {gauges['job_iterations']} iterações, "
+              f"{gauges['job_actions_per_sec']} ações/s, {elapsed:.2f} s reais")
+    return ok
+
+
+def _bench_recording(events=1000000):
+    """Tamanho, abertura, busca e reprodução (memória) de uma gravação .mrec.
+
+    MACRO_BENCH_EVENTS altera o número de eventos (ex.: 10000000).
+    """
+    import random
+    import tracemalloc
+
+    events = int(os.environ.get("MACRO_BENCH_EVENTS", events))
+    fd, path = tempfile.mkstemp(prefix="macro-bench-", suffix=".mrec")
+    os.close(fd)
+    try:
+        # Movimentos a ~1 kHz com cliques ocasionais, como um MouseListener
+        rng = random.Random(42)
+        start = time.perf_counter()
+        with RecordingWriter(path) as writer:
+            t, x, y = 0, 960, 540
+            for i in range(events):
+                t += rng.randint(500, 1500)
+                x += rng.randint(-3, 3)
+                y += rng.randint(-3, 3)
+                if i % 500 == 499:
+                    writer.append(t, REC_PRESS if i % 1000 == 499 else REC_RELEASE, x, y, "left")
+                else:
+                    writer.append(t, REC_MOVE, x, y)
+        write_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+        print(f"Gravação: {events:,} eventos em {write_time:.2f} s, {size / 1e6:.1f} MB "
+              f"({size / events:.2f} bytes/evento; tuplas cruas: {struct.calcsize('<qBiiH')} bytes)")
+
+        start = time.perf_counter()
+        recording = Recording(path)
+        print(f"Abertura: {(time.perf_counter() - start) * 1000:.2f} ms ({recording.chunk_count} blocos)")
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            recording.index_at(rng.randint(0, recording.last_t_us))
+        print(f"Busca por tempo: {(time.perf_counter() - start):.3f} ms por busca (decodifica 1 bloco)")
+
+        start = time.perf_counter()
+        count = sum(1 for _ in recording)
+        elapsed = time.perf_counter() - start
+        # Segunda passada só para medir memória (tracemalloc deixa tudo lento)
+        tracemalloc.start()
+        for _ in recording:
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Decodificação completa: {count / elapsed:,.0f} eventos/s, pico de memória {peak / 1e6:.1f} MB")
+
+        result, engine = simulate(recording, recording.duration + 1)
+        print(f"Reprodução (relógio virtual): {result}, {recording.duration:.0f} s de gravação, "
+              f"{engine.metrics.snapshot()['counters'].get('actions_total', 0)} cliques")
+        recording.close()
+    finally:
+        os.unlink(path)
+
+
+def _bench_timeline(events=1000000, pages=2000, rows=40):
+    """Rolagem de um editor sobre RecordingEdits: custo por página e memória.
+
+    MACRO_BENCH_EVENTS altera o número de eventos (ex.: 10000000).
+    """
+    import random
+    import tracemalloc
+
+    events = int(os.environ.get("MACRO_BENCH_EVENTS", events))
+    fd, path = tempfile.mkstemp(prefix="macro-bench-", suffix=".mrec")
+    os.close(fd)
+    try:
+        rng = random.Random(3)
+        with RecordingWriter(path) as writer:
+            t = 0
+            for i in range(events):
+                t += rng.randint(500, 1500)
+                writer.append(t, REC_MOVE, i % 1920, i % 1080)
+
+        recording = Recording(path)
+        edits = RecordingEdits(recording)
+        # Edições espalhadas: 1000 inserções, exclusões e deslocamentos
+        for _ in range(1000):
+            row = rng.randrange(1, len(edits) - 100)
+            op = rng.random()
+            if op < 0.4:
+                edits.insert(row, (edits[row - 1][0], REC_MOVE, 0, 0, None))
+            elif op < 0.8:
+                edits.delete(row, rng.randint(1, 50))
+            else:
+                edits.shift(row, len(edits) - row, 1000)
+
+        # Página visível: rolagem em sequência e saltos aleatórios da barra
+        tops = []
+        top = 0
+        for i in range(pages):
+            top = rng.randrange(len(edits) - rows) if i % 10 == 0 else min(top + rows, len(edits) - rows)
+            tops.append(top)
+        latencies = []
+        for top in tops:
+            start = time.perf_counter()
+            for row in range(top, top + rows):
+                edits[row]
+            latencies.append(time.perf_counter() - start)
+        # Segunda passada só para medir memória (tracemalloc deixa tudo lento)
+        tracemalloc.start()
+        for top in tops:
+            for row in range(top, top + rows):
+                edits[row]
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        latencies.sort()
+        print(f"Linhas: {len(edits):,} ({edits.edit_count} peças de edição)")
+        print(f"Página de {rows} linhas: mediana {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms")
+        print(f"Pico de memória: {peak / 1e6:.1f} MB (gravação de {os.path.getsize(path) / 1e6:.1f} MB)")
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            edits.row_at(rng.randint(0, recording.last_t_us))
+        print(f"Ir para tempo: {(time.perf_counter() - start):.3f} ms por busca")
+        recording.close()
+    finally:
+        os.unlink(path)
+
+
+def _bench_simplify(events=1000000, tolerance_px=3.0, tolerance_ms=100.0):
+    """Redução e desvio máximo da simplificação de uma gravação sintética."""
+    import math
+    import random
+
+    if np is None:
+        print("NumPy não está instalado; benchmark ignorado")
+        return
+    events = int(os.environ.get("MACRO_BENCH_EVENTS", events))
+    rng = random.Random(7)
+    fd, raw = tempfile.mkstemp(prefix="macro-bench-", suffix=".mrec")
+    os.close(fd)
+    simplified = raw + ".simples"
+    try:
+        # Trajetória humana: deslocamentos com aceleração suave amostrados a
+        # 1 kHz, tremor de ±1 px e um clique ao fim de cada deslocamento
+        with RecordingWriter(raw) as writer:
+            t, x, y = 0, 960.0, 540.0
+            while writer.count < events:
+                tx, ty = rng.uniform(0, 1920), rng.uniform(0, 1080)
+                steps = rng.randint(200, 800)
+                x0, y0 = x, y
+                for i in range(1, steps + 1):
+                    ease = (1 - math.cos(math.pi * i / steps)) / 2
+                    x = x0 + (tx - x0) * ease
+                    y = y0 + (ty - y0) * ease
+                    t += 1000
+                    writer.append(t, REC_MOVE, round(x + rng.choice((-1, 0, 1))), round(y))
+                writer.append(t + 80000, REC_PRESS, round(x), round(y), "left")
+                writer.append(t + 160000, REC_RELEASE, round(x), round(y), "left")
+                t += 400000
+        report = simplify_recording(raw, simplified, tolerance_px, tolerance_ms)
+        print(f"Tolerância: {tolerance_px} px, {tolerance_ms} ms")
+        print(f"Eventos: {report['events_in']:,} -> {report['events_out']:,} "
+              f"({report['events_in'] / report['events_out']:.1f}x)")
+        print(f"Tamanho: {report['bytes_in'] / 1e6:.2f} MB -> {report['bytes_out'] / 1e6:.2f} MB "
+              f"({report['reduction']}x)")
+        status = "OK" if report["max_deviation_px"] <= tolerance_px else "ACIMA DA TOLERÂNCIA"
+        print(f"Desvio máximo: {report['max_deviation_px']} px [{status}]; "
+              f"{report['events_in'] / report['seconds']:,.0f} eventos/s")
+    finally:
+        for path in (raw, simplified):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def _bench_failsafe(iterations=300000, rate=500):
+    """Custo do Watchdog no laço, latência dos disparos e precisão do teto de injeções."""
+    burst = ScriptCompiler.compile(f"repeat {iterations}\n click\nend")
+    pointer = [(500, 500)]
+    failsafe = {"corner_px": 2, "monitors": [(0, 0, 1920, 1080)], "heartbeat_timeout": 5.0,
+                "pointer": lambda: pointer[0]}
+
+    for label, config in (("sem watchdog", None), ("com watchdog", failsafe)):
+        engine = MacroEngine(_NullController(), _NullController(), failsafe=config)
+        start = time.perf_counter()
+        engine.run(burst)
+        elapsed = time.perf_counter() - start
+        print(f"Laço sem wait, {label:<12}: {iterations / elapsed:10.0f} ações/s")
+
+    forever = ScriptCompiler.compile("repeat\n click\n wait 5\nend")
+    engine = MacroEngine(_NullController(), _NullController(), failsafe=failsafe)
+    moved = []
+
+    def corner():
+        moved.append(time.perf_counter())
+        pointer[0] = (1919, 0)
+
+    threading.Timer(0.2, corner).start()
+    reason = engine.run(forever)
+    print(f"Cursor no canto: {reason} em {(time.perf_counter() - moved[0]) * 1000:.1f} ms "
+          f"(verificação a cada 50 ms)")
+
+    class Stuck(_NullController):
+        def click(self, button, count=1):
+            time.sleep(1.0)
+
+    pointer[0] = (500, 500)
+    tripped = []
+    engine = MacroEngine(Stuck(), _NullController(), failsafe=dict(failsafe, heartbeat_timeout=0.3),
+                         status_callback=lambda text: tripped.append(time.perf_counter()))
+    start = time.perf_counter()
+    reason = engine.run(forever)
+    print(f"Injeção travada (batimento 0.3 s): {reason}, entradas soltas em "
+          f"{tripped[0] - start:.2f} s, run() retornou em {time.perf_counter() - start:.2f} s")
+
+    mouse, keyboard = rate_limit_controllers(_NullController(), _NullController(), rate)
+    engine = MacroEngine(mouse, keyboard, failsafe=failsafe)
+    threading.Timer(2.0, engine.stop).start()
+    start = time.perf_counter()
+    engine.run(ScriptCompiler.compile("repeat\n click\nend"))
+    elapsed = time.perf_counter() - start
+    actions = engine.metrics.snapshot()["counters"]["actions_total"]
+    expected = rate + mouse.bucket.burst / elapsed
+    print(f"Teto de {rate} injeções/s: {actions / elapsed:.0f} ações/s em {elapsed:.1f} s "
+          f"(esperado {expected:.0f} com a rajada inicial), "
+          f"watchdog {'disparou' if engine._limit_reason else 'quieto'}")
+
+
+def _bench_release(iterations=300000):
+    """Releases emitidos ao parar (cego vs. InputState) e custo do rastreamento no laço."""
+
+    class Counting(_NullController):
+        def __init__(self):
+            self.log = []
+
+        def press(self, key):
+            self.log.append(("press", key))
+
+        def release(self, key):
+            self.log.append(("release", key))
+
+    mouse, keyboard = Counting(), Counting()
+    tracked_mouse, tracked_keyboard = track_controllers(mouse, keyboard)
+    state = tracked_mouse.input_state
+    custom = resolve_combo("ctrl+shift+x")
+    program = ScriptCompiler.compile("press left\nhold shift+w 60000\nrelease left")
+
+    engine = MacroEngine(tracked_mouse, tracked_keyboard)
+    threading.Timer(0.1, engine.stop).start()
+    engine.run(program)
+    held = state.held()
+    mouse.log.clear()
+    keyboard.log.clear()
+    engine.release_all()
+    exact = mouse.log + keyboard.log
+    # O _release_all antigo: esquerdo, direito, a tecla customizada e as entradas do programa
+    blind = 2 + len(custom) + len(program.buttons) + len(program.keys)
+    print(f"Parada no meio de um hold: {len(held)} pressionados, {len(exact)} releases "
+          f"(antes: {blind}); pendentes depois: {len(state)}")
+    mouse.log.clear()
+    print(f"Pausa sem nada pressionado: {state.release_all()} releases (antes: {blind})")
+
+    class Failing(Counting):
+        def click(self, button, count=1):
+            raise OSError("falha simulada")
+
+    failing = track_controllers(Failing(), Counting())
+    try:
+        MacroEngine(*failing).run(ScriptCompiler.compile("keydown ctrl+alt\npress left\nclick"))
+    except OSError:
+        pass
+    print(f"Erro no meio de um keydown: pendentes depois do run(): {len(failing[0].input_state)}")
+
+    mouse.log = keyboard.log = _NullList()
+    for name, source in (("click", "click"), ("press/release", "press left\n release left")):
+        burst = ScriptCompiler.compile(f"repeat {iterations}\n {source}\nend")
+        for label, controllers in (("sem rastreamento", (mouse, keyboard)),
+                                   ("com InputState", (tracked_mouse, tracked_keyboard))):
+            engine = MacroEngine(*controllers)
+            start = time.perf_counter()
+            engine.run(burst)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<13}, {label:<16}: {iterations / elapsed:10.0f} iterações/s")
+
+
+class _NullList(list):
+    """Lista que descarta os itens (log de controlador em benchmarks de vazão)."""
+
+    def append(self, item):
+        pass
+
+
+def _bench_window(moves=200, resolves=1000000):
+    """Janela alvo no Xvfb: atraso da invalidação por ConfigureNotify e custo por ação."""
+    if xdisplay is None:
+        print("python-xlib não instalado")
+        return
+    xvfb = _start_xvfb()
+    print(f"Servidor X: {os.environ.get('DISPLAY')} ({'Xvfb' if xvfb else 'existente'})")
+    try:
+        try:
+            display = xdisplay.Display()
+        except Exception as e:
+            print(f"Sem servidor X: {e}")
+            return
+        screen = display.screen()
+        window = screen.root.create_window(100, 100, 400, 300, 0, screen.root_depth)
+        window.set_wm_class("macro-bench", "MacroBench")
+        window.set_wm_name("Janela de teste")
+        window.map()
+        display.sync()
+
+        tracker = WindowTracker(wm_class="MacroBench").start()
+        print(f"Encontrada: {tracker.describe()} em {tracker.origin}")
+        delays = []
+        for i in range(moves):
+            target = (100 + i % 300, 100 + i % 200)
+            if target == tracker.origin:
+                continue
+            start = time.perf_counter()
+            window.configure(x=target[0], y=target[1])
+            display.flush()
+            while tracker.origin != target:
+                if time.perf_counter() - start > 1.0:
+                    print(f"Sem ConfigureNotify para {target}")
+                    return
+                time.sleep(0.0001)
+            delays.append((time.perf_counter() - start) * 1000)
+        delays.sort()
+        print(f"Invalidação: mediana {delays[len(delays) // 2]:.2f} ms, "
+              f"p99 {delays[int(len(delays) * 0.99)]:.2f} ms, {tracker.updates} consultas")
+
+        updates = tracker.updates
+        for i in range(moves):
+            window.configure(x=100 + i, y=100 + i)
+        display.sync()
+        time.sleep(0.2)
+        print(f"Arrasto de {moves} passos: {tracker.updates - updates} consultas, origem {tracker.origin}")
+
+        start = time.perf_counter()
+        for _ in range(resolves):
+            tracker.resolve(10, 20)
+        cached = (time.perf_counter() - start) / resolves * 1e9
+        root = screen.root
+        start = time.perf_counter()
+        for _ in range(1000):
+            _window_origin(root, window)
+        queried = (time.perf_counter() - start) / 1000 * 1e9
+        print(f"Resolver por ação: {cached:.0f} ns em cache vs. {queried / 1000:.0f} µs consultando o servidor")
+        tracker.stop()
+        display.close()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+def _bench_layout(targets=200000):
+    """Alvos capturados remapeados em layouts simulados e custo do mapeamento."""
+    left = Monitor("DP-1", 0, 0, 1920, 1080)
+    right = Monitor("HDMI-1", 1920, 0, 2560, 1440)
+    capture = MonitorLayout([left, right])
+    points = [(960, 540), (1919, 1079), (1920 + 1280, 720), (1920 + 2559, 0), (100, 1000)]
+    saved = [capture.normalize(x, y) for x, y in points]
+    layouts = {
+        "igual": capture,
+        "ordem trocada": MonitorLayout([right, left]),
+        "HDMI-1 à esquerda": MonitorLayout([Monitor("DP-1", 2560, 0, 1920, 1080),
+                                            Monitor("HDMI-1", 0, 0, 2560, 1440)]),
+        "DP-1 em 4K, escala 2": MonitorLayout([Monitor("DP-1", 0, 0, 3840, 2160, 2.0),
+                                               Monitor("HDMI-1", 3840, 0, 2560, 1440)]),
+        "só DP-1": MonitorLayout([left]),
+        "renomeado (USB-C)": MonitorLayout([Monitor("USB-C-1", 0, 0, 1920, 1080),
+                                            Monitor("USB-C-2", 1920, 0, 1280, 720)]),
+    }
+    print("Capturados: " + ", ".join(f"{p}" for p in points))
+    for label, layout in layouts.items():
+        mapper = CoordinateMapper(capture, layout)
+        mapped = [mapper.map_target(target) for target in saved]
+        inside = all(layout.monitors[layout.monitor_at(x, y)].distance(x, y) == 0 for x, y in mapped)
+        print(f"{label:<22}: {', '.join(str(p) for p in mapped)}"
+              f"{'' if inside else ' (FORA DA TELA)'}")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        CoordinateMapper(capture, layouts["HDMI-1 à esquerda"])
+    built = (time.perf_counter() - start) / 1000 * 1e6
+    mapper = CoordinateMapper(capture, layouts["HDMI-1 à esquerda"])
+    target = saved[2]
+    start = time.perf_counter()
+    for _ in range(targets):
+        mapper.map_target(target)
+    mapped = (time.perf_counter() - start) / targets * 1e9
+    print(f"Troca de layout: {built:.1f} µs para recalcular as transformações; "
+          f"{mapped:.0f} ns por alvo ao montar o programa, 0 no laço do motor")
+    current = x11_monitor_layout()
+    print(f"Layout X11 atual: {current if current is not None else 'indisponível'}")
+
+
+def _bench_focus(switches=200):
+    """Foco da janela alvo no Xvfb: atraso entre a troca de _NET_ACTIVE_WINDOW e a pausa."""
+    if xdisplay is None:
+        print("python-xlib não instalado")
+        return
+    from Xlib import Xatom
+
+    xvfb = _start_xvfb()
+    print(f"Servidor X: {os.environ.get('DISPLAY')} ({'Xvfb' if xvfb else 'existente'})")
+    try:
+        try:
+            display = xdisplay.Display()
+        except Exception as e:
+            print(f"Sem servidor X: {e}")
+            return
+        screen = display.screen()
+        root = screen.root
+        windows = {}
+        for name in ("MacroBench", "Outro"):
+            window = root.create_window(0, 0, 200, 200, 0, screen.root_depth)
+            window.set_wm_class(name.lower(), name)
+            window.map()
+            windows[name] = window
+        active_atom = display.intern_atom("_NET_ACTIVE_WINDOW")
+
+        def activate(name):
+            # O papel do gerenciador de janelas: o Xvfb não tem um
+            root.change_property(active_atom, Xatom.WINDOW, 32, [windows[name].id])
+            display.flush()
+
+        activate("Outro")
+        display.sync()
+        changed = threading.Event()
+        guard = FocusGuard.from_spec({"class": "MacroBench"}, lambda focused: changed.set()).start()
+        delays = []
+        for i in range(switches):
+            changed.clear()
+            start = time.perf_counter()
+            activate("MacroBench" if i % 2 == 0 else "Outro")
+            if not changed.wait(1.0):
+                print(f"Transição {i} não avisada")
+                return
+            delays.append((time.perf_counter() - start) * 1000)
+        delays.sort()
+        print(f"Troca de foco -> aviso: mediana {delays[len(delays) // 2]:.2f} ms, "
+              f"p99 {delays[int(len(delays) * 0.99)]:.2f} ms, {guard.changes} transições")
+        guard.stop()
+
+        # Motor clicando; o guarda o para (o caminho de pausa da GUI) ao perder o foco
+        class Counting(_NullController):
+            clicks = 0
+
+            def click(self, button, count=1):
+                Counting.clicks += 1
+
+        engine = MacroEngine(Counting(), Counting())
+        activate("MacroBench")
+        display.sync()
+        lost = {}
+
+        def on_focus(focused):
+            if not focused:
+                engine.stop()
+                lost["clicks"] = Counting.clicks
+
+        guard = FocusGuard.from_spec({"class": "MacroBench"}, on_focus).start()
+        thread = threading.Thread(target=engine.run, args=(ScriptCompiler.compile("repeat\n click\n wait 1\nend"),))
+        thread.start()
+        time.sleep(0.2)
+        activate("Outro")
+        thread.join(2.0)
+        print(f"Cliques depois do aviso de perda de foco: {Counting.clicks - lost.get('clicks', Counting.clicks)} "
+              f"(de {Counting.clicks})")
+        guard.stop()
+        display.close()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+BENCHMARKS = {
+    "script": _bench_script,
+    "hotkeys": _bench_hotkeys,
+    "hooks": _bench_hooks,
+    "hub": _bench_hub,
+    "handoff": _bench_handoff,
+    "uinput": _bench_uinput,
+    "xtest": _bench_xtest,
+    "jitter": _bench_jitter,
+    "process": _bench_process,
+    "tracks": _bench_tracks,
+    "async": _bench_async,
+    "virtual": _bench_virtual,
+    "jobs": _bench_jobs,
+    "recording": _bench_recording,
+    "timeline": _bench_timeline,
+    "simplify": _bench_simplify,
+    "failsafe": _bench_failsafe,
+    "release": _bench_release,
+    "window": _bench_window,
+    "layout": _bench_layout,
+    "focus": _bench_focus,
+}
+
+
+def main(argv=None):
+    """Executa benchmarks: python bench_macro_engine.py [nome ...] (sem nome, todos).
+
+    Retorna 1 se algum benchmark com conferência (virtual, jobs) falhou;
+    as asserções completas estão em test_macro_engine.py.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in ("-h", "--help"):
+        print("Uso: python bench_macro_engine.py [" + "|".join(BENCHMARKS) + "]")
+        return 0
+    names = argv or list(BENCHMARKS)
+    failed = []
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Benchmark desconhecido: {name}")
+            return 1
+        print(f"=== {name} ===")
+        if BENCHMARKS[name]() is False:
+            failed.append(name)
+    if failed:
+        print(f"Falharam: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5080 @@
+"""
+Núcleo do Motor de Macro - V2.0
+Componentes sem dependência de GUI usados pelas versões PyQt6 e tkinter.
+Autor: Senior Python Developer
+
+Uma única cópia, na pasta Shared: as duas GUIs a importam por sys.path
+ao rodar do código-fonte, e os .spec do PyInstaller a incluem por pathex.
+"""
+
+import asyncio
+import atexit
+import bisect
+import datetime
+import functools
+import hashlib
+import heapq
+import json
+import os
+import queue
+import re
+import select
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from pynput.mouse import Controller as MouseController, Button, Listener as MouseListener
+    from pynput.keyboard import Controller as KeyboardController, Key, KeyCode
+except ImportError:
+    # O núcleo (compilador, métricas, servidor) continua utilizável sem pynput;
+    # apenas a injeção real de eventos fica indisponível
+    MouseController = KeyboardController = Button = Key = KeyCode = MouseListener = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: apenas o backend pynput está disponível
+    fcntl = None
+
+try:
+    from Xlib import X, XK, display as xdisplay, error as xerror
+    from Xlib.ext import randr, xtest
+except ImportError:
+    # Backend XTest em lote, janelas alvo e monitores são opcionais (python-xlib)
+    X = XK = xdisplay = xerror = randr = xtest = None
+
+try:
+    from PIL import ImageGrab
+except ImportError:
+    ImageGrab = None
+
+try:
+    import numpy as np
+except ImportError:
+    # Simplificação vetorizada de gravações é opcional
+    np = None
+
+
+def default_control_address(port=47800):
+    """Retorna o endereço padrão do servidor de controle.
+
+    Usa socket Unix quando disponível e TCP em 127.0.0.1 como fallback
+    (Windows não suporta sockets Unix no asyncio).
+    """
+    if sys.platform != "win32" and hasattr(asyncio, "start_unix_server"):
+        uid = os.getuid() if hasattr(os, "getuid") else "user"
+        return os.path.join(tempfile.gettempdir(), f"macro_v2_{uid}.sock")
+    return ("127.0.0.1", port)
+
+
+class ControlServer:
+    """Servidor IPC local (JSON por linha) para controlar o motor em execução.
+
+    Roda em um loop asyncio próprio, em thread separada da GUI. Cada linha
+    recebida é um objeto {"id": ..., "cmd": "...", "args": {...}} e cada
+    resposta é {"id": ..., "ok": bool, "result"/"error": ...}. As conexões
+    são persistentes: um cliente pode enviar vários comandos em sequência
+    (inclusive em pipeline) sem reconectar.
+    """
+
+    def __init__(self, handler, address=None):
+        self.handler = handler
+        self.address = address or default_control_address()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self._ready = threading.Event()
+        self.error = None
+
+    @property
+    def is_unix(self):
+        return isinstance(self.address, str)
+
+    def start(self):
+        """Inicia o servidor em uma thread daemon e aguarda o bind."""
+        self.thread = threading.Thread(target=self._run, name="macro-control", daemon=True)
+        self.thread.start()
+        self._ready.wait(timeout=5)
+        if self.error:
+            print(f"Erro ao iniciar servidor de controle: {self.error}")
+            return False
+        print(f"Servidor de controle ouvindo em: {self.address}")
+        return True
+
+    def stop(self):
+        """Encerra o servidor e remove o socket Unix."""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.is_unix:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(self._create_server())
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+            self.loop.close()
+            return
+
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            # Encerrar conexões de clientes ainda abertas
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    async def _create_server(self):
+        if self.is_unix:
+            # Remover socket antigo deixado por uma execução anterior
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+            server = await asyncio.start_unix_server(self._handle_client, path=self.address)
+            os.chmod(self.address, 0o600)
+            return server
+
+        host, port = self.address
+        server = await asyncio.start_server(self._handle_client, host=host, port=port)
+        self.address = server.sockets[0].getsockname()[:2]
+        return server
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                writer.write(self._dispatch(line))
+                # drain() só bloqueia acima do limite do buffer de escrita,
+                # então comandos em pipeline não esperam um round trip cada
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError: servidor encerrando com o cliente ainda conectado
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    def _dispatch(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            result = self.handler(request["cmd"], request.get("args") or {})
+            response = {"id": request_id, "ok": True, "result": result}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "error": str(e)}
+        return (json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def parse_remote_settings(args):
+    """Valida e converte os argumentos de um "reconfigure", sem aplicar nada.
+
+    Retorna só as chaves presentes, já convertidas e limitadas como na GUI;
+    custom_key_combo vem também resolvido em "custom_key". Qualquer
+    argumento inválido levanta ValueError antes de a GUI mudar qualquer
+    coisa, então um comando recusado não deixa configurações pela metade.
+    Script e perfil são validados pela GUI (dependem da pasta da config).
+    """
+    settings = {}
+    if "action_type" in args:
+        if args["action_type"] not in ("click", "hold", "type"):
+            raise ValueError(f"action_type inválido: {args['action_type']}")
+        settings["action_type"] = args["action_type"]
+    if "button_type" in args:
+        if args["button_type"] not in ("esquerdo", "direito", "custom"):
+            raise ValueError(f"button_type inválido: {args['button_type']}")
+        settings["button_type"] = args["button_type"]
+    for key, minimum in (("click_delay_ms", 1), ("hold_duration_ms", 50), ("type_char_delay_ms", 0)):
+        if key in args:
+            settings[key] = max(minimum, _int_arg(args, key))
+    if "type_text" in args:
+        settings["type_text"] = str(args["type_text"])
+    if ("saved_x" in args) != ("saved_y" in args):
+        raise ValueError("saved_x e saved_y vão juntos")
+    if "saved_x" in args:
+        settings["saved_x"] = _int_arg(args, "saved_x")
+        settings["saved_y"] = _int_arg(args, "saved_y")
+    for key in ("script_file", "active_profile"):
+        if key in args:
+            value = args[key]
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{key} inválido: {value!r}")
+            settings[key] = value or None
+    if "custom_key_combo" in args:
+        combo = args["custom_key_combo"] or None
+        settings["custom_key_combo"] = combo
+        settings["custom_key"] = resolve_combo(combo) if combo else None
+    for key in ("key_start", "key_pause", "key_exit"):
+        if key in args:
+            if not isinstance(args[key], str):
+                raise ValueError(f"{key} inválido: {args[key]!r}")
+            HotkeyMatcher.parse(args[key])
+            settings[key] = args[key]
+    settings["persist"] = bool(args.get("persist"))
+    return settings
+
+
+def _int_arg(args, key):
+    try:
+        return int(args[key])
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} inválido: {args[key]!r}") from None
+
+
+class _ThreadMetrics:
+    """Acumuladores de uma única thread (só a thread dona escreve)."""
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}
+        # nome -> [contagens por bucket, soma, total]
+        self.histograms = {}
+
+
+class MacroMetrics:
+    """Contadores e histogramas do motor, sem locks no caminho quente.
+
+    Cada thread escreve apenas no seu próprio acumulador (threading.local);
+    o snapshot soma os acumuladores de todas as threads. O lock só é usado
+    uma vez por thread, no registro do acumulador, e pelos leitores
+    (snapshot e reset). Os acumuladores nunca são trocados: reset() guarda
+    os totais do momento como base, e o snapshot a desconta.
+    """
+
+    # Limites superiores dos buckets dos histogramas, em milissegundos
+    BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+    HELP = {
+        "actions_total": "Ações de mouse/teclado executadas",
+        "achieved_rate_per_sec": "Taxa de ações alcançada (ações/s)",
+        "sleep_overshoot_ms": "Atraso do sleep além do solicitado (ms)",
+        "hotkey_latency_ms": "Latência entre o comando de start e a primeira ação (ms)",
+        "listener_callback_ms": "Tempo gasto nos callbacks do listener (ms)",
+        "chars_typed_total": "Caracteres digitados pela ação de texto",
+        "typing_chars_per_sec": "Taxa da última digitação de texto (caracteres/s)",
+        "mouse_hook_active": "Hook global de mouse instalado (1) ou não (0)",
+        "mouse_hook_installs_total": "Instalações do hook global de mouse",
+        "hook_budget_exceeded_total": "Callbacks de hook que estouraram o orçamento de tempo",
+        "hook_queue_delay_ms": "Espera entre o hook enfileirar um evento e o consumidor tratá-lo (ms)",
+    }
+
+    def __init__(self, prefix="macro_"):
+        self.prefix = prefix
+        self._local = threading.local()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._rate_base = (time.perf_counter(), 0)
+        self._rate = 0.0
+        # Totais no último reset() (contadores, histogramas)
+        self._baseline = ({}, {})
+        # Gauges são valores pontuais: uma atribuição por escrita basta
+        self._gauges = {}
+        # Último snapshot recebido de um motor em outro processo
+        self._remote = None
+
+    def _stats(self):
+        stats = getattr(self._local, "stats", None)
+        if stats is None:
+            stats = _ThreadMetrics()
+            self._local.stats = stats
+            with self._lock:
+                self._threads.append(stats)
+        return stats
+
+    def inc(self, name, amount=1):
+        counters = self._stats().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, name, value_ms):
+        histograms = self._stats().histograms
+        hist = histograms.get(name)
+        if hist is None:
+            hist = [[0] * (len(self.BUCKETS_MS) + 1), 0.0, 0]
+            histograms[name] = hist
+        hist[0][bisect.bisect_left(self.BUCKETS_MS, value_ms)] += 1
+        hist[1] += value_ms
+        hist[2] += 1
+
+    def set_gauge(self, name, value):
+        self._gauges[name] = value
+
+    def sleep(self, seconds, name="sleep_overshoot_ms"):
+        """time.sleep que registra quanto o sleep passou do solicitado."""
+        start = time.perf_counter()
+        time.sleep(seconds)
+        self.observe(name, max(0.0, (time.perf_counter() - start - seconds) * 1000))
+
+    def reset(self):
+        """Zera os valores (threads continuam registradas e escrevendo nos mesmos acumuladores)."""
+        with self._lock:
+            self._baseline = self._local_totals()
+            self._rate_base = (time.perf_counter(), 0)
+            self._rate = 0.0
+            self._gauges = {}
+            self._remote = None
+
+    def absorb(self, snapshot):
+        """Incorpora o snapshot (cumulativo) de um motor em outro processo."""
+        self._remote = snapshot
+
+    def _local_totals(self):
+        """Soma dos acumuladores das threads deste processo (chamar com o lock)."""
+        counters = {}
+        histograms = {}
+        for stats in self._threads:
+            # copy() é atômico sob o GIL para dicionários com chaves str
+            for name, value in stats.counters.copy().items():
+                counters[name] = counters.get(name, 0) + value
+            for name, (buckets, total, count) in stats.histograms.copy().items():
+                agg = histograms.setdefault(name, [[0] * len(buckets), 0.0, 0])
+                for i, n in enumerate(buckets):
+                    agg[0][i] += n
+                agg[1] += total
+                agg[2] += count
+        return counters, histograms
+
+    def snapshot(self):
+        """Retorna um dicionário com os valores agregados de todas as threads."""
+        with self._lock:
+            counters, histograms = self._local_totals()
+            base_counters, base_histograms = self._baseline
+            remote = self._remote
+        for name, value in base_counters.items():
+            counters[name] -= value
+        for name, (buckets, total, count) in base_histograms.items():
+            agg = histograms[name]
+            for i, n in enumerate(buckets):
+                agg[0][i] -= n
+            agg[1] -= total
+            agg[2] -= count
+        if remote:
+            for name, value in remote["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+            for name, hist in remote["histograms"].items():
+                agg = histograms.setdefault(name, [[0] * len(hist["buckets"]), 0.0, 0])
+                for i, n in enumerate(hist["buckets"]):
+                    agg[0][i] += n
+                agg[1] += hist["sum"]
+                agg[2] += hist["count"]
+
+        # Taxa calculada sobre janelas de pelo menos 1 s, para que vários
+        # leitores (painel, exportação) não encurtem a janela uns dos outros
+        actions = counters.get("actions_total", 0)
+        with self._lock:
+            now = time.perf_counter()
+            base_time, base_actions = self._rate_base
+            if now - base_time >= 1.0 or actions < base_actions:
+                self._rate = max(0, actions - base_actions) / (now - base_time)
+                self._rate_base = (now, actions)
+            rate = self._rate
+
+        return {
+            "timestamp": time.time(),
+            "counters": counters,
+            "gauges": {
+                **(remote["gauges"] if remote else {}),
+                **self._gauges.copy(),
+                "achieved_rate_per_sec": round(rate, 2),
+            },
+            "histograms": {
+                name: {"buckets": buckets, "sum": total, "count": count}
+                for name, (buckets, total, count) in histograms.items()
+            },
+        }
+
+    def percentile(self, snapshot, name, q):
+        """Aproxima um percentil pelo limite superior do bucket."""
+        hist = snapshot["histograms"].get(name)
+        if not hist or not hist["count"]:
+            return None
+        target = q * hist["count"]
+        seen = 0
+        for i, n in enumerate(hist["buckets"]):
+            seen += n
+            if seen >= target:
+                return self.BUCKETS_MS[i] if i < len(self.BUCKETS_MS) else float("inf")
+        return float("inf")
+
+    def to_json(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        return json.dumps(snapshot, ensure_ascii=False)
+
+    def to_prometheus(self, snapshot=None):
+        """Formata o snapshot no formato de texto do Prometheus."""
+        snapshot = snapshot or self.snapshot()
+        lines = []
+
+        def header(name, kind):
+            full = self.prefix + name
+            if name in self.HELP:
+                lines.append(f"# HELP {full} {self.HELP[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        for name, value in sorted(snapshot["counters"].items()):
+            full = header(name, "counter")
+            lines.append(f"{full} {value}")
+
+        for name, value in sorted(snapshot["gauges"].items()):
+            full = header(name, "gauge")
+            lines.append(f"{full} {value}")
+
+        for name, hist in sorted(snapshot["histograms"].items()):
+            full = header(name, "histogram")
+            cumulative = 0
+            for i, n in enumerate(hist["buckets"]):
+                cumulative += n
+                le = str(self.BUCKETS_MS[i]) if i < len(self.BUCKETS_MS) else "+Inf"
+                lines.append(f'{full}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{full}_sum {hist['sum']:.6f}")
+            lines.append(f"{full}_count {hist['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, snapshot=None):
+        """Grava o arquivo de texto de forma atômica (textfile collector)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus(snapshot))
+        os.replace(tmp_path, path)
+
+    def summary(self, snapshot=None):
+        """Resumo curto e legível para o painel de estatísticas da GUI."""
+        snapshot = snapshot or self.snapshot()
+        hists = snapshot["histograms"]
+
+        def mean(name):
+            hist = hists.get(name)
+            if not hist or not hist["count"]:
+                return "-"
+            return f"{hist['sum'] / hist['count']:.2f} ms"
+
+        def p99(name):
+            value = self.percentile(snapshot, name, 0.99)
+            return "-" if value is None else f"{value} ms"
+
+        return (
+            f"Ações executadas: {snapshot['counters'].get('actions_total', 0)}\n"
+            f"Taxa alcançada: {snapshot['gauges']['achieved_rate_per_sec']:.1f}/s\n"
+            f"Overshoot do sleep: média {mean('sleep_overshoot_ms')}, p99 ≤ {p99('sleep_overshoot_ms')}\n"
+            f"Latência hotkey→ação: média {mean('hotkey_latency_ms')}\n"
+            f"Callback do listener: média {mean('listener_callback_ms')}, p99 ≤ {p99('listener_callback_ms')}\n"
+            f"Digitação: {snapshot['counters'].get('chars_typed_total', 0)} caracteres, "
+            f"última a {snapshot['gauges'].get('typing_chars_per_sec', 0):.0f}/s\n"
+            f"Hook do mouse: {'ativo' if snapshot['gauges'].get('mouse_hook_active') else 'inativo'} "
+            f"({snapshot['counters'].get('mouse_hook_installs_total', 0)} instalações)"
+        )
+
+
+# ===== Linguagem de script de macro =====
+
+# Códigos de operação das instruções compiladas. Cada instrução é uma
+# tupla fixa (op, a, b, c) para que o interpretador desempacote sem
+# consultas a dicionário.
+OP_MOVE = 0        # a=x, b=y
+OP_CLICK = 1       # a=botão, b=quantidade
+OP_PRESS = 2       # a=botão
+OP_RELEASE = 3     # a=botão
+OP_KEY_DOWN = 4    # a=tupla de teclas
+OP_KEY_UP = 5      # a=tupla de teclas
+OP_KEY_TAP = 6     # a=tupla de teclas
+OP_WAIT = 7        # a=segundos
+OP_LOOP_INIT = 8   # a=slot, b=repetições
+OP_LOOP_NEXT = 9   # a=slot, b=destino
+OP_JUMP = 10       # a=destino
+OP_IF_PIXEL = 11   # a=(x, y), b=(rgb, tolerância), c=destino se falso
+OP_TYPE = 12       # a=texto, b=segundos entre caracteres (0 = em lote)
+
+OP_NAMES = {
+    OP_MOVE: "MOVE", OP_CLICK: "CLICK", OP_PRESS: "PRESS", OP_RELEASE: "RELEASE",
+    OP_KEY_DOWN: "KEY_DOWN", OP_KEY_UP: "KEY_UP", OP_KEY_TAP: "KEY_TAP",
+    OP_WAIT: "WAIT", OP_LOOP_INIT: "LOOP_INIT", OP_LOOP_NEXT: "LOOP_NEXT",
+    OP_JUMP: "JUMP", OP_IF_PIXEL: "IF_PIXEL", OP_TYPE: "TYPE",
+}
+
+# Caracteres por chamada a keyboard.type() na digitação em lote; a parada
+# é verificada entre lotes
+TYPE_BATCH_SIZE = 32
+
+_TYPE_ESCAPES = {"n": "\n", "t": "\t", '"': '"', "\\": "\\"}
+
+KEY_ALIASES = {
+    "control": "ctrl", "ctl": "ctrl", "win": "cmd", "super": "cmd", "meta": "cmd",
+    "return": "enter", "escape": "esc", "del": "delete", "pgup": "page_up",
+    "pgdown": "page_down", "ins": "insert",
+}
+
+
+class ScriptError(ValueError):
+    """Erro de sintaxe ou semântica em um script de macro."""
+
+    def __init__(self, line_no, message):
+        super().__init__(f"linha {line_no}: {message}")
+        self.line_no = line_no
+
+
+def resolve_button(name):
+    """Converte 'left'/'right'/'middle' (ou esquerdo/direito) em Button."""
+    name = {"esquerdo": "left", "direito": "right", "meio": "middle"}.get(name.lower(), name.lower())
+    if name not in ("left", "right", "middle"):
+        raise ValueError(f"botão desconhecido: {name}")
+    return getattr(Button, name) if Button is not None else name
+
+
+def resolve_key(name):
+    """Converte o nome de uma tecla ('a', 'f1', 'ctrl') em um objeto do pynput."""
+    clean = name.strip()
+    lower = KEY_ALIASES.get(clean.lower(), clean.lower())
+    if Key is not None and hasattr(Key, lower):
+        return getattr(Key, lower)
+    if len(clean) == 1:
+        return clean.lower() if clean.isalpha() else clean
+    if Key is None and lower:
+        return lower
+    raise ValueError(f"tecla desconhecida: {name}")
+
+
+def resolve_combo(text):
+    """Converte 'ctrl+shift+x' em uma tupla de teclas, na ordem de pressão."""
+    if text == "+":
+        return (resolve_key("+"),)
+    return tuple(resolve_key(part) for part in text.split("+"))
+
+
+def read_pixel(x, y):
+    """Lê a cor (r, g, b) de um pixel da tela."""
+    if ImageGrab is None:
+        raise RuntimeError("Pillow não está instalado. Execute: pip install pillow")
+    return ImageGrab.grab(bbox=(x, y, x + 1, y + 1), all_screens=True).getpixel((0, 0))[:3]
+
+
+class MacroProgram:
+    """Programa compilado: lista plana de instruções pronta para o interpretador."""
+    __slots__ = ("code", "loop_slots", "buttons", "keys", "source_hash", "name")
+
+    def __init__(self, code, loop_slots=0, buttons=(), keys=(), source_hash=None, name=""):
+        self.code = tuple(code)
+        self.loop_slots = loop_slots
+        self.buttons = frozenset(buttons)
+        self.keys = frozenset(keys)
+        self.source_hash = source_hash
+        self.name = name
+
+    def __len__(self):
+        return len(self.code)
+
+    def disassemble(self):
+        """Listagem legível das instruções (útil para depuração)."""
+        return "\n".join(
+            f"{pc:4d}  {OP_NAMES[ins[0]]:<10} {', '.join(repr(v) for v in ins[1:] if v is not None)}"
+            for pc, ins in enumerate(self.code)
+        )
+
+
+# Scripts compilados que ScriptCompiler.load mantém em cache (os mais recentes)
+SCRIPT_CACHE_SIZE = 32
+
+
+class ScriptCompiler:
+    """Compila scripts de macro (.macro) para MacroProgram.
+
+    Sintaxe, uma instrução por linha ("#" seguido de espaço inicia comentário):
+
+        move X Y                  mover o cursor
+        click [BOTÃO] [N]         clicar (left, right, middle)
+        press BOTÃO / release BOTÃO
+        hold BOTÃO|COMBO MS       pressionar (botão ou teclas juntas), esperar e soltar
+        key COMBO                 tocar uma tecla ou combinação (ctrl+shift+x)
+        keydown COMBO / keyup COMBO
+        wait MS
+        repeat [N] ... end        repetir N vezes (sem N: para sempre)
+        if pixel X Y COR [TOL] ... [else ...] end
+        type [MS] "texto"         digitar texto (\\n, \\t, \\"); MS entre caracteres
+
+    load() guarda os SCRIPT_CACHE_SIZE resultados mais recentes (LRU) pelo
+    conteúdo do arquivo, então recarregar um arquivo inalterado não o
+    analisa novamente.
+    """
+
+    _COMMENT = re.compile(r"(^|\s)#(\s.*)?$")
+
+    @classmethod
+    def load(cls, path):
+        """Carrega e compila um arquivo, reaproveitando o cache por conteúdo."""
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls._compile_file(data, os.path.basename(str(path)))
+
+    @classmethod
+    @functools.lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+    def _compile_file(cls, data, name):
+        program = cls.compile(data.decode("utf-8"), name=name)
+        program.source_hash = hashlib.sha256(data).hexdigest()
+        return program
+
+    @classmethod
+    def compile(cls, source, name="<script>"):
+        code = []
+        blocks = []  # pilha de (tipo, linha, dados)
+        loop_slots = 0
+        buttons = set()
+        keys = set()
+
+        def emit(op, a=None, b=None, c=None):
+            code.append([op, a, b, c])
+            return len(code) - 1
+
+        for line_no, raw in enumerate(source.splitlines(), 1):
+            stripped = raw.strip()
+            if stripped.lower().startswith("type ") or stripped.lower() == "type":
+                # O texto pode conter "#", então é analisado antes dos comentários
+                try:
+                    text, pace = cls._type_args(stripped[4:])
+                except ValueError as e:
+                    raise ScriptError(line_no, str(e)) from None
+                emit(OP_TYPE, text, pace / 1000)
+                continue
+
+            line = cls._COMMENT.sub("", raw).strip()
+            if not line:
+                continue
+            tokens = line.split()
+            cmd, args = tokens[0].lower(), tokens[1:]
+
+            try:
+                if cmd == "move":
+                    cls._arity(args, 2, 2)
+                    emit(OP_MOVE, int(args[0]), int(args[1]))
+                elif cmd == "click":
+                    cls._arity(args, 0, 2)
+                    button = resolve_button(args[0] if args else "left")
+                    count = int(args[1]) if len(args) > 1 else 1
+                    if count < 1:
+                        raise ValueError("click precisa de N >= 1")
+                    buttons.add(button)
+                    emit(OP_CLICK, button, count)
+                elif cmd in ("press", "release"):
+                    cls._arity(args, 1, 1)
+                    button = resolve_button(args[0])
+                    buttons.add(button)
+                    emit(OP_PRESS if cmd == "press" else OP_RELEASE, button)
+                elif cmd == "hold":
+                    cls._arity(args, 2, 2)
+                    try:
+                        button = resolve_button(args[0])
+                    except ValueError:
+                        # Várias teclas seguradas juntas (ex.: hold shift+w 2000)
+                        combo = resolve_combo(args[0])
+                        keys.update(combo)
+                        emit(OP_KEY_DOWN, combo)
+                        emit(OP_WAIT, cls._millis(args[1]) / 1000)
+                        emit(OP_KEY_UP, combo)
+                    else:
+                        buttons.add(button)
+                        emit(OP_PRESS, button)
+                        emit(OP_WAIT, cls._millis(args[1]) / 1000)
+                        emit(OP_RELEASE, button)
+                elif cmd in ("key", "keydown", "keyup"):
+                    cls._arity(args, 1, 1)
+                    combo = resolve_combo(args[0])
+                    keys.update(combo)
+                    op = {"key": OP_KEY_TAP, "keydown": OP_KEY_DOWN, "keyup": OP_KEY_UP}[cmd]
+                    emit(op, combo)
+                elif cmd == "wait":
+                    cls._arity(args, 1, 1)
+                    emit(OP_WAIT, cls._millis(args[0]) / 1000)
+                elif cmd == "repeat":
+                    cls._arity(args, 0, 1)
+                    if args:
+                        count = int(args[0])
+                        if count < 1:
+                            raise ValueError("repeat precisa de N >= 1")
+                        slot = loop_slots
+                        loop_slots += 1
+                        emit(OP_LOOP_INIT, slot, count)
+                        blocks.append(("repeat", line_no, (slot, len(code))))
+                    else:
+                        blocks.append(("forever", line_no, len(code)))
+                elif cmd == "if":
+                    if not args or args[0].lower() != "pixel":
+                        raise ValueError("apenas 'if pixel X Y COR [TOL]' é suportado")
+                    cls._arity(args, 4, 5)
+                    rgb = cls._color(args[3])
+                    tolerance = int(args[4]) if len(args) > 4 else 0
+                    branch = emit(OP_IF_PIXEL, (int(args[1]), int(args[2])), (rgb, tolerance))
+                    blocks.append(("if", line_no, [branch, None]))
+                elif cmd == "else":
+                    cls._arity(args, 0, 0)
+                    if not blocks or blocks[-1][0] != "if" or blocks[-1][2][1] is not None:
+                        raise ValueError("'else' sem 'if' correspondente")
+                    branch_data = blocks[-1][2]
+                    branch_data[1] = emit(OP_JUMP)
+                    code[branch_data[0]][3] = len(code)
+                elif cmd == "end":
+                    cls._arity(args, 0, 0)
+                    if not blocks:
+                        raise ValueError("'end' sem bloco aberto")
+                    kind, _, data = blocks.pop()
+                    if kind == "repeat":
+                        slot, body = data
+                        emit(OP_LOOP_NEXT, slot, body)
+                    elif kind == "forever":
+                        emit(OP_JUMP, data)
+                    else:
+                        branch, jump_over_else = data
+                        if jump_over_else is None:
+                            code[branch][3] = len(code)
+                        else:
+                            code[jump_over_else][1] = len(code)
+                else:
+                    raise ValueError(f"comando desconhecido: {cmd}")
+            except ScriptError:
+                raise
+            except ValueError as e:
+                raise ScriptError(line_no, str(e)) from None
+
+        if blocks:
+            kind, line_no, _ = blocks[-1]
+            raise ScriptError(line_no, f"bloco '{kind}' sem 'end'")
+
+        return MacroProgram(
+            (tuple(ins) for ins in code), loop_slots, buttons, keys, name=name
+        )
+
+    @staticmethod
+    def _arity(args, minimum, maximum):
+        if not minimum <= len(args) <= maximum:
+            if minimum == maximum:
+                raise ValueError(f"esperado {minimum} argumento(s), recebido {len(args)}")
+            raise ValueError(f"esperado de {minimum} a {maximum} argumentos, recebido {len(args)}")
+
+    @classmethod
+    def _type_args(cls, rest):
+        """Lê '[MS] "texto"' de uma instrução type."""
+        rest = rest.strip()
+        pace = 0.0
+        if rest and rest[0] != '"':
+            pace_text, _, rest = rest.partition(" ")
+            pace = cls._millis(pace_text)
+            rest = rest.strip()
+        if len(rest) < 2 or rest[0] != '"':
+            raise ValueError('uso: type [MS] "texto"')
+
+        chars = []
+        i = 1
+        while i < len(rest):
+            ch = rest[i]
+            if ch == "\\" and i + 1 < len(rest):
+                escaped = rest[i + 1]
+                if escaped not in _TYPE_ESCAPES:
+                    raise ValueError(f"escape desconhecido: \\{escaped}")
+                chars.append(_TYPE_ESCAPES[escaped])
+                i += 2
+                continue
+            if ch == '"':
+                trailing = cls._COMMENT.sub("", rest[i + 1:]).strip()
+                if trailing:
+                    raise ValueError(f"texto após as aspas: {trailing}")
+                return "".join(chars), pace
+            chars.append(ch)
+            i += 1
+        raise ValueError("aspas não fechadas")
+
+    @staticmethod
+    def _millis(text):
+        value = float(text)
+        if value < 0:
+            raise ValueError("tempo negativo")
+        return value
+
+    @staticmethod
+    def _color(text):
+        text = text.lstrip("#")
+        if len(text) != 6:
+            raise ValueError(f"cor inválida: {text} (use RRGGBB)")
+        return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def build_simple_program(button_type, action_type, x, y, click_delay_ms,
+                         hold_duration_ms, custom_key=None, reposition_each_loop=True,
+                         type_text="", type_char_delay_ms=0):
+    """Compila a configuração simples da GUI (um ponto, clique, hold ou texto).
+
+    Reproduz o loop clássico: mover (opcional), agir, aguardar o delay.
+    """
+    if action_type == "type":
+        # Digitação é executada uma vez; não depende do botão nem do ponto
+        if not type_text:
+            raise ValueError("Nenhum texto para digitar")
+        return MacroProgram([(OP_TYPE, type_text, type_char_delay_ms / 1000, None)], name="texto")
+
+    hold = hold_duration_ms / 1000
+    delay = click_delay_ms / 1000
+    after = delay if action_type == "click" else hold + delay
+    code = []
+    buttons = ()
+    keys = ()
+
+    if button_type in ("esquerdo", "direito"):
+        button = resolve_button(button_type)
+        buttons = (button,)
+        move = [(OP_MOVE, x, y, None), (OP_WAIT, 0.05, None, None)]
+        if not reposition_each_loop:
+            code.extend(move)
+        loop_start = len(code)
+        if reposition_each_loop:
+            code.extend(move)
+        if action_type == "click":
+            code.append((OP_CLICK, button, 1, None))
+        else:
+            code.extend([(OP_PRESS, button, None, None),
+                         (OP_WAIT, hold, None, None),
+                         (OP_RELEASE, button, None, None)])
+    elif button_type == "custom":
+        if not custom_key:
+            raise ValueError("Nenhuma tecla customizada selecionada")
+        combo = custom_key if isinstance(custom_key, tuple) else (custom_key,)
+        keys = combo
+        loop_start = 0
+        code.extend([(OP_KEY_DOWN, combo, None, None),
+                     (OP_WAIT, 0.05 if action_type == "click" else hold, None, None),
+                     (OP_KEY_UP, combo, None, None)])
+    else:
+        raise ValueError(f"button_type inválido: {button_type}")
+
+    code.append((OP_WAIT, after, None, None))
+    code.append((OP_JUMP, loop_start, None, None))
+    return MacroProgram(code, 0, buttons, keys, name="simples")
+
+
+class TrackSet:
+    """Várias trilhas (MacroProgram independentes) executadas juntas.
+
+    O MacroEngine agenda todas em uma única thread, ordenadas por prazo
+    em um heap: cada passo custa O(log n), então 100 trilhas usam quase a
+    mesma CPU de uma, fora o trabalho das próprias ações.
+    """
+    __slots__ = ("tracks", "buttons", "keys", "name")
+
+    def __init__(self, tracks, name="trilhas"):
+        self.tracks = tuple(tracks)  # (nome, MacroProgram)
+        self.buttons = frozenset().union(*(program.buttons for _, program in self.tracks))
+        self.keys = frozenset().union(*(program.keys for _, program in self.tracks))
+        self.name = name
+
+    def __len__(self):
+        return len(self.tracks)
+
+    @classmethod
+    def from_profile(cls, profile, base_dir=".", name="trilhas"):
+        """Compila as trilhas de um perfil do macro_config.json.
+
+        Cada trilha é {"name", "script": arquivo .macro} ou {"name",
+        "source": texto do script}; "enabled": false a ignora.
+        """
+        tracks = []
+        for i, spec in enumerate(profile.get("tracks", ())):
+            if not spec.get("enabled", True):
+                continue
+            track_name = spec.get("name") or f"trilha {i + 1}"
+            if spec.get("script"):
+                path = spec["script"]
+                if not os.path.isabs(path):
+                    path = os.path.join(base_dir, path)
+                program = ScriptCompiler.load(path)
+            elif spec.get("source"):
+                program = ScriptCompiler.compile(spec["source"], name=track_name)
+            else:
+                raise ValueError(f"trilha '{track_name}' sem 'script' nem 'source'")
+            tracks.append((track_name, program))
+        if not tracks:
+            raise ValueError("perfil sem trilhas ativas")
+        return cls(tracks, name)
+
+
+# ===== Gravações (formato .mrec) =====
+
+# Tipos de evento gravado
+REC_MOVE = 0
+REC_PRESS = 1      # botão do mouse
+REC_RELEASE = 2
+REC_KEY_DOWN = 3
+REC_KEY_UP = 4
+
+REC_KIND_NAMES = {
+    REC_MOVE: "move", REC_PRESS: "press", REC_RELEASE: "release",
+    REC_KEY_DOWN: "keydown", REC_KEY_UP: "keyup",
+}
+
+RECORDING_MAGIC = b"MREC"
+RECORDING_VERSION = 1
+RECORDING_CHUNK_EVENTS = 4096
+# Flags do cabeçalho: movimentos são vértices de uma trajetória a
+# interpolar na reprodução (gravação simplificada)
+REC_FLAG_INTERPOLATE = 1
+# magic, versão, flags, eventos por bloco
+_REC_HEADER = struct.Struct("<4sBBI")
+# Por bloco: offset, tempo do primeiro evento (µs), tamanho em bytes
+_REC_INDEX = struct.Struct("<QqI")
+# Offset do índice, total de eventos, tempo do último evento, blocos,
+# tamanho da tabela de nomes, magic
+_REC_TRAILER = struct.Struct("<QQqII4s")
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def input_token(value):
+    """Nome estável de um botão ou tecla do pynput, para gravar em disco."""
+    if isinstance(value, str):
+        return value
+    name = getattr(value, "name", None)
+    if name:
+        return name
+    char = getattr(value, "char", None)
+    if char:
+        return char
+    vk = getattr(value, "vk", None)
+    return f"<{vk}>" if vk is not None else str(value)
+
+
+def resolve_token(token, mouse):
+    """Inverso de input_token: converte o nome no objeto do pynput."""
+    if mouse:
+        return resolve_button(token)
+    if token.startswith("<") and token.endswith(">") and KeyCode is not None:
+        return KeyCode.from_vk(int(token[1:-1]))
+    return resolve_key(token)
+
+
+class RecordingWriter:
+    """Grava eventos no formato .mrec.
+
+    Cada bloco tem RECORDING_CHUNK_EVENTS eventos, com tempo (µs) e
+    coordenadas em delta + varint a partir de zero, então cada bloco é
+    decodificado sozinho. No fim vem o índice dos blocos e a tabela de
+    nomes de botões/teclas. O arquivo é escrito em "<path>.tmp" e só
+    substitui o destino em close(); abort() (ou um erro dentro do with)
+    descarta o temporário.
+    """
+
+    def __init__(self, path, chunk_events=RECORDING_CHUNK_EVENTS, flags=0):
+        self.path = str(path)
+        self.chunk_events = chunk_events
+        self.count = 0
+        self._file = open(self.path + ".tmp", "wb")
+        self._file.write(_REC_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, flags, chunk_events))
+        self._index = []
+        self._names = []
+        self._codes = {}
+        self._chunk = bytearray()
+        self._in_chunk = 0
+        self._first_t = self._last_t = 0
+        self._prev = (0, 0, 0)
+
+    def append(self, t_us, kind, x=0, y=0, name=None):
+        """Acrescenta um evento; name é o botão ou tecla (input_token)."""
+        if self._in_chunk == 0:
+            self._first_t = t_us
+            self._prev = (0, 0, 0)
+        prev_t, prev_x, prev_y = self._prev
+        out = self._chunk
+        out.append(kind)
+        _write_varint(out, max(0, t_us - prev_t))
+        if kind <= REC_RELEASE:
+            _write_varint(out, _zigzag(x - prev_x))
+            _write_varint(out, _zigzag(y - prev_y))
+            self._prev = (max(t_us, prev_t), x, y)
+        else:
+            self._prev = (max(t_us, prev_t), prev_x, prev_y)
+        if kind != REC_MOVE:
+            mouse = kind <= REC_RELEASE
+            code = self._codes.get((mouse, name))
+            if code is None:
+                code = self._codes[(mouse, name)] = len(self._names)
+                self._names.append((name, mouse))
+            _write_varint(out, code)
+        self._last_t = max(t_us, self._last_t)
+        self.count += 1
+        self._in_chunk += 1
+        if self._in_chunk == self.chunk_events:
+            self._flush_chunk()
+
+    def _flush_chunk(self):
+        if not self._in_chunk:
+            return
+        self._index.append((self._file.tell(), self._first_t, len(self._chunk)))
+        self._file.write(self._chunk)
+        self._chunk = bytearray()
+        self._in_chunk = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        self._flush_chunk()
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(_REC_INDEX.pack(*entry))
+        names = json.dumps(self._names).encode("utf-8")
+        self._file.write(names)
+        self._file.write(_REC_TRAILER.pack(
+            index_offset, self.count, self._last_t, len(self._index), len(names), RECORDING_MAGIC
+        ))
+        self._file.close()
+        self._file = None
+        os.replace(self.path + ".tmp", self.path)
+
+    def abort(self):
+        """Descarta a gravação: fecha e apaga o "<path>.tmp" sem tocar no destino."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.unlink(self.path + ".tmp")
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # Erro no meio da escrita: o arquivo anterior continua intacto
+        if exc[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class Recording:
+    """Leitura de um arquivo .mrec com acesso aleatório preguiçoso.
+
+    Abrir lê apenas o rodapé (índice e nomes) de um arquivo mapeado em
+    memória; os blocos são decodificados sob demanda e só o último fica
+    em cache, então reproduzir milhões de eventos usa memória constante.
+    Eventos são tuplas (t_us, tipo, x, y, código); names[código] dá o
+    botão ou tecla.
+    """
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = str(path)
+        self.name = os.path.basename(self.path)
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _REC_HEADER.size + _REC_TRAILER.size:
+                raise ValueError(f"gravação inválida: {self.path}")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.flags, self.chunk_events = _REC_HEADER.unpack_from(self._map, 0)
+        (index_offset, self.count, self.last_t_us, chunks, names_len,
+         end_magic) = _REC_TRAILER.unpack_from(self._map, size - _REC_TRAILER.size)
+        if magic != RECORDING_MAGIC or end_magic != RECORDING_MAGIC:
+            raise ValueError(f"gravação inválida: {self.path}")
+        if version != RECORDING_VERSION:
+            raise ValueError(f"versão de gravação não suportada: {version}")
+        index_end = index_offset + chunks * _REC_INDEX.size
+        self._index = list(_REC_INDEX.iter_unpack(self._map[index_offset:index_end]))
+        self._chunk_times = [entry[1] for entry in self._index]
+        table = json.loads(self._map[index_end:index_end + names_len].decode("utf-8"))
+        self.names = [name for name, _ in table]
+        self._mouse = [mouse for _, mouse in table]
+        self._cached = (None, None)
+        self._objects = None
+
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        # Enviado ao EngineProcess: o outro processo reabre o arquivo
+        return (Recording, (self.path,))
+
+    @property
+    def chunk_count(self):
+        return len(self._index)
+
+    @property
+    def interpolate(self):
+        return bool(self.flags & REC_FLAG_INTERPOLATE)
+
+    @property
+    def duration(self):
+        """Duração em segundos."""
+        return self.last_t_us / 1e6 if self.count else 0.0
+
+    def chunk(self, i):
+        """Decodifica (ou devolve do cache) o bloco i."""
+        cached_i, events = self._cached
+        if cached_i == i:
+            return events
+        offset, _, length = self._index[i]
+        data = self._map[offset:offset + length]
+        count = min(self.chunk_events, self.count - i * self.chunk_events)
+        events = []
+        append = events.append
+        pos = t = x = y = 0
+        for _ in range(count):
+            kind = data[pos]
+            pos += 1
+            byte = data[pos]
+            if byte < 0x80:
+                t += byte
+                pos += 1
+            else:
+                delta, pos = _read_varint(data, pos)
+                t += delta
+            code = -1
+            if kind <= REC_RELEASE:
+                value, pos = _read_varint(data, pos)
+                x += (value >> 1) ^ -(value & 1)
+                value, pos = _read_varint(data, pos)
+                y += (value >> 1) ^ -(value & 1)
+            if kind != REC_MOVE:
+                code, pos = _read_varint(data, pos)
+            append((t, kind, x, y, code))
+        self._cached = (i, events)
+        return events
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.chunk(index // self.chunk_events)[index % self.chunk_events]
+
+    def iter_from(self, index=0):
+        """Itera os eventos a partir de index, um bloco por vez."""
+        chunk_i, offset = divmod(max(0, index), self.chunk_events)
+        for i in range(chunk_i, len(self._index)):
+            events = self.chunk(i)
+            yield from events[offset:] if offset else events
+            offset = 0
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def index_at(self, t_us):
+        """Índice do primeiro evento com tempo >= t_us (busca no índice de blocos).
+
+        Parte do último bloco que começa antes de t_us: com tempos repetidos
+        na fronteira, o primeiro deles pode estar no fim desse bloco. Se o
+        bloco inteiro é anterior, a resposta é o início do seguinte.
+        """
+        if not self._chunk_times:
+            return 0
+        i = max(0, bisect.bisect_left(self._chunk_times, t_us) - 1)
+        times = [event[0] for event in self.chunk(i)]
+        pos = bisect.bisect_left(times, t_us)
+        return i * self.chunk_events + pos
+
+    def objects(self):
+        """names resolvidos para objetos do pynput (botões e teclas)."""
+        if self._objects is None:
+            self._objects = [resolve_token(name, mouse) for name, mouse in zip(self.names, self._mouse)]
+        return self._objects
+
+    @property
+    def buttons(self):
+        return frozenset(obj for obj, mouse in zip(self.objects(), self._mouse) if mouse)
+
+    @property
+    def keys(self):
+        return frozenset(obj for obj, mouse in zip(self.objects(), self._mouse) if not mouse)
+
+    def close(self):
+        self._cached = (None, None)
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class InputRecorder:
+    """Grava os eventos dos hooks de mouse e teclado em um arquivo .mrec.
+
+    Os métodos on_* rodam nas threads dos hooks e só codificam o evento
+    no bloco em memória; o disco é tocado uma vez por bloco cheio.
+    """
+
+    def __init__(self, path, clock=None):
+        self.clock = clock or REAL_CLOCK
+        self.path = str(path)
+        self._writer = RecordingWriter(path)
+        self._lock = threading.Lock()
+        self._start = self.clock.now()
+        self.count = 0
+
+    def _append(self, kind, x=0, y=0, name=None):
+        t_us = int((self.clock.now() - self._start) * 1e6)
+        with self._lock:
+            if self._writer is not None:
+                self._writer.append(t_us, kind, x, y, name)
+                self.count = self._writer.count
+
+    def on_move(self, x, y):
+        self._append(REC_MOVE, x, y)
+
+    def on_click(self, x, y, button, pressed):
+        self._append(REC_PRESS if pressed else REC_RELEASE, x, y, input_token(button))
+
+    def on_press(self, key):
+        self._append(REC_KEY_DOWN, name=input_token(key))
+
+    def on_release(self, key):
+        self._append(REC_KEY_UP, name=input_token(key))
+
+    def stop(self):
+        """Finaliza o arquivo; retorna o número de eventos gravados."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        return self.count
+
+
+class RecordingEdits:
+    """Camada de edição sobre uma Recording, sem reescrever o arquivo.
+
+    Inserções, exclusões e deslocamentos de tempo ficam numa tabela de
+    peças: trechos [início, fim) da gravação base ou de eventos inseridos,
+    cada um com seu deslocamento em µs. Ler uma linha é uma busca binária
+    nas peças mais o acesso preguiçoso da Recording, então memória e custo
+    dependem do número de edições, não do tamanho da gravação. As edições
+    mantêm os eventos em ordem de tempo; save() grava o resultado em
+    streaming. Linhas são tuplas (t_us, tipo, x, y, nome).
+    """
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.modified = False
+        # Peças (eventos inseridos ou None para a base, início, fim, deslocamento)
+        self._pieces = [(None, 0, len(recording), 0)] if len(recording) else []
+        # Tempo do último evento de cada peça, para row_at (peças são imutáveis)
+        self._last_times = {}
+        self._reindex()
+
+    def _reindex(self):
+        self._starts = []
+        total = 0
+        for _, start, end, _ in self._pieces:
+            self._starts.append(total)
+            total += end - start
+        self._count = total
+        if len(self._last_times) > 4 * len(self._pieces) + 64:
+            self._last_times.clear()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def edit_count(self):
+        """Número de peças além da gravação original intacta."""
+        return max(0, len(self._pieces) - 1)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError(row)
+        i = bisect.bisect_right(self._starts, row) - 1
+        source, start, _, shift = self._pieces[i]
+        index = start + row - self._starts[i]
+        if source is None:
+            t_us, kind, x, y, code = self.recording[index]
+            return (t_us + shift, kind, x, y, self.recording.names[code] if code >= 0 else None)
+        t_us, kind, x, y, name = source[index]
+        return (t_us + shift, kind, x, y, name)
+
+    def _split(self, row):
+        """Garante uma fronteira de peça em row; retorna o índice da peça que começa ali."""
+        if row >= self._count:
+            return len(self._pieces)
+        i = bisect.bisect_right(self._starts, row) - 1
+        offset = row - self._starts[i]
+        if offset:
+            source, start, end, shift = self._pieces[i]
+            self._pieces[i:i + 1] = [(source, start, start + offset, shift),
+                                     (source, start + offset, end, shift)]
+            self._reindex()
+            i += 1
+        return i
+
+    def check_order(self, row, end, first_t, last_t):
+        """Valida que eventos com tempos first_t..last_t cabem entre row-1 e end."""
+        if first_t < 0:
+            raise ValueError("tempo negativo")
+        if row > 0 and self[row - 1][0] > first_t:
+            raise ValueError("tempo anterior ao evento precedente")
+        if end < self._count and self[end][0] < last_t:
+            raise ValueError("tempo posterior ao evento seguinte")
+
+    def insert(self, row, event):
+        """Insere event (t_us, tipo, x, y, nome) antes da linha row."""
+        row = min(max(row, 0), self._count)
+        event = (int(event[0]), int(event[1]), int(event[2]), int(event[3]), event[4])
+        self.check_order(row, row, event[0], event[0])
+        i = self._split(row)
+        self._pieces.insert(i, ((event,), 0, 1, 0))
+        self._reindex()
+        self.modified = True
+
+    def delete(self, row, count=1):
+        """Exclui as linhas [row, row + count)."""
+        count = min(count, self._count - row)
+        if row < 0 or count <= 0:
+            return
+        i = self._split(row)
+        j = self._split(row + count)
+        del self._pieces[i:j]
+        self._reindex()
+        self.modified = True
+
+    def replace(self, row, event):
+        """Troca a linha row por event, mantendo a ordem de tempo."""
+        if not 0 <= row < self._count:
+            raise IndexError(row)
+        self.check_order(row, row + 1, event[0], event[0])
+        self.delete(row)
+        self.insert(row, event)
+
+    def shift(self, row, count, delta_us):
+        """Desloca no tempo as linhas [row, row + count) em delta_us."""
+        count = min(count, self._count - row)
+        if row < 0 or count <= 0 or not delta_us:
+            return
+        self.check_order(row, row + count, self[row][0] + delta_us, self[row + count - 1][0] + delta_us)
+        i = self._split(row)
+        j = self._split(row + count)
+        self._pieces[i:j] = [(source, start, end, shift + delta_us)
+                             for source, start, end, shift in self._pieces[i:j]]
+        self.modified = True
+
+    def row_at(self, t_us):
+        """Primeira linha com tempo >= t_us.
+
+        Busca binária nas peças pelo último tempo de cada uma e, dentro de
+        uma peça da base, no índice de blocos da Recording.
+        """
+        pieces = self._pieces
+        last_times = self._last_times
+        lo, hi = 0, len(pieces)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            piece = pieces[mid]
+            last_t = last_times.get(piece)
+            if last_t is None:
+                last_t = last_times[piece] = self[self._starts[mid] + piece[2] - piece[1] - 1][0]
+            if last_t < t_us:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(pieces):
+            return self._count
+        source, start, end, shift = pieces[lo]
+        if source is None:
+            index = min(max(self.recording.index_at(t_us - shift), start), end)
+        else:
+            index = start
+            while index < end and source[index][0] + shift < t_us:
+                index += 1
+        return self._starts[lo] + index - start
+
+    def __iter__(self):
+        names = self.recording.names
+        for source, start, end, shift in self._pieces:
+            if source is None:
+                for _, (t_us, kind, x, y, code) in zip(range(end - start), self.recording.iter_from(start)):
+                    yield (t_us + shift, kind, x, y, names[code] if code >= 0 else None)
+            else:
+                for t_us, kind, x, y, name in source[start:end]:
+                    yield (t_us + shift, kind, x, y, name)
+
+    def save(self, path):
+        """Grava a gravação editada em path; retorna o número de eventos."""
+        recording = self.recording
+        with RecordingWriter(path, recording.chunk_events, recording.flags) as writer:
+            for t_us, kind, x, y, name in self:
+                writer.append(t_us, kind, x, y, name)
+        return writer.count
+
+
+# Eventos por janela de simplificação (limita a memória dos arrays NumPy)
+SIMPLIFY_WINDOW_EVENTS = 64 * RECORDING_CHUNK_EVENTS
+# Intervalo sem eventos de mouse que indica cursor parado (o hook só
+# reporta movimento); a simplificação preserva essas pausas
+SIMPLIFY_IDLE_US = 50000
+
+
+def _sed(t, x, y, a, b, lo, hi):
+    """Distância sincronizada dos pontos lo..hi-1 ao segmento a-b (interpolado no tempo)."""
+    span = t[b] - t[a]
+    ratio = (t[lo:hi] - t[a]) / span if span > 0 else np.zeros(hi - lo)
+    return np.hypot(x[lo:hi] - (x[a] + (x[b] - x[a]) * ratio),
+                    y[lo:hi] - (y[a] + (y[b] - y[a]) * ratio))
+
+
+def _simplify_path(t, x, y, anchors, tolerance_px, tolerance_ms):
+    """Máscara dos pontos a manter (Ramer–Douglas–Peucker vetorizado).
+
+    O erro de um ponto descartado é a distância sincronizada: a posição
+    original no instante t contra a posição interpolada no mesmo instante
+    entre os vértices mantidos, que é o que a reprodução interpolada faz.
+    Cada segmento é avaliado de uma vez com NumPy e dividido no pior ponto;
+    com tolerance_ms > 0, segmentos mais longos que isso também são
+    divididos (no meio, em tempo).
+    """
+    keep = anchors.copy()
+    keep[0] = keep[-1] = True
+    window_us = tolerance_ms * 1000
+    bounds = np.flatnonzero(keep).tolist()
+    stack = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b - a > 1]
+    while stack:
+        a, b = stack.pop()
+        err = _sed(t, x, y, a, b, a + 1, b)
+        worst = int(np.argmax(err))
+        if err[worst] > tolerance_px:
+            m = a + 1 + worst
+        elif window_us > 0 and t[b] - t[a] > window_us:
+            m = min(max(int(np.searchsorted(t, (t[a] + t[b]) / 2)), a + 1), b - 1)
+        else:
+            continue
+        keep[m] = True
+        if m - a > 1:
+            stack.append((a, m))
+        if b - m > 1:
+            stack.append((m, b))
+    return keep
+
+
+def _path_deviation(t, x, y, keep):
+    """Maior distância sincronizada entre a trajetória original e a mantida."""
+    idx = np.arange(len(t))
+    prev = np.maximum.accumulate(np.where(keep, idx, 0))
+    nxt = np.minimum.accumulate(np.where(keep, idx, len(t) - 1)[::-1])[::-1]
+    span = (t[nxt] - t[prev]).astype(np.float64)
+    ratio = np.divide(t - t[prev], span, out=np.zeros(len(t)), where=span > 0)
+    err = np.hypot(x - (x[prev] + (x[nxt] - x[prev]) * ratio),
+                   y - (y[prev] + (y[nxt] - y[prev]) * ratio))
+    return float(err.max()) if len(err) else 0.0
+
+
+def simplify_recording(src, dst, tolerance_px=2.0, tolerance_ms=0.0):
+    """Remove movimentos redundantes de uma gravação .mrec (requer NumPy).
+
+    Cliques e teclas são sempre mantidos, com seus tempos originais. Os
+    movimentos restantes são vértices que a reprodução interpola (a saída
+    é marcada com REC_FLAG_INTERPOLATE), e a trajetória reproduzida fica a
+    no máximo tolerance_px da original no mesmo instante (mais o
+    arredondamento para pixels inteiros da reprodução). Pausas do cursor
+    viram um ponto de espera para não serem interpoladas. A gravação é
+    processada em janelas, com memória limitada. Retorna um relatório com
+    a redução e o desvio máximo medido.
+    """
+    if np is None:
+        raise RuntimeError("NumPy não está instalado. Execute: pip install numpy")
+
+    src_path = str(src)
+    start = time.perf_counter()
+    deviation = 0.0
+    with Recording(src_path) as recording, \
+            RecordingWriter(dst, flags=REC_FLAG_INTERPOLATE) as writer:
+        names = recording.names
+        for first in range(0, len(recording), SIMPLIFY_WINDOW_EVENTS):
+            window = []
+            for event in recording.iter_from(first):
+                window.append(event)
+                if len(window) == SIMPLIFY_WINDOW_EVENTS:
+                    break
+            data = np.array(window, dtype=np.int64)
+            # Trajetória: movimentos e cliques (teclas não têm posição)
+            positions = np.flatnonzero(data[:, 1] <= REC_RELEASE)
+            write = np.ones(len(window), dtype=bool)
+            holds = ()
+            if len(positions):
+                t = data[positions, 0]
+                x = data[positions, 2].astype(np.float64)
+                y = data[positions, 3].astype(np.float64)
+                anchors = data[positions, 1] != REC_MOVE
+                # Pausa seguida de movimento: os dois lados viram âncoras e
+                # um ponto de espera é escrito logo antes do movimento
+                idle = np.flatnonzero((np.diff(t) > SIMPLIFY_IDLE_US)
+                                      & ((np.diff(x) != 0) | (np.diff(y) != 0)))
+                anchors[idle] = anchors[idle + 1] = True
+                # Nenhum segmento atravessa uma tecla: a reprodução só conhece
+                # o segmento ao ler o vértice seguinte
+                keys = np.searchsorted(positions, np.flatnonzero(data[:, 1] > REC_RELEASE))
+                anchors[np.clip(keys - 1, 0, len(t) - 1)] = True
+                anchors[np.clip(keys, 0, len(t) - 1)] = True
+                keep = _simplify_path(t, x, y, anchors, tolerance_px, tolerance_ms)
+                deviation = max(deviation, _path_deviation(t, x, y, keep))
+                write[positions] = keep
+                holds = dict(zip(positions[idle + 1].tolist(), positions[idle].tolist()))
+            for i in np.flatnonzero(write).tolist():
+                t_us, kind, ex, ey, code = window[i]
+                before = holds.get(i) if holds else None
+                if before is not None:
+                    writer.append(t_us - 1, REC_MOVE, window[before][2], window[before][3])
+                writer.append(t_us, kind, ex, ey, names[code] if code >= 0 else None)
+        events_in = len(recording)
+        events_out = writer.count
+
+    bytes_in = os.path.getsize(src_path)
+    bytes_out = os.path.getsize(str(dst))
+    return {
+        "events_in": events_in,
+        "events_out": events_out,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "reduction": round(bytes_in / bytes_out, 2) if bytes_out else 0.0,
+        "max_deviation_px": round(deviation, 3),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+# ===== Disparos agendados (cron) e limites de execução =====
+
+# Faixas dos campos cron: minuto, hora, dia do mês, mês, dia da semana
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+CRON_ALIASES = {
+    "@hourly": "0 * * * *", "@daily": "0 0 * * *", "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *", "@yearly": "0 0 1 1 *",
+}
+
+
+class CronExpression:
+    """Expressão cron de 5 campos: minuto hora dia mês dia-da-semana.
+
+    Campos aceitam *, listas (1,15), faixas (8-17) e passos (*/5, 8-18/2);
+    dia da semana 0-7 (0 e 7 = domingo). Como no cron, se dia do mês e dia
+    da semana são ambos restritos, basta um dos dois casar. Horários são
+    locais (datetime sem fuso).
+    """
+
+    def __init__(self, text):
+        self.text = text.strip()
+        fields = CRON_ALIASES.get(self.text, self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"expressão cron precisa de 5 campos: {text!r}")
+        minutes, hours, days, months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS)
+        )
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == "*" or fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(","):
+            spec, _, step = part.partition("/")
+            try:
+                step = int(step) if step else 1
+                if spec == "*":
+                    start, end = low, high
+                elif "-" in spec:
+                    start, end = (int(v) for v in spec.split("-", 1))
+                else:
+                    start = int(spec)
+                    end = high if step > 1 else start
+            except ValueError:
+                raise ValueError(f"campo cron inválido: {part!r}") from None
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError(f"campo cron inválido: {part!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, date):
+        dom = date.day in self.days
+        dow = date.isoweekday() % 7 in self.weekdays
+        return (dom and dow) if self._any_day else (dom or dow)
+
+    def next_after(self, when):
+        """Próximo instante (datetime, ao minuto) estritamente depois de when."""
+        when = when.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Dia a dia; dentro do dia, busca binária nas horas e minutos
+        for _ in range(366 * 8):
+            if when.month in self.months and self._day_matches(when):
+                i = bisect.bisect_left(self.hours, when.hour)
+                for hour in self.hours[i:]:
+                    first = when.minute if hour == when.hour else 0
+                    j = bisect.bisect_left(self.minutes, first)
+                    if j < len(self.minutes):
+                        return when.replace(hour=hour, minute=self.minutes[j])
+            when = (when + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError(f"expressão cron nunca dispara: {self.text!r}")
+
+    def __repr__(self):
+        return f"CronExpression({self.text!r})"
+
+
+def _parse_at(text):
+    """"HH:MM[:SS]" (diário) ou data/hora ISO (uma vez) -> (time, None) ou (None, epoch)."""
+    text = str(text).strip()
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(text, fmt).time(), None
+        except ValueError:
+            pass
+    try:
+        return None, datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"horário inválido: {text!r}") from None
+
+
+def _next_daily(daily, t):
+    """Próxima ocorrência (epoch) do horário diário estritamente depois de t."""
+    day = datetime.datetime.fromtimestamp(t).date()
+    due = datetime.datetime.combine(day, daily).timestamp()
+    if due <= t:
+        due = datetime.datetime.combine(day + datetime.timedelta(days=1), daily).timestamp()
+    return due
+
+
+class ScheduledTrigger:
+    """Gatilho de início de um perfil.
+
+    spec é um dict do perfil em macro_config.json com uma das chaves:
+    "cron" (expressão cron), "every_minutes" (intervalo contado a partir
+    de quando o gatilho é carregado) ou "at" ("HH:MM" diário, ou
+    "AAAA-MM-DD HH:MM" uma única vez).
+    """
+
+    __slots__ = ("profile", "spec", "_cron", "_interval", "_anchor", "_daily", "_once")
+
+    def __init__(self, profile, spec, now=None):
+        self.profile = profile
+        self.spec = dict(spec)
+        self._cron = self._interval = self._daily = self._once = None
+        kinds = [key for key in ("cron", "every_minutes", "at") if key in spec]
+        if len(kinds) != 1:
+            raise ValueError(f"gatilho precisa de exatamente um de cron/every_minutes/at: {spec}")
+        if "cron" in spec:
+            self._cron = CronExpression(str(spec["cron"]))
+            self._cron.next_after(datetime.datetime.now())  # Rejeita datas impossíveis (30/2)
+        elif "every_minutes" in spec:
+            self._interval = float(spec["every_minutes"]) * 60
+            if self._interval <= 0:
+                raise ValueError(f"every_minutes deve ser positivo: {spec}")
+            self._anchor = time.time() if now is None else now
+        else:
+            self._daily, self._once = _parse_at(spec["at"])
+
+    @classmethod
+    def from_profile(cls, name, profile, now=None):
+        """Gatilhos da lista "schedule" de um perfil."""
+        return [cls(name, spec, now) for spec in (profile or {}).get("schedule", [])]
+
+    def next_after(self, t):
+        """Próximo disparo (epoch, s) estritamente depois de t, ou None se não há mais."""
+        if self._cron is not None:
+            return self._cron.next_after(datetime.datetime.fromtimestamp(t)).timestamp()
+        if self._interval is not None:
+            periods = max(0, int((t - self._anchor) // self._interval) + 1)
+            return self._anchor + periods * self._interval
+        if self._once is not None:
+            return self._once if self._once > t else None
+        return _next_daily(self._daily, t)
+
+    def describe(self):
+        key, value = next(iter(self.spec.items()))
+        return f"{self.profile} ({key}: {value})"
+
+    def __repr__(self):
+        return f"ScheduledTrigger({self.profile!r}, {self.spec!r})"
+
+
+class TriggerScheduler:
+    """Dispara callback(gatilho) nos horários agendados, de uma única thread.
+
+    Os próximos disparos ficam num heap e a thread dorme numa Condition até
+    o mais próximo (ou até set_triggers mudar a lista): nada de polling. Um
+    disparo atrasado (máquina suspensa, callback lento) roda uma vez e o
+    gatilho é reagendado a partir de agora, sem rajada de disparos perdidos.
+    O callback roda na thread do agendador, fora do lock.
+
+    A Condition espera em tempo monotônico e os horários são do relógio de
+    parede (time_source): cada espera dura no máximo 'max_wait' segundos,
+    então um ajuste do relógio (NTP, fuso, suspensão) atrasa um disparo
+    por no máximo esse tanto.
+    """
+
+    def __init__(self, callback, time_source=time.time, max_wait=30.0):
+        self.callback = callback
+        self.time_source = time_source
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        self._thread = None
+        self._stopped = False
+
+    def set_triggers(self, triggers):
+        """Substitui os gatilhos; a thread só é criada se houver algum."""
+        now = self.time_source()
+        with self._cond:
+            self._heap = []
+            for trigger in triggers:
+                self._push(trigger, trigger.next_after(now))
+            if self._heap and self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name="macro-trigger-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _push(self, trigger, due):
+        if due is not None:
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, trigger))
+
+    def upcoming(self, limit=None):
+        """[(epoch, gatilho)] em ordem de disparo."""
+        with self._cond:
+            entries = sorted(self._heap)
+        return [(due, trigger) for due, _, trigger in entries[:limit]]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    now = self.time_source()
+                    due = self._heap[0][0]
+                    if due > now:
+                        self._cond.wait(min(due - now, self.max_wait))
+                        continue
+                    _, _, trigger = heapq.heappop(self._heap)
+                    self._push(trigger, trigger.next_after(max(now, due)))
+                    break
+            try:
+                self.callback(trigger)
+            except Exception as e:
+                print(f"Erro no disparo agendado {trigger.describe()}: {e}")
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+
+# Motivos de fim de execução por limite (além de "finished" e "stopped")
+LIMIT_REASONS = ("iterations", "duration", "deadline")
+# Motivo de fim quando a janela alvo (WindowTracker) não está disponível
+WINDOW_REASON = "window"
+LIMIT_LABELS = {"iterations": "iterações", "duration": "duração", "deadline": "horário de término"}
+# Intervalo mínimo entre mensagens de progresso de um job (s)
+PROGRESS_INTERVAL = 1.0
+
+
+class RunLimits:
+    """Condições de parada de um job: iterações, duração e horário de término.
+
+    Avaliadas pelo próprio MacroEngine, sem threads extras: o instante
+    final limita as esperas do agendador e as iterações são contadas no
+    salto para trás do laço mais externo. Com limites, um programa que
+    termina recomeça (cada passada conta uma iteração) até um deles ser
+    atingido. Em um perfil: "limits": {"iterations": N, "duration_s": S,
+    "stop_at": "HH:MM" ou data ISO}.
+    """
+
+    __slots__ = ("iterations", "duration", "stop_at")
+
+    def __init__(self, iterations=None, duration=None, stop_at=None):
+        self.iterations = int(iterations) if iterations is not None else None
+        self.duration = float(duration) if duration is not None else None
+        self.stop_at = str(stop_at) if stop_at else None
+        if self.iterations is not None and self.iterations < 1:
+            raise ValueError(f"iterations deve ser positivo: {iterations}")
+        if self.duration is not None and self.duration <= 0:
+            raise ValueError(f"duration_s deve ser positivo: {duration}")
+        if self.stop_at:
+            _parse_at(self.stop_at)
+
+    @classmethod
+    def from_profile(cls, profile):
+        """Limites do perfil (chave "limits"), ou None se não há."""
+        spec = (profile or {}).get("limits") or {}
+        unknown = set(spec) - {"iterations", "duration_s", "stop_at"}
+        if unknown:
+            raise ValueError(f"limites desconhecidos: {', '.join(sorted(unknown))}")
+        if not spec:
+            return None
+        return cls(spec.get("iterations"), spec.get("duration_s"), spec.get("stop_at"))
+
+    def end_after(self, t):
+        """(epoch, motivo) do fim por tempo de um job iniciado em t, ou (None, None)."""
+        candidates = []
+        if self.duration is not None:
+            candidates.append((t + self.duration, "duration"))
+        if self.stop_at:
+            daily, once = _parse_at(self.stop_at)
+            candidates.append((once if daily is None else _next_daily(daily, t), "deadline"))
+        return min(candidates) if candidates else (None, None)
+
+    def __repr__(self):
+        return f"RunLimits(iterations={self.iterations}, duration={self.duration}, stop_at={self.stop_at!r})"
+
+
+def _iteration_edge(code):
+    """Índice do salto para trás do laço mais externo (-1 se o programa não tem laço)."""
+    edge, edge_target = -1, None
+    for pc, (op, a, b, _) in enumerate(code):
+        target = a if op == OP_JUMP else b if op == OP_LOOP_NEXT else None
+        # Laço mais externo: alvo mais cedo; empate, o salto mais adiante
+        if target is not None and target <= pc and (edge_target is None or target <= edge_target):
+            edge, edge_target = pc, target
+    return edge
+
+
+# ===== Agendamento da thread do worker (Linux) =====
+
+SCHED_POLICIES = {"fifo": "SCHED_FIFO", "rr": "SCHED_RR", "other": "SCHED_OTHER"}
+
+
+def parse_cpu_list(spec):
+    """Converte "0,2-3", 3 ou [0, 2] em um conjunto de CPUs (None se vazio)."""
+    if spec is None or spec == "":
+        return None
+    if isinstance(spec, int):
+        return {spec}
+    if isinstance(spec, (list, tuple, set)):
+        return {int(cpu) for cpu in spec}
+    cpus = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if "-" in part:
+            low, high = part.split("-", 1)
+            cpus.update(range(int(low), int(high) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus or None
+
+
+def apply_worker_scheduling(cpus=None, policy=None, rt_priority=10, nice=None):
+    """
+    Aplica afinidade de CPU e prioridade à thread atual (o worker do macro).
+
+    Tudo é opcional e nada é fatal: sem permissão (SCHED_FIFO exige
+    CAP_SYS_NICE, nice negativo também) ou fora do Linux, a configuração
+    padrão é mantida. Retorna mensagens descrevendo o que foi aplicado.
+    """
+    tid = threading.get_native_id()
+    messages = []
+
+    cpus = parse_cpu_list(cpus)
+    if cpus:
+        if not hasattr(os, "sched_setaffinity"):
+            messages.append("Afinidade de CPU não suportada neste sistema")
+        else:
+            try:
+                os.sched_setaffinity(tid, cpus)
+                messages.append(f"Worker fixado nas CPUs {sorted(cpus)}")
+            except (OSError, ValueError) as e:
+                messages.append(f"Afinidade {sorted(cpus)} recusada: {e}")
+
+    realtime = False
+    if policy:
+        const = getattr(os, SCHED_POLICIES.get(policy, ""), None)
+        if const is None:
+            messages.append(f"Política de escalonamento '{policy}' não suportada")
+        else:
+            priority = rt_priority if policy in ("fifo", "rr") else 0
+            try:
+                os.sched_setscheduler(tid, const, os.sched_param(priority))
+                realtime = policy in ("fifo", "rr")
+                messages.append(f"Política {SCHED_POLICIES[policy]} aplicada (prioridade {priority})")
+            except (OSError, ValueError) as e:
+                messages.append(f"{SCHED_POLICIES[policy]} recusado ({e}); mantendo a política padrão")
+
+    # nice não tem efeito sobre threads de tempo real
+    if nice is not None and not realtime:
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, int(nice))
+            messages.append(f"Nice do worker ajustado para {int(nice)}")
+        except (OSError, AttributeError) as e:
+            messages.append(f"Nice {nice} recusado: {e}")
+
+    return messages
+
+
+# ===== Relógios =====
+
+class RealClock:
+    """Relógio real: perf_counter e esperas interrompíveis por um Event."""
+    virtual = False
+
+    now = staticmethod(time.perf_counter)
+
+    def wait(self, event, timeout):
+        """Espera até timeout segundos; retorna True se o evento foi sinalizado."""
+        return event.wait(timeout)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+REAL_CLOCK = RealClock()
+
+
+class VirtualClock:
+    """Relógio simulado: as esperas avançam o tempo na hora, sem dormir.
+
+    Permite executar horas de agenda em milissegundos e verificar os
+    instantes exatos de cada ação. call_at() agenda callbacks no tempo
+    simulado (ex.: engine.stop ao fim de uma hora); eles disparam, em
+    ordem, quando uma espera atravessa o instante. Feito para uma única
+    thread: os programas precisam de waits para o tempo andar.
+    """
+    virtual = True
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._timers = []
+        self._seq = 0
+
+    def now(self):
+        return self._now
+
+    def call_at(self, when, callback):
+        self._seq += 1
+        heapq.heappush(self._timers, (when, self._seq, callback))
+
+    def call_later(self, delay, callback):
+        self.call_at(self._now + delay, callback)
+
+    def advance(self, seconds, event=None):
+        """Avança o tempo disparando os callbacks; para cedo se event for sinalizado."""
+        target = self._now + max(0.0, seconds)
+        timers = self._timers
+        while timers and timers[0][0] <= target:
+            when, _, callback = heapq.heappop(timers)
+            self._now = max(self._now, when)
+            callback()
+            if event is not None and event.is_set():
+                return
+        self._now = target
+
+    def advance_to_next(self):
+        """Salta para o próximo callback agendado e dispara os desse instante.
+
+        Retorna False se não há callbacks (o tempo não anda).
+        """
+        if not self._timers:
+            return False
+        self.advance(self._timers[0][0] - self._now)
+        return True
+
+    def wait(self, event, timeout):
+        if not event.is_set():
+            self.advance(timeout, event)
+        return event.is_set()
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+class _NullController:
+    """Controlador que não injeta nada (para benchmarks e simulações)."""
+    position = (0, 0)
+
+    def click(self, button, count=1):
+        pass
+
+    def press(self, key):
+        pass
+
+    def release(self, key):
+        pass
+
+    def type(self, text):
+        for ch in text:
+            self.press(ch)
+            self.release(ch)
+
+
+def simulate(program, duration, mouse=None, keyboard=None, metrics=None, pixel_reader=None,
+             limits=None, status_callback=None):
+    """Executa um programa (ou TrackSet) por 'duration' segundos simulados.
+
+    Retorna (motivo, engine); engine.clock.now() indica o tempo simulado final.
+    """
+    clock = VirtualClock()
+    controller = _NullController()
+    engine = MacroEngine(mouse or controller, keyboard or controller, metrics, pixel_reader,
+                         status_callback=status_callback, clock=clock)
+    clock.call_at(duration, engine.stop)
+    return engine.run(program, limits=limits), engine
+
+
+class _TrackState:
+    """Estado de execução de uma trilha dentro do agendador do MacroEngine."""
+    __slots__ = ("name", "code", "counters", "pc", "text", "text_pos", "pace", "typed_at", "iteration_pc")
+
+    def __init__(self, name, program):
+        self.name = name
+        self.code = program.code
+        self.counters = [0] * program.loop_slots
+        self.pc = 0
+        self.text = None  # Digitação em andamento
+        self.text_pos = 0
+        self.pace = 0.0
+        self.typed_at = 0.0
+        # Salto que conta iterações do job (só na primeira trilha, com limites)
+        self.iteration_pc = None
+
+    def restart(self):
+        self.counters = [0] * len(self.counters)
+        self.pc = 0
+
+
+# Instruções executadas por passo de uma trilha antes de ceder a vez, para
+# que um laço sem wait não monopolize o agendador
+TRACK_STEP_BUDGET = 10000
+
+
+class MacroEngine:
+    """Interpretador de MacroProgram.
+
+    Um laço de despacho enxuto sobre a lista plana de instruções. As esperas
+    são por prazo (deadline): cada WAIT é medido a partir do prazo anterior,
+    não do fim da ação, então o ritmo não acumula deriva. A verificação de
+    parada acontece apenas em esperas e saltos para trás, que todo laço
+    possui. Um programa novo pode substituir o atual em execução via
+    replace_program(); a troca acontece no próximo salto para trás.
+
+    Um TrackSet é executado pelo agendador de trilhas (_run_tracks): a
+    mesma thread avança todas as trilhas, sempre a de prazo mais próximo.
+    Uma Recording (.mrec) é reproduzida com os intervalos gravados.
+
+    O tempo vem de self.clock; com um VirtualClock o motor roda mais rápido
+    que o tempo real e de forma determinística (ver simulate()).
+
+    run() aceita RunLimits: o fim por tempo corta a espera em que cai e as
+    iterações são contadas nos saltos do laço externo (na primeira trilha,
+    para um TrackSet); o progresso vai pelo status_callback.
+
+    Com 'failsafe' (argumentos do Watchdog) cada run() em relógio real é
+    vigiado por uma thread própria; o prazo da próxima ação (_deadline)
+    serve de batimento.
+
+    Com 'window' (WindowTracker), as coordenadas de move e if pixel são
+    relativas à janela alvo: somadas à origem em cache, sem consulta ao
+    servidor X. Sem a janela, a execução para com WINDOW_REASON.
+    """
+
+    def __init__(self, mouse=None, keyboard=None, metrics=None, pixel_reader=None,
+                 status_callback=None, scheduling=None, clock=None, failsafe=None, window=None):
+        self.mouse = mouse if mouse is not None else MouseController()
+        self.keyboard = keyboard if keyboard is not None else KeyboardController()
+        self.metrics = metrics if metrics is not None else MacroMetrics()
+        self.pixel_reader = pixel_reader or read_pixel
+        # Recebe mensagens de progresso (ex.: taxa de digitação) para a GUI
+        self.status_callback = status_callback
+        # Argumentos de apply_worker_scheduling, aplicados na thread de run()
+        self.scheduling = scheduling
+        # Argumentos do Watchdog (canto da tela, batimento), ou None
+        self.failsafe = failsafe
+        # WindowTracker: move e if pixel ficam relativos à janela alvo
+        self.window = window
+        # Todas as medidas e esperas passam pelo relógio (real ou virtual)
+        self.clock = clock or REAL_CLOCK
+        self.running = False
+        self.program = None
+        self._pending_program = None
+        self._stop_event = threading.Event()
+        # Livre fora de run(): o Watchdog espera o passo em andamento acabar
+        self._idle = threading.Event()
+        self._idle.set()
+        self._deadline = 0.0
+        self._pending_latency = None
+        self._tap_chord = None
+        # Job com limites (RunLimits): instante final no relógio e contagem
+        self.limits = None
+        self._end = None
+        self._end_reason = None
+        self._limit_reason = None
+        self._iterations = 0
+        self._job_start = 0.0
+        self._job_actions = 0
+        self._next_progress = 0.0
+        # Backends com buffer (XTest) enviam os eventos a cada passo do agendador
+        self._tick = getattr(self.mouse, "tick", None)
+        # O que está pressionado de fato (controladores de create_controllers)
+        self.input_state = getattr(self.mouse, "input_state", None)
+        # Teto de injeções (rate_limit_controllers): stop() interrompe a espera por fichas
+        bucket = getattr(self.mouse, "bucket", None)
+        if bucket is not None:
+            bucket.stop_event = self._stop_event
+
+    def stop(self):
+        """Interrompe a execução (inclusive esperas em andamento)."""
+        self.running = False
+        self._stop_event.set()
+
+    def wait_idle(self, timeout=None):
+        """Espera run() sair (inclusive o passo em andamento); False se o timeout venceu."""
+        return self._idle.wait(timeout)
+
+    def replace_program(self, program):
+        """Troca o programa em execução no próximo salto para trás."""
+        self._pending_program = program
+
+    def release_all(self):
+        """Solta tudo o que está pressionado (sem InputState: o que o programa atual usa)."""
+        if self.input_state is not None:
+            self.input_state.release_all()
+        else:
+            self.release_program_inputs()
+
+    def release_program_inputs(self, program=None):
+        """Solta os botões e teclas usados pelo programa (padrão: o atual).
+
+        Com InputState, só os que estão de fato pressionados recebem release,
+        e os de outros programas nos mesmos controladores ficam intactos.
+        """
+        if program is None:
+            program = self.program
+        if program is None:
+            return
+        if self.input_state is not None:
+            self.input_state.release(program.buttons, program.keys)
+            return
+        for button in program.buttons:
+            try:
+                self.mouse.release(button)
+            except Exception:
+                pass
+        for key in program.keys:
+            try:
+                self.keyboard.release(key)
+            except Exception:
+                pass
+
+    def _type_text(self, text, pace):
+        """Digita um texto; retorna False se a execução foi interrompida.
+
+        Sem intervalo (pace == 0) o texto vai em lotes para keyboard.type();
+        com intervalo, um caractere por prazo do agendador. Em ambos os casos
+        cada caractere é pressionado e solto dentro de keyboard.type(), então
+        uma parada entre caracteres nunca deixa tecla presa.
+        """
+        keyboard = self.keyboard
+        typed = 0
+        start = self.clock.now()
+        completed = True
+
+        if pace <= 0:
+            for i in range(0, len(text), TYPE_BATCH_SIZE):
+                if not self.running:
+                    completed = False
+                    break
+                batch = text[i:i + TYPE_BATCH_SIZE]
+                keyboard.type(batch)
+                typed += len(batch)
+                # Batimento para o Watchdog durante textos longos sem intervalo
+                self._deadline = self.clock.now()
+        else:
+            for ch in text:
+                keyboard.type(ch)
+                typed += 1
+                if typed < len(text) and not self._wait(pace):
+                    completed = False
+                    break
+
+        elapsed = self.clock.now() - start
+        rate = typed / elapsed if elapsed > 0 else 0.0
+        self.metrics.inc("chars_typed_total", typed)
+        self.metrics.set_gauge("typing_chars_per_sec", round(rate, 1))
+        if self.status_callback:
+            self.status_callback(f"Digitados {typed}/{len(text)} caracteres ({rate:.0f} caracteres/s)")
+        return completed
+
+    def _wait(self, seconds):
+        """Espera até o próximo prazo; retorna False se foi interrompido."""
+        if self._tick is not None:
+            self._tick()
+        now = self.clock.now()
+        target = self._deadline + seconds
+        if self._end is not None and target >= self._end:
+            return self._wait_end(now)
+        if target <= now:
+            # Atrasado: não tentar compensar com uma rajada de ações
+            self._deadline = now
+            return self.running
+        self._deadline = target
+        if self.clock.wait(self._stop_event, target - now):
+            return False
+        self.metrics.observe("sleep_overshoot_ms", max(0.0, (self.clock.now() - target) * 1000))
+        return self.running
+
+    def run(self, program, requested_at=None, limits=None):
+        """Executa o programa até o fim, até stop() ou até um limite. Retorna o motivo."""
+        if self.scheduling:
+            for message in apply_worker_scheduling(**self.scheduling):
+                print(message)
+        self._start_job(limits)
+        self._idle.clear()
+        self._start_running()
+        watchdog = None
+        if self.failsafe and not self.clock.virtual:
+            self._deadline = self.clock.now()
+            watchdog = Watchdog(self, **self.failsafe)
+            watchdog.start()
+        try:
+            if isinstance(program, TrackSet):
+                reason = self._run_tracks(program, requested_at)
+            elif isinstance(program, Recording):
+                reason = self._run_recording(program, requested_at)
+            else:
+                reason = self._run(program, requested_at)
+        except BaseException:
+            # Erro ou Ctrl+C no meio de um hold: nada fica pressionado
+            self.running = False
+            self.release_all()
+            raise
+        finally:
+            if self._limit_reason == FAILSAFE_REASON:
+                # O Watchdog parou o motor: solta daqui, depois do último passo,
+                # para um press no meio do passo não escapar do release
+                self.release_all()
+            if self._tick is not None:
+                self._tick()
+            self._idle.set()
+            if watchdog is not None:
+                watchdog.stop()
+        if self._limit_reason is not None:
+            reason = self._limit_reason
+        if limits is not None:
+            self._report_job(reason)
+        return reason
+
+    def _start_job(self, limits):
+        self.limits = limits
+        self._limit_reason = None
+        self._iterations = 0
+        self._end = self._end_reason = None
+        if limits is None:
+            return
+        now = self.clock.now()
+        self._job_start = now
+        self._job_actions = self.metrics.snapshot()["counters"].get("actions_total", 0)
+        self._next_progress = now + PROGRESS_INTERVAL
+        # Horários de parede viram um instante no relógio do motor; a
+        # duração vai direto, sem passar pelo epoch (exata no VirtualClock)
+        wall = time.time()
+        end, self._end_reason = limits.end_after(wall)
+        if self._end_reason == "duration":
+            self._end = now + limits.duration
+        elif end is not None:
+            self._end = now + max(0.0, end - wall)
+
+    def _wait_end(self, now):
+        """Espera até o fim do job (o prazo pedido passa dele). Sempre retorna False."""
+        self._deadline = self._end
+        if self._end > now and self.clock.wait(self._stop_event, self._end - now):
+            return False
+        if self.running:
+            self._reach_limit(self._end_reason)
+        return False
+
+    def _reach_limit(self, reason):
+        self._limit_reason = reason
+        self.running = False
+
+    def _lose_window(self):
+        """A janela alvo sumiu (fechada ou minimizada): para em vez de clicar fora dela."""
+        if self.status_callback:
+            self.status_callback(f"Janela alvo indisponível: {self.window.describe()}")
+        self._reach_limit(WINDOW_REASON)
+
+    def _count_iteration(self):
+        """Conta uma iteração do job; retorna False se um limite foi atingido."""
+        self._iterations += 1
+        limits = self.limits
+        if limits.iterations is not None and self._iterations >= limits.iterations:
+            self._reach_limit("iterations")
+            return False
+        now = self.clock.now()
+        if self._end is not None and now >= self._end:
+            self._reach_limit(self._end_reason)
+            return False
+        if now >= self._next_progress and self.status_callback:
+            self._next_progress = now + PROGRESS_INTERVAL
+            self.status_callback(self._progress_text(now))
+        return True
+
+    def _progress_text(self, now):
+        if self.limits.iterations is not None:
+            text = (f"{self._iterations}/{self.limits.iterations} iterações "
+                    f"({self._iterations * 100 // self.limits.iterations}%)")
+        else:
+            text = f"{self._iterations} iterações"
+        if self._end is not None:
+            text += f", restam {max(0.0, self._end - now):.0f} s"
+        return text
+
+    def _report_job(self, reason):
+        """Resumo do job (iterações, ações e vazão) nas métricas e no status."""
+        elapsed = self.clock.now() - self._job_start
+        actions = self.metrics.snapshot()["counters"].get("actions_total", 0) - self._job_actions
+        rate = actions / elapsed if elapsed > 0 else 0.0
+        self.metrics.inc("jobs_total")
+        self.metrics.set_gauge("job_iterations", self._iterations)
+        self.metrics.set_gauge("job_actions_per_sec", round(rate, 1))
+        if self.status_callback:
+            ending = f"limite de {LIMIT_LABELS[reason]}" if reason in LIMIT_LABELS else reason
+            self.status_callback(f"Job concluído ({ending}): {self._iterations} iterações, "
+                                 f"{actions} ações em {elapsed:.1f} s ({rate:.1f} ações/s)")
+
+    def _run(self, program, requested_at):
+        mouse = self.mouse
+        keyboard = self.keyboard
+        # Backends em lote (uinput, XTest) tocam um acorde inteiro em uma escrita
+        tap_chord = getattr(keyboard, "tap_chord", None)
+        metrics = self.metrics
+        window = self.window
+        pending_latency = requested_at
+
+        self.program = program
+        self._deadline = self.clock.now()
+
+        while True:
+            code = program.code
+            n = len(code)
+            counters = [0] * program.loop_slots
+            pc = 0
+            swapped = False
+            iteration_pc = _iteration_edge(code) if self.limits is not None else None
+
+            while pc < n:
+                op, a, b, c = code[pc]
+                pc += 1
+
+                if op == OP_WAIT:
+                    if not self._wait(a):
+                        return "stopped"
+                    continue
+
+                if op == OP_JUMP or op == OP_LOOP_NEXT:
+                    if op == OP_LOOP_NEXT:
+                        counters[a] -= 1
+                        if counters[a] <= 0:
+                            continue
+                        target = b
+                    else:
+                        target = a
+                    if not self.running:
+                        return "stopped"
+                    if pc - 1 == iteration_pc and not self._count_iteration():
+                        return "stopped"
+                    if self._pending_program is not None:
+                        program, self._pending_program = self._pending_program, None
+                        if isinstance(program, TrackSet):
+                            return self._run_tracks(program, pending_latency)
+                        self.program = program
+                        swapped = True
+                        break
+                    pc = target
+                    continue
+
+                if op == OP_LOOP_INIT:
+                    counters[a] = b
+                    continue
+
+                if op == OP_IF_PIXEL:
+                    (x, y), (rgb, tolerance) = a, b
+                    if window is not None:
+                        origin = window.origin
+                        if origin is None:
+                            self._lose_window()
+                            return "stopped"
+                        x, y = x + origin[0], y + origin[1]
+                    pixel = self.pixel_reader(x, y)
+                    if any(abs(pixel[i] - rgb[i]) > tolerance for i in range(3)):
+                        pc = c
+                    continue
+
+                # Ações de entrada
+                if op == OP_MOVE:
+                    if window is not None:
+                        origin = window.origin
+                        if origin is None:
+                            self._lose_window()
+                            return "stopped"
+                        a, b = a + origin[0], b + origin[1]
+                    mouse.position = (a, b)
+                    continue
+                if op == OP_CLICK:
+                    mouse.click(a, b)
+                elif op == OP_PRESS:
+                    mouse.press(a)
+                elif op == OP_RELEASE:
+                    mouse.release(a)
+                    continue
+                elif op == OP_KEY_DOWN:
+                    for key in a:
+                        keyboard.press(key)
+                elif op == OP_KEY_UP:
+                    for key in reversed(a):
+                        keyboard.release(key)
+                    continue
+                elif op == OP_KEY_TAP:
+                    if tap_chord is not None:
+                        tap_chord(a)
+                    else:
+                        for key in a:
+                            keyboard.press(key)
+                        for key in reversed(a):
+                            keyboard.release(key)
+                elif op == OP_TYPE:
+                    if not self._type_text(a, b):
+                        return "stopped"
+                    # O prazo segue a partir do fim da digitação
+                    self._deadline = self.clock.now()
+
+                metrics.inc("actions_total")
+                if pending_latency is not None:
+                    metrics.observe("hotkey_latency_ms", (self.clock.now() - pending_latency) * 1000)
+                    pending_latency = None
+
+            if not swapped:
+                if self.limits is None:
+                    return "finished"
+                # Com limites, cada passada completa é uma iteração e o programa recomeça
+                if not self._count_iteration():
+                    return "stopped"
+
+    def _run_recording(self, recording, requested_at):
+        """Reproduz uma gravação .mrec com os intervalos originais."""
+        objects = recording.objects()
+        pending_latency = requested_at
+
+        self.program = recording
+        self._deadline = self.clock.now()
+        # Com limites, a gravação se repete (cada reprodução é uma iteração)
+        while True:
+            reason = self._play_recording(recording, objects, pending_latency)
+            pending_latency = None
+            if reason != "finished" or self.limits is None:
+                return reason
+            if not self._count_iteration():
+                return "stopped"
+
+    def _play_recording(self, recording, objects, pending_latency):
+        """Uma reprodução completa da gravação."""
+        mouse = self.mouse
+        keyboard = self.keyboard
+        metrics = self.metrics
+        last_t = None
+        interpolate = recording.interpolate
+        prev_pos = None
+
+        # Eventos decodificados um bloco por vez: memória constante
+        for t_us, kind, x, y, code in recording:
+            if kind <= REC_RELEASE:
+                if interpolate and prev_pos is not None:
+                    # Gravação simplificada: percorre o segmento até este
+                    # vértice em passos de ~1 px (no máximo um a cada 250 µs)
+                    pt, px, py = prev_pos
+                    steps = min(max(abs(x - px), abs(y - py)), (t_us - pt) // 250)
+                    for step in range(1, steps):
+                        sub_t = pt + (t_us - pt) * step // steps
+                        if sub_t <= last_t:
+                            continue
+                        if not self._wait((sub_t - last_t) / 1e6):
+                            return "stopped"
+                        last_t = sub_t
+                        mouse.position = (px + round((x - px) * step / steps), py + round((y - py) * step / steps))
+                prev_pos = (t_us, x, y)
+            if last_t is not None and t_us > last_t:
+                if not self._wait((t_us - last_t) / 1e6):
+                    return "stopped"
+            elif not self.running:
+                return "stopped"
+            last_t = t_us
+
+            if kind == REC_MOVE:
+                mouse.position = (x, y)
+                continue
+            if kind == REC_PRESS:
+                mouse.position = (x, y)
+                mouse.press(objects[code])
+            elif kind == REC_RELEASE:
+                mouse.position = (x, y)
+                mouse.release(objects[code])
+            elif kind == REC_KEY_DOWN:
+                keyboard.press(objects[code])
+            else:
+                keyboard.release(objects[code])
+
+            metrics.inc("actions_total")
+            if pending_latency is not None:
+                metrics.observe("hotkey_latency_ms", (self.clock.now() - pending_latency) * 1000)
+                pending_latency = None
+        return "finished"
+
+    def begin_tracks(self, tracks, requested_at=None):
+        """Prepara um TrackSet para ser avançado passo a passo por um laço externo.
+
+        Retorna o estado de cada trilha, na ordem do TrackSet, para step().
+        O chamador cuida das esperas (pelo self.clock) e, ao terminar, de
+        'running = False', release_program_inputs() e flush().
+        """
+        self._start_running()
+        return self._prepare_tracks(tracks, requested_at)
+
+    def _start_running(self):
+        # Um stop() anterior não pode valer para esta execução. Limpar antes de
+        # 'running = True': um stop() concorrente deixa o evento ligado mesmo
+        # que a atribuição venha depois, e a primeira espera já retorna
+        self._stop_event.clear()
+        self.running = True
+
+    def _prepare_tracks(self, tracks, requested_at):
+        self.program = tracks
+        self._pending_latency = requested_at
+        self._tap_chord = getattr(self.keyboard, "tap_chord", None)
+        return [_TrackState(name, program) for name, program in tracks.tracks]
+
+    def step(self, track, due):
+        """Avança uma trilha até a próxima espera. Retorna o novo prazo (no self.clock) ou None no fim."""
+        return self._step_track(track, due, self.clock.now())
+
+    def flush(self):
+        """Envia os eventos retidos por backends com buffer (XTest)."""
+        if self._tick is not None:
+            self._tick()
+
+    def _run_tracks(self, tracks, requested_at):
+        metrics = self.metrics
+        self._prepare_tracks(tracks, requested_at)
+
+        # Heap de (prazo, ordem, trilha); a ordem desempata prazos iguais
+        now = self.clock.now()
+        heap = self._track_heap(tracks, now)
+
+        while heap:
+            due, seq, track = heap[0]
+            self._deadline = due
+            now = self.clock.now()
+            if self._end is not None and due >= self._end:
+                self._wait_end(now)
+                return "stopped"
+            if due > now:
+                if self._tick is not None:
+                    self._tick()
+                if self.clock.wait(self._stop_event, due - now):
+                    return "stopped"
+                now = self.clock.now()
+                metrics.observe("sleep_overshoot_ms", max(0.0, (now - due) * 1000))
+            if not self.running:
+                return "stopped"
+
+            pending = self._pending_program
+            if pending is not None:
+                self._pending_program = None
+                if not isinstance(pending, TrackSet):
+                    return self._run(pending, self._pending_latency)
+                self.program = tracks = pending
+                heap = self._track_heap(tracks, now)
+                continue
+
+            next_due = self._step_track(track, due, now)
+            if next_due is None and track.iteration_pc is not None and self.running:
+                # Com limites, a primeira trilha recomeça a cada passada completa
+                if self._count_iteration():
+                    track.restart()
+                    next_due = now
+            if not self.running:
+                return "stopped"
+            if next_due is None:
+                heapq.heappop(heap)
+                if self.status_callback and heap:
+                    self.status_callback(f"Trilha '{track.name}' concluída ({len(heap)} em execução)")
+            else:
+                heapq.heapreplace(heap, (next_due, seq, track))
+        return "finished"
+
+    def _track_heap(self, tracks, now):
+        heap = [(now, seq, _TrackState(name, program)) for seq, (name, program) in enumerate(tracks.tracks)]
+        if heap and self.limits is not None:
+            heap[0][2].iteration_pc = _iteration_edge(heap[0][2].code)
+        heapq.heapify(heap)
+        return heap
+
+    def _step_track(self, track, due, now):
+        """Avança uma trilha até a próxima espera. Retorna o novo prazo ou None no fim."""
+        mouse = self.mouse
+        keyboard = self.keyboard
+        metrics = self.metrics
+
+        if track.text is not None:
+            if track.pace > 0:
+                keyboard.type(track.text[track.text_pos])
+                track.text_pos += 1
+            else:
+                batch = track.text[track.text_pos:track.text_pos + TYPE_BATCH_SIZE]
+                keyboard.type(batch)
+                track.text_pos += len(batch)
+            if track.text_pos < len(track.text):
+                # Entre lotes a trilha cede a vez; com ritmo, espera por prazo
+                return max(due + track.pace, now) if track.pace > 0 else now
+            self._finish_track_text(track)
+
+        code = track.code
+        n = len(code)
+        counters = track.counters
+        pc = track.pc
+        budget = TRACK_STEP_BUDGET
+
+        while pc < n:
+            op, a, b, c = code[pc]
+            pc += 1
+
+            if op == OP_WAIT:
+                track.pc = pc
+                target = due + a
+                # Atrasada: segue do agora, sem rajada de compensação
+                return target if target > now else now
+
+            if op == OP_JUMP or op == OP_LOOP_NEXT:
+                if op == OP_LOOP_NEXT:
+                    counters[a] -= 1
+                    if counters[a] <= 0:
+                        continue
+                    target = b
+                else:
+                    target = a
+                if pc - 1 == track.iteration_pc and not self._count_iteration():
+                    track.pc = target
+                    return now
+                pc = target
+                budget -= 1
+                if budget <= 0:
+                    track.pc = pc
+                    return now
+                continue
+
+            if op == OP_LOOP_INIT:
+                counters[a] = b
+                continue
+
+            if op == OP_IF_PIXEL:
+                (x, y), (rgb, tolerance) = a, b
+                if self.window is not None:
+                    origin = self.window.origin
+                    if origin is None:
+                        track.pc = pc - 1
+                        self._lose_window()
+                        return now
+                    x, y = x + origin[0], y + origin[1]
+                pixel = self.pixel_reader(x, y)
+                if any(abs(pixel[i] - rgb[i]) > tolerance for i in range(3)):
+                    pc = c
+                continue
+
+            if op == OP_MOVE:
+                if self.window is not None:
+                    origin = self.window.origin
+                    if origin is None:
+                        track.pc = pc - 1
+                        self._lose_window()
+                        return now
+                    a, b = a + origin[0], b + origin[1]
+                mouse.position = (a, b)
+                continue
+            if op == OP_CLICK:
+                mouse.click(a, b)
+            elif op == OP_PRESS:
+                mouse.press(a)
+            elif op == OP_RELEASE:
+                mouse.release(a)
+                continue
+            elif op == OP_KEY_DOWN:
+                for key in a:
+                    keyboard.press(key)
+            elif op == OP_KEY_UP:
+                for key in reversed(a):
+                    keyboard.release(key)
+                continue
+            elif op == OP_KEY_TAP:
+                if self._tap_chord is not None:
+                    self._tap_chord(a)
+                else:
+                    for key in a:
+                        keyboard.press(key)
+                    for key in reversed(a):
+                        keyboard.release(key)
+            elif op == OP_TYPE:
+                # A digitação continua nos próximos passos da trilha
+                track.pc = pc
+                track.text, track.text_pos, track.pace = a, 0, b
+                track.typed_at = now
+                return now
+
+            metrics.inc("actions_total")
+            if self._pending_latency is not None:
+                metrics.observe("hotkey_latency_ms", (self.clock.now() - self._pending_latency) * 1000)
+                self._pending_latency = None
+
+        track.pc = pc
+        return None
+
+    def _finish_track_text(self, track):
+        typed = len(track.text)
+        elapsed = self.clock.now() - track.typed_at
+        rate = typed / elapsed if elapsed > 0 else 0.0
+        self.metrics.inc("chars_typed_total", typed)
+        self.metrics.set_gauge("typing_chars_per_sec", round(rate, 1))
+        self.metrics.inc("actions_total")
+        if self.status_callback:
+            self.status_callback(f"Trilha '{track.name}': {typed} caracteres ({rate:.0f} caracteres/s)")
+        track.text = None
+
+
+# ===== Estado das entradas pressionadas =====
+
+class InputState:
+    """Conjunto autoritativo dos botões e teclas que o macro mantém pressionados.
+
+    Alimentado pelos controladores de track_controllers(): cada press entra
+    e cada release sai, na ordem em que foram pressionados. Assim soltar
+    tudo (parada, pausa, failsafe, saída) emite apenas os releases
+    necessários, do último para o primeiro, sem eventos espúrios para o
+    aplicativo alvo, e vale para vários botões e teclas segurados juntos.
+    Seguro entre threads sem lock: cada escrita é uma única operação
+    atômica no dict, e quem solta retira as entradas uma a uma (uma tecla
+    pressionada no meio do caminho continua registrada). Os releases vão
+    direto ao controlador original.
+    """
+
+    def __init__(self, mouse, keyboard):
+        self.mouse = mouse
+        self.keyboard = keyboard
+        # (é_tecla, botão ou tecla) -> None; o dict preserva a ordem de pressão.
+        # Os controladores escrevem nele diretamente
+        self._held = {}
+
+    def held(self):
+        """Lista (é_tecla, botão ou tecla) do que está pressionado, em ordem."""
+        return list(self._held.copy())
+
+    def release(self, buttons=(), keys=()):
+        """Solta, dentre os pressionados, os botões e teclas dados. Retorna quantos."""
+        return self._release([entry for entry in self.held() if entry[1] in (keys if entry[0] else buttons)])
+
+    def release_all(self):
+        """Solta tudo o que está pressionado. Retorna quantos releases foram emitidos."""
+        return self._release(self.held())
+
+    def _release(self, entries):
+        released = 0
+        for entry in reversed(entries):
+            # Só quem retira a entrada emite o release (sem release duplicado)
+            if self._held.pop(entry, False) is not None:
+                continue
+            is_key, obj = entry
+            try:
+                (self.keyboard if is_key else self.mouse).release(obj)
+            except Exception:
+                pass
+            released += 1
+        return released
+
+    def __len__(self):
+        return len(self._held)
+
+
+class _TrackedMouse:
+    """Mouse que registra no InputState os botões pressionados."""
+
+    def __init__(self, mouse, state):
+        self._inner = mouse
+        self.input_state = state
+        self._held = state._held
+        # Sem estado a registrar: métodos do original, sem custo extra
+        self.click = mouse.click
+
+    @property
+    def position(self):
+        return self._inner.position
+
+    @position.setter
+    def position(self, pos):
+        self._inner.position = pos
+
+    def press(self, button):
+        self._inner.press(button)
+        self._held[(False, button)] = None
+
+    def release(self, button):
+        self._held.pop((False, button), None)
+        self._inner.release(button)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+class _TrackedKeyboard:
+    """Teclado que registra no InputState as teclas pressionadas."""
+
+    def __init__(self, keyboard, state):
+        self._inner = keyboard
+        self.input_state = state
+        self._held = state._held
+        # type() e tap_chord() pressionam e soltam por dentro
+        self.type = keyboard.type
+        if hasattr(keyboard, "tap_chord"):
+            self.tap_chord = keyboard.tap_chord
+
+    def press(self, key):
+        self._inner.press(key)
+        self._held[(True, key)] = None
+
+    def release(self, key):
+        self._held.pop((True, key), None)
+        self._inner.release(key)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def track_controllers(mouse, keyboard):
+    """Envolve (mouse, teclado) em um InputState comum (mouse.input_state).
+
+    O estado também é solto ao fim do processo, então uma saída abrupta
+    do programa não deixa tecla presa.
+    """
+    state = InputState(mouse, keyboard)
+    atexit.register(state.release_all)
+    return _TrackedMouse(mouse, state), _TrackedKeyboard(keyboard, state)
+
+
+# ===== Failsafe: watchdog e teto de injeções =====
+
+# Motivo de fim de execução quando o Watchdog dispara
+FAILSAFE_REASON = "failsafe"
+# Quanto o Watchdog espera o passo em andamento antes de soltar as entradas ele mesmo
+FAILSAFE_SETTLE_S = 0.25
+
+
+class Watchdog:
+    """Failsafe do MacroEngine em thread própria, independente da GUI.
+
+    A cada 'interval' segundos confere:
+    - o cursor real a até 'corner_px' pixels de um canto de qualquer
+      monitor (como no pyautogui: jogar o mouse no canto interrompe o
+      macro); 'monitors' são retângulos (x, y, largura, altura);
+    - o batimento do motor: o prazo da próxima ação (engine._deadline)
+      atrasado mais de 'heartbeat_timeout' segundos indica uma injeção
+      travada ou um laço sem wait.
+    Ao disparar, para o motor; o run() solta as entradas ao sair do passo
+    em andamento e termina com FAILSAFE_REASON. Com o motor preso numa
+    injeção por mais de FAILSAFE_SETTLE_S, o Watchdog solta as entradas
+    desta thread mesmo. O laço do motor não ganha nenhuma
+    verificação: o prazo já é mantido pelo agendador. corner_px ou
+    heartbeat_timeout zerados desligam a verificação correspondente.
+    """
+
+    def __init__(self, engine, heartbeat_timeout=5.0, corner_px=0, monitors=None,
+                 pointer=None, interval=0.05):
+        self.engine = engine
+        self.heartbeat_timeout = heartbeat_timeout or None
+        self.corner_px = int(corner_px or 0)
+        self.monitors = monitors
+        # Leitura do cursor real: os backends uinput/XTest só conhecem a
+        # posição que eles mesmos escreveram
+        self.pointer = pointer
+        self.interval = interval
+        self.tripped = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="macro-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def _corners(self):
+        """Retângulos (x0, y0, x1, y1) dos cantos; sem monitores, só o superior esquerdo."""
+        n = self.corner_px
+        corners = []
+        for x, y, w, h in self.monitors or [(0, 0, n, n)]:
+            right, bottom = x + w, y + h
+            corners += [(x, y, x + n, y + n), (right - n, y, right, y + n),
+                        (x, bottom - n, x + n, bottom), (right - n, bottom - n, right, bottom)]
+        return corners
+
+    def _pointer_reader(self):
+        if self.pointer is not None:
+            return self.pointer
+        if MouseController is None:
+            print("Failsafe de canto indisponível sem pynput")
+            return None
+        mouse = MouseController()
+        return lambda: mouse.position
+
+    def _run(self):
+        engine = self.engine
+        clock = engine.clock
+        corners = self._corners() if self.corner_px > 0 else ()
+        pointer = self._pointer_reader() if corners else None
+        timeout = self.heartbeat_timeout
+        # Espera de um controlador com teto de injeções também é progresso
+        bucket = getattr(engine.mouse, "bucket", None)
+
+        while not self._stop_event.wait(self.interval):
+            if not engine.running:
+                continue
+            if pointer is not None:
+                try:
+                    x, y = pointer()
+                except Exception as e:
+                    print(f"Failsafe de canto desativado: {e}")
+                    pointer = None
+                else:
+                    if any(x0 <= x < x1 and y0 <= y < y1 for x0, y0, x1, y1 in corners):
+                        self._trip(f"cursor no canto da tela ({x}, {y})")
+                        return
+            if timeout is not None:
+                beat = engine._deadline
+                if bucket is not None and bucket.wake_at > beat:
+                    beat = bucket.wake_at
+                lag = clock.now() - beat
+                if lag > timeout:
+                    self._trip(f"motor sem batimento há {lag:.1f} s")
+                    return
+
+    def _trip(self, cause):
+        engine = self.engine
+        self.tripped = cause
+        engine._limit_reason = FAILSAFE_REASON
+        engine.stop()
+        if not engine.wait_idle(FAILSAFE_SETTLE_S):
+            engine.release_all()
+        engine.metrics.inc("failsafe_trips_total")
+        print(f"Failsafe: {cause}")
+        if engine.status_callback:
+            engine.status_callback(f"Failsafe acionado: {cause}")
+
+
+class InjectionBucket:
+    """Token bucket global de injeções por segundo.
+
+    Compartilhado pelo mouse e pelo teclado (ver rate_limit_controllers).
+    take() reserva as fichas e dorme só o necessário, fora do lock, então
+    chamadas concorrentes entram na fila sem estourar a taxa. 'burst'
+    injeções saem de uma vez após um período ocioso (padrão: 1/10 s da taxa).
+    Medidas e esperas passam por 'clock' (o do motor; VirtualClock em testes).
+    A espera é interrompida por 'stop_event' (o MacroEngine liga o seu):
+    take() retorna False e a injeção não acontece.
+    """
+
+    def __init__(self, rate, burst=None, clock=None):
+        if rate <= 0:
+            raise ValueError(f"max_injections_per_sec deve ser positivo: {rate}")
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1.0, self.rate / 10)
+        self.clock = clock or REAL_CLOCK
+        self._tokens = self.burst
+        self._stamp = self.clock.now()
+        self._lock = threading.Lock()
+        # Fim da última espera imposta (lido pelo Watchdog como batimento)
+        self.wake_at = 0.0
+        self.throttled = 0
+        self.stop_event = threading.Event()
+
+    def take(self, count=1):
+        """Reserva count fichas e espera por elas; False se a espera foi interrompida."""
+        with self._lock:
+            now = self.clock.now()
+            tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate) - count
+            self._tokens, self._stamp = tokens, now
+            if tokens >= 0:
+                return True
+            delay = -tokens / self.rate
+            self.wake_at = now + delay
+            self.throttled += 1
+        return not self.clock.wait(self.stop_event, delay)
+
+
+class _RateLimitedMouse:
+    """Mouse que passa pelo InjectionBucket; soltar um botão nunca espera."""
+
+    def __init__(self, mouse, bucket):
+        self._inner = mouse
+        self.bucket = bucket
+
+    @property
+    def position(self):
+        return self._inner.position
+
+    @position.setter
+    def position(self, pos):
+        if self.bucket.take():
+            self._inner.position = pos
+
+    def press(self, button):
+        if self.bucket.take():
+            self._inner.press(button)
+
+    def release(self, button):
+        self._inner.release(button)
+
+    def click(self, button, count=1):
+        if self.bucket.take(count):
+            self._inner.click(button, count)
+
+    def __getattr__(self, name):
+        # tick, backend etc. do controlador original
+        return getattr(self._inner, name)
+
+
+class _RateLimitedKeyboard:
+    """Teclado que passa pelo InjectionBucket; soltar uma tecla nunca espera."""
+
+    def __init__(self, keyboard, bucket):
+        self._inner = keyboard
+        self.bucket = bucket
+        if hasattr(keyboard, "tap_chord"):
+            self.tap_chord = self._tap_chord
+
+    def press(self, key):
+        if self.bucket.take():
+            self._inner.press(key)
+
+    def release(self, key):
+        self._inner.release(key)
+
+    def type(self, text):
+        if self.bucket.take(len(text)):
+            self._inner.type(text)
+
+    def _tap_chord(self, keys):
+        if self.bucket.take(len(keys)):
+            self._inner.tap_chord(keys)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def rate_limit_controllers(mouse, keyboard, max_rate, burst=None, clock=None):
+    """Envolve (mouse, teclado) em um único InjectionBucket de max_rate injeções/s."""
+    bucket = InjectionBucket(max_rate, burst, clock)
+    return _RateLimitedMouse(mouse, bucket), _RateLimitedKeyboard(keyboard, bucket)
+
+
+# ===== Backends de injeção =====
+
+# Códigos do evdev (linux/input-event-codes.h)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0
+ABS_X = 0x00
+ABS_Y = 0x01
+
+EVDEV_BUTTONS = {"left": 0x110, "right": 0x111, "middle": 0x112}
+
+EVDEV_KEYS = {
+    "esc": 1, "1": 2, "2": 3, "3": 4, "4": 5, "5": 6, "6": 7, "7": 8, "8": 9,
+    "9": 10, "0": 11, "-": 12, "=": 13, "backspace": 14, "tab": 15,
+    "q": 16, "w": 17, "e": 18, "r": 19, "t": 20, "y": 21, "u": 22, "i": 23,
+    "o": 24, "p": 25, "[": 26, "]": 27, "enter": 28, "\n": 28, "ctrl": 29,
+    "ctrl_l": 29, "a": 30, "s": 31, "d": 32, "f": 33, "g": 34, "h": 35,
+    "j": 36, "k": 37, "l": 38, ";": 39, "'": 40, "`": 41, "shift": 42,
+    "shift_l": 42, "\\": 43, "z": 44, "x": 45, "c": 46, "v": 47, "b": 48,
+    "n": 49, "m": 50, ",": 51, ".": 52, "/": 53, "shift_r": 54, "alt": 56,
+    "alt_l": 56, " ": 57, "space": 57, "caps_lock": 58,
+    "f1": 59, "f2": 60, "f3": 61, "f4": 62, "f5": 63, "f6": 64, "f7": 65,
+    "f8": 66, "f9": 67, "f10": 68, "f11": 87, "f12": 88, "\t": 15,
+    "ctrl_r": 97, "alt_r": 100, "alt_gr": 100, "home": 102, "up": 103,
+    "page_up": 104, "left": 105, "right": 106, "end": 107, "down": 108,
+    "page_down": 109, "insert": 110, "delete": 111, "pause": 119,
+    "cmd": 125, "cmd_l": 125, "cmd_r": 126, "menu": 127,
+}
+
+# Caracteres que exigem Shift (layout US, o padrão do uinput sem keymap)
+_SHIFTED_CHARS = dict(zip('!@#$%^&*()_+{}|:"<>?~', "1234567890-=[]\\;',./`"))
+_SHIFT_CODE = EVDEV_KEYS["shift"]
+
+# ioctls de /dev/uinput (linux/uinput.h)
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+UI_DEV_SETUP = 0x405C5503
+UI_ABS_SETUP = 0x401C5504
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+UI_SET_ABSBIT = 0x40045567
+
+BUS_VIRTUAL = 0x06
+UINPUT_PATH = "/dev/uinput"
+
+# struct input_event: timeval (zerado; o kernel carimba), type, code, value
+INPUT_EVENT = struct.Struct("@llHHi")
+_UINPUT_SETUP = struct.Struct("@HHHH80sI")
+_UINPUT_ABS_SETUP = struct.Struct("@HxxiiiiII")
+
+
+def decode_input_events(data):
+    """Decodifica bytes escritos no dispositivo em tuplas (type, code, value)."""
+    size = INPUT_EVENT.size
+    usable = len(data) - len(data) % size
+    return [event[2:] for event in INPUT_EVENT.iter_unpack(data[:usable])]
+
+
+def _input_name(value):
+    """Nome normalizado de um botão/tecla do pynput ou de uma string."""
+    char = getattr(value, "char", None)
+    if char:
+        return char
+    name = getattr(value, "name", None)
+    if name:
+        return name
+    return str(value)
+
+
+class UInputBackend:
+    """
+    Injeção de entrada por um dispositivo virtual /dev/uinput.
+
+    Cada ação vira uma sequência de structs input_event escrita com um único
+    write(): um clique (press, SYN, release, SYN) ou um lote de texto inteiro
+    custa uma chamada de sistema, sem ida e volta ao servidor X, e funciona
+    também no Wayland. O ponteiro é absoluto (ABS_X/ABS_Y na faixa da tela).
+
+    device pode ser um caminho ou um descritor. Se não for um dispositivo de
+    caractere (arquivo comum ou pipe), os ioctls são pulados e os eventos
+    apenas escritos, o que permite conferir a saída com decode_input_events.
+    """
+
+    def __init__(self, device=UINPUT_PATH, screen_size=(1920, 1080), name="macro-v2"):
+        self.screen_size = screen_size
+        self.events_written = 0
+        self.writes = 0
+        self._owns_fd = not isinstance(device, int)
+        self.fd = os.open(device, os.O_WRONLY | os.O_NONBLOCK) if self._owns_fd else device
+        self.emulated = not stat.S_ISCHR(os.fstat(self.fd).st_mode)
+        self._lock = threading.Lock()
+        self._pressed = set()
+        self._position = (0, 0)
+        if not self.emulated:
+            try:
+                self._create_device(name)
+            except OSError:
+                self.close()
+                raise
+        self.mouse = _UInputMouse(self)
+        self.keyboard = _UInputKeyboard(self)
+
+    def _create_device(self, name):
+        if fcntl is None:
+            raise OSError("uinput requer Linux (fcntl indisponível)")
+        fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_KEY)
+        for code in set(EVDEV_BUTTONS.values()) | set(EVDEV_KEYS.values()):
+            fcntl.ioctl(self.fd, UI_SET_KEYBIT, code)
+        fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_ABS)
+        for axis, size in ((ABS_X, self.screen_size[0]), (ABS_Y, self.screen_size[1])):
+            fcntl.ioctl(self.fd, UI_SET_ABSBIT, axis)
+            fcntl.ioctl(self.fd, UI_ABS_SETUP, _UINPUT_ABS_SETUP.pack(axis, 0, 0, size - 1, 0, 0, 0))
+        fcntl.ioctl(self.fd, UI_DEV_SETUP, _UINPUT_SETUP.pack(
+            BUS_VIRTUAL, 0x1209, 0x4D56, 1, name.encode()[:79], 0
+        ))
+        fcntl.ioctl(self.fd, UI_DEV_CREATE)
+        # O compositor/servidor X precisa de um instante para adotar o dispositivo
+        time.sleep(0.2)
+
+    def write(self, events):
+        """Escreve uma sequência de (type, code, value) em um único write()."""
+        pack = INPUT_EVENT.pack
+        data = b"".join([pack(0, 0, kind, code, value) for kind, code, value in events])
+        with self._lock:
+            view = memoryview(data)
+            while view:
+                try:
+                    written = os.write(self.fd, view)
+                except BlockingIOError:
+                    # Fila do kernel (ou pipe de teste) cheia: esperar o consumidor
+                    time.sleep(0.0005)
+                    continue
+                view = view[written:]
+            self.writes += 1
+            self.events_written += len(events)
+
+    def button_code(self, button):
+        name = _input_name(button)
+        try:
+            return EVDEV_BUTTONS[name]
+        except KeyError:
+            raise ValueError(f"Botão sem código evdev: {name}") from None
+
+    def key_code(self, key):
+        name = _input_name(key)
+        code = EVDEV_KEYS.get(name) or EVDEV_KEYS.get(name.lower())
+        if code is None:
+            raise ValueError(f"Tecla sem código evdev: {name}")
+        return code
+
+    def key_events(self, code, value, out):
+        out.append((EV_KEY, code, value))
+        out.append((EV_SYN, SYN_REPORT, 0))
+        if value:
+            self._pressed.add(code)
+        else:
+            self._pressed.discard(code)
+
+    def char_events(self, char, out):
+        """Press/release de um caractere, com Shift quando necessário."""
+        base = _SHIFTED_CHARS.get(char)
+        if base is None and char.isupper():
+            base = char.lower()
+        code = self.key_code(base or char)
+        if base is not None:
+            self.key_events(_SHIFT_CODE, 1, out)
+        self.key_events(code, 1, out)
+        self.key_events(code, 0, out)
+        if base is not None:
+            self.key_events(_SHIFT_CODE, 0, out)
+
+    def release_all(self):
+        """Solta tudo o que este backend deixou pressionado."""
+        events = []
+        for code in list(self._pressed):
+            self.key_events(code, 0, events)
+        if events:
+            self.write(events)
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            if not self.emulated:
+                self.release_all()
+                fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+        finally:
+            if self._owns_fd:
+                os.close(self.fd)
+            self.fd = None
+
+
+class _UInputMouse:
+    """Interface de pynput.mouse.Controller sobre o UInputBackend."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.backend = backend
+
+    @property
+    def position(self):
+        return self._backend._position
+
+    @position.setter
+    def position(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        self._backend._position = (x, y)
+        self._backend.write(((EV_ABS, ABS_X, x), (EV_ABS, ABS_Y, y), (EV_SYN, SYN_REPORT, 0)))
+
+    def press(self, button):
+        events = []
+        self._backend.key_events(self._backend.button_code(button), 1, events)
+        self._backend.write(events)
+
+    def release(self, button):
+        events = []
+        self._backend.key_events(self._backend.button_code(button), 0, events)
+        self._backend.write(events)
+
+    def click(self, button, count=1):
+        code = self._backend.button_code(button)
+        events = []
+        for _ in range(count):
+            self._backend.key_events(code, 1, events)
+            self._backend.key_events(code, 0, events)
+        self._backend.write(events)
+
+
+class _UInputKeyboard:
+    """Interface de pynput.keyboard.Controller sobre o UInputBackend."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.backend = backend
+
+    def press(self, key):
+        events = []
+        self._backend.key_events(self._backend.key_code(key), 1, events)
+        self._backend.write(events)
+
+    def release(self, key):
+        events = []
+        self._backend.key_events(self._backend.key_code(key), 0, events)
+        self._backend.write(events)
+
+    def tap_chord(self, keys):
+        """Pressiona as teclas em ordem e solta na ordem inversa, em um write()."""
+        codes = [self._backend.key_code(key) for key in keys]
+        events = []
+        for code in codes:
+            self._backend.key_events(code, 1, events)
+        for code in reversed(codes):
+            self._backend.key_events(code, 0, events)
+        self._backend.write(events)
+
+    def type(self, text):
+        events = []
+        for char in text:
+            self._backend.char_events(char, events)
+        self._backend.write(events)
+
+
+# Nomes de teclas do pynput -> keysyms do X11
+_X_KEYSYMS = {
+    "shift": "Shift_L", "shift_l": "Shift_L", "shift_r": "Shift_R",
+    "ctrl": "Control_L", "ctrl_l": "Control_L", "ctrl_r": "Control_R",
+    "alt": "Alt_L", "alt_l": "Alt_L", "alt_r": "Alt_R", "alt_gr": "ISO_Level3_Shift",
+    "cmd": "Super_L", "cmd_l": "Super_L", "cmd_r": "Super_R",
+    "enter": "Return", "\n": "Return", "esc": "Escape", "backspace": "BackSpace",
+    "tab": "Tab", "\t": "Tab", "space": "space", "caps_lock": "Caps_Lock",
+    "delete": "Delete", "insert": "Insert", "home": "Home", "end": "End",
+    "page_up": "Prior", "page_down": "Next", "up": "Up", "down": "Down",
+    "left": "Left", "right": "Right", "menu": "Menu", "pause": "Pause",
+}
+_X_KEYSYMS.update({f"f{i}": f"F{i}" for i in range(1, 13)})
+
+X_BUTTONS = {"left": 1, "middle": 2, "right": 3}
+
+# immediate: um flush por evento (comportamento do pynput)
+# action:    um flush por chamada (mover, clicar, digitar um lote)
+# tick:      um flush por passo do agendador (antes de cada espera)
+# manual:    só em flush() explícito ou ao atingir max_pending
+XTEST_FLUSH_POLICIES = ("immediate", "action", "tick", "manual")
+
+
+class XTestBackend:
+    """
+    Injeção pelo XTest (python-xlib) com eventos acumulados no buffer.
+
+    O pynput faz uma ida e volta ao servidor X por press/release; aqui os
+    fake_input ficam no buffer da conexão e seguem juntos no flush, de
+    acordo com a política. Com "tick", mover + press + release de um passo
+    do agendador vão em um único envio. Soltar botões/teclas fora de um
+    clique sempre envia na hora (exceto em "manual"), para que um
+    _release_all nunca fique parado no buffer.
+    """
+
+    def __init__(self, display_name=None, flush_policy="tick", max_pending=64, sync=False):
+        if xdisplay is None:
+            raise OSError("python-xlib não está instalado")
+        if flush_policy not in XTEST_FLUSH_POLICIES:
+            raise ValueError(f"Política de flush inválida: {flush_policy}")
+        try:
+            self.display = xdisplay.Display(display_name)
+        except Exception as e:
+            raise OSError(f"Sem conexão com o servidor X: {e}") from e
+        if not self.display.has_extension("XTEST"):
+            self.display.close()
+            raise OSError("Servidor X sem a extensão XTEST")
+        self.flush_policy = flush_policy
+        self.max_pending = max_pending
+        # sync=True espera a confirmação do servidor (ida e volta) a cada flush
+        self.sync = sync
+        self.pending = 0
+        self.flushes = 0
+        self.events_sent = 0
+        self._lock = threading.RLock()
+        self._keycodes = {}
+        self._position = (0, 0)
+        self._shift = self.keycode("shift")[0]
+        self.mouse = _XTestMouse(self)
+        self.keyboard = _XTestKeyboard(self)
+
+    def fake(self, event_type, detail=0, x=0, y=0):
+        with self._lock:
+            xtest.fake_input(self.display, event_type, detail, x=x, y=y)
+            self.pending += 1
+            self.events_sent += 1
+            if self.flush_policy == "immediate" or self.pending >= self.max_pending:
+                self.flush()
+
+    def end_action(self, urgent=False):
+        """Fim de uma chamada do controlador: aplica a política de flush."""
+        if self.flush_policy == "action" or (urgent and self.flush_policy != "manual"):
+            self.flush()
+
+    def tick(self):
+        """Passo do agendador (chamado pelo MacroEngine antes de esperar)."""
+        if self.flush_policy != "manual":
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self.pending:
+                return
+            if self.sync:
+                self.display.sync()
+            else:
+                self.display.flush()
+            self.pending = 0
+            self.flushes += 1
+
+    def button_code(self, button):
+        name = _input_name(button)
+        try:
+            return X_BUTTONS[name]
+        except KeyError:
+            raise ValueError(f"Botão sem equivalente no X11: {name}") from None
+
+    def keycode(self, key):
+        """(keycode, precisa_de_shift) para uma tecla ou caractere, em cache."""
+        name = _input_name(key)
+        cached = self._keycodes.get(name)
+        if cached is not None:
+            return cached
+        if name in _X_KEYSYMS:
+            keysym = XK.string_to_keysym(_X_KEYSYMS[name])
+        elif len(name) == 1:
+            # Latin-1 tem keysym igual ao código; o resto usa o bloco Unicode
+            keysym = ord(name) if ord(name) < 0x100 else 0x01000000 | ord(name)
+        else:
+            keysym = XK.string_to_keysym(name)
+        keycode = self.display.keysym_to_keycode(keysym) if keysym else 0
+        if not keycode:
+            raise ValueError(f"Tecla sem keycode no servidor X: {name}")
+        cached = (keycode, self.display.keycode_to_keysym(keycode, 0) != keysym)
+        self._keycodes[name] = cached
+        return cached
+
+    def close(self):
+        with self._lock:
+            if self.display is not None:
+                self.flush()
+                self.display.close()
+                self.display = None
+
+
+class _XTestMouse:
+    """Interface de pynput.mouse.Controller sobre o XTestBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def position(self):
+        return self.backend._position
+
+    @position.setter
+    def position(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        self.backend._position = (x, y)
+        self.backend.fake(X.MotionNotify, x=x, y=y)
+        self.backend.end_action()
+
+    def press(self, button):
+        self.backend.fake(X.ButtonPress, self.backend.button_code(button))
+        self.backend.end_action()
+
+    def release(self, button):
+        self.backend.fake(X.ButtonRelease, self.backend.button_code(button))
+        self.backend.end_action(urgent=True)
+
+    def click(self, button, count=1):
+        code = self.backend.button_code(button)
+        for _ in range(count):
+            self.backend.fake(X.ButtonPress, code)
+            self.backend.fake(X.ButtonRelease, code)
+        self.backend.end_action()
+
+    def tick(self):
+        self.backend.tick()
+
+
+class _XTestKeyboard:
+    """Interface de pynput.keyboard.Controller sobre o XTestBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def press(self, key):
+        self.backend.fake(X.KeyPress, self.backend.keycode(key)[0])
+        self.backend.end_action()
+
+    def release(self, key):
+        self.backend.fake(X.KeyRelease, self.backend.keycode(key)[0])
+        self.backend.end_action(urgent=True)
+
+    def tap_chord(self, keys):
+        codes = [self.backend.keycode(key)[0] for key in keys]
+        for code in codes:
+            self.backend.fake(X.KeyPress, code)
+        for code in reversed(codes):
+            self.backend.fake(X.KeyRelease, code)
+        self.backend.end_action()
+
+    def type(self, text):
+        backend = self.backend
+        for char in text:
+            code, shift = backend.keycode(char)
+            if shift:
+                backend.fake(X.KeyPress, backend._shift)
+            backend.fake(X.KeyPress, code)
+            backend.fake(X.KeyRelease, code)
+            if shift:
+                backend.fake(X.KeyRelease, backend._shift)
+        backend.end_action()
+
+
+INPUT_BACKENDS = ("pynput", "uinput", "xtest")
+
+
+def create_controllers(backend="pynput", screen_size=(1920, 1080), device=None,
+                       flush_policy="tick", max_rate=None):
+    """Cria (mouse, teclado) para o backend de injeção escolhido.
+
+    Os dois registram o que está pressionado em um InputState
+    (mouse.input_state); com max_rate, passam também por um teto global
+    de injeções por segundo.
+    """
+    if backend == "uinput":
+        uinput = UInputBackend(device or UINPUT_PATH, screen_size)
+        mouse, keyboard = uinput.mouse, uinput.keyboard
+    elif backend == "xtest":
+        xlib = XTestBackend(flush_policy=flush_policy)
+        mouse, keyboard = xlib.mouse, xlib.keyboard
+    elif backend == "pynput":
+        mouse, keyboard = MouseController(), KeyboardController()
+    else:
+        raise ValueError(f"Backend de injeção desconhecido: {backend}")
+    mouse, keyboard = track_controllers(mouse, keyboard)
+    if max_rate:
+        return rate_limit_controllers(mouse, keyboard, max_rate)
+    return mouse, keyboard
+
+
+# ===== Janelas alvo (X11) =====
+
+def _window_title(display, window):
+    """_NET_WM_NAME (UTF-8) da janela, ou WM_NAME."""
+    net_name = window.get_full_property(display.intern_atom("_NET_WM_NAME"),
+                                        display.intern_atom("UTF8_STRING"))
+    if net_name is not None and net_name.value:
+        value = net_name.value
+        return value.decode("utf-8", "replace") if isinstance(value, bytes) else str(value)
+    name = window.get_wm_name()
+    return name.decode("latin-1") if isinstance(name, bytes) else name or ""
+
+
+def _window_matches(display, window, title, wm_class):
+    """title casa por trecho do título (sem diferenciar maiúsculas), wm_class pela instância ou classe."""
+    if wm_class:
+        names = window.get_wm_class()
+        if not names or wm_class.lower() not in (names[0].lower(), names[1].lower()):
+            return False
+    if title:
+        return title.lower() in _window_title(display, window).lower()
+    return True
+
+
+def _target_spec(spec):
+    """(title, class) de um spec {"title", "class"} da configuração."""
+    unknown = set(spec) - {"title", "class"}
+    if unknown:
+        raise ValueError(f"chaves desconhecidas na janela alvo: {', '.join(sorted(unknown))}")
+    if not spec.get("title") and not spec.get("class"):
+        raise ValueError("janela alvo sem title nem class")
+    return spec.get("title"), spec.get("class")
+
+
+def _window_origin(root, window):
+    """Canto superior esquerdo da janela em coordenadas da raiz."""
+    reply = root.translate_coords(window, 0, 0)
+    return reply.x, reply.y
+
+
+def window_under_pointer(display_name=None):
+    """(spec, origem) da janela de aplicativo sob o cursor, ou (None, None).
+
+    spec identifica a janela para o WindowTracker: a classe (WM_CLASS),
+    ou o título quando a janela não tem classe.
+    """
+    if xdisplay is None:
+        raise OSError("python-xlib não está instalado")
+    try:
+        display = xdisplay.Display(display_name)
+    except Exception as e:
+        raise OSError(f"Sem conexão com o servidor X: {e}") from e
+    try:
+        root = display.screen().root
+        window = root.query_pointer().child
+        # Desce das molduras do gerenciador de janelas até o cliente
+        while window:
+            wm_class = window.get_wm_class()
+            if wm_class:
+                return {"class": wm_class[1]}, _window_origin(root, window)
+            title = _window_title(display, window)
+            if title:
+                return {"title": title}, _window_origin(root, window)
+            window = window.query_pointer().child
+        return None, None
+    finally:
+        display.close()
+
+
+class WindowTracker:
+    """Geometria de uma janela X11, identificada por título e/ou classe.
+
+    Uma conexão própria com o servidor X, lida por uma thread, assina
+    StructureNotify na janela e nos ancestrais (molduras do gerenciador de
+    janelas): a geometria só é consultada de novo quando chega um
+    ConfigureNotify, ReparentNotify ou Map/Unmap, e vários eventos em
+    sequência (um arrasto) viram uma única consulta. O motor lê 'origin'
+    a cada ação, em O(1) e sem ida ao servidor; None enquanto a janela não
+    existe ou está minimizada. Sem a janela, a raiz é escutada
+    (SubstructureNotify) até ela aparecer.
+
+    title casa por trecho do título (sem diferenciar maiúsculas) e
+    wm_class pela instância ou classe de WM_CLASS; com os dois, ambos
+    precisam casar. Na configuração: {"title": ..., "class": ...}.
+    """
+
+    def __init__(self, title=None, wm_class=None, display_name=None):
+        if not title and not wm_class:
+            raise ValueError("janela alvo sem title nem class")
+        if xdisplay is None:
+            raise OSError("python-xlib não está instalado")
+        self.title = title
+        self.wm_class = wm_class
+        try:
+            self.display = xdisplay.Display(display_name)
+        except Exception as e:
+            raise OSError(f"Sem conexão com o servidor X: {e}") from e
+        self.root = self.display.screen().root
+        self.window = None
+        self.geometry = None  # (x, y, largura, altura) na raiz
+        self.origin = None
+        self.updates = 0  # Consultas de geometria feitas (uma por mudança)
+        self._watched = ()
+        self._client_list = self.display.intern_atom("_NET_CLIENT_LIST")
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = None
+        self._stopped = False
+        self._find()
+
+    @classmethod
+    def from_spec(cls, spec, display_name=None):
+        return cls(*_target_spec(spec), display_name)
+
+    def spec(self):
+        return {key: value for key, value in (("title", self.title), ("class", self.wm_class)) if value}
+
+    def describe(self):
+        return " / ".join(f"{key} '{value}'" for key, value in self.spec().items())
+
+    def resolve(self, x, y):
+        """Coordenada relativa à janela -> absoluta na tela (None sem a janela)."""
+        origin = self.origin
+        if origin is None:
+            return None
+        return x + origin[0], y + origin[1]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="window-tracker", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        os.write(self._wake_w, b"x")
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self.display.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _candidates(self):
+        """Janelas de aplicativo: _NET_CLIENT_LIST (EWMH) ou, sem ele, a árvore."""
+        clients = self.root.get_full_property(self._client_list, X.AnyPropertyType)
+        if clients is not None:
+            for window_id in clients.value:
+                yield self.display.create_resource_object("window", window_id)
+            return
+        # Sem gerenciador de janelas EWMH: clientes estão a até 3 níveis da raiz
+        level = self.root.query_tree().children
+        for _ in range(3):
+            below = []
+            for window in level:
+                yield window
+                below.extend(window.query_tree().children)
+            level = below
+
+    def _find(self):
+        """Procura a janela alvo; sem ela, passa a escutar a raiz."""
+        found = None
+        try:
+            for window in self._candidates():
+                try:
+                    if _window_matches(self.display, window, self.title, self.wm_class):
+                        found = window
+                        break
+                except xerror.XError:
+                    continue  # Janela destruída durante a busca
+        except xerror.XError:
+            pass
+        self.window = found
+        if found is None:
+            self.origin = self.geometry = None
+            self.root.change_attributes(event_mask=X.SubstructureNotifyMask | X.PropertyChangeMask)
+            return
+        self.root.change_attributes(event_mask=0)
+        self._subscribe()
+
+    def _subscribe(self):
+        """Assina StructureNotify na janela e nas molduras acima dela."""
+        chain = []
+        window = self.window
+        try:
+            while window is not None and window.id != self.root.id:
+                window.change_attributes(event_mask=X.StructureNotifyMask)
+                chain.append(window.id)
+                window = window.query_tree().parent
+        except xerror.XError:
+            self._find()
+            return
+        self._watched = frozenset(chain)
+        self._update_geometry()
+
+    def _update_geometry(self):
+        try:
+            if self.window.get_attributes().map_state != X.IsViewable:
+                self.origin = None
+                return
+            size = self.window.get_geometry()
+            x, y = _window_origin(self.root, self.window)
+        except xerror.XError:
+            self._find()
+            return
+        self.geometry = (x, y, size.width, size.height)
+        self.updates += 1
+        # Uma única atribuição: o motor lê a tupla inteira ou a anterior
+        self.origin = (x, y)
+
+    def _run(self):
+        display = self.display
+        fd = display.fileno()
+        while not self._stopped:
+            try:
+                if not display.pending_events():
+                    readable, _, _ = select.select([fd, self._wake_r], [], [])
+                    if self._wake_r in readable:
+                        return
+                find = resubscribe = geometry = False
+                # Esvazia a fila antes de consultar: um arrasto vira uma consulta
+                while display.pending_events():
+                    event = display.next_event()
+                    if self.window is None:
+                        find = True
+                        continue
+                    window_id = getattr(event, "window", None)
+                    window_id = getattr(window_id, "id", window_id)
+                    if event.type == X.DestroyNotify and window_id == self.window.id:
+                        find = True
+                    elif event.type in (X.ReparentNotify, X.DestroyNotify):
+                        resubscribe = True
+                    elif event.type in (X.ConfigureNotify, X.MapNotify, X.UnmapNotify):
+                        geometry = True
+                if find:
+                    self._find()
+                elif resubscribe:
+                    self._subscribe()
+                elif geometry:
+                    self._update_geometry()
+            except Exception as e:
+                if self._stopped:
+                    return
+                print(f"Rastreamento da janela alvo interrompido: {e}")
+                self.origin = None
+                return
+
+
+class FocusGuard:
+    """Avisa quando a janela ativa passa a ser (ou deixa de ser) a janela alvo.
+
+    Como o WindowTracker, tem conexão e thread próprias: assina
+    PropertyNotify na raiz e só reavalia quando o gerenciador de janelas
+    troca _NET_ACTIVE_WINDOW (ou, casando por título, quando o título da
+    janela ativa muda); nada é consultado por clique. callback(focused) é
+    chamado na thread do guarda, apenas nas transições; 'focused' tem o
+    estado atual. Exige um gerenciador de janelas EWMH.
+    """
+
+    def __init__(self, callback, title=None, wm_class=None, display_name=None):
+        if not title and not wm_class:
+            raise ValueError("janela alvo sem title nem class")
+        if xdisplay is None:
+            raise OSError("python-xlib não está instalado")
+        self.callback = callback
+        self.title = title
+        self.wm_class = wm_class
+        try:
+            self.display = xdisplay.Display(display_name)
+        except Exception as e:
+            raise OSError(f"Sem conexão com o servidor X: {e}") from e
+        self.root = self.display.screen().root
+        self._active_atom = self.display.intern_atom("_NET_ACTIVE_WINDOW")
+        self._title_atoms = {self.display.intern_atom("_NET_WM_NAME"), self.display.intern_atom("WM_NAME")}
+        if self.root.get_full_property(self._active_atom, X.AnyPropertyType) is None:
+            self.display.close()
+            raise OSError("o gerenciador de janelas não publica _NET_ACTIVE_WINDOW")
+        self.root.change_attributes(event_mask=X.PropertyChangeMask)
+        self.active = None  # Janela ativa (a que teve o título assinado)
+        self.focused = False
+        self.changes = 0  # Transições avisadas
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = None
+        self._stopped = False
+        self._evaluate(notify=False)
+
+    @classmethod
+    def from_spec(cls, spec, callback, display_name=None):
+        return cls(callback, *_target_spec(spec), display_name)
+
+    def spec(self):
+        return {key: value for key, value in (("title", self.title), ("class", self.wm_class)) if value}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="focus-guard", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        os.write(self._wake_w, b"x")
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self.display.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _active_window(self):
+        prop = self.root.get_full_property(self._active_atom, X.AnyPropertyType)
+        if prop is None or not len(prop.value) or not prop.value[0]:
+            return None
+        return self.display.create_resource_object("window", prop.value[0])
+
+    def _evaluate(self, notify=True):
+        """Relê a janela ativa e avisa se o foco na janela alvo mudou."""
+        window = self._active_window()
+        if window != self.active:
+            # O título só importa na janela ativa: assina só nela
+            try:
+                if self.active is not None and self.title:
+                    self.active.change_attributes(event_mask=0)
+                if window is not None and self.title:
+                    window.change_attributes(event_mask=X.PropertyChangeMask)
+            except xerror.XError:
+                pass
+            self.active = window
+        try:
+            focused = window is not None and _window_matches(self.display, window, self.title, self.wm_class)
+        except xerror.XError:
+            focused = False  # Janela ativa destruída no caminho
+        if focused != self.focused:
+            self.focused = focused
+            self.changes += 1
+            if notify:
+                self.callback(focused)
+
+    def _run(self):
+        display = self.display
+        fd = display.fileno()
+        while not self._stopped:
+            try:
+                if not display.pending_events():
+                    readable, _, _ = select.select([fd, self._wake_r], [], [])
+                    if self._wake_r in readable:
+                        return
+                changed = False
+                # Esvazia a fila: um alt-tab (várias trocas seguidas) vira uma avaliação
+                while display.pending_events():
+                    event = display.next_event()
+                    if event.type != X.PropertyNotify:
+                        continue
+                    if event.atom == self._active_atom or event.atom in self._title_atoms:
+                        changed = True
+                if changed:
+                    self._evaluate()
+            except Exception as e:
+                if self._stopped:
+                    return
+                print(f"Vigia de foco da janela alvo interrompido: {e}")
+                return
+
+
+# ===== Monitores e mapeamento de coordenadas =====
+
+class Monitor:
+    """Um monitor em pixels físicos (o espaço de coordenadas da injeção)."""
+    __slots__ = ("name", "x", "y", "width", "height", "scale")
+
+    def __init__(self, name, x, y, width, height, scale=1.0):
+        if width <= 0 or height <= 0:
+            raise ValueError(f"monitor {name!r} com tamanho inválido: {width}x{height}")
+        self.name = str(name)
+        self.x, self.y = int(x), int(y)
+        self.width, self.height = int(width), int(height)
+        self.scale = float(scale)
+
+    def key(self):
+        return (self.name, self.x, self.y, self.width, self.height, self.scale)
+
+    def distance(self, x, y):
+        """0 dentro do monitor; senão, a distância (Chebyshev) até a borda."""
+        dx = max(self.x - x, 0, x - (self.x + self.width - 1))
+        dy = max(self.y - y, 0, y - (self.y + self.height - 1))
+        return max(dx, dy)
+
+    def __repr__(self):
+        return f"Monitor({self.name!r}, {self.x}, {self.y}, {self.width}x{self.height}, escala {self.scale:g})"
+
+
+class MonitorLayout:
+    """Disposição dos monitores; o primeiro é o principal.
+
+    Gravada junto de cada alvo capturado (to_json/from_json) para que a
+    coordenada possa ser remapeada se monitores, resoluções ou escalas
+    mudarem até a reprodução. A escala (DPI / 96) só converte a geometria
+    lógica da GUI para pixels físicos; os alvos são normalizados em pixels
+    físicos, na mesma base do pynput, uinput e XTest.
+    """
+
+    def __init__(self, monitors):
+        self.monitors = tuple(monitors)
+        if not self.monitors:
+            raise ValueError("layout sem monitores")
+        self._by_name = {}
+        for index, monitor in enumerate(self.monitors):
+            self._by_name.setdefault(monitor.name, index)
+
+    @classmethod
+    def single(cls, width, height, name="tela"):
+        return cls([Monitor(name, 0, 0, width, height)])
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(Monitor(m["name"], m["x"], m["y"], m["width"], m["height"], m.get("scale", 1.0))
+                   for m in data)
+
+    def to_json(self):
+        return [{"name": m.name, "x": m.x, "y": m.y, "width": m.width, "height": m.height,
+                 "scale": m.scale} for m in self.monitors]
+
+    def monitor_at(self, x, y):
+        """Índice do monitor que contém o ponto (ou do mais próximo)."""
+        return min(range(len(self.monitors)), key=lambda i: self.monitors[i].distance(x, y))
+
+    def index_for(self, name, index):
+        """Correspondente de um monitor de outro layout: mesmo nome, mesma posição ou o principal."""
+        if name in self._by_name:
+            return self._by_name[name]
+        return index if 0 <= index < len(self.monitors) else 0
+
+    def normalize(self, x, y):
+        """Alvo normalizado: monitor (nome e índice) e fração (u, v) dentro dele."""
+        index = self.monitor_at(x, y)
+        monitor = self.monitors[index]
+        u = min(max((x - monitor.x + 0.5) / monitor.width, 0.0), 1.0)
+        v = min(max((y - monitor.y + 0.5) / monitor.height, 0.0), 1.0)
+        return {"monitor": monitor.name, "index": index, "u": u, "v": v}
+
+    def __eq__(self, other):
+        return isinstance(other, MonitorLayout) and [m.key() for m in self.monitors] == \
+            [m.key() for m in other.monitors]
+
+    def __hash__(self):
+        return hash(tuple(m.key() for m in self.monitors))
+
+    def __repr__(self):
+        return f"MonitorLayout({list(self.monitors)!r})"
+
+
+class CoordinateMapper:
+    """Transformações afins, por monitor, do layout da captura para o atual.
+
+    Calculadas uma vez na construção (ao mudar o layout, cria-se outro
+    mapper); cada mapeamento é só uma consulta por índice e duas
+    multiplicações, e acontece ao montar o programa, nunca no laço do
+    motor. Cada monitor da captura vai para o monitor atual de mesmo nome,
+    ou de mesma posição na lista, ou para o principal.
+    """
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        # Por monitor da captura: x' = x0 + w * u, y' = y0 + h * v, limitados ao monitor destino
+        self.transforms = []
+        for index, monitor in enumerate(source.monitors):
+            dest = target.monitors[target.index_for(monitor.name, index)]
+            self.transforms.append((dest.x, dest.width, dest.x + dest.width - 1,
+                                    dest.y, dest.height, dest.y + dest.height - 1))
+
+    def map_target(self, target):
+        """Alvo normalizado (MonitorLayout.normalize) -> coordenada física atual."""
+        x0, w, x1, y0, h, y1 = self.transforms[self.source.index_for(target["monitor"], target["index"])]
+        return min(int(x0 + w * target["u"]), x1), min(int(y0 + h * target["v"]), y1)
+
+
+def _read_monitor_layout(display):
+    """Layout pelo RandR 1.5 numa conexão aberta, ou None sem RandR."""
+    if not display.has_extension("RANDR"):
+        return None
+    monitors = []
+    for info in display.screen().root.xrandr_get_monitors().monitors:
+        scale = 1.0
+        if info.width_in_millimeters:
+            # DPI arredondado para quartos de 96 (1.0, 1.25, 1.5, ...)
+            dpi = info.width_in_pixels / (info.width_in_millimeters / 25.4)
+            scale = max(1.0, round(dpi / 96 * 4) / 4)
+        monitor = Monitor(display.get_atom_name(info.name), info.x, info.y,
+                          info.width_in_pixels, info.height_in_pixels, scale)
+        # O principal vem primeiro (MonitorLayout)
+        if info.primary:
+            monitors.insert(0, monitor)
+        else:
+            monitors.append(monitor)
+    return MonitorLayout(monitors) if monitors else None
+
+
+def x11_monitor_layout(display_name=None):
+    """Layout atual pelo RandR 1.5 (python-xlib), ou None se indisponível."""
+    if xdisplay is None:
+        return None
+    try:
+        display = xdisplay.Display(display_name)
+    except Exception:
+        return None
+    try:
+        return _read_monitor_layout(display)
+    except Exception:
+        return None
+    finally:
+        display.close()
+
+
+class MonitorWatcher:
+    """Avisa quando a disposição dos monitores muda (X11, RandR).
+
+    Como o FocusGuard, tem conexão e thread próprias: assina na raiz os
+    eventos do RandR (tela, CRTCs e saídas) e só relê o layout quando um
+    chega; a rajada de eventos de uma troca de modo vira uma leitura.
+    callback(layout) é chamado na thread do vigia, apenas quando o layout
+    de fato muda; 'layout' tem o atual.
+    """
+
+    def __init__(self, callback, display_name=None):
+        if xdisplay is None:
+            raise OSError("python-xlib não está instalado")
+        self.callback = callback
+        try:
+            self.display = xdisplay.Display(display_name)
+        except Exception as e:
+            raise OSError(f"Sem conexão com o servidor X: {e}") from e
+        try:
+            self.layout = _read_monitor_layout(self.display)
+            if self.layout is None:
+                raise OSError("o servidor X não tem a extensão RANDR")
+            self.display.screen().root.xrandr_select_input(
+                randr.RRScreenChangeNotifyMask | randr.RRCrtcChangeNotifyMask | randr.RROutputChangeNotifyMask
+            )
+        except OSError:
+            self.display.close()
+            raise
+        except Exception as e:
+            self.display.close()
+            raise OSError(f"RandR 1.5 indisponível: {e}") from e
+        self.changes = 0  # Mudanças avisadas
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="monitor-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        os.write(self._wake_w, b"x")
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self.display.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _run(self):
+        display = self.display
+        fd = display.fileno()
+        while not self._stopped:
+            try:
+                if not display.pending_events():
+                    readable, _, _ = select.select([fd, self._wake_r], [], [])
+                    if self._wake_r in readable:
+                        return
+                # Nesta conexão só chegam eventos do RandR: esvazia a fila e relê uma vez
+                while display.pending_events():
+                    display.next_event()
+                layout = _read_monitor_layout(display)
+                if layout is not None and layout != self.layout:
+                    self.layout = layout
+                    self.changes += 1
+                    self.callback(layout)
+            except Exception as e:
+                if self._stopped:
+                    return
+                print(f"Vigia de monitores interrompido: {e}")
+                return
+
+
+# ===== Motor em processo separado =====
+
+def _engine_process_main(conn, backend, screen_size, device, flush_policy, max_rate=None):
+    """Laço do processo do motor: recebe comandos pelo pipe e executa."""
+    try:
+        mouse, keyboard = create_controllers(backend, screen_size, device, flush_policy, max_rate)
+    except (OSError, ValueError) as e:
+        print(f"Backend de injeção '{backend}' indisponível no processo do motor ({e}); usando pynput")
+        mouse, keyboard = create_controllers("pynput", max_rate=max_rate)
+    metrics = MacroMetrics()
+    send_lock = threading.Lock()
+    engine = worker = None
+    # WindowTracker por janela alvo, mantidos entre execuções
+    trackers = {}
+
+    def send(*message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass
+
+    def execute(run_id, engine, program, requested_at, limits):
+        error = None
+        try:
+            reason = engine.run(program, requested_at, limits)
+        except Exception as e:
+            reason, error = "stopped", f"{type(e).__name__}: {e}"
+        send("finished", run_id, reason, error, metrics.snapshot())
+
+    while True:
+        try:
+            if not conn.poll(0.5):
+                if worker is not None and worker.is_alive():
+                    send("metrics", metrics.snapshot())
+                continue
+            command, *args = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if command == "run":
+            run_id, program, requested_at, scheduling, limits, failsafe, window = args
+            if engine is not None:
+                engine.stop()
+                worker.join()
+            if window:
+                key = tuple(sorted(window.items()))
+                try:
+                    if key not in trackers:
+                        trackers[key] = WindowTracker.from_spec(window).start()
+                except (OSError, ValueError) as e:
+                    engine = None
+                    send("finished", run_id, "stopped", f"Janela alvo: {e}", metrics.snapshot())
+                    continue
+                window = trackers[key]
+            engine = MacroEngine(
+                mouse, keyboard, metrics,
+                status_callback=lambda text, run_id=run_id: send("status", run_id, text),
+                scheduling=scheduling, failsafe=failsafe, window=window
+            )
+            worker = threading.Thread(
+                target=execute, args=(run_id, engine, program, requested_at, limits), daemon=True
+            )
+            worker.start()
+        elif command == "stop" and engine is not None:
+            engine.stop()
+        elif command == "replace" and engine is not None:
+            engine.replace_program(args[0])
+        elif command == "release" and engine is not None:
+            engine.release_all()
+        elif command == "exit":
+            break
+
+    if engine is not None:
+        engine.stop()
+        engine.release_all()
+    for tracker in trackers.values():
+        tracker.stop()
+
+
+class RemoteEngine:
+    """Uma execução no EngineProcess, com a mesma interface do MacroEngine."""
+
+    def __init__(self, process, run_id, status_callback=None, scheduling=None, failsafe=None,
+                 window=None):
+        self.process = process
+        self.run_id = run_id
+        self.status_callback = status_callback
+        self.scheduling = scheduling
+        # O Watchdog e o WindowTracker rodam no processo do motor
+        self.failsafe = failsafe
+        self.window = window
+        self.reason = None
+        self.error = None
+        self._done = threading.Event()
+
+    def run(self, program, requested_at=None, limits=None):
+        """Envia o programa ao processo do motor e espera o fim da execução."""
+        # Registrada só agora: uma sessão criada e nunca executada não fica
+        # presa em _sessions até o processo morrer
+        self.process._sessions[self.run_id] = self
+        # perf_counter usa um relógio monotônico do sistema, comparável
+        # entre processos, então a latência do hotkey continua válida
+        if not self.process.send("run", self.run_id, program, requested_at, self.scheduling, limits,
+                                 self.failsafe, self.window):
+            self.process._sessions.pop(self.run_id, None)
+            return "stopped"
+        # O leitor libera as sessões quando o processo morre; a checagem
+        # periódica cobre a morte antes do registro
+        while not self._done.wait(0.5):
+            if not self.process.alive:
+                self.process._sessions.pop(self.run_id, None)
+                return "stopped"
+        if self.error:
+            raise RuntimeError(f"Erro no processo do motor: {self.error}")
+        return self.reason
+
+    def stop(self):
+        self.process.send("stop")
+
+    def replace_program(self, program):
+        self.process.send("replace", program)
+
+    def release_all(self):
+        self.process.send("release")
+
+    def _finish(self, reason, error=None):
+        self.reason = reason
+        self.error = error
+        self._done.set()
+
+
+class EngineProcess:
+    """
+    MacroEngine executado em outro processo (multiprocessing).
+
+    A GUI vira apenas controladora: comandos vão por um Pipe e o processo
+    do motor devolve status, fim de execução e snapshots de métricas, que
+    são incorporados ao MacroMetrics local. Assim o laço de cliques não
+    disputa o GIL com o Qt/Tk, folhas de estilo ou diálogos.
+    """
+
+    def __init__(self, metrics=None, backend="pynput", screen_size=(1920, 1080), device=None,
+                 flush_policy="tick", max_rate=None):
+        self.metrics = metrics if metrics is not None else MacroMetrics()
+        self._args = (backend, screen_size, device, flush_policy, max_rate)
+        self._process = None
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self._sessions = {}
+        self._next_run = 0
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.alive:
+            return
+        import multiprocessing
+
+        # spawn: o filho não herda threads nem o estado da GUI
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_engine_process_main, args=(child_conn, *self._args),
+            name="macro-engine", daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        threading.Thread(target=self._read, args=(self._conn,), daemon=True).start()
+
+    def session(self, status_callback=None, scheduling=None, failsafe=None, window=None):
+        """Prepara uma execução; o processo é (re)iniciado se necessário.
+
+        window é o spec da janela alvo ({"title", "class"}), não o tracker.
+        """
+        self.start()
+        self._next_run += 1
+        return RemoteEngine(self, self._next_run, status_callback, scheduling, failsafe, window)
+
+    def send(self, *message):
+        with self._send_lock:
+            if self._conn is None:
+                return False
+            try:
+                self._conn.send(message)
+                return True
+            except (OSError, EOFError, ValueError):
+                return False
+
+    def _read(self, conn):
+        while True:
+            try:
+                kind, *args = conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "status":
+                session = self._sessions.get(args[0])
+                if session and session.status_callback:
+                    session.status_callback(args[1])
+            elif kind == "metrics":
+                self.metrics.absorb(args[0])
+            elif kind == "finished":
+                run_id, reason, error, snapshot = args
+                self.metrics.absorb(snapshot)
+                session = self._sessions.pop(run_id, None)
+                if session:
+                    session._finish(reason, error)
+        # Processo morreu ou foi fechado: liberar quem espera
+        for session in list(self._sessions.values()):
+            session._finish("stopped")
+        self._sessions.clear()
+
+    def close(self, timeout=2.0):
+        process, conn = self._process, self._conn
+        if process is None:
+            return
+        self.send("exit")
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+        with self._send_lock:
+            self._conn = None
+        conn.close()
+        self._process = None
+
+
+# ===== API asyncio =====
+
+_injection_executor = None
+_injection_executor_lock = threading.Lock()
+
+
+def injection_executor():
+    """Executor de uma thread, compartilhado, para as injeções do AsyncMacroEngine."""
+    global _injection_executor
+    with _injection_executor_lock:
+        if _injection_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _injection_executor = ThreadPoolExecutor(1, thread_name_prefix="macro-inject")
+        return _injection_executor
+
+
+class AsyncMacroEngine:
+    """Fachada asyncio do motor, para embutir o macro em serviços próprios.
+
+        engine = AsyncMacroEngine(mouse, keyboard)
+        task = asyncio.create_task(engine.run("repeat 10\\n click\\n wait 100\\nend"))
+        async for kind, data in engine.events():
+            ...  # ("state", "running"|"paused"), ("status", texto), ("finished", motivo)
+
+    As esperas são timers do laço de eventos; cada passo de trilha (as
+    chamadas de injeção, que bloqueiam) roda no executor, pela API de
+    passos do MacroEngine (begin_tracks/step). Assim milhares de macros
+    concorrentes dividem uma thread de injeção em vez de uma thread cada.
+    pause(), resume() e stop() devem ser chamados na thread do laço. Não
+    depende de Tk nem de PyQt6.
+
+    O tempo vem do relógio do motor: com um VirtualClock, quando todas as
+    trilhas estão esperando, o relógio salta para o próximo prazo (e
+    dispara os call_at do caminho), então horas de agenda rodam em
+    milissegundos. Trilhas pausadas não contam como esperando: com o
+    relógio virtual, pausar todas congela o tempo até resume().
+    """
+
+    def __init__(self, mouse=None, keyboard=None, metrics=None, pixel_reader=None, executor=None,
+                 clock=None):
+        self.engine = MacroEngine(mouse, keyboard, metrics, pixel_reader, status_callback=self._on_status,
+                                  clock=clock)
+        self.metrics = self.engine.metrics
+        self.executor = executor or injection_executor()
+        self.paused = False
+        self._loop = None
+        self._resume = None
+        self._tasks = ()
+        self._stopping = False
+        self._listeners = set()
+        # Relógio virtual: trilhas ainda ativas e quantas esperam um prazo
+        self._active = 0
+        self._sleeping = 0
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    async def run(self, plan, requested_at=None):
+        """Executa um MacroProgram, TrackSet ou texto de script. Retorna o motivo do fim."""
+        if self._tasks:
+            raise RuntimeError("o motor já está em execução")
+        if isinstance(plan, str):
+            plan = ScriptCompiler.compile(plan)
+        tracks = plan if isinstance(plan, TrackSet) else TrackSet([(plan.name or "macro", plan)], plan.name)
+
+        engine = self.engine
+        states = engine.begin_tracks(tracks, requested_at)
+        self._loop = asyncio.get_running_loop()
+        self._resume = asyncio.Event()
+        if not self.paused:
+            self._resume.set()
+        self._stopping = False
+        self._active = len(states)
+        self._sleeping = 0
+        self._tasks = [asyncio.ensure_future(self._run_track(track)) for track in states]
+        self._publish("state", "paused" if self.paused else "running")
+
+        reason = "error"
+        try:
+            await asyncio.gather(*self._tasks)
+            reason = "finished"
+        except asyncio.CancelledError:
+            reason = "stopped"
+            if not self._stopping:
+                raise
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            self._tasks = ()
+            engine.running = False
+            # Executor de uma thread: roda depois de qualquer passo em andamento
+            self.executor.submit(engine.release_program_inputs, tracks)
+            self.executor.submit(engine.flush)
+            # Também em erro: quem itera events() sempre recebe o fim
+            self._publish("finished", reason)
+        return reason
+
+    async def _run_track(self, track):
+        loop = self._loop
+        engine = self.engine
+        clock = engine.clock
+        metrics = self.metrics
+        try:
+            due = clock.now()
+            while True:
+                if not self._resume.is_set():
+                    await self._resume.wait()
+                    due = clock.now()  # Retoma do agora, sem rajada
+                due = await loop.run_in_executor(self.executor, engine.step, track, due)
+                if due is None:
+                    return
+                if due > clock.now():
+                    await loop.run_in_executor(self.executor, engine.flush)
+                    await self._sleep_until(due)
+                    metrics.observe("sleep_overshoot_ms", max(0.0, (clock.now() - due) * 1000))
+        finally:
+            self._active -= 1
+            self._advance_virtual()
+
+    async def _sleep_until(self, due):
+        clock = self.engine.clock
+        if not clock.virtual:
+            await asyncio.sleep(due - clock.now())
+            return
+        wake = self._loop.create_future()
+
+        def ring():
+            # Conta como acordada já no disparo, antes de a tarefa rodar,
+            # para o próximo salto não passar por cima dela
+            if wake.cancelled():
+                return
+            self._sleeping -= 1
+            wake.set_result(None)
+
+        clock.call_at(due, ring)
+        self._sleeping += 1
+        self._advance_virtual()
+        try:
+            await wake
+        except asyncio.CancelledError:
+            if wake.cancelled():
+                self._sleeping -= 1
+            raise
+
+    def _advance_virtual(self):
+        """Relógio virtual: com todas as trilhas ativas esperando, salta para o próximo prazo."""
+        if self.engine.clock.virtual and self._tasks and self._sleeping and self._sleeping >= self._active:
+            self.engine.clock.advance_to_next()
+
+    def pause(self):
+        """Suspende as trilhas (antes do próximo passo) e solta as entradas."""
+        if self.paused:
+            return
+        self.paused = True
+        if self._resume is not None:
+            self._resume.clear()
+        if self._tasks:
+            self.executor.submit(self.engine.release_program_inputs, self.engine.program)
+            self._publish("state", "paused")
+
+    def resume(self):
+        if not self.paused:
+            return
+        self.paused = False
+        if self._resume is not None:
+            self._resume.set()
+        if self._tasks:
+            self._publish("state", "running")
+
+    def stop(self):
+        """Interrompe a execução; run() retorna "stopped"."""
+        if self._tasks:
+            self._stopping = True
+            for task in self._tasks:
+                task.cancel()
+
+    async def events(self):
+        """Itera os eventos de estado e status a partir da inscrição, até o "finished" da execução."""
+        events = asyncio.Queue()
+        self._listeners.add(events)
+        try:
+            while True:
+                kind, data = await events.get()
+                yield kind, data
+                if kind == "finished":
+                    return
+        finally:
+            self._listeners.discard(events)
+
+    def _publish(self, kind, data):
+        for events in tuple(self._listeners):
+            events.put_nowait((kind, data))
+
+    def _on_status(self, message):
+        # Chamado na thread do executor
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._publish, "status", message)
+
+
+# ===== Hotkeys: acordes e sequências =====
+
+MOD_CTRL = 1
+MOD_SHIFT = 2
+MOD_ALT = 4
+MOD_CMD = 8
+
+MODIFIER_NAMES = {"ctrl": MOD_CTRL, "shift": MOD_SHIFT, "alt": MOD_ALT, "cmd": MOD_CMD}
+
+_MODIFIER_VARIANTS = {
+    MOD_CTRL: ("ctrl", "ctrl_l", "ctrl_r"),
+    MOD_SHIFT: ("shift", "shift_l", "shift_r"),
+    MOD_ALT: ("alt", "alt_l", "alt_r", "alt_gr"),
+    MOD_CMD: ("cmd", "cmd_l", "cmd_r"),
+}
+
+_NO_VK = object()
+
+
+class HotkeyMatcher:
+    """Reconhece hotkeys (teclas, acordes e sequências) com um autômato pré-compilado.
+
+    Especificações: "f1", "ctrl+shift+x" (acorde) ou "g g" (sequência de
+    passos separados por espaço; cada passo pode ser um acorde). Tudo é
+    resolvido na compilação para identificadores inteiros, e cada evento do
+    listener custa algumas consultas a dicionário: sem varrer listas e sem
+    montar strings por tecla.
+
+    Um hotkey sem modificadores continua disparando com modificadores
+    pressionados (como antes), a menos que exista um acorde específico.
+    """
+
+    def __init__(self, triggers, sequence_timeout=1.0):
+        self.sequence_timeout = sequence_timeout
+        self.mods = 0
+        self._state = 0
+        self._state_time = 0.0
+
+        self._modifier_bits = {}
+        self._special_ids = {}  # objetos Key -> id
+        self._char_ids = {}     # caractere -> id
+        self._vk_ids = {}       # código virtual -> id
+        self._transitions = {}  # (estado << 20 | mods << 16 | id) -> estado
+        self._accept = {}       # estado -> nome do trigger
+
+        if Key is not None:
+            for bit, names in _MODIFIER_VARIANTS.items():
+                for name in names:
+                    if hasattr(Key, name):
+                        self._modifier_bits[getattr(Key, name)] = bit
+        else:
+            for bit, names in _MODIFIER_VARIANTS.items():
+                for name in names:
+                    self._modifier_bits[name] = bit
+
+        states = 1
+        for name, spec in triggers.items():
+            state = 0
+            steps = self.parse(spec)
+            for i, (mods, key) in enumerate(steps):
+                code = (state << 20) | (mods << 16) | self._register_key(key)
+                nxt = self._transitions.get(code)
+                if nxt is None:
+                    nxt = states
+                    states += 1
+                    self._transitions[code] = nxt
+                state = nxt
+                if state in self._accept and i < len(steps) - 1:
+                    print(f"Aviso: hotkey '{spec}' nunca dispara ('{self._accept[state]}' é prefixo)")
+            if state in self._accept:
+                print(f"Aviso: hotkey '{spec}' duplicado, '{self._accept[state]}' será substituído")
+            self._accept[state] = name
+
+    @staticmethod
+    def parse(spec):
+        """Converte 'ctrl+shift+x' / 'g g' em [(bits de modificador, tecla), ...]."""
+        steps = []
+        for step in str(spec).strip().lower().split():
+            parts = ["+"] if step == "+" else step.split("+")
+            mods = 0
+            for part in parts[:-1]:
+                part = KEY_ALIASES.get(part, part)
+                if part not in MODIFIER_NAMES:
+                    raise ValueError(f"modificador desconhecido em '{spec}': {part}")
+                mods |= MODIFIER_NAMES[part]
+            steps.append((mods, resolve_key(parts[-1])))
+        if not steps:
+            raise ValueError("hotkey vazio")
+        return steps
+
+    def _register_key(self, key):
+        """Atribui um id inteiro à tecla e a todas as formas em que ela chega."""
+        if isinstance(key, str) and len(key) == 1:
+            kid = self._char_ids.get(key)
+            if kid is None:
+                kid = len(self._char_ids) + len(self._special_ids) + 1
+                # Com Shift o listener entrega a maiúscula; com Ctrl, letras
+                # chegam como caracteres de controle (ctrl+x -> '\x18')
+                variants = {key, key.lower(), key.upper()}
+                if key.isalpha() and key.isascii():
+                    variants.add(chr(ord(key.lower()) - 96))
+                    self._vk_ids[ord(key.upper())] = kid
+                elif key.isdigit():
+                    self._vk_ids[ord(key)] = kid
+                for variant in variants:
+                    self._char_ids[variant] = kid
+            return kid
+
+        kid = self._special_ids.get(key)
+        if kid is None:
+            kid = len(self._char_ids) + len(self._special_ids) + 1
+            self._special_ids[key] = kid
+        return kid
+
+    def reset(self):
+        self.mods = 0
+        self._state = 0
+
+    def _key_id(self, key):
+        vk = getattr(key, "vk", _NO_VK)
+        if vk is _NO_VK:
+            # Key (enum) ou string: hash barato
+            return self._special_ids.get(key) or self._char_ids.get(key)
+        # KeyCode: evitar hash(KeyCode), que monta repr() a cada chamada
+        char = key.char
+        if char is not None:
+            kid = self._char_ids.get(char)
+            if kid is not None:
+                return kid
+        return self._vk_ids.get(vk)
+
+    def feed_press(self, key):
+        """Processa uma tecla pressionada; retorna o nome do trigger ou None."""
+        bit = self._modifier_bits.get(key) if getattr(key, "vk", _NO_VK) is _NO_VK else None
+        if bit:
+            self.mods |= bit
+            return None
+
+        kid = self._key_id(key)
+        if kid is None:
+            self._state = 0
+            return None
+
+        state = self._state
+        if state and time.perf_counter() - self._state_time > self.sequence_timeout:
+            state = 0
+
+        transitions = self._transitions
+        nxt = transitions.get((state << 20) | (self.mods << 16) | kid)
+        if nxt is None:
+            nxt = transitions.get((state << 20) | kid)
+        if nxt is None and state:
+            # Sequência interrompida: tentar de novo a partir da raiz
+            nxt = transitions.get((self.mods << 16) | kid) or transitions.get(kid)
+
+        if nxt is None:
+            self._state = 0
+            return None
+
+        name = self._accept.get(nxt)
+        if name is not None:
+            self._state = 0
+            return name
+        self._state = nxt
+        self._state_time = time.perf_counter()
+        return None
+
+    def feed_release(self, key):
+        bit = self._modifier_bits.get(key) if getattr(key, "vk", _NO_VK) is _NO_VK else None
+        if bit:
+            self.mods &= ~bit
+
+
+# ===== Hooks globais de entrada =====
+
+class OnDemandHook:
+    """
+    Hook global instalado apenas enquanto alguém precisa dele.
+
+    Cada interessado chama acquire(motivo) e release(motivo) ("capture",
+    "record", ...). O listener é criado pela factory na primeira aquisição e
+    parado na última liberação: fora desses períodos nenhum evento do
+    desktop passa por callbacks Python.
+    """
+
+    def __init__(self, factory, name="mouse", metrics=None):
+        self._factory = factory
+        self.name = name
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._holders = {}
+        self._listener = None
+        self._installed_at = 0.0
+        self.installs = 0
+        self.active_seconds = 0.0
+
+    @property
+    def active(self):
+        return self._listener is not None
+
+    def holders(self):
+        with self._lock:
+            return set(self._holders)
+
+    def acquire(self, reason):
+        """Registra um interessado; instala o hook se for o primeiro."""
+        with self._lock:
+            if self._listener is None:
+                try:
+                    listener = self._factory()
+                    listener.start()
+                except Exception as e:
+                    print(f"Erro ao instalar hook de {self.name}: {e}")
+                    return False
+                self._listener = listener
+                self._installed_at = time.perf_counter()
+                self.installs += 1
+                if self.metrics:
+                    self.metrics.inc(f"{self.name}_hook_installs_total")
+            self._holders[reason] = self._holders.get(reason, 0) + 1
+        self._publish()
+        return True
+
+    def release(self, reason):
+        """Remove um interessado; desinstala o hook quando não resta nenhum."""
+        with self._lock:
+            count = self._holders.get(reason, 0)
+            if count > 1:
+                self._holders[reason] = count - 1
+                return
+            self._holders.pop(reason, None)
+            if self._holders or self._listener is None:
+                return
+            listener, self._listener = self._listener, None
+            self.active_seconds += time.perf_counter() - self._installed_at
+        # stop() pode ser chamado de dentro do próprio callback do listener
+        try:
+            listener.stop()
+        except Exception as e:
+            print(f"Erro ao remover hook de {self.name}: {e}")
+        self._publish()
+
+    def close(self):
+        """Remove o hook independentemente dos interessados (encerramento)."""
+        with self._lock:
+            self._holders.clear()
+            if self._listener is None:
+                return
+            self._holders["close"] = 1
+        self.release("close")
+
+    def _publish(self):
+        if self.metrics:
+            self.metrics.set_gauge(f"{self.name}_hook_active", 1 if self.active else 0)
+
+
+class HookSubscription:
+    """Assinatura de um InputHub; cancel() a remove."""
+    __slots__ = ("hub", "on_press", "on_release", "priority", "once", "order")
+
+    def __init__(self, hub, on_press, on_release, priority, once, order):
+        self.hub = hub
+        self.on_press = on_press
+        self.on_release = on_release
+        self.priority = priority
+        self.once = once
+        self.order = order
+
+    @property
+    def active(self):
+        return self in self.hub._subscribers
+
+    def cancel(self):
+        self.hub.unsubscribe(self)
+
+
+class InputHub:
+    """
+    Um único hook global de teclado compartilhado por todo o processo.
+
+    Hotkeys, diálogos de captura e gravadores assinam em vez de criar o
+    próprio Listener. Assinantes de maior prioridade recebem o evento
+    primeiro; um handler que retorna True consome o evento (os de menor
+    prioridade não o veem). Assinaturas once=True são removidas após o
+    primeiro evento entregue.
+    """
+
+    PRIORITY_CAPTURE = 100
+    PRIORITY_RECORD = 50  # Gravadores veem a tecla antes dos hotkeys, sem consumir
+    PRIORITY_HOTKEYS = 0
+
+    def __init__(self, factory, name="keyboard"):
+        # factory(on_press, on_release) -> listener ainda não iniciado
+        self._factory = factory
+        self.name = name
+        self._lock = threading.Lock()
+        # Tupla imutável ordenada: o despacho lê sem travar
+        self._subscribers = ()
+        self._order = 0
+        self._listener = None
+
+    @property
+    def alive(self):
+        listener = self._listener
+        return listener is not None and listener.is_alive()
+
+    def start(self):
+        """Instala o hook (ou reinstala, se o listener anterior morreu)."""
+        with self._lock:
+            if self.alive:
+                return True
+            try:
+                listener = self._factory(self._on_press, self._on_release)
+                listener.start()
+            except Exception as e:
+                print(f"Erro ao instalar hook de {self.name}: {e}")
+                return False
+            self._listener = listener
+        return True
+
+    def stop(self):
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            try:
+                listener.stop()
+            except Exception as e:
+                print(f"Erro ao remover hook de {self.name}: {e}")
+
+    def subscribe(self, on_press=None, on_release=None, priority=0, once=False):
+        with self._lock:
+            self._order += 1
+            sub = HookSubscription(self, on_press, on_release, priority, once, self._order)
+            self._subscribers = tuple(sorted(
+                self._subscribers + (sub,), key=lambda s: (-s.priority, s.order)
+            ))
+        return sub
+
+    def unsubscribe(self, sub):
+        """Remove a assinatura. Retorna False se ela já não estava ativa."""
+        with self._lock:
+            if sub not in self._subscribers:
+                return False
+            self._subscribers = tuple(s for s in self._subscribers if s is not sub)
+        return True
+
+    def _on_press(self, key):
+        self._dispatch(key, True)
+
+    def _on_release(self, key):
+        self._dispatch(key, False)
+
+    def _dispatch(self, key, pressed):
+        for sub in self._subscribers:
+            handler = sub.on_press if pressed else sub.on_release
+            if handler is None:
+                continue
+            # Um once só é entregue a quem o remover primeiro
+            if sub.once and not self.unsubscribe(sub):
+                continue
+            try:
+                consumed = handler(key)
+            except Exception as e:
+                print(f"Erro em assinante do hook de {self.name}: {e}")
+                continue
+            if consumed is True:
+                break
+
+
+class HookEventQueue:
+    """
+    Separa os callbacks de hook do trabalho que eles disparam.
+
+    Na thread do hook só se enfileira um registro (função, argumentos,
+    instante); uma thread consumidora grava a configuração, injeta
+    soltura de teclas e sinaliza a GUI. timed() envolve um callback de
+    hook e avisa quando ele passa do orçamento, pois um hook lento atrasa
+    a entrada de todo o desktop.
+    """
+
+    def __init__(self, metrics=None, budget_ms=2.0, name="hook-consumer"):
+        self.metrics = metrics
+        self.budget_ms = budget_ms
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._last_warning = {}
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Processa o que já está na fila e encerra o consumidor."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+
+    def post(self, handler, *args):
+        """Chamado na thread do hook: apenas enfileira."""
+        self._queue.put((handler, args, time.perf_counter()))
+
+    def timed(self, callback, name):
+        """Envolve um callback de hook medindo-o contra o orçamento."""
+        budget = self.budget_ms
+        metrics = self.metrics
+
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if metrics:
+                    metrics.observe("listener_callback_ms", elapsed_ms)
+                if elapsed_ms > budget:
+                    self._over_budget(name, elapsed_ms)
+        return wrapper
+
+    def _over_budget(self, name, elapsed_ms):
+        if self.metrics:
+            self.metrics.inc("hook_budget_exceeded_total")
+        # No máximo um aviso por segundo por callback
+        now = time.monotonic()
+        if now - self._last_warning.get(name, 0.0) >= 1.0:
+            self._last_warning[name] = now
+            print(f"Aviso: callback de hook '{name}' levou {elapsed_ms:.2f} ms "
+                  f"(orçamento {self.budget_ms:.2f} ms)")
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            handler, args, posted_at = record
+            if self.metrics:
+                self.metrics.observe("hook_queue_delay_ms", (time.perf_counter() - posted_at) * 1000)
+            try:
+                handler(*args)
+            except Exception as e:
+                print(f"Erro ao processar evento de hook: {e}")
@@ -0,0 +1,1021 @@
+"""Testes do macro_engine.
+
+Os do motor usam relógio virtual (VirtualClock): conferem contagem e
+instante exato de cada ação e o ponto de parada dos limites de job, sem
+injetar nada no sistema. Os de X11 sobem um Xvfb descartável e são
+pulados sem Xvfb ou python-xlib. Rodam com pytest ou com
+'python -m unittest test_macro_engine' a partir desta pasta.
+"""
+
+import asyncio
+import datetime
+import importlib.util
+import json
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from macro_engine import (
+    AsyncMacroEngine, ControlServer, CoordinateMapper, CronExpression, FAILSAFE_REASON, FocusGuard,
+    HotkeyMatcher, InjectionBucket, MacroEngine, MacroMetrics, Monitor, MonitorLayout, REC_KEY_DOWN,
+    REC_KEY_UP, REC_MOVE, REC_PRESS, REC_RELEASE, Recording, RecordingEdits, RecordingWriter,
+    RunLimits, ScriptCompiler, TrackSet, TriggerScheduler, VirtualClock, WINDOW_REASON,
+    WindowTracker, build_simple_program, parse_remote_settings, rate_limit_controllers, resolve_key,
+    simulate, track_controllers, x11_monitor_layout, xdisplay, _NullController,
+)
+
+
+class Recorder(_NullController):
+    """Controlador que anota o instante (no relógio virtual) de cada ação."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.times = []
+
+    def click(self, button, count=1):
+        self.times.append(self.clock.now())
+
+    def press(self, key):
+        self.times.append(self.clock.now())
+
+
+def run_virtual(plan, duration, keyboard_apart=False, limits=None):
+    """Executa 'plan' por 'duration' segundos simulados; retorna (motivo, engine, mouse, teclado)."""
+    clock = VirtualClock()
+    mouse = Recorder(clock)
+    keyboard = Recorder(clock) if keyboard_apart else mouse
+    engine = MacroEngine(mouse, keyboard, clock=clock)
+    clock.call_at(duration, engine.stop)
+    reason = engine.run(plan, limits=limits)
+    return reason, engine, mouse, keyboard
+
+
+def script(text):
+    return ScriptCompiler.compile(text)
+
+
+class VirtualScheduleTests(unittest.TestCase):
+    """Uma hora de agenda simulada: sem ação perdida, sem deriva."""
+
+    HOUR = 3600.0
+
+    def assertPaced(self, times, interval, expected, start=0.0):
+        self.assertEqual(len(times), expected)
+        self.assertAlmostEqual(times[0], start, places=9)
+        for i, t in enumerate(times):
+            # Prazo a partir do anterior: o erro não acumula ao longo da hora
+            self.assertAlmostEqual(t, start + i * interval, places=6)
+
+    def test_simple_program(self):
+        # O programa simples espera 50 ms após o move e mais 50 ms de delay
+        program = build_simple_program("esquerdo", "click", 10, 10, 50, 0)
+        reason, engine, mouse, _ = run_virtual(program, self.HOUR)
+        self.assertEqual(reason, "stopped")
+        # Intervalo semiaberto: a ação no instante exato do stop não ocorre
+        self.assertPaced(mouse.times, 0.1, 36000, start=0.05)
+        self.assertAlmostEqual(engine.clock.now(), self.HOUR, places=9)
+
+    def test_script(self):
+        reason, _, mouse, _ = run_virtual(script("repeat\n  click left\n  wait 50\nend\n"), self.HOUR)
+        self.assertEqual(reason, "stopped")
+        self.assertPaced(mouse.times, 0.05, 72000)
+
+    def test_finite_script_finishes(self):
+        reason, engine, mouse, _ = run_virtual(script("repeat 3\n  click\n  wait 250\nend\n"), self.HOUR)
+        self.assertEqual(reason, "finished")
+        self.assertEqual(mouse.times, [0.0, 0.25, 0.5])
+        self.assertAlmostEqual(engine.clock.now(), 0.75, places=9)
+
+    def test_tracks_share_scheduler(self):
+        tracks = TrackSet([
+            ("cliques", script("repeat\n  click left\n  wait 50\nend\n")),
+            ("tecla", script("repeat\n  key f5\n  wait 3000\nend\n")),
+        ])
+        reason, _, clicks, keys = run_virtual(tracks, self.HOUR, keyboard_apart=True)
+        self.assertEqual(reason, "stopped")
+        self.assertPaced(clicks.times, 0.05, 72000)
+        self.assertPaced(keys.times, 3.0, 1200)
+
+    def test_run_again_after_stop(self):
+        plan = script("repeat\n  click\n  wait 100\nend\n")
+        tracks = TrackSet([("cliques", plan)])
+        clock = VirtualClock()
+        mouse = Recorder(clock)
+        engine = MacroEngine(mouse, mouse, clock=clock)
+        for program in (plan, plan, tracks):
+            with self.subTest(program=program):
+                start = clock.now()
+                clock.call_at(start + 0.95, engine.stop)
+                mouse.times = []
+                # O stop() da execução anterior não encerra esta logo no início
+                self.assertEqual(engine.run(program), "stopped")
+                self.assertPaced(mouse.times, 0.1, 10, start=start)
+
+    def test_metrics_count_actions(self):
+        _, engine = simulate(script("repeat 500\n  click\n  wait 10\nend\n"), 60)
+        self.assertEqual(engine.metrics.snapshot()["counters"]["actions_total"], 500)
+
+
+class HotkeyMatcherTests(unittest.TestCase):
+    """Acordes e sequências no autômato de hotkeys (com ou sem pynput)."""
+
+    def setUp(self):
+        self.matcher = HotkeyMatcher({"start": "f1", "copiar": "ctrl+shift+x", "goto": "g g",
+                                      "salvar": "ctrl+s ctrl+w"}, sequence_timeout=0.05)
+
+    def tap(self, *names):
+        """Pressiona as teclas em ordem e solta na ordem inversa; retorna o que disparou."""
+        keys = [resolve_key(name) for name in names]
+        fired = [self.matcher.feed_press(key) for key in keys]
+        for key in reversed(keys):
+            self.matcher.feed_release(key)
+        return [name for name in fired if name]
+
+    def test_chord_modifiers_in_any_order(self):
+        self.assertEqual(self.tap("ctrl", "shift", "x"), ["copiar"])
+        self.assertEqual(self.tap("shift_r", "ctrl_l", "x"), ["copiar"])
+        # Falta um modificador, ou a tecla vem antes deles: não é o acorde
+        self.assertEqual(self.tap("ctrl", "x"), [])
+        self.assertEqual(self.tap("x", "ctrl", "shift"), [])
+        self.assertEqual(self.matcher.mods, 0)
+
+    def test_plain_hotkey_fires_with_modifiers(self):
+        self.assertEqual(self.tap("f1"), ["start"])
+        self.assertEqual(self.tap("alt", "f1"), ["start"])
+
+    def test_sequence(self):
+        self.assertEqual(self.tap("g") + self.tap("g"), ["goto"])
+        self.assertEqual(self.tap("ctrl", "s") + self.tap("ctrl", "w"), ["salvar"])
+        # Uma tecla fora da sequência a interrompe
+        self.assertEqual(self.tap("g") + self.tap("x") + self.tap("g"), [])
+
+    def test_sequence_timeout(self):
+        self.assertEqual(self.tap("g"), [])
+        time.sleep(0.1)
+        # O primeiro passo expirou: este "g" recomeça a sequência
+        self.assertEqual(self.tap("g"), [])
+        self.assertEqual(self.tap("g"), ["goto"])
+
+    def test_invalid_specs(self):
+        for spec in ("", "hyper+x", "ctrl+"):
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    HotkeyMatcher.parse(spec)
+
+
+class MetricsExportTests(unittest.TestCase):
+    """Formato de texto do Prometheus gerado por MacroMetrics.to_prometheus."""
+
+    SAMPLE = re.compile(r'^(macro_[a-z_]+?)(_bucket\{le="([^"]+)"\}|_sum|_count)? (\S+)$')
+
+    def test_text_format(self):
+        metrics = MacroMetrics()
+        metrics.inc("actions_total", 3)
+        # Outra thread escreve no seu próprio acumulador; o snapshot soma as duas
+        worker = threading.Thread(target=metrics.inc, args=("actions_total", 2))
+        worker.start()
+        worker.join()
+        for value in (0.3, 7, 5000):
+            metrics.observe("sleep_overshoot_ms", value)
+        metrics.set_gauge("mouse_hook_active", 1)
+        text = metrics.to_prometheus()
+        self.assertTrue(text.endswith("\n"))
+
+        types, samples, buckets = {}, {}, []
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                continue
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split(" ")
+                types[name] = kind
+                continue
+            match = self.SAMPLE.match(line)
+            self.assertIsNotNone(match, line)
+            name, suffix, le, value = match.groups()
+            # Cada amostra vem depois do TYPE da sua métrica
+            self.assertIn(name, types, line)
+            float(value)
+            if le is not None:
+                buckets.append((le, int(value)))
+            else:
+                samples[name + (suffix or "")] = value
+
+        self.assertEqual(types["macro_actions_total"], "counter")
+        self.assertEqual(types["macro_mouse_hook_active"], "gauge")
+        self.assertEqual(types["macro_sleep_overshoot_ms"], "histogram")
+        self.assertEqual(samples["macro_actions_total"], "5")
+        self.assertEqual(samples["macro_sleep_overshoot_ms_count"], "3")
+        self.assertAlmostEqual(float(samples["macro_sleep_overshoot_ms_sum"]), 5007.3)
+        # Buckets cumulativos, em ordem, terminando em +Inf com a contagem total
+        self.assertEqual([le for le, _ in buckets],
+                         [str(b) for b in MacroMetrics.BUCKETS_MS] + ["+Inf"])
+        counts = [n for _, n in buckets]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(dict(buckets)["0.5"], 1)
+        self.assertEqual(dict(buckets)["10"], 2)
+        self.assertEqual(counts[-1], 3)
+
+    def test_reset_starts_from_zero(self):
+        metrics = MacroMetrics()
+        metrics.inc("actions_total", 4)
+        metrics.reset()
+        metrics.inc("actions_total")
+        self.assertIn("macro_actions_total 1\n", metrics.to_prometheus())
+
+
+class ScriptCompilerTests(unittest.TestCase):
+    """Validação em tempo de compilação e cache do load()."""
+
+    def test_click_count_must_be_positive(self):
+        for count in ("0", "-2"):
+            with self.subTest(count=count):
+                with self.assertRaisesRegex(ValueError, "linha 2"):
+                    script(f"move 1 1\nclick left {count}\n")
+
+    def test_load_example_is_cached(self):
+        path = os.path.join(HERE, "exemplo.macro")
+        program = ScriptCompiler.load(path)
+        self.assertIs(ScriptCompiler.load(path), program)
+        self.assertEqual(len(program.source_hash), 64)
+
+
+class RunLimitsTests(unittest.TestCase):
+    """Limites de job: o motor para no instante e na iteração certos."""
+
+    def setUp(self):
+        self.program = build_simple_program("esquerdo", "click", 100, 100, 50, 0, None)
+        self.tracks = TrackSet([
+            ("cliques", script("repeat\n click\n wait 50\nend")),
+            ("tecla", script("repeat\n key a\n wait 3000\nend")),
+        ], "jobs")
+
+    def check_stop(self, plan, limits, reason, stop_time, iterations):
+        result, engine = simulate(plan, 86400, limits=limits)
+        self.assertEqual(result, reason)
+        self.assertAlmostEqual(engine.clock.now(), stop_time, places=9)
+        self.assertEqual(engine.metrics.snapshot()["gauges"]["job_iterations"], iterations)
+
+    def test_iterations_simple(self):
+        self.check_stop(self.program, RunLimits(iterations=10000), "iterations", 1000.0, 10000)
+
+    # Durações fora da borda de uma passada: prazos somados em float não
+    # caem exatamente no fim, e a passada da borda poderia contar ou não
+    def test_duration_simple(self):
+        self.check_stop(self.program, RunLimits(duration=1800.02), "duration", 1800.02, 18000)
+
+    def test_iterations_tracks(self):
+        self.check_stop(self.tracks, RunLimits(iterations=5000), "iterations", 250.0, 5000)
+
+    def test_duration_tracks(self):
+        self.check_stop(self.tracks, RunLimits(duration=600.02), "duration", 600.02, 12000)
+
+    def test_finite_program_restarts_until_limit(self):
+        # Com limites, cada passada de um programa que termina conta uma iteração
+        reason, _, mouse, _ = run_virtual(script("click\nwait 100\n"), 60, limits=RunLimits(iterations=7))
+        self.assertEqual(reason, "iterations")
+        self.assertEqual(len(mouse.times), 7)
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            RunLimits(iterations=0)
+        with self.assertRaises(ValueError):
+            RunLimits(duration=-1)
+        with self.assertRaises(ValueError):
+            RunLimits.from_profile({"limits": {"loops": 3}})
+        self.assertIsNone(RunLimits.from_profile({}))
+
+
+class AsyncVirtualClockTests(unittest.TestCase):
+    """AsyncMacroEngine com VirtualClock: o relógio salta entre os prazos."""
+
+    def run_async(self, plan, stop_after=None):
+        clock = VirtualClock()
+        mouse = Recorder(clock)
+        engine = AsyncMacroEngine(mouse, mouse, clock=clock)
+
+        async def main():
+            events = []
+
+            async def listen():
+                async for event in engine.events():
+                    events.append(event)
+
+            listener = asyncio.ensure_future(listen())
+            await asyncio.sleep(0)
+            if stop_after is not None:
+                clock.call_at(stop_after, engine.stop)
+            reason = await engine.run(plan)
+            await asyncio.wait_for(listener, 1.0)
+            return reason, events
+
+        reason, events = asyncio.run(main())
+        return reason, events, mouse, clock
+
+    def test_timestamps_and_finished_event(self):
+        reason, events, mouse, clock = self.run_async("repeat 5\n click\n wait 1000\nend")
+        self.assertEqual(reason, "finished")
+        self.assertEqual(mouse.times, [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertAlmostEqual(clock.now(), 5.0, places=9)
+        # events() termina sozinho depois do "finished"
+        self.assertEqual(events[-1], ("finished", "finished"))
+
+    def test_stop(self):
+        reason, events, mouse, clock = self.run_async("repeat 1000000\n click\n wait 10\nend", stop_after=2.0)
+        self.assertEqual(reason, "stopped")
+        self.assertEqual(events[-1], ("finished", "stopped"))
+        self.assertEqual(len(mouse.times), 200)
+
+
+class FailsafeTests(unittest.TestCase):
+    """Teto de injeções no relógio do motor e release do Watchdog."""
+
+    def test_bucket_waits_on_clock(self):
+        clock = VirtualClock()
+        bucket = InjectionBucket(10, burst=1, clock=clock)
+        for _ in range(11):
+            bucket.take()
+        # A primeira sai do burst; as outras dez, a 10/s
+        self.assertAlmostEqual(clock.now(), 1.0, places=9)
+        self.assertEqual(bucket.throttled, 10)
+
+    def test_rate_limited_schedule(self):
+        clock = VirtualClock()
+        recorder = Recorder(clock)
+        mouse, keyboard = rate_limit_controllers(recorder, recorder, 4, burst=1, clock=clock)
+        engine = MacroEngine(mouse, keyboard, clock=clock)
+        engine.run(script("repeat 5\n  click\nend\n"))
+        self.assertEqual(recorder.times, [0.0, 0.25, 0.5, 0.75, 1.0])
+
+    def test_stop_interrupts_bucket_wait(self):
+        clock = VirtualClock()
+        recorder = Recorder(clock)
+        mouse, keyboard = rate_limit_controllers(recorder, recorder, 1, burst=1, clock=clock)
+        engine = MacroEngine(mouse, keyboard, clock=clock)
+        clock.call_at(2.5, engine.stop)
+        engine.run(script("repeat 10\n  click\nend\n"))
+        # A espera pela quarta ficha acaba no stop(), sem injetar o clique
+        self.assertEqual(recorder.times, [0.0, 1.0, 2.0])
+        self.assertAlmostEqual(clock.now(), 2.5, places=9)
+
+    def test_watchdog_releases_after_current_step(self):
+        log = []
+
+        class Slow(_NullController):
+            def press(self, key):
+                # O Watchdog dispara enquanto o press ainda não voltou
+                time.sleep(0.2)
+                log.append(("press", key))
+
+            def release(self, key):
+                log.append(("release", key))
+
+        mouse, keyboard = track_controllers(Slow(), Slow())
+        failsafe = {"corner_px": 2, "pointer": lambda: (0, 0), "heartbeat_timeout": 0, "interval": 0.01}
+        engine = MacroEngine(mouse, keyboard, failsafe=failsafe)
+        reason = engine.run(script("keydown a\nwait 5000\nkeyup a\n"))
+        self.assertEqual(reason, FAILSAFE_REASON)
+        self.assertEqual(log, [("press", "a"), ("release", "a")])
+        self.assertEqual(len(mouse.input_state), 0)
+
+    def test_corners_of_every_monitor(self):
+        # Secundário à direita, mais alto e deslocado para cima
+        monitors = [(0, 0, 1920, 1080), (1920, -200, 2560, 1440)]
+
+        def run(position):
+            failsafe = {"corner_px": 2, "monitors": monitors, "pointer": lambda: position,
+                        "heartbeat_timeout": 0, "interval": 0.01}
+            engine = MacroEngine(_NullController(), _NullController(), failsafe=failsafe)
+            return engine.run(script("wait 150\n"))
+
+        self.assertEqual(run((1920 + 2559, -200 + 1439)), FAILSAFE_REASON)
+        self.assertEqual(run((1921, -199)), FAILSAFE_REASON)
+        self.assertEqual(run((1918, 1079)), FAILSAFE_REASON)
+        # Bordas fora dos cantos não param
+        self.assertNotEqual(run((1919, 540)), FAILSAFE_REASON)
+        self.assertNotEqual(run((4000, 1239)), FAILSAFE_REASON)
+
+
+class CoordinateMapperTests(unittest.TestCase):
+    """Alvos capturados num layout e reproduzidos em outro."""
+
+    def remap(self, capture, current, x, y):
+        target = capture.normalize(x, y)
+        # Como na configuração: o layout da captura vai e volta pelo JSON
+        source = MonitorLayout.from_json(capture.to_json())
+        self.assertEqual(source, capture)
+        return CoordinateMapper(source, current).map_target(target)
+
+    def test_1080p_to_4k(self):
+        full_hd = MonitorLayout([Monitor("DP-1", 0, 0, 1920, 1080)])
+        uhd = MonitorLayout([Monitor("DP-1", 0, 0, 3840, 2160, scale=2.0)])
+        # O pixel (960, 540) cobre [1920, 1922) no 4K: vai para o centro dele
+        self.assertEqual(self.remap(full_hd, uhd, 960, 540), (1921, 1081))
+        self.assertEqual(self.remap(full_hd, uhd, 0, 0), (1, 1))
+        self.assertEqual(self.remap(full_hd, uhd, 1919, 1079), (3839, 2159))
+        # E de volta, sem sair da tela
+        self.assertEqual(self.remap(uhd, full_hd, 3839, 2159), (1919, 1079))
+        self.assertEqual(self.remap(uhd, full_hd, 1921, 1081), (960, 540))
+
+    def test_swapped_primary(self):
+        left = Monitor("DP-1", 0, 0, 1920, 1080)
+        right = Monitor("HDMI-1", 1920, 0, 2560, 1440)
+        capture = MonitorLayout([left, right])
+        # HDMI-1 virou o principal e foi para a esquerda
+        current = MonitorLayout([Monitor("HDMI-1", 0, 0, 2560, 1440), Monitor("DP-1", 2560, 0, 1920, 1080)])
+        # Cada alvo segue o seu monitor pelo nome, não pela posição na lista
+        self.assertEqual(self.remap(capture, current, 960, 540), (2560 + 960, 540))
+        self.assertEqual(self.remap(capture, current, 1920 + 100, 200), (100, 200))
+
+    def test_removed_monitor_falls_back_to_primary(self):
+        primary = Monitor("DP-1", 0, 0, 1920, 1080)
+        capture = MonitorLayout([primary, Monitor("HDMI-1", 1920, 0, 2560, 1440)])
+        current = MonitorLayout([primary])
+        # Mesma fração (u, v) no principal
+        self.assertEqual(self.remap(capture, current, 1920 + 1280, 720), (960, 540))
+        self.assertEqual(self.remap(capture, current, 1920 + 2559, 1439), (1919, 1079))
+        # Alvos no monitor que ficou não mudam
+        self.assertEqual(self.remap(capture, current, 100, 200), (100, 200))
+
+    def test_renamed_monitor_keeps_position(self):
+        capture = MonitorLayout([Monitor("DP-1", 0, 0, 1920, 1080), Monitor("HDMI-1", 1920, 0, 1920, 1080)])
+        current = MonitorLayout([Monitor("DP-1", 0, 0, 1920, 1080), Monitor("DP-2", 1920, 0, 1920, 1080)])
+        self.assertEqual(self.remap(capture, current, 1920 + 500, 600), (1920 + 500, 600))
+
+    def test_point_outside_uses_nearest_monitor(self):
+        layout = MonitorLayout([Monitor("DP-1", 0, 0, 1920, 1080), Monitor("HDMI-1", 1920, 0, 1920, 1080)])
+        self.assertEqual(layout.monitor_at(5000, 500), 1)
+        self.assertEqual(layout.normalize(-10, -10)["u"], 0.0)
+
+
+class RecordingWriterTests(unittest.TestCase):
+    """Escrita atômica do .mrec: um erro no meio não estraga o arquivo anterior."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "rec.mrec")
+        self.write(self.path, 100)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, path, events):
+        with RecordingWriter(path) as writer:
+            for i in range(events):
+                writer.append(i * 1000, REC_MOVE, i, i)
+
+    def assertIntact(self):
+        self.assertEqual(os.listdir(self.dir.name), ["rec.mrec"])
+        with Recording(self.path) as recording:
+            self.assertEqual(len(recording), 100)
+
+    def test_error_inside_with_keeps_previous_file(self):
+        with self.assertRaises(ZeroDivisionError):
+            with RecordingWriter(self.path) as writer:
+                writer.append(0, REC_MOVE, 1, 1)
+                1 / 0
+        self.assertIntact()
+
+    def test_abort(self):
+        writer = RecordingWriter(self.path)
+        writer.append(0, REC_MOVE, 1, 1)
+        writer.abort()
+        writer.close()  # Depois de abort() não faz nada
+        self.assertIntact()
+
+    def test_failed_edits_save_keeps_previous_file(self):
+        class Broken(RecordingEdits):
+            def __iter__(self):
+                yield from list(super().__iter__())[:10]
+                raise OSError("disco cheio")
+
+        with Recording(self.path) as recording:
+            edits = Broken(recording)
+            with self.assertRaises(OSError):
+                edits.save(self.path)
+        self.assertIntact()
+
+
+class RecordingIndexTests(unittest.TestCase):
+    """Busca por tempo no índice de blocos do .mrec."""
+
+    def test_index_at_with_duplicates_across_chunks(self):
+        # Blocos de 4: o tempo 30 começa no fim do primeiro e ocupa o segundo inteiro
+        times = [0, 10, 20, 30, 30, 30, 30, 30, 30, 40, 50]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "dup.mrec")
+            with RecordingWriter(path, chunk_events=4) as writer:
+                for i, t in enumerate(times):
+                    writer.append(t, REC_MOVE, i, i)
+            with Recording(path) as recording:
+                self.assertEqual(recording.index_at(30), 3)
+                for t in range(-5, 60):
+                    expected = next((i for i, value in enumerate(times) if value >= t), len(times))
+                    self.assertEqual(recording.index_at(t), expected, t)
+
+
+class RecordingEditsTests(unittest.TestCase):
+    """Tabela de peças do editor contra uma lista comum, com save e releitura."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.path = os.path.join(self.folder, "base.mrec")
+        # Blocos de 4 eventos: as edições cortam peças no meio e nas fronteiras
+        with RecordingWriter(self.path, chunk_events=4) as writer:
+            for i in range(12):
+                writer.append(i * 1000, REC_MOVE, i, 2 * i)
+            writer.append(12000, REC_PRESS, 12, 24, "left")
+            writer.append(12500, REC_KEY_DOWN, name="a")
+            writer.append(13000, REC_KEY_UP, name="a")
+            writer.append(13500, REC_RELEASE, 12, 24, "left")
+
+    @staticmethod
+    def comparable(events):
+        # Eventos de teclado não gravam x/y: a releitura devolve outra posição
+        return [(t, kind, x, y, name) if kind <= REC_RELEASE else (t, kind, 0, 0, name)
+                for t, kind, x, y, name in events]
+
+    def assertMatches(self, edits, model):
+        self.assertEqual(self.comparable(edits), self.comparable(model))
+        self.assertEqual(len(edits), len(model))
+        self.assertEqual(edits[-1], model[-1])
+        for t in range(-500, model[-1][0] + 1500, 250):
+            expected = next((i for i, event in enumerate(model) if event[0] >= t), len(model))
+            self.assertEqual(edits.row_at(t), expected, t)
+
+    def test_edits_match_list_and_survive_save(self):
+        with Recording(self.path) as recording:
+            edits = RecordingEdits(recording)
+            model = list(edits)
+            self.assertEqual(len(model), 16)
+            self.assertFalse(edits.modified)
+
+            edits.insert(3, (2500, REC_MOVE, 99, 98, None))
+            model.insert(3, (2500, REC_MOVE, 99, 98, None))
+            # Exclusão que atravessa duas fronteiras de bloco
+            edits.delete(5, 6)
+            del model[5:11]
+            edits.replace(2, (2000, REC_PRESS, 7, 7, "right"))
+            model[2] = (2000, REC_PRESS, 7, 7, "right")
+            # Atrasa o fim (inclusive o teclado) sem passar do evento seguinte
+            edits.shift(6, len(model) - 6, 250)
+            model[6:] = [(t + 250, kind, x, y, name) for t, kind, x, y, name in model[6:]]
+            self.assertMatches(edits, model)
+            self.assertTrue(edits.modified)
+
+            # Edição fora de ordem é recusada sem mudar nada
+            with self.assertRaises(ValueError):
+                edits.insert(1, (5000, REC_MOVE, 0, 0, None))
+            with self.assertRaises(ValueError):
+                edits.shift(0, 2, 10 ** 6)
+            self.assertMatches(edits, model)
+
+            saved = os.path.join(self.folder, "editado.mrec")
+            self.assertEqual(edits.save(saved), len(model))
+
+        with Recording(saved) as reloaded:
+            self.assertEqual(reloaded.chunk_events, 4)
+            self.assertMatches(RecordingEdits(reloaded), model)
+
+
+def wait_for(predicate, timeout=2.0):
+    """Espera a condição (atualizada por outra thread); retorna o último valor."""
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return predicate()
+
+
+class ControlServerTests(unittest.TestCase):
+    """Ida e volta de comandos JSON por linha num socket temporário."""
+
+    def setUp(self):
+        self.calls = []
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        if hasattr(socket, "AF_UNIX"):
+            address = os.path.join(folder.name, "control.sock")
+        else:
+            address = ("127.0.0.1", 0)
+        self.server = ControlServer(self.handle, address)
+        self.assertTrue(self.server.start())
+        self.addCleanup(self.server.stop)
+
+    def handle(self, cmd, args):
+        self.calls.append((cmd, args, threading.current_thread().name))
+        if cmd == "fail":
+            raise ValueError("comando recusado")
+        return {"cmd": cmd, "args": args}
+
+    def connect(self):
+        if self.server.is_unix:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(2.0)
+        sock.connect(self.server.address)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_pipelined_round_trip(self):
+        sock = self.connect()
+        # Vários comandos de uma vez, na mesma conexão: as respostas voltam em ordem
+        requests = [{"id": 1, "cmd": "status"}, {"id": 2, "cmd": "reconfigure", "args": {"a": "ç"}},
+                    {"id": 3, "cmd": "fail"}]
+        payload = "".join(json.dumps(request) + "\n" for request in requests) + "nao e json\n\n"
+        sock.sendall(payload.encode("utf-8"))
+        reader = sock.makefile("r", encoding="utf-8")
+        responses = [json.loads(reader.readline()) for _ in range(4)]
+        self.assertEqual(responses[0], {"id": 1, "ok": True, "result": {"cmd": "status", "args": {}}})
+        self.assertEqual(responses[1]["result"]["args"], {"a": "ç"})
+        self.assertEqual(responses[2], {"id": 3, "ok": False, "error": "comando recusado"})
+        self.assertFalse(responses[3]["ok"])
+        self.assertIsNone(responses[3]["id"])
+        self.assertEqual([cmd for cmd, _, _ in self.calls], ["status", "reconfigure", "fail"])
+        # O handler roda na thread do servidor, não na de quem chamou start()
+        self.assertEqual({thread for _, _, thread in self.calls}, {"macro-control"})
+
+    def test_unix_socket_is_private(self):
+        if not self.server.is_unix:
+            self.skipTest("sem socket Unix")
+        self.assertEqual(os.stat(self.server.address).st_mode & 0o777, 0o600)
+
+
+class CronExpressionTests(unittest.TestCase):
+    """Campos, passos e dia da semana das expressões cron."""
+
+    def next(self, text, when):
+        return CronExpression(text).next_after(datetime.datetime(*when))
+
+    def test_fields_and_steps(self):
+        cron = CronExpression("5/15 8-18/5 * * *")
+        self.assertEqual(cron.minutes, [5, 20, 35, 50])
+        self.assertEqual(cron.hours, [8, 13, 18])
+        self.assertEqual(CronExpression("0,30 */6 1,15 1-3 *").hours, [0, 6, 12, 18])
+        self.assertEqual(CronExpression("@hourly").minutes, [0])
+
+    def test_next_after(self):
+        # Estritamente depois, ao minuto: segundos descartados
+        self.assertEqual(self.next("*/15 * * * *", (2026, 5, 4, 10, 15, 30)),
+                         datetime.datetime(2026, 5, 4, 10, 30))
+        self.assertEqual(self.next("*/15 * * * *", (2026, 5, 4, 10, 14, 59)),
+                         datetime.datetime(2026, 5, 4, 10, 15))
+        # Virada de hora, dia, mês e ano
+        self.assertEqual(self.next("0 8-18/5 * * *", (2026, 5, 4, 18, 0)),
+                         datetime.datetime(2026, 5, 5, 8, 0))
+        self.assertEqual(self.next("59 23 31 12 *", (2026, 12, 31, 23, 59)),
+                         datetime.datetime(2027, 12, 31, 23, 59))
+        # 29 de fevereiro só no próximo ano bissexto
+        self.assertEqual(self.next("0 0 29 2 *", (2025, 3, 1, 0, 0)), datetime.datetime(2028, 2, 29))
+
+    def test_day_of_week(self):
+        # 2026-05-03 é domingo: 0 e 7 são o mesmo dia
+        for field in ("0", "7"):
+            with self.subTest(field=field):
+                self.assertEqual(self.next(f"0 9 * * {field}", (2026, 4, 30, 0, 0)),
+                                 datetime.datetime(2026, 5, 3, 9, 0))
+        self.assertEqual(CronExpression("0 9 * * 1-7/2").weekdays, {1, 3, 5, 0})
+        # Dia do mês e da semana restritos: basta um casar (dia 13 ou sexta-feira)
+        self.assertEqual(self.next("0 0 13 * 5", (2026, 5, 9, 0, 0)), datetime.datetime(2026, 5, 13))
+        self.assertEqual(self.next("0 0 13 * 5", (2026, 5, 13, 0, 0)), datetime.datetime(2026, 5, 15))
+        # Com "*" num dos dois, os dois precisam casar
+        self.assertEqual(self.next("0 0 * 5 5", (2026, 5, 9, 0, 0)), datetime.datetime(2026, 5, 15))
+
+    def test_invalid(self):
+        for text in ("* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *",
+                     "* * * * 8", "*/0 * * * *", "5-1 * * * *", "a * * * *", "1-2-3 * * * *"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    CronExpression(text)
+        with self.assertRaisesRegex(ValueError, "nunca dispara"):
+            self.next("0 0 30 2 *", (2026, 1, 1, 0, 0))
+
+
+class TriggerSchedulerTests(unittest.TestCase):
+    """Disparos agendados com o relógio de parede saltando."""
+
+    class Once:
+        def __init__(self, at):
+            self.at = at
+
+        def next_after(self, now):
+            return self.at if now < self.at else None
+
+        def describe(self):
+            return f"em {self.at}"
+
+    def test_wall_clock_jump_forward(self):
+        wall = [1000.0]
+        fired = []
+        scheduler = TriggerScheduler(lambda trigger: fired.append(wall[0]), lambda: wall[0],
+                                     max_wait=0.01)
+        self.addCleanup(scheduler.stop)
+        scheduler.set_triggers([self.Once(4600.0)])
+        time.sleep(0.05)
+        self.assertEqual(fired, [])
+        # Uma hora à frente (NTP, suspensão): a espera em curso não pode durar a hora toda
+        wall[0] = 5000.0
+        self.assertTrue(wait_for(lambda: fired))
+        self.assertEqual(fired, [5000.0])
+        self.assertEqual(scheduler.upcoming(), [])
+
+
+class RemoteSettingsTests(unittest.TestCase):
+    """Validação do "reconfigure" do servidor de controle antes de aplicar."""
+
+    def test_converts_and_clamps(self):
+        settings = parse_remote_settings({"click_delay_ms": "0", "hold_duration_ms": 10,
+                                          "saved_x": "5", "saved_y": 7, "script_file": ""})
+        self.assertEqual(settings, {"click_delay_ms": 1, "hold_duration_ms": 50, "saved_x": 5,
+                                    "saved_y": 7, "script_file": None, "persist": False})
+
+    def test_rejects_any_invalid_argument(self):
+        for args in ({"action_type": "drag"}, {"button_type": "meio"}, {"click_delay_ms": "x"},
+                     {"saved_x": 1}, {"key_exit": "hyper+f1"}, {"key_start": 3},
+                     {"custom_key_combo": "ctrl+"}, {"script_file": 1}):
+            with self.subTest(args=args):
+                with self.assertRaises(ValueError):
+                    # Um argumento válido junto não muda o resultado
+                    parse_remote_settings(dict(args, action_type=args.get("action_type", "click")))
+
+
+class XvfbTestCase(unittest.TestCase):
+    """Base dos testes X11: um Xvfb descartável por classe (pulados sem Xvfb ou python-xlib)."""
+
+    @classmethod
+    def setUpClass(cls):
+        if xdisplay is None:
+            raise unittest.SkipTest("python-xlib não instalado")
+        if not shutil.which("Xvfb"):
+            raise unittest.SkipTest("Xvfb não instalado")
+        from bench_macro_engine import _start_xvfb
+
+        cls._previous_display = os.environ.get("DISPLAY")
+        cls.xvfb = _start_xvfb()
+        if cls.xvfb is None:
+            raise unittest.SkipTest("Xvfb não iniciou")
+        cls.display = xdisplay.Display()
+        cls.root = cls.display.screen().root
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.display.close()
+        cls.xvfb.terminate()
+        cls.xvfb.wait()
+        if cls._previous_display is None:
+            os.environ.pop("DISPLAY", None)
+        else:
+            os.environ["DISPLAY"] = cls._previous_display
+
+    def create_window(self, x, y, title, wm_class):
+        screen = self.display.screen()
+        window = self.root.create_window(x, y, 400, 300, 0, screen.root_depth)
+        window.set_wm_class(wm_class.lower(), wm_class)
+        window.set_wm_name(title)
+        window.map()
+        self.display.sync()
+        self.addCleanup(self.display.sync)
+        self.addCleanup(window.destroy)
+        return window
+
+
+class WindowTrackerXvfbTests(XvfbTestCase):
+    """WindowTracker num servidor X real: a origem em cache segue a janela."""
+
+    def start_tracker(self, wm_class):
+        tracker = WindowTracker(wm_class=wm_class).start()
+        self.addCleanup(tracker.stop)
+        return tracker
+
+    def test_origin_follows_move(self):
+        window = self.create_window(100, 100, "Janela de teste", "MacroTeste")
+        tracker = self.start_tracker("macroteste")
+        self.assertTrue(wait_for(lambda: tracker.origin == (100, 100)), tracker.origin)
+        for target in ((300, 200), (301, 200), (0, 0)):
+            window.configure(x=target[0], y=target[1])
+            self.display.flush()
+            # Sem consulta por ação: a origem muda pelo ConfigureNotify
+            self.assertTrue(wait_for(lambda: tracker.origin == target), (tracker.origin, target))
+        self.assertEqual(tracker.resolve(10, 20), (10, 20))
+
+    def test_origin_none_when_unmapped(self):
+        window = self.create_window(50, 60, "Minimizável", "MacroUnmap")
+        tracker = self.start_tracker("MacroUnmap")
+        self.assertTrue(wait_for(lambda: tracker.origin == (50, 60)), tracker.origin)
+        window.unmap()
+        self.display.flush()
+        self.assertTrue(wait_for(lambda: tracker.origin is None), tracker.origin)
+
+        # Sem a janela, o motor para em vez de clicar fora dela
+        engine = MacroEngine(_NullController(), _NullController(), window=tracker)
+        self.assertEqual(engine.run(script("move 5 5\nclick\n")), WINDOW_REASON)
+
+        window.map()
+        self.display.flush()
+        self.assertTrue(wait_for(lambda: tracker.origin == (50, 60)), tracker.origin)
+
+    def test_window_created_later(self):
+        tracker = self.start_tracker("MacroTardia")
+        self.assertIsNone(tracker.origin)
+        self.create_window(70, 80, "Aparece depois", "MacroTardia")
+        self.assertTrue(wait_for(lambda: tracker.origin == (70, 80)), tracker.origin)
+
+
+class MonitorLayoutXvfbTests(XvfbTestCase):
+    """Layout pelo RandR de um servidor X real."""
+
+    def test_xvfb_screen(self):
+        layout = x11_monitor_layout()
+        if layout is None:
+            self.skipTest("Xvfb sem RandR 1.5")
+        self.assertEqual(len(layout.monitors), 1)
+        monitor = layout.monitors[0]
+        self.assertEqual((monitor.x, monitor.y, monitor.width, monitor.height), (0, 0, 1280, 1024))
+
+
+class EwmhTestCase(XvfbTestCase):
+    """Duas janelas e a janela ativa publicada pelo teste (o Xvfb não tem gerenciador de janelas)."""
+
+    def setUp(self):
+        self.active_atom = self.display.intern_atom("_NET_ACTIVE_WINDOW")
+        self.game = self.create_window(10, 10, "Jogo - nível 1", "MacroJogo")
+        self.terminal = self.create_window(400, 10, "Terminal", "MacroTerminal")
+        self.activate(self.terminal)
+        self.addCleanup(self.display.sync)
+        self.addCleanup(self.root.delete_property, self.active_atom)
+
+    def activate(self, window):
+        """Troca _NET_ACTIVE_WINDOW como um gerenciador EWMH faria num alt-tab."""
+        from Xlib import Xatom
+
+        self.root.change_property(self.active_atom, Xatom.WINDOW, 32, [window.id if window else 0])
+        self.display.flush()
+
+    def rename(self, window, title):
+        window.set_wm_name(title)
+        self.display.flush()
+
+
+class FocusGuardXvfbTests(EwmhTestCase):
+    """O callback do FocusGuard vem uma vez por transição real, e só nelas."""
+
+    def start_guard(self, spec, log):
+        guard = FocusGuard.from_spec(spec, log.append).start()
+        self.addCleanup(guard.stop)
+        return guard
+
+    def test_once_per_transition(self):
+        log = []
+        guard = self.start_guard({"class": "MacroJogo"}, log)
+        self.assertFalse(guard.focused)
+        self.activate(self.game)
+        self.assertTrue(wait_for(lambda: log == [True]), log)
+        # PropertyNotify sem transição: a mesma janela de novo e outro título
+        self.activate(self.game)
+        self.rename(self.game, "Jogo - nível 2")
+        self.activate(self.terminal)
+        self.assertTrue(wait_for(lambda: len(log) >= 2), log)
+        # Sem janela ativa continua sem foco
+        self.activate(None)
+        self.activate(self.terminal)
+        self.activate(self.game)
+        self.assertTrue(wait_for(lambda: len(log) >= 3), log)
+        time.sleep(0.1)
+        self.assertEqual(log, [True, False, True])
+        self.assertEqual(guard.changes, 3)
+        self.assertTrue(guard.focused)
+
+    def test_title_change_of_active_window(self):
+        log = []
+        guard = self.start_guard({"title": "nível"}, log)
+        self.activate(self.game)
+        self.assertTrue(wait_for(lambda: log == [True]), log)
+        self.rename(self.game, "Jogo - menu")
+        self.assertTrue(wait_for(lambda: len(log) >= 2), log)
+        # O título de uma janela inativa não importa
+        self.rename(self.terminal, "Terminal - nível")
+        self.rename(self.game, "Jogo - nível 3")
+        self.assertTrue(wait_for(lambda: len(log) >= 3), log)
+        time.sleep(0.1)
+        self.assertEqual(log, [True, False, True])
+        self.assertTrue(guard.focused)
+
+
+class Counter(_NullController):
+    def __init__(self):
+        self.clicks = 0
+
+    def click(self, button, count=1):
+        self.clicks += count
+
+
+class TkFocusPauseXvfbTests(EwmhTestCase):
+    """Pausa e retomada por foco da GUI tkinter (_apply_focus) com um FocusGuard real."""
+
+    GUI = os.path.join(HERE, os.pardir, "Tkinter_Versions", "MacroV2.0", "MacroV2.0.py")
+
+    @classmethod
+    def setUpClass(cls):
+        # Antes de subir o Xvfb: um SkipTest depois dele pularia o tearDownClass
+        for module in ("tkinter", "pynput"):
+            if importlib.util.find_spec(module) is None:
+                raise unittest.SkipTest(f"{module} não instalado")
+        super().setUpClass()
+        spec = importlib.util.spec_from_file_location("macro_gui_tk", cls.GUI)
+        cls.gui = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.gui)
+
+    def make_app(self, mouse):
+        """MacroAutomation só com o estado que início, pausa e foco usam (sem hooks nem processo do motor)."""
+        gui = self.gui
+        app = gui.MacroAutomation.__new__(gui.MacroAutomation)
+        app.root = gui.tk.Tk()
+        self.addCleanup(app.root.destroy)
+        app._gui_thread = threading.current_thread()
+        app.theme = gui.ThemeManager.THEMES["dark"]
+        app.statuses = []
+        app._update_status = lambda message, color: app.statuses.append(message)
+        config_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(config_dir.cleanup)
+        app.config_mgr = gui.ConfigManager(os.path.join(config_dir.name, "macro_config.json"))
+        app.config_mgr.config.update({
+            "pause_on_focus_loss": True, "target_window": {"class": "MacroJogo"},
+            "failsafe_corner_px": 0, "watchdog_timeout_s": 0,
+        })
+        app.action_type = gui.tk.StringVar(app.root, value="click")
+        app.saved_x = app.saved_y = 10
+        app.script_file = None
+        app.engine_process = None
+        app.engine = None
+        app.window_tracker = None
+        app.focus_guard = None
+        app._focus_paused = False
+        app._run_program = None
+        app._state_lock = threading.Lock()
+        app._run_id = 0
+        app.is_running = app.is_paused = False
+        app.metrics = MacroMetrics()
+        app.screen_size = (1280, 1024)
+        app.monitor_layout = None
+        app.coordinate_mapper = None
+        app.mouse_controller, app.keyboard_controller = track_controllers(mouse, _NullController())
+        app.input_state = app.mouse_controller.input_state
+        self.addCleanup(app._stop_focus_guard)
+        self.addCleanup(app._stop_macro)
+        return app
+
+    def pump(self, app, predicate, timeout=2.0):
+        """Roda o laço do Tk (os root.after do FocusGuard) até a condição valer."""
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            app.root.update()
+            time.sleep(0.005)
+        return predicate()
+
+    def test_pause_and_resume_on_focus(self):
+        mouse = Counter()
+        app = self.make_app(mouse)
+        program = script("repeat\n  click\n  wait 5\nend\n")
+
+        # Sem foco na janela alvo, o início fica aguardando
+        self.assertTrue(app._start_macro(program=program))
+        self.assertFalse(app.is_running)
+        self.assertTrue(app._focus_paused)
+
+        self.activate(self.game)
+        self.assertTrue(self.pump(app, lambda: app.is_running and mouse.clicks > 0))
+
+        self.activate(self.terminal)
+        self.assertTrue(self.pump(app, lambda: not app.is_running and app._focus_paused))
+        self.assertIn("Janela alvo sem foco: pausado", app.statuses)
+        self.assertIs(app._run_program, program)
+        app.macro_thread.join(1.0)
+        clicks = mouse.clicks
+        time.sleep(0.05)
+        self.assertEqual(mouse.clicks, clicks)
+
+        # De volta ao foco: o mesmo programa recomeça
+        self.activate(self.game)
+        self.assertTrue(self.pump(app, lambda: app.is_running and mouse.clicks > clicks))
+
+        # Uma pausa manual não é desfeita pelo foco
+        app._pause_macro()
+        app.macro_thread.join(1.0)
+        self.activate(self.terminal)
+        self.activate(self.game)
+        self.assertFalse(self.pump(app, lambda: app.is_running, timeout=0.3))
+        self.assertTrue(app.is_paused)
+
+
+if __name__ == "__main__":
+    unittest.main()
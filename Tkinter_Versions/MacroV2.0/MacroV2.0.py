@@ -17,7 +17,9 @@ Funcionalidades V2.0:
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
+import multiprocessing
+import queue
 import threading
 import time
 import json
@@ -31,6 +33,19 @@ except ImportError:
     print("Erro: pynput não está instalado. Execute: pip install pynput")
     exit(1)
 
+# macro_engine.py é compartilhado pelas duas versões (pasta Shared na raiz do
+# repositório); no executável do PyInstaller ele já vem empacotado
+if not getattr(sys, "frozen", False):
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "Shared"))
+from macro_engine import (
+    ControlServer, CoordinateMapper, EngineProcess, FAILSAFE_REASON, FocusGuard, HookEventQueue,
+    HotkeyMatcher, InputHub, InputRecorder, LIMIT_REASONS, MacroEngine, MacroMetrics, MonitorLayout,
+    MonitorWatcher, OnDemandHook, Recording, RunLimits, ScheduledTrigger, ScriptCompiler, TrackSet,
+    TriggerScheduler, WINDOW_REASON, WindowTracker, build_simple_program, create_controllers,
+    default_control_address, parse_remote_settings, resolve_combo, simplify_recording,
+    window_under_pointer, x11_monitor_layout
+)
+
 # ===== VARIÁVEL GLOBAL CRÍTICA =====
 # Capturar o diretório correto ANTES de qualquer mudança
 # Isso é essencial para PyInstaller --onefile
@@ -97,9 +112,38 @@ class ConfigManager:
             "key_pause": "f2",
             "key_exit": "f3",
             "click_delay_ms": 100,
-            "action_type": "click",  # 'click' ou 'hold'
+            "action_type": "click",  # 'click', 'hold' ou 'type'
             "hold_duration_ms": 500,
-            "custom_key_name": "Nenhuma"
+            "custom_key_name": "Nenhuma",
+            "custom_key_combo": None,  # Tecla ou acorde ("ctrl+shift+x")
+            "control_api_enabled": False,  # Servidor de controle local
+            "control_socket": None,
+            "control_port": 47800,
+            "metrics_textfile": None,  # Exportação Prometheus (textfile)
+            "input_backend": "pynput",  # "pynput", "uinput" (Linux, também Wayland) ou "xtest"
+            "uinput_device": None,
+            "xtest_flush_policy": "tick",  # immediate, action, tick ou manual
+            "worker_cpus": None,  # Afinidade do worker, ex.: "2-3" (Linux)
+            "worker_sched_policy": None,  # "fifo", "rr" ou "other" (requer permissão)
+            "worker_rt_priority": 10,
+            "worker_nice": None,
+            "engine_process": False,  # Motor em processo separado (isola do GIL da GUI)
+            "failsafe_corner_px": 0,  # Cursor a N px do canto de um monitor para o macro (0 = desligado)
+            "watchdog_timeout_s": 5.0,  # Motor sem batimento por esse tempo é parado (0 = desligado)
+            "max_injections_per_sec": None,  # Teto global de injeções por segundo
+            "window_relative": False,  # Coordenadas relativas à janela alvo (X11, requer python-xlib)
+            "target_window": None,  # {"title": trecho do título, "class": WM_CLASS}
+            "pause_on_focus_loss": False,  # Pausa quando a janela alvo perde o foco (X11 EWMH, requer python-xlib)
+            "saved_target": None,  # Coordenada salva normalizada: {"monitor", "index", "u", "v"}
+            "capture_layout": None,  # Monitores no momento da captura (remapeia se mudarem)
+            "profiles": {},  # nome -> {"tracks": [{"name", "script" ou "source"}], "schedule": [...], "limits": {...}}
+            "active_profile": None,
+            "recording_file": "gravacao.mrec",  # Gravação de mouse/teclado ao lado da config
+            "recording_simplify_px": None,  # Simplifica a gravação ao parar (tolerância em px, requer NumPy)
+            "recording_simplify_ms": 0,  # Intervalo máximo entre pontos mantidos (0 = sem limite)
+            "script_file": None,  # Script de macro (.macro) ao lado da config
+            "type_text": "",  # Texto da ação de digitação
+            "type_char_delay_ms": 0  # Pausa entre caracteres (0 = em lote)
         }
         self.config = self.load_config()
     
@@ -197,8 +241,10 @@ class MacroAutomation:
     def __init__(self, root):
         """Inicializa a aplicação de automação de macro V2.0."""
         self.root = root
+        # Widgets e variáveis do tkinter só podem ser tocados nesta thread
+        self._gui_thread = threading.current_thread()
         self.root.title("Macro Automation V2.0 - F1 (Start) F2 (Pause) F3 (Exit)")
-        self.root.geometry("700x700")
+        self.root.geometry("700x960")
         self.root.resizable(True, True)
         self.root.minsize(500, 600)
         
@@ -241,8 +287,17 @@ class MacroAutomation:
         self.root.configure(bg=self.theme["bg"])
         
         # Variáveis de controle
-        self.mouse_controller = MouseController()
-        self.keyboard_controller = KeyboardController()
+        self.mouse_controller, self.keyboard_controller = self._create_controllers()
+        # Botões e teclas que o macro mantém pressionados (ver InputState)
+        self.input_state = self.mouse_controller.input_state
+        # Cantos do failsafe: tamanho da tela lido uma vez, na thread da GUI
+        self.screen_size = self._backend_options()[0]
+        # Monitores atuais e o mapeamento da coordenada salva; o tkinter não
+        # avisa mudanças de monitor: no X11 o MonitorWatcher (RandR) avisa, e
+        # o layout também é relido a cada início
+        self.monitor_layout = None
+        self.coordinate_mapper = None
+        self.monitor_watcher = self._start_monitor_watcher()
         self.is_running = False
         self.is_paused = False
         self.capture_mode = False
@@ -255,9 +310,13 @@ class MacroAutomation:
         self.button_type = tk.StringVar(value=self.config_mgr.get("button_type", "esquerdo"))
         
         # Tecla customizada (para suportar qualquer tecla)
-        self.custom_key = self.config_mgr.get("custom_key", None)
+        # Tupla de teclas; mais de uma = acorde
+        self.custom_key = self._load_custom_key()
         self.custom_key_name = self.config_mgr.get("custom_key_name", "Nenhuma")
         
+        # Script de macro (arquivo .macro ao lado do macro_config.json)
+        self.script_file = self.config_mgr.get("script_file")
+        
         # Tipo de ação (clique ou pressão prolongada)
         self.action_type = tk.StringVar(value=self.config_mgr.get("action_type", "click"))
         
@@ -267,12 +326,54 @@ class MacroAutomation:
         # Duração de pressão prolongada (em milissegundos)
         self.hold_duration_ms = tk.IntVar(value=self.config_mgr.get("hold_duration_ms", 500))
         
-        # Thread para execução do macro
-        self.macro_thread = None
+        # Texto para a ação de digitação (e pausa entre caracteres, 0 = em lote)
+        self.type_text = self.config_mgr.get("type_text", "") or ""
+        self.type_char_delay_ms = tk.IntVar(value=self.config_mgr.get("type_char_delay_ms", 0))
+        self._type_text_save_job = None
         
-        # Listeners
-        self.listener = None
-        self.mouse_listener = None
+        # Thread para execução do macro e geração da execução atual
+        # (evita dois loops simultâneos quando start/pause chegam rápido)
+        self.macro_thread = None
+        self._run_id = 0
+        self._state_lock = threading.Lock()
+        self.engine = None
+        
+        # Métricas do motor (painel de estatísticas e exportação)
+        self.metrics = MacroMetrics()
+        
+        # Motor fora do processo da GUI (opcional): a GUI só envia comandos
+        self.engine_process = self._create_engine_process()
+        
+        # Servidor de controle local (opcional)
+        self.control_server = None
+        
+        # Inícios agendados dos perfis (uma thread, só se houver gatilhos)
+        self.trigger_scheduler = TriggerScheduler(self._on_scheduled_trigger)
+        
+        # Geometria da janela alvo (coordenadas relativas), criada sob demanda
+        self.window_tracker = None
+        # Pausa automática quando a janela alvo perde o foco: o programa da
+        # execução atual é guardado para retomar quando o foco voltar
+        self.focus_guard = None
+        self._focus_paused = False
+        self._run_program = None
+        
+        # Hooks globais: um único hook de teclado compartilhado (hotkeys e
+        # diálogos de captura assinam) e o de mouse só durante a captura.
+        # Os callbacks só enfileiram; disco e GUI ficam com hook_events
+        self.hook_events = HookEventQueue(self.metrics)
+        self.input_hub = InputHub(lambda on_press, on_release: Listener(
+            on_press=self.hook_events.timed(on_press, "teclado"),
+            on_release=self.hook_events.timed(on_release, "teclado")
+        ))
+        self.mouse_hook = OnDemandHook(lambda: MouseListener(
+            on_move=self.hook_events.timed(self._on_mouse_move, "mouse"),
+            on_click=self.hook_events.timed(self._on_mouse_click, "mouse")
+        ), "mouse", self.metrics)
+        
+        # Gravação em andamento (InputRecorder) e sua assinatura no teclado
+        self.recorder = None
+        self._record_subscription = None
         
         # Keybinds
         key_start_str = self.config_mgr.get("key_start", "f1")
@@ -290,6 +391,8 @@ class MacroAutomation:
         self.key_pause = self._string_to_key(key_pause_str)
         self.key_exit = self._string_to_key(key_exit_str)
         
+        self._compile_hotkeys()
+        
         log_msg = f"Hotkeys convertidos: START={self.key_start}, PAUSE={self.key_pause}, EXIT={self.key_exit}\n"
         print(log_msg, end="")
         try:
@@ -304,6 +407,10 @@ class MacroAutomation:
         # Construir interface gráfica
         self._build_gui()
         
+        # Servidor de controle local
+        self._start_control_server()
+        self._load_schedule()
+        
         # Gerenciar fechamento da janela
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
     
@@ -311,6 +418,9 @@ class MacroAutomation:
         """Converte string para objeto Key do pynput."""
         try:
             key_str_clean = key_str.lower().strip()
+            # Acordes ("ctrl+shift+x") e sequências ("g g") ficam como texto
+            if len(key_str_clean) > 1 and ("+" in key_str_clean or " " in key_str_clean):
+                return key_str_clean
             # Tentar com underscore
             try:
                 result = getattr(Key, key_str_clean)
@@ -346,30 +456,72 @@ class MacroAutomation:
             print(f"Erro em _key_to_string: {e}, retornando f1")
             return "f1"
     
-    def _normalize_key(self, key):
-        """Normaliza uma tecla para comparação."""
-        try:
-            # Se é uma string, retornar como está
-            if isinstance(key, str):
-                return key.lower()
-            # Se é um Key enum, retornar o nome
+    def _compile_hotkeys(self):
+        """Compila os hotkeys da configuração no autômato de reconhecimento."""
+        defaults = {"start": "f1", "pause": "f2", "exit": "f3"}
+        specs = {}
+        for action, default in defaults.items():
+            spec = self.config_mgr.get(f"key_{action}", default)
             try:
-                return key.name.lower().lstrip("_")
-            except:
-                return str(key).lower()
-        except:
-            return str(key).lower()
+                HotkeyMatcher.parse(spec)
+                specs[action] = spec
+            except ValueError as e:
+                print(f"Hotkey inválido para {action} ({e}), usando {default}")
+                specs[action] = default
+        self.hotkeys = HotkeyMatcher(specs)
     
-    def _initialize_listeners(self):
-        """Inicializa os listeners de teclado e mouse de forma segura."""
+    def _load_custom_key(self):
+        """Lê a tecla (ou acorde) customizada salva na configuração."""
+        combo = self.config_mgr.get("custom_key_combo") or self.config_mgr.get("custom_key_stored")
+        if not combo:
+            return None
         try:
-            self.mouse_listener = MouseListener(on_click=self._on_mouse_click)
-            self.mouse_listener.start()
-            
-            self.listener = Listener(on_press=self._on_key_press)
-            self.listener.start()
-        except Exception as e:
-            print(f"Erro ao inicializar listeners: {str(e)}")
+            return resolve_combo(combo)
+        except ValueError as e:
+            print(f"Tecla customizada inválida '{combo}': {e}")
+            return None
+    
+    def _create_controllers(self):
+        """Cria os controladores do backend de injeção configurado."""
+        backend = self.config_mgr.get("input_backend", "pynput")
+        try:
+            return create_controllers(backend, *self._backend_options(), max_rate=self._max_rate())
+        except (OSError, ValueError) as e:
+            print(f"Backend de injeção '{backend}' indisponível ({e}); usando pynput")
+            return create_controllers("pynput", max_rate=self._max_rate())
+    
+    def _backend_options(self):
+        """Tamanho da tela, dispositivo uinput e política de flush do XTest."""
+        return (
+            (self.root.winfo_screenwidth(), self.root.winfo_screenheight()),
+            self.config_mgr.get("uinput_device"), self.config_mgr.get("xtest_flush_policy", "tick")
+        )
+    
+    def _max_rate(self):
+        """Teto de injeções por segundo (None ou 0 = sem teto)."""
+        return self.config_mgr.get("max_injections_per_sec") or None
+    
+    def _create_engine_process(self):
+        """Inicia o processo do motor se "engine_process" estiver ativo."""
+        if not self.config_mgr.get("engine_process", False):
+            return None
+        engine_process = EngineProcess(
+            self.metrics, self.config_mgr.get("input_backend", "pynput"), *self._backend_options(),
+            max_rate=self._max_rate()
+        )
+        try:
+            engine_process.start()
+        except OSError as e:
+            print(f"Não foi possível iniciar o processo do motor ({e}); usando thread local")
+            return None
+        print("Motor executando em processo separado")
+        return engine_process
+    
+    def _initialize_listeners(self):
+        """Assina os hotkeys no hook de teclado compartilhado e o instala."""
+        self.hook_events.start()
+        self.input_hub.subscribe(self._on_key_press, self._on_key_release, InputHub.PRIORITY_HOTKEYS)
+        self.input_hub.start()
     
     def _build_gui(self):
         """Constrói a interface gráfica completa."""
@@ -384,6 +536,14 @@ class MacroAutomation:
         arquivo_menu.add_command(label="Salvar Config Manualmente", command=self._save_config_manually)
         arquivo_menu.add_command(label="Criar Config Padrão", command=self._create_default_config)
         arquivo_menu.add_separator()
+        arquivo_menu.add_command(label="Carregar Script de Macro...", command=self._load_script_dialog)
+        arquivo_menu.add_command(label="Desativar Script", command=self._clear_script)
+        arquivo_menu.add_separator()
+        arquivo_menu.add_command(label="Iniciar Gravação", command=self._toggle_recording)
+        self.record_menu_index = arquivo_menu.index(tk.END)
+        arquivo_menu.add_command(label="Reproduzir Gravação", command=self._play_recording)
+        self.arquivo_menu = arquivo_menu
+        arquivo_menu.add_separator()
         arquivo_menu.add_command(label="Sair", command=self._on_closing)
         
         # Menu Configurações
@@ -391,6 +551,16 @@ class MacroAutomation:
         menubar.add_cascade(label="Configurações", menu=config_menu)
         config_menu.add_command(label="Rebindar Teclas...", command=self._open_keybind_dialog)
         config_menu.add_command(label="Alterar Tema...", command=self._open_theme_dialog)
+        self.window_relative_var = tk.BooleanVar(value=self.config_mgr.get("window_relative", False))
+        config_menu.add_checkbutton(
+            label="Coordenadas Relativas à Janela", variable=self.window_relative_var,
+            command=self._toggle_window_relative
+        )
+        self.pause_on_focus_loss_var = tk.BooleanVar(value=self.config_mgr.get("pause_on_focus_loss", False))
+        config_menu.add_checkbutton(
+            label="Pausar sem Foco na Janela Alvo", variable=self.pause_on_focus_loss_var,
+            command=self._toggle_pause_on_focus_loss
+        )
         config_menu.add_separator()
         config_menu.add_command(label="Restaurar Padrão", command=self._reset_all)
         
@@ -423,6 +593,14 @@ class MacroAutomation:
             command=self._on_action_change
         ).pack(anchor=tk.W)
         
+        ttk.Radiobutton(
+            action_frame,
+            text="Digitar Texto",
+            variable=self.action_type,
+            value="type",
+            command=self._on_action_change
+        ).pack(anchor=tk.W)
+        
         # ===== SEÇÃO: Seleção de Botão =====
         button_frame = ttk.LabelFrame(main_frame, text="Seleção de Botão/Tecla", padding="10")
         button_frame.pack(fill=tk.X, pady=(0, 15))
@@ -431,21 +609,24 @@ class MacroAutomation:
             button_frame,
             text="Botão Esquerdo do Mouse",
             variable=self.button_type,
-            value="esquerdo"
+            value="esquerdo",
+            command=self._reload_program
         ).pack(anchor=tk.W)
         
         ttk.Radiobutton(
             button_frame,
             text="Botão Direito do Mouse",
             variable=self.button_type,
-            value="direito"
+            value="direito",
+            command=self._reload_program
         ).pack(anchor=tk.W)
         
         ttk.Radiobutton(
             button_frame,
             text="Qualquer Tecla (Customizada)",
             variable=self.button_type,
-            value="custom"
+            value="custom",
+            command=self._reload_program
         ).pack(anchor=tk.W)
         
         # Label para exibir tecla customizada
@@ -517,6 +698,29 @@ class MacroAutomation:
         )
         hold_spinbox.pack(side=tk.LEFT, padx=10)
         
+        # ===== SEÇÃO: Texto para Digitar =====
+        type_frame = ttk.LabelFrame(main_frame, text="Texto para Digitar", padding="10")
+        type_frame.pack(fill=tk.X, pady=(0, 15))
+        
+        self.type_text_widget = tk.Text(type_frame, height=3, wrap=tk.WORD, font=("Arial", 10))
+        self.type_text_widget.insert("1.0", self.type_text)
+        self.type_text_widget.pack(fill=tk.X, pady=(0, 10))
+        self.type_text_widget.bind("<<Modified>>", self._on_type_text_change)
+        
+        type_delay_frame = ttk.Frame(type_frame)
+        type_delay_frame.pack(fill=tk.X)
+        
+        ttk.Label(type_delay_frame, text="Pausa entre caracteres (ms, 0 = lote):", width=30).pack(side=tk.LEFT)
+        type_delay_spinbox = ttk.Spinbox(
+            type_delay_frame,
+            from_=0,
+            to=5000,
+            textvariable=self.type_char_delay_ms,
+            width=10,
+            command=self._on_type_delay_change
+        )
+        type_delay_spinbox.pack(side=tk.LEFT, padx=10)
+        
         # ===== SEÇÃO: Hotkeys =====
         hotkey_frame = ttk.LabelFrame(main_frame, text="Hotkeys de Controle", padding="10")
         hotkey_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
@@ -548,15 +752,62 @@ class MacroAutomation:
             font=("Arial", 9)
         )
         self.status_label.pack(anchor=tk.W)
+        
+        self.script_label = ttk.Label(
+            status_frame,
+            text=self._script_label_text(),
+            font=("Arial", 9),
+            foreground="gray"
+        )
+        self.script_label.pack(anchor=tk.W)
+        
+        # ===== SEÇÃO: Estatísticas =====
+        stats_frame = ttk.LabelFrame(main_frame, text="Estatísticas", padding="10")
+        stats_frame.pack(fill=tk.X, pady=(15, 0))
+        
+        self.stats_label = ttk.Label(
+            stats_frame,
+            text=self.metrics.summary(),
+            font=("Consolas", 9),
+            justify=tk.LEFT
+        )
+        self.stats_label.pack(anchor=tk.W)
+        self.root.after(500, self._refresh_stats)
     
     def _on_action_change(self):
         """Callback quando tipo de ação é alterado."""
         self.config_mgr.set("action_type", self.action_type.get())
+        self._reload_program()
     
     def _on_timing_change(self):
         """Callback quando timing é alterado."""
         self.config_mgr.set("click_delay_ms", self.click_delay_ms.get())
         self.config_mgr.set("hold_duration_ms", self.hold_duration_ms.get())
+        self._reload_program()
+    
+    def _on_type_text_change(self, event=None):
+        """Callback quando o texto muda (salvo com atraso para não gravar a cada tecla)."""
+        if not self.type_text_widget.edit_modified():
+            return
+        self.type_text_widget.edit_modified(False)
+        self.type_text = self.type_text_widget.get("1.0", "end-1c")
+        if self._type_text_save_job is not None:
+            self.root.after_cancel(self._type_text_save_job)
+        self._type_text_save_job = self.root.after(500, self._save_type_text)
+    
+    def _sync_type_text_widget(self):
+        """Reflete no campo de texto um valor recebido pelo servidor de controle."""
+        self.type_text_widget.delete("1.0", tk.END)
+        self.type_text_widget.insert("1.0", self.type_text)
+        self.type_text_widget.edit_modified(False)
+    
+    def _save_type_text(self):
+        self._type_text_save_job = None
+        self.config_mgr.set("type_text", self.type_text)
+    
+    def _on_type_delay_change(self):
+        """Callback quando a pausa entre caracteres é alterada."""
+        self.config_mgr.set("type_char_delay_ms", self.type_char_delay_ms.get())
     
     def _start_capture_mode(self):
         """Ativa o modo de captura de coordenadas."""
@@ -567,156 +818,773 @@ class MacroAutomation:
         )
         
         self.capture_mode = True
+        if not self.mouse_hook.acquire("capture"):
+            self.capture_mode = False
+            self._update_status("Erro ao instalar hook de mouse", self.theme["error"])
+            return
         self.capture_button.config(state=tk.DISABLED, text="Aguardando clique...")
         self._update_status("Aguardando clique na tela...", self.theme["warning"])
         self.root.update()
     
     def _on_key_press(self, key):
-        """Manipulador de eventos de teclado para hotkeys."""
+        """Manipulador de eventos de teclado para hotkeys (thread do hook)."""
+        received_at = time.perf_counter()
         try:
-            # Normalizar tecla para comparação
-            key_pressed = self._normalize_key(key)
-            key_start = self._normalize_key(self.key_start)
-            key_pause = self._normalize_key(self.key_pause)
-            key_exit = self._normalize_key(self.key_exit)
-            
-            if key_pressed == key_start:
-                if self.saved_x is None or self.saved_y is None:
-                    messagebox.showwarning(
-                        "Aviso",
-                        "Por favor, capture uma coordenada primeiro!"
-                    )
-                    return
-                
-                self.is_running = True
-                self.is_paused = False
-                self._update_status("Executando...", self.theme["success"])
-                
-                self.macro_thread = threading.Thread(target=self._execute_macro, daemon=True)
-                self.macro_thread.start()
-            
-            elif key_pressed == key_pause:
-                self.is_running = False
-                self.is_paused = True
-                self._release_all()
-                self._update_status("Pausado", self.theme["warning"])
-            
-            elif key_pressed == key_exit:
-                self.is_running = False
-                self.is_paused = False
-                self._release_all()
-                self.config_mgr.save_config()
-                self.root.after(500, self._on_closing)
-        
+            action = self.hotkeys.feed_press(key)
         except AttributeError:
-            pass
+            return
+        if action:
+            self.hook_events.post(self._handle_hotkey, action, received_at)
+    
+    def _handle_hotkey(self, action, received_at):
+        """Executa a ação de um hotkey (thread consumidora de eventos)."""
+        if action == "start":
+            if not self._start_macro(received_at):
+                self.root.after(0, lambda: messagebox.showwarning(
+                    "Aviso",
+                    "Por favor, capture uma coordenada primeiro!"
+                ))
+        
+        elif action == "pause":
+            self._pause_macro()
+        
+        elif action == "exit":
+            self._stop_macro()
+            self.config_mgr.save_config()
+            self.root.after(500, self._on_closing)
     
-    def _execute_macro(self):
-        """Executa a automação do macro em thread separada."""
+    def _on_key_release(self, key):
+        """Acompanha a soltura de modificadores para os acordes."""
+        self.hotkeys.feed_release(key)
+    
+    def _start_macro(self, requested_at=None, program=None):
+        """Inicia o macro (ou o program dado). Retorna False se não há coordenada capturada."""
+        needs_coords = self.action_type.get() != "type"
+        needs_coords = needs_coords and program is None and not self.script_file and not self._uses_tracks()
+        if needs_coords and (self.saved_x is None or self.saved_y is None):
+            return False
+        
         try:
-            action = self.action_type.get()
-            button_type = self.button_type.get()
-            
-            # Mover mouse para coordenada
-            if button_type in ["esquerdo", "direito"]:
-                self.mouse_controller.position = (self.saved_x, self.saved_y)
-                time.sleep(0.05)
+            # Spec da janela alvo; na thread local o motor recebe o WindowTracker
+            window = self._window_spec()
+            if window and not self.engine_process:
+                window = self._window_tracker(window)
+            guard = self._focus_guard()
+        except (OSError, ValueError) as e:
+            self._update_status(f"Janela alvo: {e}", self.theme["error"])
+            return True
+        if guard is not None and not guard.focused:
+            # Começa quando a janela alvo ganhar o foco
+            self._focus_paused, self._run_program = True, program
+            self._update_status("Aguardando foco na janela alvo...", self.theme["warning"])
+            return True
+        self._refresh_monitor_layout()
+        
+        with self._state_lock:
+            if self.is_running:
+                return True
+            self._run_id += 1
+            self._run_program = program
+            self.is_running = True
+            self.is_paused = False
+            status_callback = lambda text: self._update_status(text, self.theme["success"])
+            if self.engine_process:
+                self.engine = self.engine_process.session(
+                    status_callback, self._worker_scheduling(), self._failsafe(), window
+                )
+            else:
+                self.engine = MacroEngine(
+                    self.mouse_controller, self.keyboard_controller, self.metrics,
+                    status_callback=status_callback, scheduling=self._worker_scheduling(),
+                    failsafe=self._failsafe(), window=window
+                )
+            self.macro_thread = threading.Thread(
+                target=self._execute_macro,
+                args=(self._run_id, self.engine, requested_at or time.perf_counter(), program),
+                daemon=True
+            )
+            self.macro_thread.start()
+        
+        self._update_status("Executando...", self.theme["success"])
+        return True
+    
+    def _pause_macro(self):
+        """Pausa o macro e solta todas as teclas e botões."""
+        self._focus_paused = False
+        with self._state_lock:
+            self.is_running = False
+            self.is_paused = True
+            if self.engine:
+                self.engine.stop()
+        self._release_all()
+        self._update_status("Pausado", self.theme["warning"])
+    
+    def _stop_macro(self):
+        """Para o macro sem deixá-lo em estado de pausa."""
+        self._focus_paused = False
+        with self._state_lock:
+            self.is_running = False
+            self.is_paused = False
+            if self.engine:
+                self.engine.stop()
+        self._release_all()
+    
+    def _execute_macro(self, run_id, engine, requested_at, program=None):
+        """Executa a automação do macro em thread separada (via MacroEngine)."""
+        try:
+            limits = None
+            if program is None:
+                program = self._build_program()
+                limits = RunLimits.from_profile(self._active_profile())
+            reason = engine.run(program, requested_at, limits)
             
-            while self.is_running:
-                if button_type == "esquerdo":
-                    self._perform_action(Button.left, action)
-                elif button_type == "direito":
-                    self._perform_action(Button.right, action)
-                elif button_type == "custom":
-                    if self.custom_key:
-                        self._perform_keyboard_action(self.custom_key, action)
-                    else:
-                        self._update_status("Erro: Nenhuma tecla customizada selecionada", self.theme["error"])
-                        break
-                
-                # Delay entre cliques
-                if action == "click":
-                    time.sleep(self.click_delay_ms.get() / 1000)
-                else:
-                    # Se for hold, aguarda o tempo do hold + delay
-                    time.sleep((self.hold_duration_ms.get() + self.click_delay_ms.get()) / 1000)
+            if run_id != self._run_id:
+                # Uma nova execução já assumiu o controle
+                return
             
             self._release_all()
-            self._update_status("Parado", self.theme["error"])
+            if reason == "finished" or reason in LIMIT_REASONS:
+                with self._state_lock:
+                    if run_id == self._run_id:
+                        self.is_running = False
+                # Jobs com limites já informaram o resumo pelo status_callback
+                if reason == "finished" and program.name != "texto":
+                    self._update_status("Script concluído", self.theme["success"])
+            elif reason == FAILSAFE_REASON:
+                with self._state_lock:
+                    if run_id == self._run_id:
+                        self.is_running = False
+                self._update_status("Failsafe acionado: macro parado", self.theme["error"])
+            elif reason == WINDOW_REASON:
+                with self._state_lock:
+                    if run_id == self._run_id:
+                        self.is_running = False
+                self._update_status("Janela alvo indisponível: macro parado", self.theme["error"])
+            else:
+                self._update_status("Parado", self.theme["error"])
         
         except Exception as e:
+            with self._state_lock:
+                if run_id == self._run_id:
+                    self.is_running = False
+            self._release_all()
             self._update_status(f"Erro: {str(e)}", self.theme["error"])
             print(f"Erro durante execução: {str(e)}")
     
-    def _perform_action(self, button, action_type):
-        """Realiza ação com o mouse."""
+    def _worker_scheduling(self):
+        """Afinidade/prioridade opcionais do worker lidas da configuração."""
+        scheduling = {
+            "cpus": self.config_mgr.get("worker_cpus"),
+            "policy": self.config_mgr.get("worker_sched_policy"),
+            "rt_priority": self.config_mgr.get("worker_rt_priority", 10),
+            "nice": self.config_mgr.get("worker_nice"),
+        }
+        if scheduling["cpus"] is None and not scheduling["policy"] and scheduling["nice"] is None:
+            return None
+        return scheduling
+    
+    def _failsafe(self):
+        """Argumentos do Watchdog (cantos dos monitores e batimento do motor) lidos da configuração."""
+        corner_px = self.config_mgr.get("failsafe_corner_px", 0)
+        timeout = self.config_mgr.get("watchdog_timeout_s", 5.0)
+        if not corner_px and not timeout:
+            return None
+        # Retângulos simples: os argumentos vão para o processo do motor
+        monitors = [(m.x, m.y, m.width, m.height) for m in self.monitor_layout.monitors]
+        return {"corner_px": corner_px, "heartbeat_timeout": timeout, "monitors": monitors}
+    
+    def _window_spec(self):
+        """Janela alvo ({"title", "class"}) se as coordenadas são relativas, senão None."""
+        if not self.config_mgr.get("window_relative", False):
+            return None
+        spec = self.config_mgr.get("target_window")
+        if not spec:
+            raise ValueError("capture a coordenada sobre a janela alvo")
+        return spec
+    
+    def _window_tracker(self, spec):
+        """WindowTracker da janela alvo, reaproveitado enquanto o spec não muda."""
+        tracker = self.window_tracker
+        if tracker is None or tracker.spec() != {key: value for key, value in spec.items() if value}:
+            if tracker is not None:
+                tracker.stop()
+            self.window_tracker = None
+            self.window_tracker = WindowTracker.from_spec(spec).start()
+        return self.window_tracker
+    
+    def _focus_guard(self):
+        """FocusGuard da janela alvo se a pausa por foco está ligada, reaproveitado enquanto o spec não muda."""
+        if not self.config_mgr.get("pause_on_focus_loss", False):
+            self._stop_focus_guard()
+            return None
+        spec = self.config_mgr.get("target_window")
+        if not spec:
+            raise ValueError("capture a coordenada sobre a janela alvo")
+        guard = self.focus_guard
+        if guard is None or guard.spec() != {key: value for key, value in spec.items() if value}:
+            self._stop_focus_guard()
+            self.focus_guard = FocusGuard.from_spec(spec, self._on_focus_changed).start()
+        return self.focus_guard
+    
+    def _stop_focus_guard(self):
+        guard, self.focus_guard = self.focus_guard, None
+        self._focus_paused = False
+        if guard is not None:
+            guard.stop()
+    
+    def _on_focus_changed(self, focused):
+        """Transição de foco da janela alvo (thread do FocusGuard): aplicada na thread da GUI."""
+        self.root.after(0, lambda: self._apply_focus(focused))
+    
+    def _apply_focus(self, focused):
+        if not focused and self.is_running:
+            program = self._run_program
+            self._pause_macro()
+            self._focus_paused, self._run_program = True, program
+            self._update_status("Janela alvo sem foco: pausado", self.theme["warning"])
+        elif focused and self._focus_paused and not self.is_running:
+            self._focus_paused = False
+            self._start_macro(program=self._run_program)
+    
+    def _build_program(self):
+        """Compila as trilhas do perfil, o script ativo ou a configuração simples."""
+        if self._uses_tracks():
+            name = self.config_mgr.get("active_profile")
+            return TrackSet.from_profile(self._active_profile(), self.config_mgr.config_file.parent, name)
+        if self.script_file:
+            return ScriptCompiler.load(self._script_path())
+        # O modo simples do tkinter posiciona o mouse uma vez, antes do loop
+        x, y = self._target_point()
+        return build_simple_program(
+            self.button_type.get(), self.action_type.get(), x, y,
+            self.click_delay_ms.get(), self.hold_duration_ms.get(), self.custom_key,
+            reposition_each_loop=False, type_text=self.type_text,
+            type_char_delay_ms=self.type_char_delay_ms.get()
+        )
+    
+    def _reload_program(self):
+        """Aplica mudanças de configuração ao programa em execução."""
+        engine = self.engine
+        if not self.is_running or engine is None or self.script_file or self._uses_tracks():
+            return
         try:
-            if action_type == "click":
-                self.mouse_controller.click(button, 1)
-            else:  # hold
-                self.mouse_controller.press(button)
-                time.sleep(self.hold_duration_ms.get() / 1000)
-                self.mouse_controller.release(button)
-        except Exception as e:
-            print(f"Erro ao performar ação do mouse: {e}")
+            engine.replace_program(self._build_program())
+        except (ValueError, tk.TclError) as e:
+            print(f"Configuração inválida, mantendo programa atual: {e}")
+    
+    def _script_path(self, script_file=None):
+        """Caminho absoluto do script ativo (relativo à pasta da config)."""
+        path = Path(script_file or self.script_file)
+        if not path.is_absolute():
+            path = self.config_mgr.config_file.parent / path
+        return path
+    
+    def _script_label_text(self):
+        if self._uses_tracks():
+            tracks = self._active_profile()["tracks"]
+            return f"Perfil: {self.config_mgr.get('active_profile')} ({len(tracks)} trilhas)"
+        return f"Script: {self.script_file}" if self.script_file else "Script: nenhum (modo simples)"
+    
+    def _active_profile(self):
+        """Perfil ativo do macro_config.json, ou None."""
+        name = self.config_mgr.get("active_profile")
+        if not name:
+            return None
+        return self.config_mgr.get("profiles", {}).get(name)
+    
+    def _uses_tracks(self):
+        """True se o perfil ativo define trilhas (agendador multi-trilha)."""
+        profile = self._active_profile()
+        return bool(profile and profile.get("tracks"))
+    
+    def _set_active_profile(self, name):
+        """Ativa um perfil (compilando suas trilhas) ou nenhum, com None."""
+        if name:
+            self._check_profile(name)
+        self.config_mgr.set("active_profile", name or None)
+        self.root.after(0, lambda: self.script_label.config(text=self._script_label_text()))
+    
+    def _check_profile(self, name):
+        """Valida um perfil (trilhas e limites) sem ativá-lo."""
+        profile = self.config_mgr.get("profiles", {}).get(name)
+        if profile is None:
+            raise ValueError(f"Perfil desconhecido: {name}")
+        if profile.get("tracks"):
+            TrackSet.from_profile(profile, self.config_mgr.config_file.parent, name)
+        RunLimits.from_profile(profile)
+    
+    def _set_script_file(self, script_file):
+        """Valida (compilando) e ativa um script, ou desativa com None."""
+        if script_file:
+            ScriptCompiler.load(self._script_path(script_file))
+        self.script_file = script_file or None
+        self.config_mgr.set("script_file", self.script_file)
+        self.script_label.config(text=self._script_label_text())
     
-    def _perform_keyboard_action(self, key, action_type):
-        """Realiza ação com o teclado."""
+    def _load_script_dialog(self):
+        """Abre um script de macro e o compila para validar."""
+        base_dir = self.config_mgr.config_file.parent
+        path = filedialog.askopenfilename(
+            title="Carregar Script de Macro",
+            initialdir=str(base_dir),
+            filetypes=[("Scripts de macro", "*.macro *.txt"), ("Todos os arquivos", "*")]
+        )
+        if not path:
+            return
+        
+        path = Path(path)
+        # Guardar caminho relativo quando o script está ao lado da config
+        script_file = path.name if path.parent.resolve() == base_dir.resolve() else str(path)
         try:
-            if action_type == "click":
-                self.keyboard_controller.press(key)
-                time.sleep(0.05)
-                self.keyboard_controller.release(key)
-            else:  # hold
-                self.keyboard_controller.press(key)
-                time.sleep(self.hold_duration_ms.get() / 1000)
-                self.keyboard_controller.release(key)
+            self._set_script_file(script_file)
         except Exception as e:
-            print(f"Erro ao performar ação do teclado: {e}")
+            messagebox.showerror("Erro no Script", f"Falha ao compilar o script:\n{e}")
+            return
+        
+        program = ScriptCompiler.load(self._script_path())
+        messagebox.showinfo(
+            "Script Carregado",
+            f"Script '{script_file}' compilado: {len(program)} instruções."
+        )
     
-    def _release_all(self):
-        """Solta todas as teclas e botões pressionados."""
+    def _clear_script(self):
+        """Volta ao modo simples (um ponto, clique ou hold)."""
+        self._set_script_file(None)
+        self._update_status("Script desativado", self.theme["warning"])
+    
+    def _recording_path(self):
+        """Caminho absoluto da gravação (relativo à pasta da config)."""
+        path = Path(self.config_mgr.get("recording_file") or "gravacao.mrec")
+        if not path.is_absolute():
+            path = self.config_mgr.config_file.parent / path
+        return path
+    
+    def _toggle_recording(self):
+        """Inicia ou finaliza a gravação de mouse e teclado."""
+        if self.recorder is None:
+            try:
+                self.recorder = InputRecorder(self._recording_path())
+            except OSError as e:
+                messagebox.showerror("Erro", f"Não foi possível criar a gravação:\n{e}")
+                return
+            if not self.mouse_hook.acquire("record"):
+                self.recorder.stop()
+                self.recorder = None
+                self._update_status("Erro ao instalar hook de mouse", self.theme["error"])
+                return
+            self._record_subscription = self.input_hub.subscribe(
+                self.recorder.on_press, self.recorder.on_release, InputHub.PRIORITY_RECORD
+            )
+            self.arquivo_menu.entryconfig(self.record_menu_index, label="Parar Gravação")
+            self._update_status("Gravando...", self.theme["warning"])
+            return
+        
+        recorder, self.recorder = self.recorder, None
+        self._record_subscription.cancel()
+        self._record_subscription = None
+        self.mouse_hook.release("record")
+        count = recorder.stop()
+        self.arquivo_menu.entryconfig(self.record_menu_index, label="Iniciar Gravação")
+        self._update_status(f"Gravação salva: {count} eventos", self.theme["success"])
+        if self.config_mgr.get("recording_simplify_px"):
+            threading.Thread(target=self._simplify_recording, daemon=True).start()
+    
+    def _simplify_recording(self):
+        """Simplifica a gravação recém-salva, fora da thread da GUI."""
+        path = self._recording_path()
+        simplified = path.with_name(path.name + ".simples")
         try:
-            self.mouse_controller.release(Button.left)
-        except:
-            pass
+            report = simplify_recording(
+                path, simplified,
+                float(self.config_mgr.get("recording_simplify_px")),
+                float(self.config_mgr.get("recording_simplify_ms") or 0)
+            )
+            os.replace(simplified, path)
+        except (OSError, ValueError, RuntimeError) as e:
+            error = f"Erro ao simplificar gravação: {e}"
+            self.root.after(0, lambda: self._update_status(error, self.theme["error"]))
+            return
+        text = (f"Gravação simplificada: {report['events_in']} -> {report['events_out']} eventos "
+                f"({report['reduction']}x, desvio máx. {report['max_deviation_px']} px)")
+        self.root.after(0, lambda: self._update_status(text, self.theme["success"]))
+    
+    def _play_recording(self):
+        """Reproduz a gravação salva pelo caminho de execução normal."""
+        if self.recorder is not None:
+            self._toggle_recording()
+        try:
+            recording = Recording(self._recording_path())
+        except (OSError, ValueError) as e:
+            messagebox.showwarning("Aviso", f"Nenhuma gravação disponível:\n{e}")
+            return
+        self._start_macro(program=recording)
+    
+    def _release_all(self):
+        """Solta só os botões e teclas que estão de fato pressionados."""
+        self.input_state.release_all()
+        # Local, o motor compartilha o mesmo estado; no processo do motor,
+        # o estado de lá é solto por comando
+        if self.engine is not None:
+            self.engine.release_all()
+    
+    def _start_control_server(self):
+        """Inicia o servidor de controle local se habilitado na configuração."""
+        if not self.config_mgr.get("control_api_enabled", False):
+            return
         
+        address = self.config_mgr.get("control_socket") or default_control_address(
+            self.config_mgr.get("control_port", 47800)
+        )
+        self.control_server = ControlServer(self._handle_control_command, address)
+        if not self.control_server.start():
+            self.control_server = None
+    
+    def _load_schedule(self):
+        """Carrega no agendador os gatilhos "schedule" de todos os perfis."""
+        triggers = []
+        for name, profile in self.config_mgr.get("profiles", {}).items():
+            try:
+                triggers.extend(ScheduledTrigger.from_profile(name, profile))
+            except ValueError as e:
+                print(f"Agendamento inválido no perfil {name}: {e}")
+        self.trigger_scheduler.set_triggers(triggers)
+        upcoming = self._next_scheduled()
+        if upcoming:
+            when = time.strftime("%d/%m %H:%M", time.localtime(upcoming["at"]))
+            message = f"Próximo início agendado: {upcoming['profile']} em {when}"
+            self.root.after(0, lambda: self._update_status(message, self.theme["success"]))
+    
+    def _next_scheduled(self):
+        """Próximo início agendado ({"profile", "at" em epoch}) ou None."""
+        upcoming = self.trigger_scheduler.upcoming(1)
+        if not upcoming:
+            return None
+        when, trigger = upcoming[0]
+        return {"profile": trigger.profile, "at": when}
+    
+    def _on_scheduled_trigger(self, trigger):
+        """Gatilho agendado (thread do agendador): ativa o perfil e inicia pelo caminho normal."""
+        if self.is_running:
+            message = f"Início agendado ignorado ({trigger.describe()}): macro já em execução"
+            self.root.after(0, lambda: self._update_status(message, self.theme["warning"]))
+            return
         try:
-            self.mouse_controller.release(Button.right)
-        except:
-            pass
+            if self.config_mgr.get("active_profile") != trigger.profile:
+                self._set_active_profile(trigger.profile)
+            started = self._start_macro()
+        except ValueError as e:
+            message = f"Erro no início agendado ({trigger.describe()}): {e}"
+            self.root.after(0, lambda: self._update_status(message, self.theme["error"]))
+            return
+        if not started:
+            message = f"Início agendado sem coordenada capturada: {trigger.profile}"
+            self.root.after(0, lambda: self._update_status(message, self.theme["error"]))
+            return
+        self.metrics.inc("scheduled_starts_total")
+    
+    def _handle_control_command(self, cmd, args):
+        """Executa um comando recebido pelo servidor de controle.
+        
+        Chamado na thread do servidor: as métricas respondem ali mesmo; os
+        demais comandos leem e alteram variáveis e widgets do tkinter, então
+        rodam na thread da GUI (root.after) e o resultado volta por uma fila.
+        """
+        if cmd == "metrics":
+            if args.get("format") == "prometheus":
+                return self.metrics.to_prometheus()
+            return self.metrics.snapshot()
+        return self._call_in_gui(self._run_control_command, cmd, args)
+    
+    def _call_in_gui(self, function, *args, timeout=2.0):
+        """Executa function na thread da GUI e devolve o resultado (ou relança o erro)."""
+        results = queue.Queue(maxsize=1)
         
-        # Soltar tecla customizada
+        def call():
+            try:
+                results.put((True, function(*args)))
+            except Exception as e:
+                results.put((False, e))
+        
+        self.root.after(0, call)
         try:
-            if self.custom_key:
-                self.keyboard_controller.release(self.custom_key)
-        except:
-            pass
+            ok, value = results.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("a interface não respondeu a tempo") from None
+        if not ok:
+            raise value
+        return value
+    
+    def _run_control_command(self, cmd, args):
+        """Comando do servidor de controle, já na thread da GUI."""
+        if cmd == "start":
+            if not self._start_macro():
+                raise ValueError("Nenhuma coordenada capturada")
+        elif cmd == "pause":
+            self._pause_macro()
+        elif cmd == "stop":
+            self._stop_macro()
+            self._update_status("Parado", self.theme["error"])
+        elif cmd == "reconfigure":
+            self._apply_remote_settings(args)
+        elif cmd != "status":
+            raise ValueError(f"Comando desconhecido: {cmd}")
+        return self._control_status()
+    
+    def _apply_remote_settings(self, args):
+        """Aplica configurações recebidas pelo servidor de controle (na thread da GUI).
+        
+        Tudo é validado antes da primeira atribuição: um argumento inválido
+        recusa o comando inteiro sem deixar configurações pela metade.
+        """
+        settings = parse_remote_settings(args)
+        if settings.get("script_file"):
+            ScriptCompiler.load(self._script_path(settings["script_file"]))
+        if settings.get("active_profile"):
+            self._check_profile(settings["active_profile"])
+        
+        for key in ("action_type", "button_type", "click_delay_ms", "hold_duration_ms",
+                    "type_char_delay_ms"):
+            if key in settings:
+                getattr(self, key).set(settings[key])
+        if "type_text" in settings:
+            self.type_text = settings["type_text"]
+            self._sync_type_text_widget()
+        if "saved_x" in settings:
+            self.saved_x, self.saved_y = settings["saved_x"], settings["saved_y"]
+            self._remember_target(self.saved_x, self.saved_y)
+            self.coord_label.config(text=f"Coordenadas: X={self.saved_x}, Y={self.saved_y}")
+        if "script_file" in settings:
+            self._set_script_file(settings["script_file"])
+        if "active_profile" in settings:
+            self._set_active_profile(settings["active_profile"])
+        if "custom_key_combo" in settings:
+            combo = settings["custom_key_combo"]
+            self.custom_key = settings["custom_key"]
+            self.custom_key_name = combo.upper() if combo else "Nenhuma"
+            self.config_mgr.config["custom_key_combo"] = combo
+            self.config_mgr.config["custom_key_name"] = self.custom_key_name
+        hotkeys = {name: settings[name] for name in ("key_start", "key_pause", "key_exit")
+                   if name in settings}
+        if hotkeys:
+            self.config_mgr.config.update(hotkeys)
+            self._compile_hotkeys()
+            self.key_start = self._string_to_key(self.config_mgr.get("key_start"))
+            self.key_pause = self._string_to_key(self.config_mgr.get("key_pause"))
+            self.key_exit = self._string_to_key(self.config_mgr.get("key_exit"))
+        
+        self.config_mgr.config.update({
+            key: value for key, value in self._control_status().items()
+            if key not in ("running", "paused", "type_text_length")
+        })
+        self.config_mgr.config["type_text"] = self.type_text
+        # Gravar em disco apenas quando pedido, para manter o comando barato
+        if settings["persist"]:
+            self.config_mgr.save_config()
+        
+        self._reload_program()
+        self._update_hotkey_display()
+        self.custom_key_label.config(text=f"Tecla selecionada: {self.custom_key_name}")
+    
+    def _control_status(self):
+        """Retorna o estado atual do macro para o servidor de controle."""
+        return {
+            "running": self.is_running,
+            "paused": self.is_paused,
+            "action_type": self.action_type.get(),
+            "button_type": self.button_type.get(),
+            "click_delay_ms": self.click_delay_ms.get(),
+            "hold_duration_ms": self.hold_duration_ms.get(),
+            "saved_x": self.saved_x,
+            "saved_y": self.saved_y,
+            "script_file": self.script_file,
+            "active_profile": self.config_mgr.get("active_profile"),
+            "next_scheduled": self._next_scheduled(),
+            "type_char_delay_ms": self.type_char_delay_ms.get(),
+            "type_text_length": len(self.type_text)
+        }
+    
+    def _refresh_stats(self):
+        """Atualiza o painel de estatísticas e o arquivo de métricas."""
+        snapshot = self.metrics.snapshot()
+        try:
+            self.stats_label.config(text=self.metrics.summary(snapshot))
+        except tk.TclError:
+            return  # Janela já destruída
+        
+        textfile = self.config_mgr.get("metrics_textfile")
+        if textfile:
+            try:
+                self.metrics.write_prometheus(textfile, snapshot)
+            except OSError as e:
+                print(f"Erro ao exportar métricas: {e}")
+        
+        self.root.after(500, self._refresh_stats)
     
     def _update_status(self, message, color):
-        """Atualiza o label de status na GUI."""
+        """Atualiza o label de status na GUI (de outra thread, via root.after)."""
+        if threading.current_thread() is not self._gui_thread:
+            self.root.after(0, lambda: self._update_status(message, color))
+            return
         try:
             self.status_label.config(text=f"Status: {message}")
             self.root.update()
         except:
             pass
     
+    def _on_mouse_move(self, x, y):
+        """Repassa movimentos à gravação em andamento (thread do hook)."""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.on_move(x, y)
+    
     def _on_mouse_click(self, x, y, button, pressed):
-        """Manipulador de eventos de mouse para captura de coordenadas."""
+        """Manipulador de eventos de mouse para captura de coordenadas e gravação."""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.on_click(x, y, button, pressed)
         if self.capture_mode and pressed:
-            self.saved_x = x
-            self.saved_y = y
             self.capture_mode = False
-            
-            # Salvar coordenadas
-            self.config_mgr.set("saved_x", self.saved_x)
-            self.config_mgr.set("saved_y", self.saved_y)
-            
+            self.hook_events.post(self._apply_captured_coordinate, x, y)
+    
+    def _apply_captured_coordinate(self, x, y):
+        """Grava a coordenada capturada e atualiza a GUI (fora do hook)."""
+        self.mouse_hook.release("capture")
+        message = "Coordenada capturada!"
+        if self.config_mgr.get("window_relative", False):
+            relative = self._capture_window(x, y)
+            if relative is None:
+                def reset_gui():
+                    self.capture_button.config(state=tk.NORMAL, text="Capturar Coordenada")
+                    self._update_status("Nenhuma janela sob o cursor", self.theme["error"])
+                self.root.after(0, reset_gui)
+                return
+            x, y, message = relative
+        elif self.config_mgr.get("pause_on_focus_loss", False):
+            # Coordenada absoluta; a janela sob o cursor vira a janela alvo do foco
+            if self._capture_window(x, y) is not None:
+                spec = self.config_mgr.get("target_window")
+                message = f"Coordenada capturada; janela alvo '{spec.get('class') or spec.get('title')}'"
+        self.saved_x = x
+        self.saved_y = y
+        self._remember_target(x, y)
+        
+        # Salvar coordenadas (uma única gravação em disco)
+        self.config_mgr.config["saved_x"] = self.saved_x
+        self.config_mgr.set("saved_y", self.saved_y)
+        
+        def update_gui():
             self.coord_label.config(
                 text=f"Coordenadas: X={self.saved_x}, Y={self.saved_y}"
             )
             self.capture_button.config(state=tk.NORMAL, text="Capturar Coordenada")
-            self._update_status("Coordenada capturada!", self.theme["success"])
+            self._update_status(message, self.theme["success"])
+        
+        self.root.after(0, update_gui)
+    
+    def _toggle_window_relative(self):
+        """Liga/desliga coordenadas relativas à janela alvo."""
+        enabled = self.window_relative_var.get()
+        self.config_mgr.set("window_relative", enabled)
+        if enabled:
+            self._update_status(
+                "Coordenadas relativas à janela: capture a coordenada sobre a janela alvo", self.theme["warning"]
+            )
+        else:
+            self._update_status("Coordenadas absolutas: capture a coordenada de novo", self.theme["warning"])
+    
+    def _toggle_pause_on_focus_loss(self):
+        """Liga/desliga a pausa automática quando a janela alvo perde o foco."""
+        enabled = self.pause_on_focus_loss_var.get()
+        self.config_mgr.set("pause_on_focus_loss", enabled)
+        if not enabled:
+            self._stop_focus_guard()
+            self._update_status("Pausa por foco desligada", self.theme["warning"])
+        elif not self.config_mgr.get("target_window"):
+            self._update_status("Pausa por foco: capture a coordenada sobre a janela alvo", self.theme["warning"])
+        else:
+            self._update_status("Pausa por foco ligada", self.theme["success"])
+    
+    def _capture_window(self, x, y):
+        """Identifica a janela sob o cursor como alvo; retorna (x, y relativos, mensagem) ou None."""
+        try:
+            spec, origin = window_under_pointer()
+        except OSError as e:
+            print(f"Não foi possível identificar a janela: {e}")
+            return None
+        if spec is None:
+            return None
+        self.config_mgr.config["target_window"] = spec
+        name = spec.get("class") or spec.get("title")
+        return x - origin[0], y - origin[1], f"Coordenada capturada relativa a '{name}'"
+    
+    def _monitor_layout(self):
+        """Monitores atuais (RandR no X11; fora dele, só a tela principal)."""
+        return x11_monitor_layout() or MonitorLayout.single(*self.screen_size)
+    
+    def _refresh_monitor_layout(self):
+        """Relê os monitores e, se mudaram, recalcula as transformações da coordenada salva.
+        
+        Retorna True se o layout mudou desde a última leitura.
+        """
+        layout = self._monitor_layout()
+        if layout == self.monitor_layout:
+            return False
+        changed = self.monitor_layout is not None
+        self.monitor_layout = layout
+        self.coordinate_mapper = None
+        if changed:
+            print(f"Monitores mudaram: {layout}")
+        captured = self.config_mgr.get("capture_layout")
+        if captured:
+            try:
+                source = MonitorLayout.from_json(captured)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Layout de captura inválido, usando a coordenada absoluta: {e}")
+                return changed
+            if source != layout:
+                self.coordinate_mapper = CoordinateMapper(source, layout)
+        return changed
+    
+    def _start_monitor_watcher(self):
+        """Vigia de mudanças de monitor (RandR); None fora do X11."""
+        try:
+            return MonitorWatcher(self._on_monitors_changed).start()
+        except OSError as e:
+            print(f"Mudanças de monitor só serão lidas a cada início: {e}")
+            return None
+    
+    def _on_monitors_changed(self, layout):
+        # Thread do vigia: o remapeamento e o programa ficam na thread da GUI
+        self.root.after(0, self._apply_monitor_change)
+    
+    def _apply_monitor_change(self):
+        """Remapeia a coordenada salva e remonta o programa em execução."""
+        if not self._refresh_monitor_layout():
+            return
+        if self.coordinate_mapper is not None and self.config_mgr.get("saved_target"):
+            x, y = self._target_point()
+            self._update_status(f"Monitores mudaram: coordenada remapeada para X={x}, Y={y}",
+                                self.theme["warning"])
+            self._reload_program()
+    
+    def _remember_target(self, x, y):
+        """Grava a coordenada normalizada e o layout da captura (relativa à janela, não há)."""
+        self._refresh_monitor_layout()
+        if self.config_mgr.get("window_relative", False):
+            target, layout = None, None
+        else:
+            target, layout = self.monitor_layout.normalize(x, y), self.monitor_layout.to_json()
+        self.config_mgr.config["saved_target"] = target
+        self.config_mgr.config["capture_layout"] = layout
+        self.coordinate_mapper = None
+    
+    def _target_point(self):
+        """Coordenada salva, remapeada se os monitores mudaram desde a captura."""
+        mapper = self.coordinate_mapper
+        target = self.config_mgr.get("saved_target")
+        if mapper is None or not target or self.config_mgr.get("window_relative", False):
+            return self.saved_x, self.saved_y
+        return mapper.map_target(target)
     
     def _key_name(self, key):
         """Retorna o nome legível da tecla."""
@@ -727,13 +1595,6 @@ class MacroAutomation:
     
     def _open_keybind_dialog(self):
         """Abre diálogo para rebindar teclas."""
-        # Parar listener global para evitar conflitos
-        try:
-            if self.listener:
-                self.listener.stop()
-        except:
-            pass
-        
         dialog = tk.Toplevel(self.root)
         dialog.title("Rebindar Teclas")
         dialog.geometry("450x350")
@@ -778,57 +1639,53 @@ class MacroAutomation:
         button_frame.pack(fill=tk.X, pady=(20, 0))
         ttk.Button(button_frame, text="OK", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Restaurar Padrão", command=lambda: [self._reset_keybinds(), dialog.destroy()]).pack(side=tk.LEFT, padx=5)
-        
-        # Reiniciar listener quando dialog fecha
-        def on_dialog_close():
-            try:
-                if not self.listener or not self.listener.is_alive():
-                    self._initialize_listeners()
-            except:
-                self._initialize_listeners()
-        
-        dialog.protocol("WM_DELETE_WINDOW", lambda: [on_dialog_close(), dialog.destroy()])
     
     def _capture_key(self, action, button):
         """Captura uma tecla pressionada."""
         button.config(text="Aguardando tecla...", state=tk.DISABLED)
         self.root.update()
         
-        def capture_in_thread():
-            def on_press(key):
-                try:
-                    if action == "start":
-                        self.key_start = key
-                        key_str = self._key_to_string(key)
-                        self.config_mgr.set("key_start", key_str)
-                        print(f"Rebinded START para: {key_str}")
-                    elif action == "pause":
-                        self.key_pause = key
-                        key_str = self._key_to_string(key)
-                        self.config_mgr.set("key_pause", key_str)
-                        print(f"Rebinded PAUSE para: {key_str}")
-                    elif action == "exit":
-                        self.key_exit = key
-                        key_str = self._key_to_string(key)
-                        self.config_mgr.set("key_exit", key_str)
-                        print(f"Rebinded EXIT para: {key_str}")
-                    
-                    self.root.after(0, lambda: button.config(text=self._key_name(key), state=tk.NORMAL))
-                    self.root.after(0, self._update_hotkey_display)
-                    return False
-                except:
-                    return False
-            
+        def apply_rebind(key):
             try:
-                with Listener(on_press=on_press) as listener:
-                    listener.join(timeout=5)
-            except:
-                pass
-            
-            self.root.after(0, lambda: button.config(state=tk.NORMAL))
+                if action == "start":
+                    self.key_start = key
+                    key_str = self._key_to_string(key)
+                    self.config_mgr.set("key_start", key_str)
+                    print(f"Rebinded START para: {key_str}")
+                elif action == "pause":
+                    self.key_pause = key
+                    key_str = self._key_to_string(key)
+                    self.config_mgr.set("key_pause", key_str)
+                    print(f"Rebinded PAUSE para: {key_str}")
+                elif action == "exit":
+                    self.key_exit = key
+                    key_str = self._key_to_string(key)
+                    self.config_mgr.set("key_exit", key_str)
+                    print(f"Rebinded EXIT para: {key_str}")
+                
+                self._compile_hotkeys()
+                self.root.after(0, lambda: button.config(text=self._key_name(key), state=tk.NORMAL))
+                self.root.after(0, self._update_hotkey_display)
+            except Exception as e:
+                print(f"Erro ao capturar tecla: {e}")
+        
+        def on_press(key):
+            # Thread do hook: só enfileira e consome a tecla, para que os
+            # hotkeys atuais não disparem durante a captura
+            self.hook_events.post(apply_rebind, key)
+            return True
+        
+        # Assinatura one-shot no hook compartilhado (sem Listener próprio)
+        subscription = self.input_hub.subscribe(
+            on_press, priority=InputHub.PRIORITY_CAPTURE, once=True
+        )
+        
+        def on_timeout():
+            if subscription.active:
+                subscription.cancel()
+                button.config(state=tk.NORMAL)
         
-        capture_thread = threading.Thread(target=capture_in_thread, daemon=True)
-        capture_thread.start()
+        self.root.after(5000, on_timeout)
     
     def _open_theme_dialog(self):
         """Abre diálogo para mudar o tema."""
@@ -896,7 +1753,7 @@ class MacroAutomation:
         )
         info_label.pack(pady=10)
         
-        def on_press(key):
+        def apply_key(key):
             try:
                 # Obter nome da tecla
                 try:
@@ -907,48 +1764,52 @@ class MacroAutomation:
                     # Para caracteres normais
                     key_name = str(key).replace("'", "")
                 
-                self.custom_key = key
+                self.custom_key = (key,)
                 self.custom_key_name = key_name.upper()
-                self.config_mgr.set("custom_key_name", self.custom_key_name)
-                self.config_mgr.set("custom_key_stored", key_name.lower())
-                
-                # Atualizar display
-                key_display_label.config(
-                    text=f"Tecla selecionada: {self.custom_key_name}",
-                    foreground="green"
-                )
-                
-                # Atualizar label na janela principal
-                self.custom_key_label.config(text=f"Tecla selecionada: {self.custom_key_name}")
-                
-                # Fechar diálogo após 1 segundo
-                dialog.after(1000, dialog.destroy)
-                
-                return False  # Parar de capturar
+                self.config_mgr.config["custom_key_name"] = self.custom_key_name
+                self.config_mgr.config["custom_key_stored"] = key_name.lower()
+                self.config_mgr.set("custom_key_combo", key_name.lower())
+                self.root.after(0, update_dialog)
             except Exception as e:
                 print(f"Erro ao selecionar tecla: {e}")
-                key_display_label.config(
-                    text=f"Erro: {str(e)}",
+                message = f"Erro: {str(e)}"
+                self.root.after(0, lambda: key_display_label.config(
+                    text=message,
                     foreground="red"
-                )
-                return False
+                ))
         
-        # Iniciar captura em thread separada
-        def capture_in_thread():
-            try:
-                with Listener(on_press=on_press) as listener:
-                    listener.join(timeout=15)  # Timeout de 15 segundos
-            except:
-                pass
+        def update_dialog():
+            # Atualizar display
+            key_display_label.config(
+                text=f"Tecla selecionada: {self.custom_key_name}",
+                foreground="green"
+            )
             
-            # Fechar diálogo se timeout
-            try:
-                dialog.destroy()
-            except:
-                pass
+            # Atualizar label na janela principal
+            self.custom_key_label.config(text=f"Tecla selecionada: {self.custom_key_name}")
+            
+            # Fechar diálogo após 1 segundo
+            dialog.after(1000, dialog.destroy)
+        
+        def on_press(key):
+            self.hook_events.post(apply_key, key)
+            return True  # Consumir a tecla
+        
+        subscription = self.input_hub.subscribe(
+            on_press, priority=InputHub.PRIORITY_CAPTURE, once=True
+        )
         
-        capture_thread = threading.Thread(target=capture_in_thread, daemon=True)
-        capture_thread.start()
+        # Fechar diálogo se nenhuma tecla for pressionada em 15 segundos
+        def on_timeout():
+            if subscription.active:
+                subscription.cancel()
+                try:
+                    dialog.destroy()
+                except tk.TclError:
+                    pass
+        
+        dialog.after(15000, on_timeout)
+        dialog.bind("<Destroy>", lambda e: subscription.cancel() if e.widget is dialog else None)
     
     def _reset_keybinds(self):
         """Restaura as teclas padrão."""
@@ -958,6 +1819,7 @@ class MacroAutomation:
         self.config_mgr.set("key_start", "f1")
         self.config_mgr.set("key_pause", "f2")
         self.config_mgr.set("key_exit", "f3")
+        self._compile_hotkeys()
         self._update_hotkey_display()
     
     def _reset_all(self):
@@ -976,7 +1838,8 @@ class MacroAutomation:
             self.config_mgr.set("click_delay_ms", 100)
             self.config_mgr.set("hold_duration_ms", 500)
             self.config_mgr.set("button_type", "esquerdo")
-            self.config_mgr.set("custom_key", None)
+            self.config_mgr.set("custom_key_combo", None)
+            self.config_mgr.set("custom_key_stored", None)
             self.config_mgr.set("custom_key_name", "Nenhuma")
             self.theme = ThemeManager.get_theme("dark")
             ThemeManager.configure_style(self.style, "dark")
@@ -1039,19 +1902,7 @@ F3 - Sair
     
     def _create_default_config(self):
         """Cria um arquivo de configuração padrão que pode ser editado manualmente."""
-        default_template = {
-            "theme": "dark",
-            "button_type": "esquerdo",
-            "saved_x": None,
-            "saved_y": None,
-            "key_start": "f1",
-            "key_pause": "f2",
-            "key_exit": "f3",
-            "click_delay_ms": 100,
-            "action_type": "click",
-            "hold_duration_ms": 500,
-            "custom_key_name": "Nenhuma"
-        }
+        default_template = dict(self.config_mgr.default_config)
         
         try:
             with open(self.config_mgr.config_file, 'w', encoding='utf-8') as f:
@@ -1066,33 +1917,48 @@ F3 - Sair
     
     def _on_closing(self):
         """Encerra a aplicação de forma segura."""
-        self.is_running = False
-        self._release_all()
+        self._stop_macro()
+        
+        if self.recorder is not None:
+            self._toggle_recording()
+        
+        backend = getattr(self.mouse_controller, "backend", None)
+        if backend:
+            backend.close()
         
         # Salvar todas as configurações atuais
         self.config_mgr.set("button_type", self.button_type.get())
         self.config_mgr.set("action_type", self.action_type.get())
         self.config_mgr.set("click_delay_ms", self.click_delay_ms.get())
         self.config_mgr.set("hold_duration_ms", self.hold_duration_ms.get())
+        self.config_mgr.set("type_text", self.type_text)
+        self.config_mgr.set("type_char_delay_ms", self.type_char_delay_ms.get())
         self.config_mgr.set("custom_key_name", self.custom_key_name)
         
-        try:
-            if self.listener:
-                self.listener.stop()
-        except:
-            pass
+        if self.control_server:
+            self.control_server.stop()
         
-        try:
-            if self.mouse_listener:
-                self.mouse_listener.stop()
-        except:
-            pass
+        self.trigger_scheduler.stop()
+        
+        if self.window_tracker is not None:
+            self.window_tracker.stop()
+        self._stop_focus_guard()
+        if self.monitor_watcher is not None:
+            self.monitor_watcher.stop()
+        
+        if self.engine_process:
+            self.engine_process.close()
+        
+        self.input_hub.stop()
+        self.mouse_hook.close()
+        self.hook_events.stop()
         
         self.root.destroy()
 
 
 def main():
     """Função principal para inicializar a aplicação."""
+    multiprocessing.freeze_support()
     try:
         # Setup logging para debug
         log_file = os.path.join(os.getcwd(), "macro_debug.log")